@@ -0,0 +1,84 @@
+# api_cache.py
+"""
+Record-and-replay cache of raw integration API responses.
+
+With API_CACHE=record the sync scripts write the JSON of every successful
+GET through to API_CACHE_DIR, one compressed file per response, named by the
+SHA-256 of its endpoint path and sorted query parameters under a directory
+per service. With API_CACHE=replay they read those files instead of calling
+Freshservice or Datto, skip their request delays, and treat a response that
+was never recorded like a failed request. Replaying re-runs only the
+transform and write stages, at local disk speed, e.g. after changing how
+tickets or devices render (scripts/rebuild_from_cache.py).
+
+Keys leave out the host and credentials, so a recording made against one
+endpoint (the benchmark stand-ins, say) replays against any other.
+"""
+import os
+import json
+import hashlib
+import threading
+from urllib.parse import urlsplit, parse_qsl, urlencode
+
+import requests
+
+import compression
+
+# 'off', 'record' or 'replay'.
+API_CACHE = os.getenv("API_CACHE", "off")
+API_CACHE_DIR = os.getenv("API_CACHE_DIR", "api_cache")
+
+
+class CacheMiss(requests.exceptions.RequestException):
+    """A replayed request whose response was never recorded."""
+
+
+def replaying():
+    return API_CACHE == 'replay'
+
+def delay(seconds):
+    """A request delay setting, which replays do without."""
+    return 0 if replaying() else seconds
+
+def cache_key(url, params=None):
+    """The endpoint path and sorted query parameters of a request."""
+    parts = urlsplit(url)
+    # A base URL without a scheme (or an unset one, 'None') leaves its host in the path.
+    path = parts.path if parts.netloc else '/' + parts.path.lstrip('/').partition('/')[2]
+    query = sorted(parse_qsl(parts.query) + [(k, str(v)) for k, v in (params or {}).items()])
+    return path + ('?' + urlencode(query) if query else '')
+
+def _file(service, key):
+    return os.path.join(API_CACHE_DIR, service, hashlib.sha256(key.encode('utf-8')).hexdigest())
+
+def get_json(service, url, fetch, params=None):
+    """
+    The JSON payload of a GET request. fetch() sends the request and returns
+    its payload, raising when it fails; replays return the recorded payload
+    instead and raise CacheMiss when there is none.
+    """
+    key = cache_key(url, params)
+    if replaying():
+        return load(service, key)
+    payload = fetch()
+    if API_CACHE == 'record':
+        save(service, key, payload)
+    return payload
+
+def save(service, key, payload):
+    codec, data = compression.compress(json.dumps({'key': key, 'payload': payload}))
+    path = _file(service, key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Written aside and renamed, so a replay never reads half a response.
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, 'wb') as f:
+        f.write(codec.encode('ascii') + b'\n' + data)
+    os.replace(tmp, path)
+
+def load(service, key):
+    try:
+        with open(_file(service, key), 'rb') as f:
+            codec, data = f.read().split(b'\n', 1)
+    except FileNotFoundError:
+        raise CacheMiss(f"No recorded {service} response for {key}") from None
+    return json.loads(compression.decompress(codec.decode('ascii'), data))['payload']
@@ -1,106 +1,52 @@
 # app.py
 import os
 import uuid
-import schedule
-import time
-import threading
 import json
+import atexit
 from urllib.parse import unquote, quote
 from dotenv import load_dotenv, set_key
-from flask import Flask, render_template, request, jsonify, send_from_directory, redirect, url_for, send_file
-from neo4j import GraphDatabase, basic_auth
-import markdown
-from scripts.pull_freshservice import sync_companies_and_users
-from scripts.pull_datto import sync_datto_devices
-from scripts.pull_fresh_tickets import sync_fresh_tickets
+from flask import Flask, Blueprint, Response, current_app, render_template, request, jsonify, send_from_directory, redirect, url_for, send_file
+import metrics
+import http_cache
+import slow_queries
+import context_blocks
+import relevance
+import hierarchy
+import jobs
+import ingest
+from storage import get_store, close_store
+from storage.base import path_stamp
+from storage.batch import prepare_batch, batch_results
 
 
 load_dotenv()
 
-app = Flask(__name__)
-app.config['UPLOAD_FOLDER'] = 'uploads'
-
-# --- Neo4j Connection ---
-uri = os.getenv("NEO4J_URI")
-user = os.getenv("NEO4J_USER")
-password = os.getenv("NEO4J_PASSWORD")
-driver = GraphDatabase.driver(uri, auth=basic_auth(user, password))
-
-# --- DB Helper ---
-def ensure_root_exists(tx):
-    tx.run("""
-        MERGE (r:ContextItem {id: 'root', name: 'KnowledgeTree Root'})
-        ON CREATE SET r.content = '# Welcome to KnowledgeTree', r.is_folder = true, r.is_attached = false
-    """)
-
-def prime_database_schema(tx):
-    """
-    Creates and immediately deletes a dummy file node and relationship.
-    This "primes" the database with the necessary labels and relationship types,
-    preventing "UnknownLabelWarning" and "UnknownRelationshipTypeWarning"
-    on a fresh database.
-    """
-    tx.run("""
-        MERGE (dummy_parent:ContextItem {id: 'schema_primer_parent'})
-        CREATE (dummy_file:File {id: 'schema_primer_file', filename: 'dummy.txt'})
-        CREATE (dummy_parent)-[:HAS_FILE]->(dummy_file)
-        DETACH DELETE dummy_parent, dummy_file
-    """)
-
-with driver.session() as session:
-    session.write_transaction(ensure_root_exists)
-    session.write_transaction(prime_database_schema)
+bp = Blueprint('main', __name__)
 
 
 # --- URL Generation Helper ---
-@app.template_filter('quote_plus')
+@bp.app_template_filter('quote_plus')
 def quote_plus_filter(s):
     # This makes the URL encoding function available in Jinja templates
     return quote(s)
 
 # --- Main Routes ---
 
-@app.route('/')
+@bp.route('/')
 def index():
-    return redirect(url_for('browse'))
+    return redirect(url_for('.browse'))
 
-@app.route('/browse/', defaults={'path': ''})
-@app.route('/browse/<path:path>')
+@bp.route('/browse/', defaults={'path': ''})
+@bp.route('/browse/<path:path>')
 def browse(path):
     path_parts = [p for p in path.split('/') if p]
 
     parent_path = "/".join([quote(part) for part in path_parts[:-1]])
 
-    with driver.session() as session:
-        query = "MATCH (n0:ContextItem {id: 'root'})"
-        match_clauses, where_clauses, params = [], [], {}
-        for i, part in enumerate(path_parts):
-            prev_node, curr_node = f"n{i}", f"n{i+1}"
-            param_name = f"part_{i}"
-            match_clauses.append(f"MATCH ({prev_node})-[:PARENT_OF]->({curr_node})")
-            where_clauses.append(f"{curr_node}.name = ${param_name}")
-            params[param_name] = unquote(part)
-
-        full_query = "\n".join([query] + match_clauses) + ("\nWHERE " + " AND ".join(where_clauses) if where_clauses else "") + f"\nRETURN n{len(path_parts)}.id as id"
-
-        result = session.run(full_query, params).single()
-        node_id = result['id'] if result else 'root'
-
-        children_query = """
-            MATCH (:ContextItem {id: $parent_id})-[:PARENT_OF]->(child)
-            RETURN DISTINCT child.id AS id, child.name AS name, child.is_folder AS is_folder,
-                   child.is_attached as is_attached, child.read_only as read_only
-            ORDER BY child.is_folder DESC, child.name
-        """
-        children_result = session.run(children_query, parent_id=node_id)
-        items = [dict(record) for record in children_result]
-
-        path_query = """
-            MATCH path = (:ContextItem {id: 'root'})-[:PARENT_OF*0..]->(:ContextItem {id: $node_id})
-            RETURN [n in nodes(path) | n.name] AS names
-        """
-        path_result = session.run(path_query, node_id=node_id).single()
-        breadcrumb_names = path_result['names'] if path_result else ["KnowledgeTree Root"]
+    store = get_store()
+    node_id = hierarchy.resolve_path(store, [unquote(part) for part in path_parts]) or 'root'
+    items = hierarchy.list_children(store, node_id)
+    breadcrumb_names = hierarchy.path_names(store, node_id) or ["KnowledgeTree Root"]
 
     return render_template('index.html',
                            items=items,
@@ -109,29 +55,24 @@ def browse(path):
                            current_node_id=node_id,
                            parent_path=parent_path)
 
-@app.route('/view/<node_id>')
+@bp.route('/view/<node_id>')
 def view_node(node_id):
-    with driver.session() as session:
-        path_query = """
-            MATCH p = shortestPath((:ContextItem {id: 'root'})-[:PARENT_OF*..]->(:ContextItem {id: $node_id}))
-            RETURN [n IN nodes(p) | n.name] AS names
-        """
-        result = session.run(path_query, node_id=node_id).single()
-
-        parent_path = ''
-        if result and result['names']:
-            parent_path_parts = result['names'][1:-1]
-            parent_path = "/".join([quote(name) for name in parent_path_parts])
+    names = hierarchy.path_names(get_store(), node_id)
+
+    parent_path = ''
+    if names:
+        parent_path_parts = names[1:-1]
+        parent_path = "/".join([quote(name) for name in parent_path_parts])
 
     return render_template('view.html', node_id=node_id, parent_path=parent_path)
 
 
-@app.route('/uploads/<filename>')
+@bp.route('/uploads/<filename>')
 def uploaded_file(filename):
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    return send_from_directory(current_app.config['UPLOAD_FOLDER'], filename)
 
 # --- Admin Routes ---
-@app.route('/admin')
+@bp.route('/admin')
 def admin_panel():
     settings = {
         'FRESHSERVICE_PULL_INTERVAL': os.getenv('FRESHSERVICE_PULL_INTERVAL', 1440),
@@ -141,37 +82,29 @@ def admin_panel():
 
 # --- API Endpoints ---
 
-@app.route('/api/search', methods=['GET'])
+@bp.route('/api/search', methods=['GET'])
 def search_nodes():
     query = request.args.get('query', '')
     start_node_id = request.args.get('start_node_id', 'root')
+    mode = request.args.get('mode', relevance.SEARCH_MODE)
 
     if not query: return jsonify([])
 
-    with driver.session() as session:
-        result = session.run("""
-            MATCH (startNode:ContextItem {id: $start_node_id})-[:PARENT_OF*0..]->(node)
-            WHERE toLower(node.name) CONTAINS toLower($query) OR toLower(node.content) CONTAINS toLower($query)
-            WITH DISTINCT node
-            MATCH p = (:ContextItem {id: 'root'})-[:PARENT_OF*..]->(node)
-            RETURN node.id as id,
-                   node.name as name,
-                   node.is_folder as is_folder,
-                   [n IN nodes(p) | n.name] AS path_names
-            LIMIT 15
-            """, {'start_node_id': start_node_id, 'query': query})
-
-        processed_results = []
-        for record in result:
-            record_dict = dict(record)
-            path_list = record_dict['path_names'][1:]
-            folder_path = "/".join([quote(name) for name in path_list])
-            record_dict['folder_path'] = folder_path
-            processed_results.append(record_dict)
-
-        return jsonify(processed_results)
-
-@app.route('/api/node', methods=['POST'])
+    store = get_store()
+    if mode == 'relevance':
+        results = relevance.search(store, query, start_node_id, limit=15)
+    else:
+        results = store.search(query, start_node_id, limit=15)
+    return jsonify(with_folder_paths(results))
+
+def with_folder_paths(results):
+    """Adds the browse path of each search result's folder."""
+    for record_dict in results:
+        path_list = record_dict['path_names'][1:]
+        record_dict['folder_path'] = "/".join([quote(name) for name in path_list])
+    return results
+
+@bp.route('/api/node', methods=['POST'])
 def create_node():
     data = request.json
     parent_id = data.get('parent_id')
@@ -183,71 +116,85 @@ def create_node():
         return jsonify({'error': 'parent_id and name are required'}), 400
 
     new_id = str(uuid.uuid4())
-    with driver.session() as session:
-        session.run("""
-            MATCH (parent:ContextItem {id: $parent_id})
-            CREATE (child:ContextItem {
-                id: $id,
-                name: $name,
-                is_folder: $is_folder,
-                content: '',
-                is_attached: $is_attached,
-                read_only: false
-            })
-            CREATE (parent)-[:PARENT_OF]->(child)
-        """, parent_id=parent_id, id=new_id, name=name, is_folder=is_folder, is_attached=is_attached)
+    get_store().create_node(new_id, parent_id, name, is_folder=is_folder, is_attached=is_attached)
     return jsonify({'success': True, 'id': new_id})
 
 
-@app.route('/api/node/<node_id>', methods=['GET'])
+@bp.route('/api/node/<node_id>', methods=['GET'])
 def get_node(node_id):
-    def fetch_node(tx, node_id):
-        query = """
-        MATCH (n:ContextItem {id: $node_id})
-        OPTIONAL MATCH (n)-[:HAS_FILE]->(f:File)
-        RETURN n.id AS id, n.name AS name, n.content AS content, n.is_folder AS is_folder,
-               n.is_attached as is_attached, n.read_only as read_only,
-               collect({id: f.id, filename: f.filename}) AS files
-        """
-        result = tx.run(query, node_id=node_id).single()
-        if result:
-            data = dict(result)
-            content = data.get('content') or ''
-            data['content_html'] = markdown.markdown(content, extensions=['fenced_code', 'tables'])
-            data['files'] = [f for f in data.get('files', []) if f['id'] is not None]
-            return data
-        return None
-
-    with driver.session() as session:
-        node_data = session.read_transaction(fetch_node, node_id)
-        if node_data:
-            return jsonify(node_data)
-        else:
-            return jsonify({'error': 'Node not found'}), 404
-
-@app.route('/api/node/<node_id>', methods=['PUT'])
+    store = get_store()
+    stamp = store.node_stamp(node_id)
+    if stamp is None:
+        return jsonify({'error': 'Node not found'}), 404
+    etag = f"node-{stamp['stamp']}"
+    max_age = http_cache.SYNCED_NODE_MAX_AGE if stamp['read_only'] else None
+    if http_cache.is_fresh(etag):
+        return http_cache.not_modified(etag, max_age)
+
+    node_data = store.get_node(node_id)
+    if node_data:
+        node_data['content_html'] = render_markdown(node_data.get('content') or '')
+        return http_cache.with_validators(jsonify(node_data), etag, max_age)
+    else:
+        return jsonify({'error': 'Node not found'}), 404
+
+def render_markdown(content):
+    import markdown
+
+    with metrics.phase('render_markdown'):
+        return markdown.markdown(content, extensions=['fenced_code', 'tables'])
+
+@bp.route('/api/node/<node_id>/children', methods=['GET'])
+def get_children(node_id):
+    return jsonify(hierarchy.list_children(get_store(), node_id))
+
+@bp.route('/api/node/<node_id>', methods=['PUT'])
 def update_node(node_id):
     data = request.json
-    with driver.session() as session:
-        if 'content' in data:
-            session.run("MATCH (n:ContextItem {id: $id}) SET n.content = $content",
-                        id=node_id, content=data['content'])
-        if 'name' in data:
-            session.run("MATCH (n:ContextItem {id: $id}) SET n.name = $name",
-                        id=node_id, name=data['name'])
+    get_store().update_node(node_id, name=data.get('name'), content=data.get('content'))
     return jsonify({'success': True})
 
-@app.route('/api/node/<node_id>', methods=['DELETE'])
+@bp.route('/api/node/<node_id>', methods=['DELETE'])
 def delete_node(node_id):
-    with driver.session() as session:
-        session.run("""
-            MATCH (n:ContextItem {id: $id})
-            OPTIONAL MATCH (n)-[:PARENT_OF*0..]->(child)
-            DETACH DELETE n, child
-        """, id=node_id)
+    get_store().delete_node(node_id)
+    return jsonify({'success': True})
+
+@bp.route('/api/node/<node_id>/move', methods=['POST'])
+def move_node(node_id):
+    """Relinks the node and its subtree under `parent_id`, optionally only from `from_parent_id`."""
+    data = request.json or {}
+    if not data.get('parent_id'):
+        return jsonify({'success': False, 'error': 'parent_id is required'}), 400
+    try:
+        get_store().move_node(node_id, data['parent_id'], data.get('from_parent_id'))
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
     return jsonify({'success': True})
 
-@app.route('/api/upload/<node_id>', methods=['POST'])
+@bp.route('/api/node/<node_id>/copy', methods=['POST'])
+def copy_node(node_id):
+    """Copies the node's subtree, with files and attached folders, under `parent_id`."""
+    data = request.json or {}
+    if not data.get('parent_id'):
+        return jsonify({'success': False, 'error': 'parent_id is required'}), 400
+    try:
+        new_id = get_store().copy_node(node_id, data['parent_id'], name=data.get('name'))
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    return jsonify({'success': True, 'id': new_id})
+
+@bp.route('/api/batch', methods=['POST'])
+def batch_operations():
+    """Applies an ordered list of create/update/move/delete operations in one transaction."""
+    data = request.json or {}
+    try:
+        ops, temp_ids = prepare_batch(data.get('operations'))
+        get_store().apply_batch(ops)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    return jsonify({'success': True, 'results': batch_results(ops), 'temp_ids': temp_ids})
+
+@bp.route('/api/upload/<node_id>', methods=['POST'])
 def upload_file_to_node(node_id):
     if 'file' not in request.files:
         return jsonify({'error': 'No file part'}), 400
@@ -255,83 +202,69 @@ def upload_file_to_node(node_id):
     if file:
         filename = file.filename
         file_id = str(uuid.uuid4())
-        file.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
-        with driver.session() as session:
-            session.run("""
-                MATCH (n:ContextItem {id: $node_id})
-                CREATE (f:File {id: $file_id, filename: $filename})
-                CREATE (n)-[:HAS_FILE]->(f)
-            """, node_id=node_id, file_id=file_id, filename=filename)
+        file.save(os.path.join(current_app.config['UPLOAD_FOLDER'], filename))
+        get_store().add_file(node_id, file_id, filename)
         return jsonify({'success': True, 'filename': filename})
     return jsonify({'error': 'File upload failed'}), 500
 
-@app.route('/api/admin/reinitialize_db', methods=['POST'])
+@bp.route('/api/admin/reinitialize_db', methods=['POST'])
 def reinitialize_db():
     try:
-        with driver.session() as session:
-            session.run("MATCH (n) DETACH DELETE n")
-            session.write_transaction(ensure_root_exists)
+        get_store().reinitialize()
         return jsonify({'success': True, 'message': 'Database wiped and re-initialized.'})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
-@app.route('/api/admin/save_settings', methods=['POST'])
+@bp.route('/api/admin/slow_queries', methods=['GET'])
+def get_slow_queries():
+    limit = request.args.get('limit', 50, type=int)
+    return jsonify({
+        'threshold_ms': slow_queries.SLOW_QUERY_MS,
+        'entries': slow_queries.recent(max(1, min(limit, 500)))
+    })
+
+@bp.route('/api/admin/save_settings', methods=['POST'])
 def save_settings():
     settings = request.json
     for key, value in settings.items():
         set_key('.env', key, value)
     return jsonify({'success': True, 'message': 'Settings saved.'})
 
-@app.route('/api/admin/run_job/<job_name>', methods=['POST'])
+@bp.route('/api/admin/run_job/<job_name>', methods=['POST'])
 def run_job(job_name):
-    if job_name == 'freshservice':
-        threading.Thread(target=sync_companies_and_users).start()
-        return jsonify({'success': True, 'message': 'Freshservice sync started.'})
-    elif job_name == 'datto':
-        threading.Thread(target=sync_datto_devices).start()
-        return jsonify({'success': True, 'message': 'Datto sync started.'})
-    elif job_name == 'freshtickets':
-        overwrite = request.json.get('overwrite', False)
-        threading.Thread(target=sync_fresh_tickets, args=(overwrite,)).start()
-        return jsonify({'success': True, 'message': 'Freshservice ticket sync started.'})
-    return jsonify({'success': False, 'error': 'Invalid job name.'}), 400
-
-@app.route('/api/admin/export', methods=['GET'])
+    # Jobs run in the worker process (scripts/job_worker.py); the web tier only queues them.
+    messages = {
+        'freshservice': 'Freshservice sync',
+        'datto': 'Datto sync',
+        'freshtickets': 'Freshservice ticket sync',
+    }
+    if job_name not in messages:
+        return jsonify({'success': False, 'error': 'Invalid job name.'}), 400
+    args = {'overwrite': bool((request.get_json(silent=True) or {}).get('overwrite', False))} if job_name == 'freshtickets' else {}
+    job_id, created = jobs.enqueue(job_name, args)
+    message = f"{messages[job_name]} queued." if created else f"{messages[job_name]} is already queued."
+    return jsonify({'success': True, 'message': message, 'job_id': job_id})
+
+@bp.route('/api/admin/jobs', methods=['GET'])
+def get_jobs():
+    limit = request.args.get('limit', 50, type=int)
+    return jsonify({'jobs': jobs.recent(max(1, min(limit, 500)))})
+
+@bp.route('/api/admin/export', methods=['GET'])
 def export_user_data():
     try:
-        with driver.session() as session:
-            result = session.run("""
-                MATCH p = (:ContextItem {id:'root'})-[:PARENT_OF*..]->(n:ContextItem)
-                // This ensures that every node in the path from the root's direct children
-                // to the target node `n` is user-created (not read-only).
-                WHERE ALL(node IN nodes(p)[1..] WHERE node.read_only IS NULL OR node.read_only = false)
-                RETURN [node IN nodes(p) | node.name] AS path_parts,
-                       n.content AS content,
-                       n.is_folder AS is_folder,
-                       n.is_attached AS is_attached
-            """)
-
-            export_data = []
-            for record in result:
-                # The path includes 'KnowledgeTree Root', which we skip for the export path
-                path = "/".join(record['path_parts'][1:])
-                export_data.append({
-                    "path": path,
-                    "content": record['content'],
-                    "is_folder": record['is_folder'],
-                    "is_attached": record['is_attached']
-                })
-
-            export_file_path = "export.json"
-            with open(export_file_path, 'w') as f:
-                json.dump(export_data, f, indent=2)
-
-            return send_file(export_file_path, as_attachment=True, download_name='knowledgetree_export.json')
+        export_data = get_store().export_user_items()
+
+        export_file_path = "export.json"
+        with open(export_file_path, 'w') as f:
+            json.dump(export_data, f, indent=2)
+
+        return send_file(export_file_path, as_attachment=True, download_name='knowledgetree_export.json')
 
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
-@app.route('/api/admin/import', methods=['POST'])
+@bp.route('/api/admin/import', methods=['POST'])
 def import_user_data():
     if 'file' not in request.files:
         return jsonify({'error': 'No file part'}), 400
@@ -342,139 +275,148 @@ def import_user_data():
             # Sort by path so that parent directories are processed before their children
             import_data.sort(key=lambda x: x['path'])
 
-            with driver.session() as session:
-                with session.begin_transaction() as tx:
-                    for item in import_data:
-                        path_parts = item['path'].split('/')
-                        item_name = path_parts[-1]
-                        parent_path_parts = path_parts[:-1]
-
-                        # Find the parent node by traversing from the root
-                        current_parent_id = 'root'
-                        for folder_name in parent_path_parts:
-                            result = tx.run(
-                                "MATCH (parent:ContextItem {id: $parent_id})-[:PARENT_OF]->(child:ContextItem {name: $name}) RETURN child.id as id",
-                                parent_id=current_parent_id, name=folder_name).single()
-
-                            if result:
-                                current_parent_id = result['id']
-                            else:
-                                # This error means the import file is missing a parent folder definition, or is not sorted correctly.
-                                raise Exception(f"Inconsistent data: parent folder '{folder_name}' not found for item '{item_name}'.")
-
-                        # Create or update the item itself
-                        is_folder = item.get('is_folder', False)
-                        # The 'is_attached' flag should only apply to folders
-                        is_attached = item.get('is_attached', False) and is_folder
-                        # Files have content, folders do not
-                        content = item.get('content', '') if not is_folder else ''
-
-                        # MERGE on the relationship pattern to correctly find or create the node.
-                        # This is the idiomatic way to handle nodes that are unique per parent.
-                        tx.run("""
-                            MATCH (parent:ContextItem {id: $parent_id})
-                            MERGE (parent)-[r:PARENT_OF]->(item:ContextItem {name: $name})
-                            ON CREATE SET item.id = $id,
-                                          item.is_folder = $is_folder,
-                                          item.is_attached = $is_attached,
-                                          item.content = $content,
-                                          item.read_only = false
-                            ON MATCH SET  item.is_folder = $is_folder,
-                                          item.is_attached = $is_attached,
-                                          item.content = $content
-                        """, parent_id=current_parent_id, name=item_name, id=str(uuid.uuid4()),
-                             is_folder=is_folder, is_attached=is_attached, content=content)
+            get_store().import_items(import_data)
 
             return jsonify({'success': True, 'message': 'Import successful.'})
         except Exception as e:
             return jsonify({'success': False, 'error': str(e)}), 500
     return jsonify({'error': 'File import failed'}), 500
 
-@app.route('/api/context/tree/<node_id>', methods=['GET'])
+@bp.route('/api/context/tree/<node_id>', methods=['GET'])
 def get_context_tree(node_id):
-    with driver.session() as session:
-        # This query finds the direct path and then, for each node on that path,
-        # finds any folders that are directly attached.
-        path_query = """
-            MATCH p = (:ContextItem {id: 'root'})-[:PARENT_OF*0..]->(:ContextItem {id: $node_id})
-            WITH nodes(p) AS path_nodes
-            UNWIND path_nodes as ancestor
-            MATCH (ancestor)-[:PARENT_OF]->(attached:ContextItem {is_attached: true})
-            RETURN DISTINCT attached.id as id, attached.name as name
-        """
-        result = session.run(path_query, node_id=node_id)
-        attached_folders = [dict(record) for record in result]
-        return jsonify({'attached_folders': attached_folders})
-
-@app.route('/api/context/<node_id>', methods=['GET', 'POST'])
+    store = get_store()
+    stamp = store.context_stamp(node_id)
+    etag = f"tree-{stamp}"
+    if stamp and http_cache.is_fresh(etag):
+        return http_cache.not_modified(etag)
+    attached_folders = hierarchy.attached_folders_on_path(store, node_id)
+    response = jsonify({'attached_folders': attached_folders})
+    return http_cache.with_validators(response, etag) if stamp else response
+
+@bp.route('/api/context/batch', methods=['POST'])
+def get_context_batch():
+    """
+    Contexts for many nodes at once. Blocks shared by their paths are loaded
+    once. With `merge` the result is one context in which each shared block
+    appears once; otherwise it maps every node id to its own context.
+    """
+    data = request.json or {}
+    node_ids = data.get('ids')
+    if not isinstance(node_ids, list) or not node_ids:
+        return jsonify({'error': "'ids' must be a non-empty list"}), 400
+    if len(node_ids) > context_blocks.MAX_CONTEXT_BATCH:
+        return jsonify({'error': f"At most {context_blocks.MAX_CONTEXT_BATCH} ids per request"}), 400
+    excluded_attached_ids = data.get('excluded_ids', [])
+
+    store = get_store()
+    context_blocks.ensure_worker()
+    paths = store.context_paths(node_ids)
+    found = [node_id for node_id in dict.fromkeys(node_ids) if node_id in paths]
+    blocks = context_blocks.load_blocks(store, paths.values(), excluded_attached_ids)
+    files_by_node = store.file_names_by_node(found)
+    response = {'missing': [node_id for node_id in dict.fromkeys(node_ids) if node_id not in paths]}
+    if data.get('merge'):
+        response['context'] = context_blocks.assemble_merged([paths[node_id] for node_id in found], blocks,
+                                                             excluded_attached_ids, files_by_node)
+    else:
+        response['contexts'] = {node_id: context_blocks.assemble(paths[node_id], blocks, excluded_attached_ids,
+                                                                 files_by_node.get(node_id, ()))
+                                for node_id in found}
+    return jsonify(response)
+
+@bp.route('/api/context/<node_id>', methods=['GET', 'POST'])
 def get_context(node_id):
     excluded_attached_ids = []
     if request.method == 'POST':
         data = request.json
         excluded_attached_ids = data.get('excluded_ids', [])
 
-    all_context_blocks = []
-    with driver.session() as session:
-        path_query = """
-            MATCH p = (:ContextItem {id: 'root'})-[:PARENT_OF*0..]->(:ContextItem {id: $node_id})
-            RETURN nodes(p) AS path_nodes
-        """
-        result = session.run(path_query, node_id=node_id).single()
-        if not result:
-            return jsonify({'error': 'Node not found'}), 404
-
-        path_nodes = result['path_nodes']
-
-        for i, node in enumerate(path_nodes):
-            # This query gets direct child articles AND articles from attached folders
-            articles_query = """
-                MATCH (folder:ContextItem {id: $folder_id})-[:PARENT_OF]->(child)
-                WHERE NOT child.is_folder AND (child.is_attached IS NULL OR child.is_attached = false)
-                RETURN child.id as id, child.name AS name, child.content AS content, "" AS source_folder
-                UNION
-                MATCH (folder:ContextItem {id: $folder_id})-[:PARENT_OF]->(attached:ContextItem {is_attached: true})
-                WHERE NOT attached.id IN $excluded_ids
-                MATCH (attached)-[:PARENT_OF*..]->(article:ContextItem)
-                WHERE NOT article.is_folder
-                RETURN article.id as id, article.name AS name, article.content AS content, attached.name AS source_folder
-            """
-            articles_result = session.run(articles_query, folder_id=node['id'], excluded_ids=excluded_attached_ids)
-
-            content_block_items = []
-            for record in articles_result:
-                file_header = f"File: {record['name']}"
-                if record['source_folder']:
-                    file_header += f" (from attached folder: {record['source_folder']})"
-                content_block_items.append(f"{file_header}\n\n{record['content'] or '> No content.'}")
-
-            if content_block_items:
-                all_context_blocks.append({
-                    "header": f"Context: {node['name']}",
-                    "content": "\n\n".join(content_block_items),
-                    "depth": i + 1
-                })
-
-        final_context_parts = []
-        for block in sorted(all_context_blocks, key=lambda x: x['depth']):
-            heading = '#' * block['depth']
-            final_context_parts.append(f"{heading} {block['header']}")
-            final_context_parts.append(block['content'])
-
-        files_query = """
-            OPTIONAL MATCH (:ContextItem {id: $node_id})-[:HAS_FILE]->(f:File)
-            RETURN f.filename as filename
-        """
-        files_result = session.run(files_query, node_id=node_id)
-        filenames = [record['filename'] for record in files_result if record['filename'] is not None]
-        if filenames:
-            final_context_parts.append(f"## Attached Files for {path_nodes[-1]['name']}")
-            final_context_parts.append("\n".join([f"- {name}" for name in filenames]))
-
-    full_context = "\n\n".join(final_context_parts)
-    return jsonify({'context': full_context})
+    store = get_store()
+    context_blocks.ensure_worker()
+    path = store.context_path(node_id)
+    if not path:
+        return jsonify({'error': 'Node not found'}), 404
+    # Only GETs are conditional; a POST's exclusions change the result anyway.
+    stamp = path_stamp(path) if request.method == 'GET' else None
+    etag = f"context-{stamp}"
+    if stamp and http_cache.is_fresh(etag):
+        return http_cache.not_modified(etag)
+
+    blocks = context_blocks.load_blocks(store, [path], excluded_attached_ids)
+    full_context = context_blocks.assemble(path, blocks, excluded_attached_ids, store.file_names(node_id))
+    response = jsonify({'context': full_context, 'cursor': context_blocks.cursor(path)})
+    return http_cache.with_validators(response, etag) if stamp else response
+
+@bp.route('/api/context/<node_id>/delta', methods=['GET', 'POST'])
+def get_context_delta(node_id):
+    """
+    What changed in a node's context since the `cursor` a previous context or
+    delta response returned, passed as `since`. See context_blocks.context_delta.
+    """
+    excluded_attached_ids = []
+    since = request.args.get('since')
+    if request.method == 'POST':
+        data = request.json or {}
+        excluded_attached_ids = data.get('excluded_ids', [])
+        since = data.get('since', since)
+
+    store = get_store()
+    path = store.context_path(node_id)
+    if not path:
+        return jsonify({'error': 'Node not found'}), 404
+    return jsonify(context_blocks.context_delta(store, path, since, excluded_attached_ids))
+
+
+# --- Ingest Routes ---
+@bp.route('/api/ingest/freshservice', methods=['POST'])
+def ingest_freshservice():
+    if not ingest.enabled():
+        return jsonify({'success': False, 'error': 'Webhook ingest is not configured.'}), 503
+    if not ingest.authorized(request.headers.get('X-Webhook-Secret')):
+        return jsonify({'success': False, 'error': 'Invalid webhook secret.'}), 403
+    try:
+        event, ticket_id = ingest.parse_ticket_event(request.get_json(silent=True))
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    job_id, created = ingest.queue_ticket(ticket_id)
+    return jsonify({'success': True, 'event': event, 'ticket_id': ticket_id, 'job_id': job_id, 'queued': created}), 202
+
+
+# --- Metrics ---
+@bp.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+
+# --- App Factory ---
+def create_app(init_db=True):
+    """
+    Builds the Flask app. Nothing here opens a database connection except the
+    optional schema initialisation; each worker connects to the store on first use.
+    Production entry points (wsgi.py) pass init_db=False and leave schema setup
+    to a single process before workers are forked.
+    """
+    app = Flask(__name__)
+    app.config['UPLOAD_FOLDER'] = os.getenv('UPLOAD_FOLDER', 'uploads')
+    app.config['QUERY_COUNT_HEADER'] = os.getenv('QUERY_COUNT_HEADER', '').lower() in ('1', 'true', 'yes')
+    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+    app.register_blueprint(bp)
+    metrics.init_app(app)
+    http_cache.init_app(app)
+    hierarchy.init_app(app)
+
+    @app.cli.command('init-db')
+    def init_db_command():
+        """Creates the root node and primes the schema."""
+        get_store().init_schema()
+        print('Database schema initialized.')
+
+    if init_db:
+        get_store().init_schema()
+
+    atexit.register(close_store)
+    return app
 
 
 if __name__ == '__main__':
-    if not os.path.exists(app.config['UPLOAD_FOLDER']):
-        os.makedirs(app.config['UPLOAD_FOLDER'])
-    app.run(host='0.0.0.0', port=5001, debug=True)
+    create_app().run(host='0.0.0.0', port=5001, debug=True)
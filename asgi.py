@@ -0,0 +1,251 @@
+# asgi.py
+"""
+Async entry point: gunicorn -c gunicorn.conf.py -k uvicorn.workers.UvicornWorker asgi:app
+
+The read APIs that mostly wait on the database are served natively as
+coroutines on the async store (see storage.get_async_store), so a request
+waiting on Neo4j holds no thread and a slow context export for a big
+company does not tie up a worker:
+
+    GET      /api/node/<id>
+    GET      /api/node/<id>/children
+    GET      /api/search
+    GET/POST /api/context/<id>
+
+They answer exactly as the Flask routes of the same name, validators
+included, and the block recomputes inside one context request run
+concurrently. Every other request goes to the Flask app, run on a pool of
+ASGI_WSGI_THREADS threads (WEB_THREADS by default). Schema initialisation is
+left to the gunicorn master, as under wsgi.py.
+"""
+import os
+import re
+import sys
+import json
+import asyncio
+import logging
+from io import BytesIO
+from urllib.parse import parse_qs
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+import http_cache
+import context_blocks
+import relevance
+import hierarchy
+from app import create_app, render_markdown, with_folder_paths
+from storage import get_store, close_store, get_async_store, close_async_store
+from storage.base import path_stamp
+
+ASGI_WSGI_THREADS = int(os.getenv("ASGI_WSGI_THREADS", os.getenv("WEB_THREADS", 4)))
+
+_logger = logging.getLogger("knowledgetree.asgi")
+
+flask_app = create_app(init_db=False)
+_wsgi_pool = ThreadPoolExecutor(ASGI_WSGI_THREADS, thread_name_prefix="wsgi")
+
+
+class Request:
+    __slots__ = ('method', 'headers', 'args', 'body')
+
+    def __init__(self, scope, body):
+        self.method = scope['method']
+        self.headers = {name.decode('latin-1'): value.decode('latin-1') for name, value in scope['headers']}
+        self.args = {key: values[0] for key, values in parse_qs(scope['query_string'].decode('latin-1')).items()}
+        self.body = body
+
+    def json(self):
+        try:
+            return json.loads(self.body) if self.body else None
+        except ValueError:
+            return None
+
+
+def _json(status, payload, headers=()):
+    # Serialized as Flask's jsonify does outside debug mode.
+    body = json.dumps(payload, sort_keys=True, separators=(',', ':')).encode('utf-8')
+    return status, body, [('content-type', 'application/json')] + list(headers)
+
+def _not_modified(etag, max_age=None):
+    return 304, b'', http_cache.validator_headers(etag, max_age)
+
+def _is_fresh(request, etag):
+    return http_cache.etag_matches(request.headers.get('if-none-match', ''), etag)
+
+
+# --- Async routes ---
+async def get_node(request, node_id):
+    store = get_async_store()
+    stamp = await store.node_stamp(node_id)
+    if stamp is None:
+        return _json(404, {'error': 'Node not found'})
+    etag = f"node-{stamp['stamp']}"
+    max_age = http_cache.SYNCED_NODE_MAX_AGE if stamp['read_only'] else None
+    if _is_fresh(request, etag):
+        return _not_modified(etag, max_age)
+
+    node_data = await store.get_node(node_id)
+    if not node_data:
+        return _json(404, {'error': 'Node not found'})
+    node_data['content_html'] = await asyncio.to_thread(render_markdown, node_data.get('content') or '')
+    return _json(200, node_data, http_cache.validator_headers(etag, max_age))
+
+async def get_children(request, node_id):
+    # The mirror answers from memory; the thread covers a refresh or a store fallback.
+    return _json(200, await asyncio.to_thread(hierarchy.list_children, get_store(), node_id))
+
+async def search_nodes(request):
+    query = request.args.get('query', '')
+    start_node_id = request.args.get('start_node_id', 'root')
+    mode = request.args.get('mode', relevance.SEARCH_MODE)
+
+    if not query:
+        return _json(200, [])
+    if mode == 'relevance':
+        results = await asyncio.to_thread(relevance.search, get_store(), query, start_node_id, limit=15)
+    else:
+        results = await get_async_store().search(query, start_node_id, limit=15)
+    return _json(200, with_folder_paths(results))
+
+async def get_context(request, node_id):
+    excluded_attached_ids = []
+    if request.method == 'POST':
+        excluded_attached_ids = (request.json() or {}).get('excluded_ids', [])
+
+    store = get_async_store()
+    context_blocks.ensure_worker()
+    path = await store.context_path(node_id)
+    if not path:
+        return _json(404, {'error': 'Node not found'})
+    # Only GETs are conditional; a POST's exclusions change the result anyway.
+    stamp = path_stamp(path) if request.method == 'GET' else None
+    etag = f"context-{stamp}"
+    if stamp and _is_fresh(request, etag):
+        return _not_modified(etag)
+
+    blocks, filenames = await asyncio.gather(context_blocks.load_blocks_async(store, [path], excluded_attached_ids),
+                                             store.file_names(node_id))
+    full_context = context_blocks.assemble(path, blocks, excluded_attached_ids, filenames)
+    return _json(200, {'context': full_context, 'cursor': context_blocks.cursor(path)},
+                 http_cache.validator_headers(etag) if stamp else ())
+
+# (methods, path pattern, Flask rule for metrics, handler). Anything unmatched goes to Flask.
+ROUTES = [
+    (('GET',), re.compile(r'/api/node/(?P<node_id>[^/]+)'), '/api/node/<node_id>', get_node),
+    (('GET',), re.compile(r'/api/node/(?P<node_id>[^/]+)/children'), '/api/node/<node_id>/children', get_children),
+    (('GET',), re.compile(r'/api/search'), '/api/search', search_nodes),
+    # /api/context/batch is Flask's.
+    (('GET', 'POST'), re.compile(r'/api/context/(?P<node_id>(?!batch$)[^/]+)'), '/api/context/<node_id>',
+     get_context),
+]
+
+def _route(method, path):
+    for methods, pattern, rule, handler in ROUTES:
+        match = pattern.fullmatch(path)
+        if match and method in methods:
+            return rule, handler, match.groupdict()
+    return None
+
+
+# --- Serving ---
+async def _read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            return b''.join(chunks)
+
+async def _send(send, status, body, headers):
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(name.encode('latin-1'), value.encode('latin-1')) for name, value in headers]})
+    await send({'type': 'http.response.body', 'body': body})
+
+async def _serve(scope, receive, send, rule, handler, params):
+    request = Request(scope, await _read_body(receive))
+    request_scope = metrics.start_request()
+    try:
+        status, body, headers = await handler(request, **params)
+    except Exception:
+        _logger.exception("Error serving %s %s", scope['method'], scope['path'])
+        status, body, headers = _json(500, {'error': 'Internal Server Error'})
+    stats = metrics.finish_request(request_scope, rule, request.method, status)
+    if flask_app.debug or flask_app.config.get('QUERY_COUNT_HEADER'):
+        headers += [('x-query-count', str(stats.queries)), ('x-query-time-ms', f"{stats.query_seconds * 1000:.1f}")]
+    if status == 200:
+        body, encoding_headers = http_cache.encode_headers(body, request.headers.get('accept-encoding', ''))
+        headers += encoding_headers
+    await _send(send, status, body, headers + [('content-length', str(len(body)))])
+
+def _environ(scope, body):
+    """The WSGI environ of an ASGI HTTP request whose body has been read."""
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        # The body has been read whole, chunked or not.
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        name, value = name.decode('latin-1'), value.decode('latin-1')
+        if name == 'content-type':
+            environ['CONTENT_TYPE'] = value
+        elif name != 'content-length':
+            key = 'HTTP_' + name.upper().replace('-', '_')
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+async def _serve_flask(scope, receive, send):
+    # Bodies are read whole on both sides: uploads are capped by the Flask
+    # routes, and file downloads go through memory once.
+    environ = _environ(scope, await _read_body(receive))
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        started['status'], started['headers'] = int(status.split(' ', 1)[0]), headers
+
+    def run():
+        result = flask_app(environ, start_response)
+        try:
+            return b''.join(result)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+
+    body = await asyncio.get_running_loop().run_in_executor(_wsgi_pool, run)
+    await _send(send, started['status'], body, started['headers'])
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await close_async_store()
+            close_store()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await _lifespan(receive, send)
+    if scope['type'] != 'http':
+        raise ValueError(f"Unsupported ASGI scope type '{scope['type']}'.")
+    route = _route(scope['method'], scope['path'])
+    if route is None:
+        return await _serve_flask(scope, receive, send)
+    await _serve(scope, receive, send, *route)
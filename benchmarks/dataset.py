@@ -0,0 +1,103 @@
+# benchmarks/dataset.py
+"""
+Deterministic synthetic data shaped like the Freshservice and Datto API
+payloads the sync scripts consume. The same dataset feeds both the stand-in
+HTTP servers (fake_services.py) and the direct tree generator (generate.py).
+"""
+import random
+
+FIRST_NAMES = ["Alice", "Bob", "Carol", "Dave", "Erin", "Frank", "Grace", "Heidi", "Ivan", "Judy",
+               "Mallory", "Niaj", "Olivia", "Peggy", "Rupert", "Sybil", "Trent", "Victor", "Walter", "Yolanda"]
+LAST_NAMES = ["Smith", "Jones", "Brown", "Taylor", "Wilson", "Davies", "Evans", "Thomas", "Roberts", "Walker"]
+WORDS = ["printer", "email", "vpn", "password", "laptop", "outlook", "backup", "firewall", "license",
+         "monitor", "network", "server", "update", "invoice", "scanner", "teams", "onboarding", "wifi"]
+FIRST_TICKET_ID = 550
+
+
+class SyntheticDataset:
+    """
+    N companies, each with users, assets and tickets. Every list is generated
+    up front from the seed so repeated runs (and both stand-ins) agree.
+    """
+
+    def __init__(self, companies=10, users_per_company=10, assets_per_company=10,
+                 tickets_per_user=5, conversations_per_ticket=3, content_bytes=2000, seed=42):
+        self.rng = random.Random(seed)
+        self.content_bytes = content_bytes
+        self.conversations_per_ticket = conversations_per_ticket
+        self.companies = []
+        self.users = []
+        self.sites = []
+        self.site_variables = {}
+        self.devices = {}
+        self.tickets = []
+
+        for c in range(companies):
+            company_id = 1000 + c
+            account_number = str(100000 + c)
+            name = f"Company {c:04d} {self.rng.choice(LAST_NAMES)} Holdings"
+            self.companies.append({"id": company_id, "name": name,
+                                   "custom_fields": {"account_number": account_number}})
+
+            site_uid = f"site-{c:04d}"
+            self.sites.append({"uid": site_uid, "name": f"{name} (Datto)"})
+            self.site_variables[site_uid] = [{"name": "AccountNumber", "value": account_number}]
+
+            company_users = []
+            for u in range(users_per_company):
+                requester_id = company_id * 1000 + u
+                first = FIRST_NAMES[(c + u) % len(FIRST_NAMES)]
+                last = f"{LAST_NAMES[u % len(LAST_NAMES)]}{u}"
+                user = {"id": requester_id, "first_name": first, "last_name": last,
+                        "primary_email": f"{first.lower()}.{last.lower()}@company{c:04d}.example",
+                        "department_ids": [company_id], "active": True,
+                        "job_title": "Staff", "work_phone_number": "555-0100",
+                        "mobile_phone_number": "555-0199", "time_zone": "Pacific Time (US & Canada)"}
+                self.users.append(user)
+                company_users.append(user)
+
+            devices = []
+            for a in range(assets_per_company):
+                owner = company_users[a % len(company_users)] if company_users else None
+                description = f"{owner['first_name']} {owner['last_name']} workstation" if owner else "Shared"
+                devices.append({
+                    "uid": f"dev-{c:04d}-{a:04d}", "hostname": f"WS-{c:04d}-{a:04d}",
+                    "description": description, "operatingSystem": "Windows 11 Pro",
+                    "deviceType": {"category": "Desktop"}, "intIpAddress": f"10.{c % 256}.0.{a % 256}",
+                    "extIpAddress": "203.0.113.10", "lastLoggedInUser": owner["primary_email"] if owner else "",
+                    "online": a % 3 != 0, "lastSeen": 1700000000000 + a,
+                    "antivirus": {"productName": "Defender", "upToDate": True},
+                    "totalDiskSpaceUsage": "120 GB", "memory": "16 GB",
+                })
+            self.devices[site_uid] = devices
+
+        ticket_id = FIRST_TICKET_ID
+        for user in self.users:
+            for _ in range(tickets_per_user):
+                self.tickets.append({
+                    "id": ticket_id, "requester_id": user["id"],
+                    "subject": f"{self.rng.choice(WORDS).title()} issue #{ticket_id}",
+                    "description": f"<p>{self.text(self.content_bytes // 2)}</p>",
+                    "status": self.rng.choice([2, 3, 4, 5]), "priority": self.rng.choice([1, 2, 3, 4]),
+                    "source_name": "Email", "created_at": f"2024-{(ticket_id % 12) + 1:02d}-01T10:00:00Z",
+                    "responder": {"name": "Helpdesk Agent"}, "group": {"name": "Service Desk"},
+                })
+                ticket_id += 1
+        self.tickets_by_id = {t["id"]: t for t in self.tickets}
+
+    def text(self, size):
+        """Returns roughly `size` bytes of space-separated vocabulary."""
+        words = []
+        length = 0
+        while length < size:
+            word = self.rng.choice(WORDS)
+            words.append(word)
+            length += len(word) + 1
+        return " ".join(words)
+
+    def conversations(self, ticket_id):
+        rng = random.Random(ticket_id)
+        return [{"user": {"name": "Helpdesk Agent" if i % 2 else "Requester"},
+                 "created_at": f"2024-01-0{(i % 9) + 1}T12:00:00Z",
+                 "body": f"<p>{' '.join(rng.choice(WORDS) for _ in range(self.content_bytes // 40))}</p>"}
+                for i in range(self.conversations_per_ticket)]
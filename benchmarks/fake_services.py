@@ -0,0 +1,138 @@
+# benchmarks/fake_services.py
+"""
+Local stand-ins for the Freshservice and Datto RMM APIs, serving a
+SyntheticDataset over HTTP so the sync scripts run unmodified against them.
+"""
+import json
+import re
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+DATTO_PAGE_SIZE = 250
+
+
+class _JSONHandler(BaseHTTPRequestHandler):
+    dataset = None
+    latency = 0.0
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, payload, status=200):
+        # Stands in for the round trip to the real API.
+        if self.latency:
+            time.sleep(self.latency)
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def not_found(self):
+        self.send_json({"error": "not found"}, status=404)
+
+
+class FreshserviceHandler(_JSONHandler):
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        page = int(query.get("page", ["1"])[0])
+        per_page = int(query.get("per_page", ["30"])[0])
+
+        def page_of(items):
+            return items[(page - 1) * per_page: page * per_page]
+
+        if url.path == "/api/v2/departments":
+            return self.send_json({"departments": page_of(self.dataset.companies)})
+        if url.path == "/api/v2/requesters":
+            return self.send_json({"requesters": page_of(self.dataset.users)})
+        if url.path == "/api/v2/tickets":
+            tickets = self.dataset.tickets
+            if query.get("order_type", ["asc"])[0] == "desc":
+                tickets = list(reversed(tickets))
+            return self.send_json({"tickets": [{"id": t["id"]} for t in page_of(tickets)]})
+
+        match = re.fullmatch(r"/api/v2/tickets/(\d+)(/conversations)?", url.path)
+        if match:
+            ticket = self.dataset.tickets_by_id.get(int(match.group(1)))
+            if ticket is None:
+                return self.not_found()
+            if match.group(2):
+                return self.send_json({"conversations": self.dataset.conversations(ticket["id"])})
+            return self.send_json({"ticket": ticket})
+        self.not_found()
+
+    def do_PUT(self):
+        length = int(self.headers.get("Content-Length", 0))
+        self.rfile.read(length)
+        if re.fullmatch(r"/api/v2/departments/\d+", urlparse(self.path).path):
+            return self.send_json({"department": {}})
+        self.not_found()
+
+
+class DattoHandler(_JSONHandler):
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        self.rfile.read(length)
+        if self.path == "/auth/oauth/token":
+            return self.send_json({"access_token": "benchmark-token"})
+        self.not_found()
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        page = int(parse_qs(url.query).get("page", ["0"])[0])
+        base = f"http://{self.headers['Host']}{url.path}"
+
+        def paged(key, items):
+            chunk = items[page * DATTO_PAGE_SIZE:(page + 1) * DATTO_PAGE_SIZE]
+            has_next = (page + 1) * DATTO_PAGE_SIZE < len(items)
+            return {key: chunk, "pageDetails": {"nextPageUrl": f"{base}?page={page + 1}" if has_next else None}}
+
+        if url.path == "/api/v2/account/sites":
+            return self.send_json(paged("sites", self.dataset.sites))
+
+        match = re.fullmatch(r"/api/v2/site/([^/]+)/(variables|devices)", url.path)
+        if match and match.group(1) in self.dataset.site_variables:
+            site_uid = match.group(1)
+            if match.group(2) == "variables":
+                return self.send_json({"variables": self.dataset.site_variables[site_uid]})
+            return self.send_json(paged("devices", self.dataset.devices[site_uid]))
+        self.not_found()
+
+    def do_PUT(self):
+        length = int(self.headers.get("Content-Length", 0))
+        payload = json.loads(self.rfile.read(length) or b"{}")
+        match = re.fullmatch(r"/api/v2/site/([^/]+)/variable", urlparse(self.path).path)
+        if match and match.group(1) in self.dataset.site_variables:
+            variables = self.dataset.site_variables[match.group(1)]
+            variables[:] = [v for v in variables if v["name"] != payload.get("name")] + [payload]
+            return self.send_json({})
+        self.not_found()
+
+
+class FakeService:
+    """Runs a handler on an ephemeral localhost port in a daemon thread."""
+
+    def __init__(self, handler_class, dataset, latency=0.0):
+        handler = type(handler_class.__name__, (handler_class,), {"dataset": dataset, "latency": latency})
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def fake_freshservice(dataset, latency=0.0):
+    return FakeService(FreshserviceHandler, dataset, latency)
+
+def fake_datto(dataset, latency=0.0):
+    return FakeService(DattoHandler, dataset, latency)
@@ -0,0 +1,138 @@
+# benchmarks/generate.py
+"""
+Bulk-loads a SyntheticDataset straight into the graph, using the same node
+ids and shapes the sync scripts produce, plus user-authored Docs and an
+attached Policies folder per company so context and export have work to do.
+"""
+TICKET_FOLDER_FANOUT = 2
+
+
+def _extra_parents(candidates, index, count, own_parent=None):
+    """Up to `count` further parents for the index-th node, picked round-robin from candidates."""
+    picked = [candidates[(index + k) % len(candidates)] for k in range(1, count + 1)]
+    return [p for p in dict.fromkeys(picked) if p != own_parent]
+
+def _ticket_leaf_folders(parent_id, depth, nodes, rels, multi_parent=0):
+    """
+    Creates `depth - 1` levels of subfolders under a Tickets folder and
+    returns the leaf ids. With multi_parent each subfolder is also linked
+    under that many other folders of the level above.
+    """
+    leaves = [parent_id]
+    for level in range(1, depth):
+        next_leaves = []
+        for folder_id in leaves:
+            for branch in range(TICKET_FOLDER_FANOUT):
+                child_id = f"{folder_id}-{level}.{branch}"
+                nodes.append({"id": child_id, "name": f"Archive {level}.{branch}", "is_folder": True,
+                              "is_attached": False, "read_only": True})
+                rels.append({"parent": folder_id, "child": child_id})
+                for extra in _extra_parents(leaves, len(next_leaves), multi_parent, folder_id):
+                    rels.append({"parent": extra, "child": child_id})
+                next_leaves.append(child_id)
+        leaves = next_leaves
+    return leaves
+
+
+def build_tree(dataset, ticket_depth=1, docs_per_company=5, docs_depth=2, multi_parent=0):
+    """
+    Returns (nodes, rels, samples) for the dataset without touching the
+    database. multi_parent > 0 links every ticket and ticket subfolder under
+    that many extra folders of its Tickets tree, for multi-parent traversals.
+    """
+    nodes = [{"id": "companies_root", "name": "Companies", "is_folder": True}]
+    rels = [{"parent": "root", "child": "companies_root"}]
+    samples = {"companies": [], "users": [], "assets": [], "tickets": [], "docs": []}
+    tickets_by_requester = {}
+    for ticket in dataset.tickets:
+        tickets_by_requester.setdefault(ticket["requester_id"], []).append(ticket)
+
+    for company in dataset.companies:
+        acct = company["custom_fields"]["account_number"]
+        nodes.append({"id": acct, "name": company["name"], "is_folder": True, "freshservice_id": company["id"]})
+        rels.append({"parent": "companies_root", "child": acct})
+        samples["companies"].append(company["name"])
+
+        nodes.append({"id": f"users_for_{acct}", "name": "Users", "is_folder": True})
+        rels.append({"parent": acct, "child": f"users_for_{acct}"})
+        nodes.append({"id": f"assets_for_{acct}", "name": "Assets", "is_folder": True})
+        rels.append({"parent": acct, "child": f"assets_for_{acct}"})
+
+        policies_id = f"policies_for_{acct}"
+        nodes.append({"id": policies_id, "name": "Policies", "is_folder": True, "is_attached": True, "read_only": False})
+        rels.append({"parent": acct, "child": policies_id})
+        for p in range(3):
+            nodes.append({"id": f"{policies_id}-{p}", "name": f"Policy {p}.md", "is_folder": False,
+                          "is_attached": False, "read_only": False, "content": dataset.text(dataset.content_bytes)})
+            rels.append({"parent": policies_id, "child": f"{policies_id}-{p}"})
+
+        parent_id = f"docs_for_{acct}"
+        nodes.append({"id": parent_id, "name": "Docs", "is_folder": True, "is_attached": False, "read_only": False})
+        rels.append({"parent": acct, "child": parent_id})
+        for level in range(docs_depth):
+            for d in range(docs_per_company):
+                doc_id = f"{parent_id}-doc{d}"
+                nodes.append({"id": doc_id, "name": f"Runbook {level}.{d}.md", "is_folder": False,
+                              "is_attached": False, "read_only": False, "content": dataset.text(dataset.content_bytes)})
+                rels.append({"parent": parent_id, "child": doc_id})
+                samples["docs"].append(doc_id)
+            folder_id = f"{parent_id}-sub{level}"
+            nodes.append({"id": folder_id, "name": f"Section {level}", "is_folder": True,
+                          "is_attached": False, "read_only": False})
+            rels.append({"parent": parent_id, "child": folder_id})
+            parent_id = folder_id
+
+    accounts = {c["id"]: c["custom_fields"]["account_number"] for c in dataset.companies}
+    email_by_name = {}
+    for user in dataset.users:
+        acct = accounts[user["department_ids"][0]]
+        email = user["primary_email"]
+        name = f"{user['first_name']} {user['last_name']}"
+        email_by_name[(acct, name)] = email
+        nodes.append({"id": email, "name": name, "is_folder": True, "user_email": email,
+                      "freshservice_requester_id": user["id"]})
+        rels.append({"parent": f"users_for_{acct}", "child": email})
+        nodes.append({"id": f"contact_for_{email}", "name": "Contact.md", "is_folder": False, "user_email": email,
+                      "read_only": True, "content": f"# Contact Information for {name}\n\n- **Email:** {email}"})
+        rels.append({"parent": email, "child": f"contact_for_{email}"})
+        tickets_id = f"tickets_for_{email}"
+        nodes.append({"id": tickets_id, "name": "Tickets", "is_folder": True, "is_attached": True})
+        rels.append({"parent": email, "child": tickets_id})
+        samples["users"].append(email)
+
+        leaves = _ticket_leaf_folders(tickets_id, ticket_depth, nodes, rels, multi_parent)
+        for i, ticket in enumerate(tickets_by_requester.get(user["id"], [])):
+            node_id = f"ticket_{ticket['id']}"
+            nodes.append({"id": node_id, "name": f"{ticket['id']}_{ticket['subject']}.md", "is_folder": False,
+                          "read_only": True, "content": f"# Ticket #{ticket['id']}\n\n{ticket['description']}"})
+            rels.append({"parent": leaves[i % len(leaves)], "child": node_id})
+            for extra in _extra_parents(leaves, i, multi_parent, leaves[i % len(leaves)]):
+                rels.append({"parent": extra, "child": node_id})
+            samples["tickets"].append(node_id)
+
+    for company in dataset.companies:
+        acct = company["custom_fields"]["account_number"]
+        site_uid = next(s["uid"] for s in dataset.sites if s["name"].startswith(company["name"]))
+        for device in dataset.devices[site_uid]:
+            nodes.append({"id": device["uid"], "name": f"{device['hostname']}.md", "is_folder": False,
+                          "datto_uid": device["uid"], "read_only": True,
+                          "content": f"# Computer Information: {device['hostname']}\n\n- **Description:** {device['description']}"})
+            rels.append({"parent": f"assets_for_{acct}", "child": device["uid"]})
+            samples["assets"].append(device["uid"])
+            # pull_datto links each asset under its owner's user folder as well.
+            owner_email = email_by_name.get((acct, device["description"].replace(" workstation", "")))
+            if owner_email:
+                rels.append({"parent": owner_email, "child": device["uid"]})
+
+    return nodes, rels, samples
+
+
+def generate_tree(store, dataset, ticket_depth=1, docs_per_company=5, docs_depth=2, wipe=False, multi_parent=0):
+    """Builds the synthetic tree in the store and returns sample ids/paths to benchmark against."""
+    store.init_schema()
+    if wipe:
+        store.reinitialize()
+    nodes, rels, samples = build_tree(dataset, ticket_depth, docs_per_company, docs_depth, multi_parent)
+    store.bulk_load(nodes, rels)
+    samples["node_count"] = len(nodes) + 1
+    return samples
@@ -0,0 +1,414 @@
+# benchmarks/run.py
+"""
+Benchmark suite. Generates a synthetic tree, times the read APIs, export and
+import through the Flask test client, then wipes the database and times each
+sync writer against local Freshservice/Datto stand-ins. Results are written
+as JSON; pass --baseline to compare against an earlier run.
+
+WARNING: this wipes the configured store. Point NEO4J_URI (or SQLITE_PATH
+with STORAGE_BACKEND=sqlite) at a scratch database and pass --wipe to confirm.
+
+Usage: python -m benchmarks.run --wipe --companies 20 --output bench.json [--baseline old.json]
+"""
+import os
+import io
+import sys
+import json
+import time
+import argparse
+import platform
+import statistics
+import subprocess
+from contextlib import nullcontext
+from urllib.parse import quote, unquote
+
+import api_cache
+
+from benchmarks.dataset import SyntheticDataset
+from benchmarks.fake_services import fake_freshservice, fake_datto
+from benchmarks.webhook_sender import ticket_events, send_events
+
+
+def summarize(samples):
+    ordered = sorted(samples)
+    return {
+        "runs": len(ordered),
+        "min_ms": ordered[0],
+        "median_ms": statistics.median(ordered),
+        "p95_ms": ordered[min(len(ordered) - 1, int(round(0.95 * (len(ordered) - 1))))],
+        "mean_ms": statistics.fmean(ordered),
+    }
+
+def timed(fn, repeat):
+    """Runs fn `repeat` times and returns per-run wall times in milliseconds."""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+def request_ok(client, method, url, **kwargs):
+    response = client.open(url, method=method, **kwargs)
+    if response.status_code >= 400:
+        raise RuntimeError(f"{method} {url} returned {response.status_code}: {response.get_data(as_text=True)[:200]}")
+    return response
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_hierarchy_benchmarks(store, samples, repeat):
+    """
+    Loads the hierarchy mirror, records its size per node, and times its
+    structural reads next to the store's. Leaves the worker's mirror warm,
+    so the read benchmarks after it browse from memory.
+    """
+    import hierarchy
+
+    results = {"hierarchy_load": summarize(timed(lambda: hierarchy.warm(store), 1))}
+    mirror = hierarchy.load(store)
+    structure, strings = mirror.memory_bytes()
+    results["hierarchy_load"].update(nodes=len(mirror), bytes_per_node=round((structure + strings) / len(mirror), 1),
+                                     structure_bytes_per_node=round(structure / len(mirror), 1),
+                                     string_bytes_per_node=round(strings / len(mirror), 1))
+
+    ticket = samples["tickets"][len(samples["tickets"]) // 2]
+    names = [node["name"] for node in store.path_nodes(ticket)[1:]]
+    folder = store.resolve_path(names[:-1])
+    cases = {
+        "path": lambda reader: reader.path_nodes(ticket),
+        "children": lambda reader: reader.list_children(folder),
+        "resolve": lambda reader: reader.resolve_path(names),
+        "attached": lambda reader: reader.attached_folders_on_path(ticket),
+    }
+    for name, read in cases.items():
+        results[f"hierarchy_{name}_store"] = summarize(timed(lambda: read(store), repeat))
+        results[f"hierarchy_{name}_mirror"] = summarize(timed(lambda: read(mirror), repeat))
+    return results
+
+def run_read_benchmarks(client, samples, repeat):
+    company = samples["companies"][len(samples["companies"]) // 2]
+    user = samples["users"][len(samples["users"]) // 2]
+    ticket = samples["tickets"][len(samples["tickets"]) // 2]
+    asset = samples["assets"][len(samples["assets"]) // 2]
+    doc = samples["docs"][-1]
+    company_path = f"Companies/{quote(company)}"
+
+    cases = {
+        "browse_root": lambda: request_ok(client, "GET", "/browse/"),
+        "browse_company_users": lambda: request_ok(client, "GET", f"/browse/{company_path}/Users"),
+        "search_global": lambda: request_ok(client, "GET", "/api/search?query=firewall&start_node_id=root"),
+        "search_scoped": lambda: request_ok(client, "GET", f"/api/search?query=vpn&start_node_id={quote(user)}"),
+        "get_node_ticket": lambda: request_ok(client, "GET", f"/api/node/{ticket}"),
+        "get_node_folder": lambda: request_ok(client, "GET", f"/api/node/{quote(user)}"),
+        "get_context_asset": lambda: request_ok(client, "GET", f"/api/context/{asset}"),
+        "get_context_doc": lambda: request_ok(client, "GET", f"/api/context/{quote(doc)}"),
+        "get_context_user": lambda: request_ok(client, "GET", f"/api/context/{quote(user)}"),
+        "get_context_tree": lambda: request_ok(client, "GET", f"/api/context/tree/{ticket}"),
+    }
+    return {name: summarize(timed(fn, repeat)) for name, fn in cases.items()}
+
+def serving_mix(samples):
+    """The read requests the serving benchmark cycles through: nodes, children, search and contexts."""
+    user = samples["users"][len(samples["users"]) // 2]
+    return [
+        f"/api/node/{samples['tickets'][len(samples['tickets']) // 2]}",
+        f"/api/node/{quote(user)}/children",
+        "/api/search?query=firewall&start_node_id=root",
+        f"/api/context/{samples['assets'][len(samples['assets']) // 2]}",
+        f"/api/node/{quote(user)}",
+        f"/api/context/{quote(user)}",
+    ]
+
+async def asgi_get(app, url):
+    """A GET through an ASGI app in-process; returns the status."""
+    path, _, query = url.partition("?")
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    await app({"type": "http", "method": "GET", "path": unquote(path), "query_string": query.encode(),
+               "headers": [], "http_version": "1.1", "scheme": "http", "root_path": "",
+               "server": ("localhost", 80), "client": ("127.0.0.1", 0)}, receive, send)
+    return messages[0]["status"]
+
+def run_serving_benchmarks(samples, concurrency, requests_per_client):
+    """
+    The read APIs under load: `concurrency` clients each send requests back
+    to back, once to the Flask app on WEB_THREADS threads (one gthread
+    worker) and once to the ASGI app on one event loop (one uvicorn worker).
+    Latency includes the wait for a free thread.
+    """
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+    from werkzeug.test import EnvironBuilder, run_wsgi_app
+    import asgi
+    from storage import close_async_store
+
+    urls = serving_mix(samples)
+    threads = int(os.getenv("WEB_THREADS", 4))
+
+    def wsgi_get(url):
+        path, _, query = url.partition("?")
+        _, status, _ = run_wsgi_app(asgi.flask_app, EnvironBuilder(path=unquote(path), query_string=query).get_environ(),
+                                    buffered=True)
+        return int(status.split(" ", 1)[0])
+
+    async def load(request):
+        latencies = []
+
+        async def client(offset):
+            for i in range(requests_per_client):
+                url = urls[(offset + i) % len(urls)]
+                start = time.perf_counter()
+                status = await request(url)
+                latencies.append((time.perf_counter() - start) * 1000)
+                if status >= 400:
+                    raise RuntimeError(f"GET {url} returned {status}")
+
+        start = time.perf_counter()
+        await asyncio.gather(*(client(offset) for offset in range(concurrency)))
+        return latencies, time.perf_counter() - start
+
+    async def serve_sync():
+        loop = asyncio.get_running_loop()
+        with ThreadPoolExecutor(threads) as pool:
+            return await load(lambda url: loop.run_in_executor(pool, wsgi_get, url))
+
+    async def serve_async():
+        try:
+            return await load(lambda url: asgi_get(asgi.app, url))
+        finally:
+            await close_async_store()
+
+    results = {}
+    for name, serve in (("sync", serve_sync), ("async", serve_async)):
+        latencies, elapsed = asyncio.run(serve())
+        results[f"serve_{name}_c{concurrency}"] = dict(summarize(latencies),
+                                                       requests_per_s=round(len(latencies) / elapsed, 1))
+    results[f"serve_sync_c{concurrency}"]["threads"] = threads
+    return results
+
+def run_traversal_benchmarks(store, samples, repeat):
+    """
+    Recomputes a user's context block, whose attached Tickets folder is the
+    deepest traversal in the tree (and a DAG with --multi-parent).
+    """
+    user = samples["users"][len(samples["users"]) // 2]
+    return {"context_articles_user": summarize(timed(lambda: store.context_articles(user), repeat))}
+
+def run_relevance_benchmarks(client, store, samples, repeat):
+    """The BM25 index build and ranked searches, next to the substring searches above."""
+    import relevance
+
+    if not relevance.available():
+        print("Skipping relevance search benchmarks: numpy/scipy are not installed.")
+        return {}
+    user = samples["users"][len(samples["users"]) // 2]
+    results = {"search_index_build": summarize(timed(lambda: relevance.warm(store), 1))}
+    cases = {
+        "search_relevance_global": lambda: request_ok(client, "GET", "/api/search?query=firewall&start_node_id=root&mode=relevance"),
+        "search_relevance_scoped": lambda: request_ok(client, "GET", f"/api/search?query=vpn&start_node_id={quote(user)}&mode=relevance"),
+    }
+    results.update({name: summarize(timed(fn, repeat)) for name, fn in cases.items()})
+    return results
+
+def run_export_import(client, repeat):
+    exported = {}
+
+    def export():
+        exported["body"] = request_ok(client, "GET", "/api/admin/export").get_data()
+
+    def import_():
+        request_ok(client, "POST", "/api/admin/import",
+                   data={"file": (io.BytesIO(exported["body"]), "export.json")},
+                   content_type="multipart/form-data")
+
+    results = {"export": summarize(timed(export, repeat))}
+    results["import"] = summarize(timed(import_, repeat))
+    results["import"]["items"] = len(json.loads(exported["body"]))
+    return results
+
+def run_sync_benchmarks(store, dataset, repeat, api_latency=0.0, cache_mode=None, client=None):
+    """
+    Times each sync writer from an empty database against the local
+    stand-ins. With cache_mode 'record' their responses are written through
+    to API_CACHE_DIR; with 'replay' the writers read them back from there
+    and no stand-ins are started. Given a client, also times the webhook
+    ingest against the synced tree.
+    """
+    results = {}
+    if cache_mode:
+        api_cache.API_CACHE = cache_mode
+    replay = cache_mode == 'replay'
+    with nullcontext() if replay else fake_freshservice(dataset, api_latency) as freshservice, \
+         nullcontext() if replay else fake_datto(dataset, api_latency) as datto:
+        os.environ.update({
+            "FRESHSERVICE_URL": freshservice.url if freshservice else "http://replay.invalid",
+            "FRESHSERVICE_API_KEY": "benchmark",
+            "DATTO_API_ENDPOINT": datto.url if datto else "http://replay.invalid",
+            "DATTO_API_KEY": "benchmark", "DATTO_API_SECRET": "benchmark",
+            "SYNC_REQUEST_DELAY": "0", "SYNC_TICKET_DELAY": "0",
+        })
+        # Imported only now so the modules pick up the stand-in endpoints.
+        from scripts.pull_freshservice import sync_companies_and_users
+        from scripts.pull_datto import sync_datto_devices
+        from scripts.pull_fresh_tickets import sync_fresh_tickets
+
+        writers = [
+            ("sync_freshservice", sync_companies_and_users),
+            ("sync_datto", sync_datto_devices),
+            ("sync_fresh_tickets_overwrite", lambda: sync_fresh_tickets(overwrite=True)),
+        ]
+        timings = {name: [] for name, _ in writers}
+        for _ in range(repeat):
+            store.reinitialize()
+            for name, writer in writers:
+                timings[name].extend(timed(writer, 1))
+        results = {name: summarize(samples) for name, samples in timings.items()}
+        if client and not replay:
+            results.update(run_webhook_benchmark(client, store, dataset))
+    return results
+
+def run_webhook_benchmark(client, store, dataset, tickets=20, burst=3):
+    """
+    Edits some tickets on the stand-in, sends a burst of webhook events for
+    each through the stand-in sender, then runs the queued jobs in process.
+    Times the whole round trip and checks every edit reached the store.
+    """
+    import tempfile
+    import threading
+    import jobs
+    import ingest
+
+    edited = dataset.tickets[:tickets]
+    for ticket in edited:
+        ticket['subject'] += ' (edited)'
+    ingest.FRESHSERVICE_WEBHOOK_SECRET = 'benchmark'
+    ingest.WEBHOOK_COALESCE_SECONDS = 0
+    with tempfile.TemporaryDirectory() as queue_dir:
+        jobs.JOB_QUEUE_PATH = os.path.join(queue_dir, 'jobs.db')
+        start = time.perf_counter()
+        statuses = send_events(client.post, '/api/ingest/freshservice',
+                               ticket_events([t['id'] for t in edited], burst), 'benchmark')
+        jobs.work_loop(threading.Event(), drain=True)
+        elapsed = (time.perf_counter() - start) * 1000
+        fetches = sum(1 for job in jobs.recent(len(statuses)) if job['state'] == 'done')
+    written = sum(1 for t in edited if t['subject'] in (store.get_node(f"ticket_{t['id']}") or {}).get('content', ''))
+    if statuses.count(202) != len(statuses) or written != len(edited):
+        raise RuntimeError(f"Webhook ingest: {statuses.count(202)}/{len(statuses)} events accepted, "
+                           f"{written}/{len(edited)} edits written.")
+    result = summarize([elapsed])
+    result.update(events=len(statuses), fetches=fetches)
+    return {"webhook_ingest": result}
+
+
+def compare(results, baseline, tolerance):
+    """Returns the benchmarks whose median regressed by more than `tolerance` against the baseline."""
+    regressions = []
+    for name, current in results["benchmarks"].items():
+        previous = baseline.get("benchmarks", {}).get(name)
+        if not previous or not previous.get("median_ms"):
+            continue
+        ratio = current["median_ms"] / previous["median_ms"]
+        marker = "REGRESSION" if ratio > 1 + tolerance else ""
+        print(f"  {name:<32} {previous['median_ms']:>10.1f} -> {current['median_ms']:>10.1f} ms  x{ratio:.2f} {marker}")
+        if marker:
+            regressions.append(name)
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="KnowledgeTree benchmark suite")
+    parser.add_argument("--wipe", action="store_true", help="confirm that the configured database may be wiped")
+    parser.add_argument("--companies", type=int, default=10)
+    parser.add_argument("--users", type=int, default=10, help="users per company")
+    parser.add_argument("--assets", type=int, default=10, help="assets per company")
+    parser.add_argument("--tickets", type=int, default=5, help="tickets per user")
+    parser.add_argument("--ticket-depth", type=int, default=1, help="folder levels inside each Tickets folder")
+    parser.add_argument("--multi-parent", type=int, default=0,
+                        help="extra parents for every ticket and ticket subfolder inside its Tickets folder")
+    parser.add_argument("--docs", type=int, default=5, help="user-authored articles per company and level")
+    parser.add_argument("--docs-depth", type=int, default=2)
+    parser.add_argument("--content-bytes", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--sync-repeat", type=int, default=1)
+    parser.add_argument("--skip-sync", action="store_true")
+    parser.add_argument("--concurrency", type=int, default=64,
+                        help="concurrent clients in the sync vs async serving benchmark")
+    parser.add_argument("--serve-requests", type=int, default=20, help="requests per serving benchmark client")
+    parser.add_argument("--api-latency", type=float, default=0.0,
+                        help="seconds the stand-in APIs wait before each response")
+    parser.add_argument("--api-cache", choices=("record", "replay"),
+                        help="record the sync responses to API_CACHE_DIR, or replay them from there offline")
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--baseline", help="earlier results JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed median slowdown before failing")
+    args = parser.parse_args(argv)
+
+    if not args.wipe:
+        sys.exit("Refusing to run: the benchmark wipes the database. Pass --wipe to confirm.")
+
+    from app import create_app
+    from storage import get_store
+    from benchmarks.generate import generate_tree
+
+    store = get_store()
+    dataset = SyntheticDataset(companies=args.companies, users_per_company=args.users,
+                               assets_per_company=args.assets, tickets_per_user=args.tickets,
+                               content_bytes=args.content_bytes, seed=args.seed)
+
+    benchmarks = {}
+    start = time.perf_counter()
+    samples = generate_tree(store, dataset, ticket_depth=args.ticket_depth, docs_per_company=args.docs,
+                            docs_depth=args.docs_depth, wipe=True, multi_parent=args.multi_parent)
+    benchmarks["generate_tree"] = summarize([(time.perf_counter() - start) * 1000])
+    print(f"Generated {samples['node_count']} nodes.")
+
+    client = create_app(init_db=False).test_client()
+    benchmarks.update(run_hierarchy_benchmarks(store, samples, args.repeat))
+    benchmarks.update(run_read_benchmarks(client, samples, args.repeat))
+    benchmarks.update(run_relevance_benchmarks(client, store, samples, args.repeat))
+    benchmarks.update(run_traversal_benchmarks(store, samples, args.repeat))
+    benchmarks.update(run_serving_benchmarks(samples, args.concurrency, args.serve_requests))
+    benchmarks.update(run_export_import(client, max(1, args.repeat // 5)))
+    if not args.skip_sync:
+        benchmarks.update(run_sync_benchmarks(store, dataset, args.sync_repeat, args.api_latency, args.api_cache,
+                                              client))
+
+    results = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "backend": os.getenv("STORAGE_BACKEND", "neo4j"),
+        "params": {k: v for k, v in vars(args).items() if k not in ("wipe", "output", "baseline")},
+        "node_count": samples["node_count"],
+        "benchmarks": benchmarks,
+    }
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+
+    for name, stats in benchmarks.items():
+        print(f"  {name:<32} median {stats['median_ms']:>10.1f} ms   p95 {stats['p95_ms']:>10.1f} ms")
+    print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        print(f"\nComparison against {args.baseline} (tolerance {args.tolerance:.0%}):")
+        if compare(results, baseline, args.tolerance):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
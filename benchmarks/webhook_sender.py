@@ -0,0 +1,54 @@
+# benchmarks/webhook_sender.py
+"""
+Stand-in for Freshservice's webhook sender. Posts ticket events to
+/api/ingest/freshservice the way a Freshservice workflow does, a burst of
+several events per ticket, to exercise the ingest and its coalescing (see
+ingest.py) without a Freshservice account.
+
+Usage: python -m benchmarks.webhook_sender TICKET_ID [TICKET_ID ...]
+           [--url http://localhost:5001/api/ingest/freshservice] [--burst 3] [--secret S]
+"""
+import os
+import sys
+import argparse
+from itertools import cycle, islice
+
+EVENT_CYCLE = ('ticket_updated', 'ticket_replied')
+
+
+def ticket_events(ticket_ids, burst=3, created=False):
+    """Webhook payloads for the tickets: burst events each, opened by a ticket_created when created is set."""
+    for ticket_id in ticket_ids:
+        events = (['ticket_created'] if created else []) + list(islice(cycle(EVENT_CYCLE), burst - int(created)))
+        for event in events:
+            # Freshservice renders {{ticket.id}} with the workspace's prefix.
+            yield {'event': event, 'ticket_id': f"#SR-{ticket_id}"}
+
+def send_events(post, url, events, secret):
+    """
+    Posts each event with post(url, json=..., headers=...), a requests.post
+    or a Flask test client's post. Returns the status codes.
+    """
+    return [post(url, json=event, headers={'X-Webhook-Secret': secret}).status_code for event in events]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Send stand-in Freshservice ticket webhooks.")
+    parser.add_argument("ticket_ids", type=int, nargs="+")
+    parser.add_argument("--url", default="http://localhost:5001/api/ingest/freshservice")
+    parser.add_argument("--burst", type=int, default=3, help="events per ticket")
+    parser.add_argument("--created", action="store_true", help="open each burst with a ticket_created event")
+    parser.add_argument("--secret", default=os.getenv("FRESHSERVICE_WEBHOOK_SECRET", ""))
+    args = parser.parse_args(argv)
+
+    import requests
+
+    statuses = send_events(requests.post, args.url, ticket_events(args.ticket_ids, args.burst, args.created),
+                           args.secret)
+    accepted = statuses.count(202)
+    print(f"Sent {len(statuses)} events: {accepted} accepted"
+          + (f", {len(statuses) - accepted} rejected ({sorted(set(statuses) - {202})})." if accepted < len(statuses) else "."))
+    return 0 if accepted == len(statuses) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
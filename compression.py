@@ -0,0 +1,131 @@
+# compression.py
+"""
+Compressed, content-addressed storage for large synced content.
+
+Synced ticket and asset markdown used to sit on the nodes themselves, so
+every query touching those nodes carried it. Bodies of at least
+CONTENT_COMPRESS_MIN_BYTES are instead stored once per distinct text,
+compressed and keyed by its SHA-256, in the store's side store (SQLite's
+content_blobs table, Neo4j ContentBlob nodes); the node keeps only
+content_ref and content_size, and reads decompress when they return content.
+
+zstd is used when the optional zstandard package is installed, zlib
+otherwise. Tickets share most of their layout, so a zstd dictionary trained
+on a sample of them (scripts/train_content_dictionary.py) compresses them
+further. A process compresses with the dictionary that was current when it
+first synced a ticket; stored bodies name the dictionary they need.
+
+Cypher cannot read a compressed body, so on Neo4j each one keeps a bounded
+list of its distinct words (search_terms) for substring search to match.
+"""
+import os
+import re
+import zlib
+import hashlib
+
+# Bodies shorter than this stay on the node; 0 keeps every body there.
+CONTENT_COMPRESS_MIN_BYTES = int(os.getenv("CONTENT_COMPRESS_MIN_BYTES", 2048))
+# 'zstd' falls back to 'zlib' when zstandard is not installed.
+CONTENT_CODEC = os.getenv("CONTENT_CODEC", "zstd")
+ZSTD_LEVEL = 9
+ZLIB_LEVEL = 6
+CONTENT_DICTIONARY_SIZE = int(os.getenv("CONTENT_DICTIONARY_SIZE", 65536))
+# The codec stored dictionaries are saved under; purges never delete them.
+DICTIONARY_CODEC = 'dict'
+# How many distinct words of a compressed body Neo4j substring search can match.
+CONTENT_SEARCH_TERMS = int(os.getenv("CONTENT_SEARCH_TERMS", 256))
+SEARCH_TERM_MAX_LENGTH = 32
+
+WORD_PATTERN = re.compile(r"\w+")
+
+_zstd = None
+_dictionaries = {}
+_ticket_dictionary = None
+
+
+def _get_zstd():
+    """zstd is used only when the optional zstandard package is installed."""
+    global _zstd
+    if _zstd is None:
+        try:
+            import zstandard
+            _zstd = zstandard
+        except ImportError:
+            _zstd = False
+    return _zstd
+
+def _dictionary(dictionary_hash, data):
+    if dictionary_hash not in _dictionaries:
+        _dictionaries[dictionary_hash] = _get_zstd().ZstdCompressionDict(data)
+    return _dictionaries[dictionary_hash]
+
+def should_compress(text):
+    return bool(text) and CONTENT_COMPRESS_MIN_BYTES > 0 and len(text.encode('utf-8')) >= CONTENT_COMPRESS_MIN_BYTES
+
+def search_terms(text, limit=None):
+    """
+    The distinct lowercased words of a text in order of first use, cut to
+    SEARCH_TERM_MAX_LENGTH characters, and at most `limit` of them.
+    """
+    terms = {}
+    for word in WORD_PATTERN.findall((text or '').lower()):
+        terms.setdefault(word[:SEARCH_TERM_MAX_LENGTH], None)
+        if limit is not None and len(terms) >= limit:
+            break
+    return list(terms)
+
+def content_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+def compress(text, dictionary=None):
+    """
+    (codec, data) for the text. `dictionary` is a (hash, data) pair from
+    TreeStore.content_dictionary; the codec then names it, as 'zstd:<hash>'.
+    """
+    raw = text.encode('utf-8')
+    zstd = _get_zstd() if CONTENT_CODEC == 'zstd' else False
+    if not zstd:
+        return 'zlib', zlib.compress(raw, ZLIB_LEVEL)
+    if dictionary:
+        compressor = zstd.ZstdCompressor(level=ZSTD_LEVEL, dict_data=_dictionary(*dictionary))
+        return f"zstd:{dictionary[0]}", compressor.compress(raw)
+    return 'zstd', zstd.ZstdCompressor(level=ZSTD_LEVEL).compress(raw)
+
+def decompress(codec, data, load_dictionary=None):
+    """
+    The text a blob holds. load_dictionary(hash) returns a dictionary's data
+    the first time a process reads a body compressed with it.
+    """
+    if codec == 'zlib':
+        return zlib.decompress(data).decode('utf-8')
+    zstd = _get_zstd()
+    if not zstd:
+        raise RuntimeError("Content is compressed with zstd; install the zstandard package to read it.")
+    _, _, dictionary_hash = codec.partition(':')
+    if dictionary_hash:
+        if dictionary_hash not in _dictionaries:
+            stored = load_dictionary(dictionary_hash) if load_dictionary else None
+            if stored is None:
+                raise RuntimeError(f"Content dictionary '{dictionary_hash}' is missing.")
+            _dictionary(dictionary_hash, stored)
+        return zstd.ZstdDecompressor(dict_data=_dictionaries[dictionary_hash]).decompress(data).decode('utf-8')
+    return zstd.ZstdDecompressor().decompress(data).decode('utf-8')
+
+def ticket_dictionary(load):
+    """
+    The (hash, data) dictionary tickets are compressed with, or None. load()
+    is TreeStore.content_dictionary; it is asked once per process.
+    """
+    global _ticket_dictionary
+    if _ticket_dictionary is None:
+        usable = _get_zstd() and CONTENT_CODEC == 'zstd'
+        _ticket_dictionary = (load() if usable else None) or False
+    return _ticket_dictionary or None
+
+def train_dictionary(samples):
+    """(hash, data) of a zstd dictionary trained on sample texts; needs zstandard."""
+    zstd = _get_zstd()
+    if not zstd:
+        raise RuntimeError("Training a content dictionary needs the zstandard package.")
+    data = zstd.train_dictionary(CONTENT_DICTIONARY_SIZE, [s.encode('utf-8') for s in samples]).as_bytes()
+    return hashlib.sha256(data).hexdigest(), data
@@ -0,0 +1,254 @@
+# context_blocks.py
+"""
+Materialized context blocks.
+
+A folder's block is what it contributes to the context of everything below
+it: its own articles and the articles inside each attached folder it holds,
+stored as one rendered segment per source. A context that excludes
+attached folders recomputes the blocks holding them, since an article the
+excluded folder claimed may be reachable through another. A stored block is current while its version equals the
+folder's block version (see TreeStore.context_path), which any write that
+could change the block raises. Checking a whole path therefore costs one
+query, and assembling a context is a concatenation of stored segments.
+
+Reads recompute stale blocks inline, so a context is never served stale. A
+background thread keeps blocks warm: every CONTEXT_REFRESH_INTERVAL seconds
+it asks the store which stored blocks the nodes stamped since its last pass
+feed, and recomputes only those, so a read after an edit or a sync batch
+rarely has to.
+
+Agents holding a context can instead ask for what changed since a cursor
+(see context_delta): the blocks on the path whose block version rose, and in
+them only the articles stamped since, plus the ids of the articles that left
+them, recorded as tombstones when they were moved or deleted. The refresher
+also purges tombstones older than CONTEXT_DELTA_RETENTION versions; older
+cursors get the whole context again.
+"""
+import os
+import time
+import hashlib
+import logging
+import threading
+
+# Seconds between refresh passes; 0 turns the background refresher off.
+CONTEXT_REFRESH_INTERVAL = float(os.getenv("CONTEXT_REFRESH_INTERVAL", 5))
+MAX_CONTEXT_BATCH = int(os.getenv("MAX_CONTEXT_BATCH", 1000))
+# How many versions of removals context deltas can report.
+CONTEXT_DELTA_RETENTION = int(os.getenv("CONTEXT_DELTA_RETENTION", 100000))
+
+_logger = logging.getLogger("knowledgetree.context_blocks")
+_lock = threading.Lock()
+_worker_pid = None
+
+
+def render_article(record):
+    header = f"File: {record['name']}"
+    if record['source_folder']:
+        header += f" (from attached folder: {record['source_folder']})"
+    return f"{header}\n\n{record['content'] or '> No content.'}"
+
+def build_segments(articles):
+    """Groups context_articles rows into rendered segments, the folder's own articles first."""
+    segments, by_source = [], {}
+    for record in sorted(articles, key=lambda r: (r['source_folder'], r['source_id'], r['name'] or '')):
+        segment = by_source.get(record['source_id'])
+        if segment is None:
+            segment = by_source[record['source_id']] = {
+                'source_id': record['source_id'], 'source_folder': record['source_folder'], 'articles': []}
+            segments.append(segment)
+        segment['articles'].append(render_article(record))
+    return [{'source_id': segment['source_id'], 'source_folder': segment['source_folder'],
+             'text': "\n\n".join(segment['articles'])} for segment in segments]
+
+def compute_blocks(store, versions):
+    """Recomputes and stores the blocks of {folder_id: block_version}; returns them as stored_blocks does."""
+    # The versions were read before the articles, so a write landing in
+    # between leaves the block labelled older than its content and the next
+    # read recomputes it; it is never labelled newer.
+    blocks = {folder_id: {'version': version, 'segments': build_segments(store.context_articles(folder_id))}
+              for folder_id, version in versions.items()}
+    store.save_blocks([{'folder_id': folder_id, **block} for folder_id, block in blocks.items()])
+    return blocks
+
+def load_blocks(store, paths, excluded_ids=()):
+    """
+    {folder_id: segments} for every node on the given context paths. Folders
+    shared by several paths are loaded, and if stale recomputed, once.
+
+    A stored block lists each article once, under the first attached folder
+    to reach it. Blocks holding an excluded attached folder are therefore
+    recomputed without it, and not stored, so the articles it claimed still
+    come from the other attached folders that reach them.
+    """
+    versions = _block_versions(paths)
+    stored = store.stored_blocks(list(versions))
+    stale = _stale_blocks(versions, stored)
+    if stale:
+        stored.update(compute_blocks(store, stale))
+    blocks = {folder_id: block['segments'] for folder_id, block in stored.items()}
+    for folder_id in _excluding(blocks, excluded_ids):
+        blocks[folder_id] = build_segments(store.context_articles(folder_id, excluded_ids))
+    return blocks
+
+def _excluding(blocks, excluded_ids):
+    """The folders whose blocks hold a segment from an excluded attached folder."""
+    excluded = set(excluded_ids)
+    if not excluded:
+        return []
+    return [folder_id for folder_id, segments in blocks.items()
+            if any(segment['source_id'] in excluded for segment in segments)]
+
+def _block_versions(paths):
+    return {node['id']: node['block_version'] for path in paths for node in path['nodes']}
+
+def _stale_blocks(versions, stored):
+    return {folder_id: version for folder_id, version in versions.items()
+            if stored.get(folder_id, {}).get('version') != version}
+
+async def compute_blocks_async(store, versions):
+    """compute_blocks on an async store (see asgi.py), reading the folders' articles concurrently."""
+    import asyncio  # Only the ASGI app pays for importing it.
+
+    folder_ids = list(versions)
+    articles = await asyncio.gather(*(store.context_articles(folder_id) for folder_id in folder_ids))
+    blocks = {folder_id: {'version': versions[folder_id], 'segments': build_segments(rows)}
+              for folder_id, rows in zip(folder_ids, articles)}
+    await store.save_blocks([{'folder_id': folder_id, **block} for folder_id, block in blocks.items()])
+    return blocks
+
+async def load_blocks_async(store, paths, excluded_ids=()):
+    """load_blocks on an async store."""
+    import asyncio
+
+    versions = _block_versions(paths)
+    stored = await store.stored_blocks(list(versions))
+    stale = _stale_blocks(versions, stored)
+    if stale:
+        stored.update(await compute_blocks_async(store, stale))
+    blocks = {folder_id: block['segments'] for folder_id, block in stored.items()}
+    excluding = _excluding(blocks, excluded_ids)
+    articles = await asyncio.gather(*(store.context_articles(folder_id, excluded_ids) for folder_id in excluding))
+    for folder_id, rows in zip(excluding, articles):
+        blocks[folder_id] = build_segments(rows)
+    return blocks
+
+def _block_parts(depth, node, blocks, excluded):
+    texts = [segment['text'] for segment in blocks.get(node['id'], ()) if segment['source_id'] not in excluded]
+    return [f"{'#' * depth} Context: {node['name']}", "\n\n".join(texts)] if texts else []
+
+def _file_parts(node, filenames):
+    if not filenames:
+        return []
+    return [f"## Attached Files for {node['name']}", "\n".join(f"- {name}" for name in filenames)]
+
+def assemble(path, blocks, excluded_ids=(), filenames=()):
+    """Concatenates the path's blocks into the markdown context export."""
+    excluded = set(excluded_ids)
+    parts = []
+    for depth, node in enumerate(path['nodes'], start=1):
+        parts.extend(_block_parts(depth, node, blocks, excluded))
+    parts.extend(_file_parts(path['nodes'][-1], filenames))
+    return "\n\n".join(parts)
+
+def assemble_merged(paths, blocks, excluded_ids=(), files_by_node=None):
+    """
+    One context for several nodes: each path's blocks in order, skipping any
+    block an earlier path already included, then each node's attached files.
+    """
+    excluded, seen, parts = set(excluded_ids), set(), []
+    for path in paths:
+        for depth, node in enumerate(path['nodes'], start=1):
+            if node['id'] not in seen:
+                seen.add(node['id'])
+                parts.extend(_block_parts(depth, node, blocks, excluded))
+        target = path['nodes'][-1]
+        parts.extend(_file_parts(target, (files_by_node or {}).get(target['id'])))
+    return "\n\n".join(parts)
+
+
+# --- Deltas ---
+def _path_digest(path):
+    return hashlib.sha1("/".join(node['id'] for node in path['nodes']).encode('utf-8')).hexdigest()[:8]
+
+def cursor(path):
+    """
+    The delta cursor of a context_path result: its epoch, newest block
+    version and a digest of the path's folders, so a node that moved gets
+    its whole context again.
+    """
+    return f"{path['epoch']}-{max(node['block_version'] for node in path['nodes'])}-{_path_digest(path)}"
+
+def _parse_cursor(value):
+    parts = str(value or '').split('-')
+    if len(parts) != 3 or not parts[1].isdigit():
+        return None
+    return parts[0], int(parts[1]), parts[2]
+
+def context_delta(store, path, since, excluded_ids=()):
+    """
+    What changed in a context since the cursor `since`. Every block on the
+    path is listed in order as {id, name, depth, changed}; changed blocks
+    also carry the articles stamped after the cursor, rendered as in the full
+    context, and the ids of the articles that left them; when the node's own
+    block changed its file names are included too. With `reset` the
+    cursor was unusable (another epoch, another path, or older than the
+    retained removals) and every block is sent whole. Exclusions must match
+    the ones the cursor's context was built with.
+    """
+    parsed = _parse_cursor(since)
+    reset = (parsed is None or parsed[0] != path['epoch'] or parsed[2] != _path_digest(path)
+             or parsed[1] < store.current_version() - CONTEXT_DELTA_RETENTION)
+    # -1 also sends articles stamped 0 by databases that predate version stamps.
+    since_version = -1 if reset else parsed[1]
+    changed = [node['id'] for node in path['nodes'] if node['block_version'] > since_version]
+    removed = store.tombstones(changed, since_version) if changed and not reset else {}
+    blocks = []
+    for depth, node in enumerate(path['nodes'], start=1):
+        block = {'id': node['id'], 'name': node['name'], 'depth': depth, 'changed': node['id'] in changed}
+        if block['changed']:
+            articles = sorted(store.context_articles(node['id'], excluded_ids),
+                              key=lambda r: (r['source_folder'], r['source_id'], r['name'] or ''))
+            present = {record['id'] for record in articles}
+            block['articles'] = [{'id': record['id'], 'name': record['name'], 'version': record['version'],
+                                  'source_id': record['source_id'], 'source_folder': record['source_folder'],
+                                  'text': render_article(record)}
+                                 for record in articles if record['version'] > since_version]
+            # An article that left and came back within the window is listed, not removed.
+            block['removed'] = sorted(set(removed.get(node['id'], ())) - present)
+        blocks.append(block)
+    delta = {'cursor': cursor(path), 'reset': reset, 'blocks': blocks}
+    if blocks[-1]['changed']:
+        delta['files'] = store.file_names(path['nodes'][-1]['id'])
+    return delta
+
+
+# --- Background refresh ---
+def refresh(store, since_version):
+    """One refresh pass. Returns the version the next pass should start from."""
+    version, stale = store.blocks_to_refresh(since_version)
+    if stale:
+        compute_blocks(store, stale)
+    if version > CONTEXT_DELTA_RETENTION:
+        store.purge_tombstones(version - CONTEXT_DELTA_RETENTION)
+    return version
+
+def ensure_worker():
+    """Starts this process's refresher on first use; forked workers start their own."""
+    global _worker_pid
+    if CONTEXT_REFRESH_INTERVAL <= 0:
+        return
+    with _lock:
+        if _worker_pid != os.getpid():
+            threading.Thread(target=_work, name="context-block-refresher", daemon=True).start()
+            _worker_pid = os.getpid()
+
+def _work():
+    from storage import get_store
+
+    since = None
+    while True:
+        try:
+            since = refresh(get_store(), since)
+        except Exception as e:
+            _logger.warning("Context block refresh failed: %s", e)
+        time.sleep(CONTEXT_REFRESH_INTERVAL)
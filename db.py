@@ -0,0 +1,105 @@
+# db.py
+import os
+import asyncio
+import threading
+from dotenv import load_dotenv
+
+load_dotenv()
+
+_driver = None
+_driver_pid = None
+_driver_lock = threading.Lock()
+
+# The async driver serves asgi.py. It belongs to the event loop it was made on.
+_async_driver = None
+_async_driver_loop = None
+
+
+def _reset_after_fork():
+    """
+    A forked worker must never reuse its parent's sockets. Drop the inherited
+    driver reference (without closing it, which would talk on the parent's
+    connections) so the child lazily builds its own pool.
+    """
+    global _driver, _driver_pid, _driver_lock, _async_driver, _async_driver_loop
+    _driver = None
+    _driver_pid = None
+    _driver_lock = threading.Lock()
+    _async_driver = None
+    _async_driver_loop = None
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _driver_config():
+    """(uri, user, password, keyword arguments) shared by the sync and async drivers."""
+    uri = os.getenv("NEO4J_URI") or os.getenv("NEO_URI")
+    user = os.getenv("NEO4J_USER") or os.getenv("NEO_USER")
+    password = os.getenv("NEO4J_PASSWORD") or os.getenv("NEO_PASSWORD")
+    pool_size = int(os.getenv("NEO4J_MAX_POOL_SIZE", 100))
+    # How long a managed transaction keeps retrying transient errors.
+    retry_time = float(os.getenv("NEO4J_MAX_RETRY_TIME", 30))
+    return uri, user, password, {'max_connection_pool_size': pool_size, 'max_transaction_retry_time': retry_time}
+
+
+def get_driver():
+    """Returns the Neo4j driver for this process, creating it on first use."""
+    global _driver, _driver_pid
+    pid = os.getpid()
+    if _driver is None or _driver_pid != pid:
+        with _driver_lock:
+            if _driver is None or _driver_pid != pid:
+                # Imported here so processes that never touch the database skip its import cost.
+                from neo4j import GraphDatabase, basic_auth
+                uri, user, password, config = _driver_config()
+                _driver = GraphDatabase.driver(uri, auth=basic_auth(user, password), **config)
+                _driver_pid = pid
+    return _driver
+
+
+def committed_bookmarks():
+    """
+    Bookmarks of the transactions this process committed through the sync
+    driver, or None before it has one. Async reads wait for them, so they
+    see the writes the Flask routes made.
+    """
+    driver = _driver
+    if driver is None or _driver_pid != os.getpid():
+        return None
+    return driver.execute_query_bookmark_manager.get_bookmarks()
+
+
+def close_driver():
+    """Closes this process's driver, if it has one. Safe to call more than once."""
+    global _driver, _driver_pid
+    with _driver_lock:
+        if _driver is not None and _driver_pid == os.getpid():
+            _driver.close()
+        _driver = None
+        _driver_pid = None
+
+
+def get_async_driver():
+    """
+    Returns the async Neo4j driver for the running event loop, creating it on
+    first use. Call it from a coroutine; the loop makes a lock unnecessary.
+    """
+    global _async_driver, _async_driver_loop
+    loop = asyncio.get_running_loop()
+    if _async_driver is None or _async_driver_loop is not loop:
+        from neo4j import AsyncGraphDatabase, basic_auth
+        uri, user, password, config = _driver_config()
+        _async_driver = AsyncGraphDatabase.driver(uri, auth=basic_auth(user, password), **config)
+        _async_driver_loop = loop
+    return _async_driver
+
+
+async def close_async_driver():
+    """Closes the running loop's async driver, if it has one."""
+    global _async_driver, _async_driver_loop
+    driver = _async_driver
+    if driver is not None and _async_driver_loop is asyncio.get_running_loop():
+        _async_driver, _async_driver_loop = None, None
+        await driver.close()
@@ -0,0 +1,35 @@
+# gunicorn.conf.py
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+bind = os.getenv("BIND", "0.0.0.0:5001")
+workers = int(os.getenv("WEB_CONCURRENCY", 4))
+threads = int(os.getenv("WEB_THREADS", 4))
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT", 30))
+timeout = int(os.getenv("WORKER_TIMEOUT", 120))
+preload_app = True
+
+
+def on_starting(server):
+    # Runs once in the master before any worker is forked.
+    from storage import get_store, close_store
+    get_store().init_schema()
+    close_store()
+
+
+def post_fork(server, worker):
+    # Each worker loads its own hierarchy mirror, and search index when searches
+    # rank by default; start before the first request needs them.
+    import hierarchy
+    import relevance
+    hierarchy.start()
+    if relevance.SEARCH_MODE == 'relevance':
+        relevance.start()
+
+
+def worker_exit(server, worker):
+    # Gunicorn has already drained in-flight requests by the time this runs.
+    from storage import close_store
+    close_store()
@@ -0,0 +1,461 @@
+# hierarchy.py
+"""
+In-process mirror of the PARENT_OF hierarchy for structural reads.
+
+Browse, breadcrumbs and the context tree only ask structural questions:
+a node's children, its path from the root, the folders attached along it.
+The mirror answers them from memory. It holds each node's id, name and
+flags, and no content. Nodes live in numbered slots. Names are interned and
+flags are packed into one byte. Each node's first parent, first child and
+next sibling are slots in int arrays, so child lists are linked lists that
+need no object per folder. Extra parents, which only DAG links such as a
+Datto asset under a user folder have, sit in side tables.
+
+The mirror follows the store's version stamps the same way the relevance
+index does. At most every HIERARCHY_REFRESH_INTERVAL seconds, a read asks
+the store for the nodes stamped since the last refresh (structure_changes)
+and applies their names, flags and child lists. Nodes left without a parent
+are dropped along with anything below them that has no other parent. A
+new epoch reloads everything. After a write request this process refreshes
+on its next read, so it always sees its own writes; writes by other
+processes, such as the job worker's syncs, show up within the interval.
+One thread refreshes at a time, querying the store without holding the
+lock that reads take; reads that find the mirror due meanwhile go to the
+store.
+
+Each gunicorn worker starts loading its mirror in the background as soon as
+it is forked (see gunicorn.conf.py), so the load is under way before the
+first request rather than blocking the worker's boot. HIERARCHY_MIRROR=off
+sends every read to the store. So do reads while the mirror is still
+loading, and a failed load is retried on the next read.
+"""
+import os
+import sys
+import time
+import logging
+import threading
+from array import array
+from collections import deque
+
+from storage.base import ROOT_ID
+
+HIERARCHY_MIRROR = os.getenv("HIERARCHY_MIRROR", "on")
+HIERARCHY_REFRESH_INTERVAL = float(os.getenv("HIERARCHY_REFRESH_INTERVAL", 1))
+
+# Each flag takes two bits of a node's flag byte: 0 unset (None), 1 False, 2 True.
+FLAG_FIELDS = ('is_folder', 'is_attached', 'read_only')
+FLAG_VALUES = (None, False, True)
+# list_children's order: unset is_folder first (as Neo4j sorts nulls), then folders, then files.
+FOLDER_ORDER = {None: 0, True: 1, False: 2}
+
+_logger = logging.getLogger("knowledgetree.hierarchy")
+_lock = threading.Lock()
+_mirror = None
+_mirror_pid = None
+_refreshing = False
+# Bumped by invalidate(), so a refresh that was already querying does not count as fresh.
+_invalidations = 0
+
+
+def _pack_flags(node):
+    packed = 0
+    for shift, field in enumerate(FLAG_FIELDS):
+        value = node.get(field)
+        packed |= (0 if value is None else 2 if value else 1) << (2 * shift)
+    return packed
+
+def _flag(packed, field):
+    return FLAG_VALUES[(packed >> (2 * FLAG_FIELDS.index(field))) & 3]
+
+
+class Hierarchy:
+    """The hierarchy's ids, names and flags, in slots linked by int arrays."""
+
+    __slots__ = ('_slots', '_ids', '_names', '_flags', '_parent', '_first_child', '_next_sibling',
+                 '_more_parents', '_more_children', '_free', 'epoch', 'version', 'refreshed_at')
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self._slots = {}                # id -> slot
+        self._ids = []                  # slot -> id, None once freed
+        self._names = []                # slot -> interned name
+        self._flags = bytearray()       # slot -> packed flags
+        # Each node sits in its first parent's child list, linked through
+        # these arrays; -1 ends a list.
+        self._parent = array('i')       # slot -> first parent's slot, -1 for none
+        self._first_child = array('i')
+        self._next_sibling = array('i')
+        # DAG links beyond a node's first parent, both ways.
+        self._more_parents = {}         # child slot -> [parent slot, ...]
+        self._more_children = {}        # parent slot -> [child slot, ...]
+        self._free = []
+        self.epoch = None
+        self.version = None
+        self.refreshed_at = 0.0
+
+    def __len__(self):
+        return len(self._slots)
+
+    # --- Following the store ---
+    def refresh(self, store):
+        """Applies the nodes stamped since the last refresh; a new epoch reloads everything."""
+        epoch, version, nodes = store.structure_changes(self.version)
+        if epoch != self.epoch:
+            self.reset()
+            epoch, version, nodes = store.structure_changes(None)
+        self.update(epoch, version, nodes)
+
+    def update(self, epoch, version, nodes):
+        """Applies the result of store.structure_changes for the current epoch."""
+        self.epoch, self.version, self.refreshed_at = epoch, version, time.monotonic()
+        if nodes:
+            self.apply(nodes)
+
+    def apply(self, nodes):
+        """Applies changed nodes ({id, name, flags..., children}) to the mirror."""
+        # Every node is placed before any child list is, so lists can name new nodes.
+        for node in nodes:
+            self._place(node)
+        detached = set()
+        for node in nodes:
+            slot = self._slots[node['id']]
+            children = set()
+            for child_id in node['children']:
+                child = self._slots.get(child_id)
+                if child is None:
+                    # A child the store never reported: start over on the next refresh.
+                    self.epoch = None
+                    continue
+                children.add(child)
+            old = set(self._child_slots(slot))
+            for child in old - children:
+                self._unlink(slot, child)
+                detached.add(child)
+            for child in children - old:
+                self._link(slot, child)
+        for slot in detached:
+            self._collect(slot)
+
+    def _place(self, node):
+        slot = self._slots.get(node['id'])
+        name = sys.intern(node['name']) if node['name'] is not None else None
+        if slot is None:
+            if self._free:
+                slot = self._free.pop()
+                self._ids[slot], self._names[slot], self._flags[slot] = node['id'], name, _pack_flags(node)
+                self._parent[slot] = self._first_child[slot] = self._next_sibling[slot] = -1
+            else:
+                slot = len(self._ids)
+                self._ids.append(node['id'])
+                self._names.append(name)
+                self._flags.append(_pack_flags(node))
+                self._parent.append(-1)
+                self._first_child.append(-1)
+                self._next_sibling.append(-1)
+            self._slots[node['id']] = slot
+        else:
+            self._names[slot], self._flags[slot] = name, _pack_flags(node)
+        return slot
+
+    def _push(self, parent, child):
+        self._parent[child] = parent
+        self._next_sibling[child] = self._first_child[parent]
+        self._first_child[parent] = child
+
+    def _unthread(self, parent, child):
+        """Takes the child out of its first parent's linked list."""
+        previous, current = -1, self._first_child[parent]
+        while current != child:
+            previous, current = current, self._next_sibling[current]
+        if previous == -1:
+            self._first_child[parent] = self._next_sibling[child]
+        else:
+            self._next_sibling[previous] = self._next_sibling[child]
+        self._parent[child] = self._next_sibling[child] = -1
+
+    def _link(self, parent, child):
+        if self._parent[child] == -1:
+            self._push(parent, child)
+        else:
+            self._more_parents.setdefault(child, []).append(parent)
+            self._more_children.setdefault(parent, []).append(child)
+
+    def _unlink(self, parent, child):
+        if self._parent[child] == parent:
+            self._unthread(parent, child)
+            more = self._more_parents.pop(child, None)
+            if more:
+                # The next parent becomes the first: move the child into its linked list.
+                promoted = more.pop(0)
+                self._drop_more_child(promoted, child)
+                self._push(promoted, child)
+                if more:
+                    self._more_parents[child] = more
+        else:
+            more = self._more_parents[child]
+            more.remove(parent)
+            if not more:
+                del self._more_parents[child]
+            self._drop_more_child(parent, child)
+
+    def _drop_more_child(self, parent, child):
+        more = self._more_children[parent]
+        more.remove(child)
+        if not more:
+            del self._more_children[parent]
+
+    def _collect(self, slot):
+        """Frees the slot if nothing links to it any more, then whatever that leaves parentless below it."""
+        pending = [slot]
+        while pending:
+            slot = pending.pop()
+            if self._ids[slot] is None or self._ids[slot] == ROOT_ID or self._parent[slot] != -1:
+                continue
+            for child in list(self._child_slots(slot)):
+                self._unlink(slot, child)
+                pending.append(child)
+            del self._slots[self._ids[slot]]
+            self._ids[slot] = self._names[slot] = None
+            self._free.append(slot)
+
+    # --- Structural reads ---
+    def _parents(self, slot):
+        first = self._parent[slot]
+        if first == -1:
+            return ()
+        return [first] + self._more_parents.get(slot, [])
+
+    def _child_slots(self, slot):
+        child = self._first_child[slot]
+        while child != -1:
+            yield child
+            child = self._next_sibling[child]
+        yield from self._more_children.get(slot, ())
+
+    def _record(self, slot):
+        flags = self._flags[slot]
+        return {'id': self._ids[slot], 'name': self._names[slot],
+                **{field: _flag(flags, field) for field in FLAG_FIELDS}}
+
+    def _path_slots(self, slot):
+        """A shortest root path to the slot, root first, or None: breadth first up the parents."""
+        root = self._slots.get(ROOT_ID)
+        came_from = {slot: None}
+        frontier = deque([slot])
+        while frontier:
+            current = frontier.popleft()
+            if current == root:
+                path = []
+                while current is not None:
+                    path.append(current)
+                    current = came_from[current]
+                return path
+            for parent in self._parents(current):
+                if parent not in came_from:
+                    came_from[parent] = current
+                    frontier.append(parent)
+        return None
+
+    def list_children(self, node_id):
+        slot = self._slots.get(node_id)
+        if slot is None:
+            return []
+        records = [self._record(child) for child in self._child_slots(slot)]
+        return sorted(records, key=lambda r: (FOLDER_ORDER[r['is_folder']], r['name'] is not None, r['name'] or ''))
+
+    def path_nodes(self, node_id):
+        slot = self._slots.get(node_id)
+        path = self._path_slots(slot) if slot is not None else None
+        return [{'id': self._ids[s], 'name': self._names[s]} for s in path] if path else None
+
+    def resolve_path(self, names):
+        slot = self._slots.get(ROOT_ID)
+        for name in names:
+            if slot is None:
+                return None
+            slot = next((child for child in self._child_slots(slot) if self._names[child] == name), None)
+            if slot is None:
+                return None
+        return self._ids[slot] if slot is not None else None
+
+    def descendant_ids(self, node_id):
+        slot = self._slots.get(node_id)
+        if slot is None:
+            return []
+        seen = {slot: None}
+        pending = [slot]
+        while pending:
+            for child in self._child_slots(pending.pop()):
+                if child not in seen:
+                    seen[child] = None
+                    pending.append(child)
+        return [self._ids[s] for s in seen]
+
+    def attached_folders_on_path(self, node_id):
+        """Attached children of every ancestor (and the node) that the root reaches."""
+        slot = self._slots.get(node_id)
+        root = self._slots.get(ROOT_ID)
+        if slot is None or root is None:
+            return []
+        ancestors = {slot}
+        pending = [slot]
+        while pending:
+            for parent in self._parents(pending.pop()):
+                if parent not in ancestors:
+                    ancestors.add(parent)
+                    pending.append(parent)
+        if root not in ancestors:
+            return []
+        # Only ancestors on a path from the root count.
+        reached = {root}
+        pending = [root]
+        while pending:
+            for child in self._child_slots(pending.pop()):
+                if child in ancestors and child not in reached:
+                    reached.add(child)
+                    pending.append(child)
+        attached = {}
+        for ancestor in reached:
+            for child in self._child_slots(ancestor):
+                if _flag(self._flags[child], 'is_attached'):
+                    attached[child] = None
+        return [{'id': self._ids[s], 'name': self._names[s]} for s in attached]
+
+    def memory_bytes(self):
+        """(structure, strings): bytes held by the slots and indexes, and by the id and name strings."""
+        tables = (self._slots, self._ids, self._names, self._flags, self._parent, self._first_child,
+                  self._next_sibling, self._more_parents, self._more_children)
+        structure = (sum(sys.getsizeof(t) for t in tables)
+                     + sum(sys.getsizeof(s) for s in self._more_parents.values())
+                     + sum(sys.getsizeof(s) for s in self._more_children.values()))
+        names = {id(n): n for n in self._names if n is not None}
+        strings = sum(sys.getsizeof(i) for i in self._slots) + sum(sys.getsizeof(n) for n in names.values())
+        return structure, strings
+
+
+# --- Per-process mirror ---
+def enabled():
+    return HIERARCHY_MIRROR != 'off'
+
+def _ensure_mirror(store):
+    """
+    The worker's mirror, refreshed if due, or None while it is first loaded
+    in the background. Forked workers load their own.
+    """
+    global _mirror, _refreshing
+    with _lock:
+        if _mirror_pid != os.getpid():
+            _start_load()
+            return None
+        mirror = _mirror
+        if mirror is None or time.monotonic() - mirror.refreshed_at < HIERARCHY_REFRESH_INTERVAL:
+            return mirror
+        if _refreshing:
+            # The refresh under way may predate this process's last write.
+            return None
+        _refreshing, invalidations = True, _invalidations
+    try:
+        started = time.monotonic()
+        epoch, version, nodes = store.structure_changes(mirror.version)
+        # A new epoch is loaded into a new mirror, so reads keep the old one meanwhile.
+        reloaded = load(store) if epoch != mirror.epoch else None
+        with _lock:
+            if _mirror is not mirror:
+                return _mirror
+            if reloaded is not None:
+                _mirror = mirror = reloaded
+            else:
+                mirror.update(epoch, version, nodes)
+            mirror.refreshed_at = started if _invalidations == invalidations else 0.0
+            return mirror
+    finally:
+        with _lock:
+            _refreshing = False
+
+def _start_load():
+    """Starts loading this process's mirror in the background; called with _lock held."""
+    global _mirror, _mirror_pid, _refreshing
+    _mirror, _mirror_pid, _refreshing = None, os.getpid(), False
+    threading.Thread(target=_load, name="hierarchy-loader", daemon=True).start()
+
+def _load():
+    global _mirror, _mirror_pid
+    from storage import get_store
+
+    try:
+        mirror = load(get_store())
+    except Exception as e:
+        _logger.warning("Hierarchy mirror load failed, retrying on the next read: %s", e)
+        with _lock:
+            if _mirror is None:
+                _mirror_pid = None
+        return
+    with _lock:
+        _mirror = mirror
+
+def start():
+    """Starts loading this process's mirror in the background, unless it is loaded or loading."""
+    if not enabled():
+        return
+    with _lock:
+        if _mirror_pid != os.getpid():
+            _start_load()
+
+def load(store):
+    """Loads a complete mirror from the store."""
+    mirror = Hierarchy()
+    mirror.refresh(store)
+    return mirror
+
+def warm(store):
+    """Loads this worker's mirror in the foreground, as the benchmarks do before timing reads."""
+    global _mirror, _mirror_pid
+    mirror = load(store)
+    with _lock:
+        _mirror, _mirror_pid = mirror, os.getpid()
+
+def invalidate():
+    """Makes the next read refresh first; called after this process writes."""
+    global _invalidations
+    with _lock:
+        _invalidations += 1
+        if _mirror is not None:
+            _mirror.refreshed_at = 0.0
+
+def init_app(app):
+    """Registers the hook that makes reads after a write request see it."""
+    from flask import request
+
+    @app.after_request
+    def _invalidate_after_write(response):
+        if request.method not in ('GET', 'HEAD', 'OPTIONS'):
+            invalidate()
+        return response
+
+def _read(store, method, *args):
+    mirror = _ensure_mirror(store) if enabled() else None
+    if mirror is None:
+        return getattr(store, method)(*args)
+    with _lock:
+        return getattr(mirror, method)(*args)
+
+def list_children(store, node_id):
+    return _read(store, 'list_children', node_id)
+
+def path_nodes(store, node_id):
+    return _read(store, 'path_nodes', node_id)
+
+def path_names(store, node_id):
+    nodes = path_nodes(store, node_id)
+    return [n['name'] for n in nodes] if nodes else None
+
+def resolve_path(store, names):
+    return _read(store, 'resolve_path', names)
+
+def descendant_ids(store, node_id):
+    return _read(store, 'descendant_ids', node_id)
+
+def attached_folders_on_path(store, node_id):
+    return _read(store, 'attached_folders_on_path', node_id)
@@ -0,0 +1,113 @@
+# http_cache.py
+"""
+Validators and compression for the node and context APIs.
+
+ETags come from the store's version stamps, so a conditional request costs
+one small stamp query: when the client's copy is current the route answers
+304 without loading content or assembling context. Routes read the stamp
+before building the payload, so a write that lands in between can only make
+the ETag older than the body. That costs the client one extra full response
+later, never a stale one.
+
+ETags are weak because the same content is served gzip-, br- or
+un-compressed depending on Accept-Encoding.
+"""
+import os
+import gzip
+from flask import current_app, request
+from werkzeug.http import parse_etags, quote_etag, parse_accept_header
+
+# Read-only nodes only change when a sync rewrites them.
+SYNCED_NODE_MAX_AGE = int(os.getenv("SYNCED_NODE_MAX_AGE", 300))
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", 1024))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", 6))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", 5))
+COMPRESSIBLE_MIMETYPES = {
+    'application/json', 'text/html', 'text/plain', 'text/markdown', 'text/css', 'application/javascript',
+}
+
+_brotli = None
+
+
+def _get_brotli():
+    """br is offered only when the optional brotli package is installed."""
+    global _brotli
+    if _brotli is None:
+        try:
+            import brotli
+            _brotli = brotli
+        except ImportError:
+            _brotli = False
+    return _brotli
+
+
+# --- Validators ---
+def is_fresh(etag):
+    """True when the request's If-None-Match already names this ETag."""
+    return request.method in ('GET', 'HEAD') and request.if_none_match.contains_weak(etag)
+
+def with_validators(response, etag, max_age=None):
+    """Attaches the ETag and Cache-Control; without max_age clients must revalidate."""
+    response.set_etag(etag, weak=True)
+    if max_age:
+        response.cache_control.private = True
+        response.cache_control.max_age = max_age
+    else:
+        response.cache_control.no_cache = True
+    return response
+
+def not_modified(etag, max_age=None):
+    return with_validators(current_app.response_class(status=304), etag, max_age)
+
+
+# --- Compression ---
+def compress(response):
+    if (response.status_code != 200 or response.direct_passthrough
+            or 'Content-Encoding' in response.headers or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_BYTES:
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encoded = encode(data, request.accept_encodings)
+    if encoded is None:
+        return response
+    response.set_data(encoded[0])
+    response.headers['Content-Encoding'] = encoded[1]
+    return response
+
+def encode(data, accepted):
+    """(body, Content-Encoding) for data in the best encoding the parsed Accept-Encoding allows, or None."""
+    brotli = _get_brotli()
+    if brotli and accepted['br']:
+        return brotli.compress(data, quality=BROTLI_QUALITY), 'br'
+    if accepted['gzip']:
+        return gzip.compress(data, compresslevel=GZIP_LEVEL), 'gzip'
+    return None
+
+def init_app(app):
+    app.after_request(compress)
+
+
+# --- Raw headers, for the ASGI app (asgi.py) ---
+def etag_matches(if_none_match, etag):
+    """is_fresh for a raw If-None-Match header."""
+    return parse_etags(if_none_match).contains_weak(etag)
+
+def validator_headers(etag, max_age=None):
+    """The headers with_validators sets."""
+    return [('etag', quote_etag(etag, weak=True)),
+            ('cache-control', f"private, max-age={max_age}" if max_age else "no-cache")]
+
+def encode_headers(data, accept_encoding):
+    """
+    compress for a JSON body and a raw Accept-Encoding header: (body, extra
+    headers), the body unchanged when too small or nothing is accepted.
+    """
+    if len(data) < COMPRESS_MIN_BYTES:
+        return data, []
+    encoded = encode(data, parse_accept_header(accept_encoding))
+    if encoded is None:
+        return data, [('vary', 'Accept-Encoding')]
+    return encoded[0], [('vary', 'Accept-Encoding'), ('content-encoding', encoded[1])]
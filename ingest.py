@@ -0,0 +1,55 @@
+# ingest.py
+"""
+Freshservice webhook ingest: near-real-time ticket updates without polling.
+
+A Freshservice workflow posts a JSON event to /api/ingest/freshservice
+when a ticket is created, updated or replied to, e.g.
+
+    {"event": "ticket_updated", "ticket_id": "{{ticket.id}}"}
+
+with the shared FRESHSERVICE_WEBHOOK_SECRET in an X-Webhook-Secret header.
+The route only queues a 'freshticket' job (see jobs.py) that runs
+WEBHOOK_COALESCE_SECONDS later. Every further event for the same ticket
+until then finds that job still pending and is folded into it, so a burst
+of edits costs one fetch of the ticket. The job fetches and renders the
+ticket exactly as pull_fresh_tickets does and writes it.
+"""
+import os
+import re
+import hmac
+
+import jobs
+
+FRESHSERVICE_WEBHOOK_SECRET = os.getenv("FRESHSERVICE_WEBHOOK_SECRET", "")
+WEBHOOK_COALESCE_SECONDS = float(os.getenv("WEBHOOK_COALESCE_SECONDS", 5))
+
+TICKET_EVENTS = ('ticket_created', 'ticket_updated', 'ticket_replied')
+
+
+def enabled():
+    return bool(FRESHSERVICE_WEBHOOK_SECRET)
+
+def authorized(secret):
+    return enabled() and hmac.compare_digest((secret or '').encode(), FRESHSERVICE_WEBHOOK_SECRET.encode())
+
+def parse_ticket_event(payload):
+    """
+    The (event, ticket id) of a webhook payload. Raises ValueError for
+    anything else. Ticket ids may come as numbers or as Freshservice renders
+    them into templates ('#SR-1234', 'INC-1234').
+    """
+    if not isinstance(payload, dict):
+        raise ValueError("Expected a JSON object.")
+    event = str(payload.get('event') or 'ticket_updated').lower()
+    if not event.startswith('ticket_'):
+        event = f"ticket_{event}"
+    if event not in TICKET_EVENTS:
+        raise ValueError(f"Unsupported event '{payload.get('event')}'.")
+    match = re.search(r'(\d+)\s*$', str(payload.get('ticket_id', '')))
+    if not match:
+        raise ValueError("Missing or invalid ticket_id.")
+    return event, int(match.group(1))
+
+def queue_ticket(ticket_id):
+    """Queues the ticket's fetch, or folds into the one already pending. Returns (job id, newly queued)."""
+    return jobs.enqueue('freshticket', {'ticket_id': ticket_id}, delay=WEBHOOK_COALESCE_SECONDS)
@@ -0,0 +1,230 @@
+# jobs.py
+"""
+Persistent job queue for syncs and maintenance, run by scripts/job_worker.py.
+
+The web tier only enqueues: a job is a row in a local SQLite file
+(JOB_QUEUE_PATH), independent of the storage backend, so queued jobs survive
+restarts of both the web server and the worker. The worker runs up to
+JOB_WORKERS jobs at a time, highest priority first, and never more than a
+job's `limit` of the same kind at once (one sync of each source, since a
+sync's checkpoint is per source).
+
+Enqueueing a job identical to one still pending (same name and arguments)
+returns the pending one, raised to the higher of the two priorities. A job
+that raises or exits is retried after JOB_RETRY_DELAY seconds, doubling per
+attempt, up to JOB_MAX_ATTEMPTS attempts; the syncs resume from their
+checkpoints, so a retry does not start over. A running job holds a lease of
+JOB_LEASE seconds that its worker renews; when a worker dies, the job goes
+back to the queue once its lease runs out.
+"""
+import os
+import json
+import time
+import sqlite3
+import threading
+import importlib
+import traceback
+
+JOB_QUEUE_PATH = os.getenv("JOB_QUEUE_PATH", "jobs.db")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 2))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", 3))
+JOB_RETRY_DELAY = float(os.getenv("JOB_RETRY_DELAY", 60))
+JOB_LEASE = float(os.getenv("JOB_LEASE", 300))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", 1))
+
+# name -> the function it runs ('module:attribute', called with the job's
+# arguments), its default priority, and how many may run at once.
+JOBS = {
+    'freshservice': {'target': 'scripts.pull_freshservice:sync_companies_and_users', 'priority': 30, 'limit': 1},
+    'datto': {'target': 'scripts.pull_datto:sync_datto_devices', 'priority': 20, 'limit': 1},
+    'freshtickets': {'target': 'scripts.pull_fresh_tickets:sync_fresh_tickets', 'priority': 10, 'limit': 1},
+    # One ticket, queued by the webhook ingest (see ingest.py).
+    'freshticket': {'target': 'scripts.pull_fresh_tickets:sync_ticket', 'priority': 40, 'limit': 1},
+    'purge_content_blobs': {'target': 'jobs:purge_content_blobs', 'priority': 0, 'limit': 1},
+    'train_content_dictionary': {'target': 'jobs:train_content_dictionary', 'priority': 0, 'limit': 1},
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    args TEXT NOT NULL,
+    priority INTEGER NOT NULL,
+    state TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    run_after REAL NOT NULL,
+    lease_until REAL,
+    created REAL NOT NULL,
+    started REAL,
+    finished REAL,
+    error TEXT
+);
+-- At most one pending job per name and arguments.
+CREATE UNIQUE INDEX IF NOT EXISTS jobs_pending ON jobs(name, args) WHERE state = 'pending';
+CREATE INDEX IF NOT EXISTS jobs_queue ON jobs(state, priority DESC, id);
+"""
+
+_local = threading.local()
+
+
+def _conn():
+    conn = getattr(_local, 'conn', None)
+    if conn is None or _local.pid != os.getpid():
+        conn = sqlite3.connect(JOB_QUEUE_PATH, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(SCHEMA)
+        _local.conn, _local.pid = conn, os.getpid()
+    return conn
+
+def _transaction(work):
+    conn = _conn()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        result = work(conn)
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+    return result
+
+def _job(row):
+    return dict(row, args=json.loads(row['args'])) if row else None
+
+def enqueue(name, args=None, priority=None, delay=0):
+    """
+    Queues a job to run no sooner than delay seconds from now and returns
+    (job id, whether it was newly queued). An identical pending job is
+    reused instead of queueing a second one, and keeps its own start time.
+    """
+    if name not in JOBS:
+        raise ValueError(f"Unknown job '{name}'.")
+    args = json.dumps(args or {}, sort_keys=True)
+    priority = JOBS[name]['priority'] if priority is None else priority
+
+    def work(conn):
+        row = conn.execute("SELECT id FROM jobs WHERE state = 'pending' AND name = ? AND args = ?",
+                           (name, args)).fetchone()
+        if row:
+            conn.execute("UPDATE jobs SET priority = max(priority, ?) WHERE id = ?", (priority, row['id']))
+            return row['id'], False
+        now = time.time()
+        cursor = conn.execute("""
+            INSERT INTO jobs (name, args, priority, state, run_after, created)
+            VALUES (?, ?, ?, 'pending', ?, ?)
+        """, (name, args, priority, now + delay, now))
+        return cursor.lastrowid, True
+
+    return _transaction(work)
+
+def _retry_or_fail(conn, job, error):
+    """Puts a job whose attempt failed back in the queue, or fails it for good."""
+    now = time.time()
+    duplicate = conn.execute("SELECT id FROM jobs WHERE state = 'pending' AND name = ? AND args = ?",
+                             (job['name'], job['args'])).fetchone()
+    if job['attempts'] < JOB_MAX_ATTEMPTS and not duplicate:
+        conn.execute("""
+            UPDATE jobs SET state = 'pending', lease_until = NULL, run_after = ?, error = ? WHERE id = ?
+        """, (now + JOB_RETRY_DELAY * 2 ** (job['attempts'] - 1), error, job['id']))
+    else:
+        if duplicate:
+            error += f"\n(not retried: job {duplicate['id']} is already queued)"
+        conn.execute("""
+            UPDATE jobs SET state = 'failed', lease_until = NULL, finished = ?, error = ? WHERE id = ?
+        """, (now, error, job['id']))
+
+def claim():
+    """Takes the next job that may run now, marking it running under a lease, or None."""
+    def work(conn):
+        now = time.time()
+        for job in conn.execute("SELECT * FROM jobs WHERE state = 'running' AND lease_until < ?", (now,)).fetchall():
+            _retry_or_fail(conn, job, "The worker running this job stopped renewing its lease.")
+
+        running = dict(conn.execute("SELECT name, count(*) FROM jobs WHERE state = 'running' GROUP BY name").fetchall())
+        for job in conn.execute("""
+            SELECT * FROM jobs WHERE state = 'pending' AND run_after <= ? ORDER BY priority DESC, id
+        """, (now,)):
+            if job['name'] in JOBS and running.get(job['name'], 0) >= JOBS[job['name']]['limit']:
+                continue
+            conn.execute("""
+                UPDATE jobs SET state = 'running', attempts = attempts + 1, started = ?, lease_until = ?
+                WHERE id = ?
+            """, (now, now + JOB_LEASE, job['id']))
+            return _job(conn.execute("SELECT * FROM jobs WHERE id = ?", (job['id'],)).fetchone())
+        return None
+
+    return _transaction(work)
+
+def renew(job_id):
+    _conn().execute("UPDATE jobs SET lease_until = ? WHERE id = ? AND state = 'running'",
+                    (time.time() + JOB_LEASE, job_id))
+
+def complete(job_id):
+    _conn().execute("UPDATE jobs SET state = 'done', lease_until = NULL, finished = ?, error = NULL WHERE id = ?",
+                    (time.time(), job_id))
+
+def fail(job_id, error):
+    def work(conn):
+        job = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if job and job['state'] == 'running':
+            _retry_or_fail(conn, job, error)
+
+    _transaction(work)
+
+def recent(limit=50):
+    """The most recently queued jobs, newest first."""
+    return [_job(row) for row in _conn().execute("SELECT * FROM jobs ORDER BY id DESC LIMIT ?", (limit,))]
+
+def pending_count():
+    return _conn().execute("SELECT count(*) FROM jobs WHERE state IN ('pending', 'running')").fetchone()[0]
+
+
+# --- Running jobs ---
+def run(job):
+    """Runs one claimed job to completion, renewing its lease meanwhile, and records the outcome."""
+    module_name, _, attribute = JOBS[job['name']]['target'].partition(':')
+    done = threading.Event()
+
+    def keep_lease():
+        while not done.wait(JOB_LEASE / 3):
+            renew(job['id'])
+
+    threading.Thread(target=keep_lease, name=f"job-{job['id']}-lease", daemon=True).start()
+    print(f"Job {job['id']} ({job['name']}, attempt {job['attempts']}) started.")
+    try:
+        getattr(importlib.import_module(module_name), attribute)(**job['args'])
+    # The sync scripts sys.exit() when an API is unreachable.
+    except (Exception, SystemExit):
+        error = traceback.format_exc()
+        print(f"Job {job['id']} ({job['name']}) failed:\n{error}")
+        fail(job['id'], error)
+        return False
+    finally:
+        done.set()
+    complete(job['id'])
+    print(f"Job {job['id']} ({job['name']}) finished.")
+    return True
+
+def work_loop(stop, drain=False, poll_interval=JOB_POLL_INTERVAL):
+    """Claims and runs jobs until stop is set (or, with drain, until none is left to claim)."""
+    while not stop.is_set():
+        job = claim()
+        if job:
+            run(job)
+        elif drain:
+            return
+        else:
+            stop.wait(poll_interval)
+
+
+# --- Maintenance jobs ---
+def purge_content_blobs():
+    from storage import get_store
+
+    print(f"Purged {get_store().purge_content_blobs()} unreferenced content blobs.")
+
+def train_content_dictionary(sample_size=None):
+    from storage import get_store
+    from scripts.train_content_dictionary import train, DEFAULT_SAMPLE_SIZE
+
+    train(get_store(), sample_size or DEFAULT_SAMPLE_SIZE)
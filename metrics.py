@@ -0,0 +1,225 @@
+# metrics.py
+"""
+In-process query and request instrumentation, exposed in Prometheus text
+format at /metrics. Every store query reports its name, duration, row count
+and (when profiled) database hits; every request reports its latency, how
+many queries it ran and how long they took, so slow requests can be split
+into database time, rendering phases and everything else.
+
+Metrics are per process. Under gunicorn, scrape each worker or aggregate
+downstream.
+"""
+import os
+import time
+import random
+import threading
+import functools
+import contextvars
+from contextlib import contextmanager
+
+import slow_queries
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+# Fraction of queries re-issued with PROFILE to collect database hits.
+PROFILE_SAMPLE_RATE = float(os.getenv("QUERY_PROFILE_SAMPLE_RATE", 0))
+
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+
+class _RequestStats:
+    __slots__ = ('queries', 'query_seconds')
+
+    def __init__(self):
+        self.queries = 0
+        self.query_seconds = 0.0
+
+
+_lock = threading.Lock()
+_histograms = {}   # (metric, labels) -> Histogram
+_counters = {}     # (metric, labels) -> number
+_current_request = contextvars.ContextVar('kt_request_stats', default=None)
+
+HELP = {
+    'kt_query_duration_seconds': ('histogram', 'Database query latency by query name.'),
+    'kt_query_rows_total': ('counter', 'Rows returned by query name.'),
+    'kt_query_db_hits_total': ('counter', 'Database hits of profiled executions by query name.'),
+    'kt_query_profiled_total': ('counter', 'Executions run under PROFILE by query name.'),
+    'kt_request_duration_seconds': ('histogram', 'Request latency by route.'),
+    'kt_request_db_seconds': ('histogram', 'Time spent in database queries per request, by route.'),
+    'kt_request_queries': ('histogram', 'Database queries per request, by route.'),
+    'kt_requests_total': ('counter', 'Requests by route, method and status.'),
+    'kt_phase_duration_seconds': ('histogram', 'Latency of named non-database phases such as rendering.'),
+}
+
+
+def _observe(metric, labels, value, buckets=LATENCY_BUCKETS):
+    key = (metric, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = Histogram(buckets)
+        histogram.observe(value)
+
+def _increment(metric, labels, amount=1):
+    key = (metric, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+# --- Recording ---
+def should_profile():
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+def plan_db_hits(plan):
+    """Sums dbHits over a PROFILE plan tree as returned by the driver."""
+    if not plan:
+        return 0
+    return plan.get('dbHits', 0) + sum(plan_db_hits(child) for child in plan.get('children', []))
+
+def record_query(name, seconds, rows=0, db_hits=None):
+    labels = (('query', name),)
+    _observe('kt_query_duration_seconds', labels, seconds)
+    _increment('kt_query_rows_total', labels, rows)
+    if db_hits is not None:
+        _increment('kt_query_db_hits_total', labels, db_hits)
+        _increment('kt_query_profiled_total', labels)
+    stats = _current_request.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.query_seconds += seconds
+
+def instrumented(fn):
+    """
+    Records each call of a store operation as one query named after the
+    method, for backends whose operations are several small statements.
+    """
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        result = None
+        try:
+            result = fn(*args, **kwargs)
+            return result
+        finally:
+            elapsed = time.perf_counter() - start
+            rows = len(result) if isinstance(result, list) else int(result is not None)
+            record_query(fn.__name__, elapsed, rows=rows)
+            if slow_queries.enabled() and elapsed * 1000 >= slow_queries.SLOW_QUERY_MS:
+                slow_queries.report(fn.__name__, elapsed, parameters={'args': list(args[1:]), **kwargs}, rows=rows)
+    return wrapper
+
+@contextmanager
+def phase(name):
+    """Times a non-database phase of a request, e.g. markdown rendering."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _observe('kt_phase_duration_seconds', (('phase', name),), time.perf_counter() - start)
+
+
+# --- Request scopes ---
+def start_request():
+    """Starts attributing queries to a request; returns the scope to pass to finish_request."""
+    stats = _RequestStats()
+    return time.perf_counter(), stats, _current_request.set(stats)
+
+def finish_request(scope, route, method, status):
+    """Records a request's latency, queries and status; returns its _RequestStats."""
+    start, stats, token = scope
+    _current_request.reset(token)
+    labels = (('route', route),)
+    _observe('kt_request_duration_seconds', labels, time.perf_counter() - start)
+    _observe('kt_request_db_seconds', labels, stats.query_seconds)
+    _observe('kt_request_queries', labels, stats.queries, COUNT_BUCKETS)
+    _increment('kt_requests_total', labels + (('method', method), ('status', str(status))))
+    return stats
+
+
+# --- Flask integration ---
+def init_app(app):
+    """Registers request hooks that attribute query counts and time to each route."""
+    from flask import g, request
+
+    @app.before_request
+    def _start_request_metrics():
+        g.kt_request_scope = start_request()
+
+    @app.after_request
+    def _finish_request_metrics(response):
+        scope = g.pop('kt_request_scope', None)
+        if scope is None:
+            return response
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        stats = finish_request(scope, route, request.method, response.status_code)
+        if app.debug or app.config.get('QUERY_COUNT_HEADER'):
+            response.headers['X-Query-Count'] = str(stats.queries)
+            response.headers['X-Query-Time-Ms'] = f"{stats.query_seconds * 1000:.1f}"
+        return response
+
+
+# --- Exposition ---
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _label_str(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in pairs) + '}'
+
+def _format_bound(bound):
+    return repr(float(bound))
+
+def render_prometheus():
+    """Returns every metric in the Prometheus text exposition format."""
+    with _lock:
+        histograms = {k: (list(h.counts), h.sum, h.count, h.buckets) for k, h in _histograms.items()}
+        counters = dict(_counters)
+
+    lines = []
+    for metric, (kind, help_text) in HELP.items():
+        if kind == 'histogram':
+            series = sorted((labels, data) for (name, labels), data in histograms.items() if name == metric)
+        else:
+            series = sorted((labels, value) for (name, labels), value in counters.items() if name == metric)
+        if not series:
+            continue
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} {kind}")
+        for labels, data in series:
+            if kind == 'histogram':
+                counts, total, count, buckets = data
+                cumulative = 0
+                for bound, bucket_count in zip(buckets, counts):
+                    cumulative += bucket_count
+                    lines.append(f"{metric}_bucket{_label_str(labels, [('le', _format_bound(bound))])} {cumulative}")
+                lines.append(f"{metric}_bucket{_label_str(labels, [('le', '+Inf')])} {count}")
+                lines.append(f"{metric}_sum{_label_str(labels)} {total}")
+                lines.append(f"{metric}_count{_label_str(labels)} {count}")
+            else:
+                lines.append(f"{metric}{_label_str(labels)} {data}")
+    return "\n".join(lines) + "\n"
+
+def reset():
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
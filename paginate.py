@@ -0,0 +1,88 @@
+# paginate.py
+"""
+Prefetching pagination for numbered list endpoints.
+
+A PageStream starts requesting pages as soon as it is created and keeps
+PAGINATE_PREFETCH of them in flight, so several streams (companies and
+users, say) download at the same time and a writer can start on the first
+records while later pages are still arriving. Records are yielded in page
+order. The stream stops at the first empty page; pages past it that were
+already requested are discarded. A page that fails raises from the
+iteration, after the records of the pages before it.
+
+Streams that share a RateLimiter together send at most one request per
+interval, which replaces the fixed sleep between sequential pages. A 429 on
+any of them can pause all of them.
+"""
+import os
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+PAGINATE_PREFETCH = int(os.getenv("PAGINATE_PREFETCH", 4))
+
+
+class RateLimiter:
+    """Spaces requests from any number of threads at least `interval` seconds apart."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._next = 0.0
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+    def pause(self, seconds):
+        """Holds every request back for `seconds`, as a Retry-After asks."""
+        with self._lock:
+            self._next = max(self._next, time.monotonic() + seconds)
+
+
+class PageStream:
+    """Iterates the records of pages first_page, first_page + 1, ... as fetch_page(page) returns them."""
+
+    def __init__(self, fetch_page, limiter=None, prefetch=PAGINATE_PREFETCH, first_page=1):
+        self._fetch_page = fetch_page
+        self._limiter = limiter
+        self._pool = ThreadPoolExecutor(max_workers=max(prefetch, 1), thread_name_prefix="paginate")
+        self._pending = deque()
+        self._next_page = first_page
+        self._stopped = False
+        for _ in range(max(prefetch, 1)):
+            self._submit()
+
+    def _fetch(self, page):
+        if self._limiter:
+            self._limiter.wait()
+        # A page still waiting for the limiter when the stream ended is never requested.
+        return [] if self._stopped else self._fetch_page(page)
+
+    def _submit(self):
+        self._pending.append(self._pool.submit(self._fetch, self._next_page))
+        self._next_page += 1
+
+    def __iter__(self):
+        try:
+            while self._pending:
+                records = self._pending.popleft().result()
+                if not records:
+                    break
+                self._submit()
+                yield from records
+        finally:
+            self.close()
+
+    def close(self):
+        """Cancels the pages not yet requested; pages in flight finish and are dropped."""
+        self._stopped = True
+        for future in self._pending:
+            future.cancel()
+        self._pending.clear()
+        self._pool.shutdown(wait=False)
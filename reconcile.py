@@ -0,0 +1,142 @@
+# reconcile.py
+"""
+Account-number reconciliation between Freshservice and Datto RMM.
+
+push_account_nums_to_datto matches each Datto site to the Freshservice
+company with the longest name contained in the site's name. NameMatcher
+compiles the company names into one Aho-Corasick automaton, so matching a
+site is a single pass over its name instead of a substring test against
+every company.
+
+Both account-number scripts first read what they need, then build a plan of
+actions, then apply only the writes the plan calls for. Reads and writes go
+through run_parallel, which keeps at most RECONCILE_WORKERS requests in
+flight and starts at most one every RECONCILE_REQUEST_DELAY seconds. Work
+that is rate limited raises RateLimited (see check_rate_limit): every worker
+then holds back for the Retry-After, as paginated streams do, and the item
+is retried up to RECONCILE_MAX_RETRIES times. The plan and the outcomes can
+be written as a JSON report.
+"""
+import os
+import json
+import time
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+
+import paginate
+
+RECONCILE_WORKERS = int(os.getenv("RECONCILE_WORKERS", 8))
+RECONCILE_REQUEST_DELAY = float(os.getenv("RECONCILE_REQUEST_DELAY", 0.1))
+RECONCILE_MAX_RETRIES = int(os.getenv("RECONCILE_MAX_RETRIES", 5))
+# The first back-off, doubled on each retry, when a 429 carries no usable Retry-After.
+RECONCILE_RETRY_DELAY = float(os.getenv("RECONCILE_RETRY_DELAY", 5))
+
+
+class NameMatcher:
+    """Finds which of a fixed set of names occur in a text."""
+
+    def __init__(self, names):
+        self.names = []
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [[]]
+        for name in dict.fromkeys(n for n in names if n):
+            node = 0
+            for ch in name:
+                if ch not in self._goto[node]:
+                    self._goto[node][ch] = len(self._goto)
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append([])
+                node = self._goto[node][ch]
+            self._out[node].append(len(self.names))
+            self.names.append(name)
+
+        # Breadth first, so every failure link points at a node already done.
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, child in self._goto[node].items():
+                fail = self._fail[node]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(ch, 0)
+                self._out[child] = self._out[child] + self._out[self._fail[child]]
+                queue.append(child)
+
+    def matches(self, text):
+        """The names occurring in text, each once, in the order they were given."""
+        node = 0
+        found = set()
+        for ch in text:
+            while node and ch not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(ch, 0)
+            found.update(self._out[node])
+        return [self.names[i] for i in sorted(found)]
+
+    def longest(self, text):
+        """The longest name occurring in text, the first given of equally long ones, or None."""
+        return max(self.matches(text), key=len, default=None)
+
+
+class RateLimited(Exception):
+    """Raised by run_parallel work whose request got a 429; retry_after is None when not given."""
+
+    def __init__(self, retry_after=None):
+        super().__init__("Rate limited" + (f", retry after {retry_after} seconds" if retry_after is not None else ""))
+        self.retry_after = retry_after
+
+def check_rate_limit(response):
+    """Raises RateLimited when a requests response is a 429."""
+    if response.status_code == 429:
+        try:
+            retry_after = float(response.headers.get('Retry-After'))
+        except (TypeError, ValueError):
+            # Missing, or an HTTP date: back off by RECONCILE_RETRY_DELAY instead.
+            retry_after = None
+        raise RateLimited(retry_after)
+
+def run_parallel(items, work, workers=RECONCILE_WORKERS, interval=RECONCILE_REQUEST_DELAY,
+                 max_retries=RECONCILE_MAX_RETRIES):
+    """
+    [(item, work(item))] in the order of items, with an exception work
+    raised in place of its result. Work that raises RateLimited is retried,
+    after every worker has held back, up to max_retries times.
+    """
+    limiter = paginate.RateLimiter(interval)
+
+    def call(item):
+        for attempt in range(max_retries + 1):
+            limiter.wait()
+            try:
+                return work(item)
+            except RateLimited as e:
+                if attempt == max_retries:
+                    return e
+                # Every worker backs off, not just this one.
+                limiter.pause(e.retry_after if e.retry_after is not None
+                              else RECONCILE_RETRY_DELAY * 2 ** attempt)
+            except Exception as e:
+                return e
+
+    items = list(items)
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+        return list(zip(items, pool.map(call, items)))
+
+def write_report(path, name, actions, dry_run=False):
+    """
+    Writes the actions (dicts with an 'action' and, once applied, an
+    'outcome') as JSON, with their counts per action and per outcome.
+    """
+    report = {
+        "report": name,
+        "generated": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "dry_run": dry_run,
+        "actions": dict(Counter(a['action'] for a in actions)),
+        "outcomes": dict(Counter(a['outcome'] for a in actions if a.get('outcome'))),
+        "items": actions,
+    }
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Report written to {path}")
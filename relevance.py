@@ -0,0 +1,306 @@
+# relevance.py
+"""
+BM25 relevance search over node names and content.
+
+The index is a list of segments, each a sparse term-frequency matrix (one
+row per node, one column per term) with the rows' document lengths. Scoring
+a query slices the query's columns out of every segment and computes BM25
+for all matching rows at once with NumPy. Subtree scoping marks the rows of
+the start node's descendants, read from the store's ancestor data.
+
+The index follows the store's version stamps: at most every
+SEARCH_REFRESH_INTERVAL seconds a search asks for the nodes stamped since the
+last refresh and adds them as a new segment, retiring their older rows. When
+there are more than SEARCH_MAX_SEGMENTS segments they are merged into one,
+which drops retired rows. Deleted nodes are found when a search would
+return them, and retired then.
+
+One thread refreshes at a time, querying the store without holding the
+lock that searches take; other searches meanwhile use the index as it is.
+
+NumPy and SciPy are optional. Without them, and while a worker's first
+index is still being built in the background, searches fall back to the
+store's substring search. A failed build is retried on the next search.
+"""
+import os
+import re
+import time
+import logging
+import threading
+from collections import Counter
+
+import hierarchy
+from storage.base import ROOT_ID
+
+# 'substring' keeps /api/search on TreeStore.search unless a request asks for mode=relevance.
+SEARCH_MODE = os.getenv("SEARCH_MODE", "substring")
+SEARCH_REFRESH_INTERVAL = float(os.getenv("SEARCH_REFRESH_INTERVAL", 2))
+SEARCH_MAX_SEGMENTS = int(os.getenv("SEARCH_MAX_SEGMENTS", 8))
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+_logger = logging.getLogger("knowledgetree.relevance")
+_lock = threading.Lock()
+_index = None
+_index_pid = None
+_refreshing = False
+_modules = None
+
+
+def _get_modules():
+    """(numpy, scipy.sparse), or False when either is not installed."""
+    global _modules
+    if _modules is None:
+        try:
+            import numpy
+            import scipy.sparse
+            _modules = (numpy, scipy.sparse)
+        except ImportError:
+            _modules = False
+    return _modules
+
+def available():
+    return bool(_get_modules())
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall((text or '').lower())
+
+
+class Segment:
+    """Immutable rows of the index; `live` marks the rows that have not been retired."""
+
+    def __init__(self, ids, folders, tf, lengths):
+        np, _ = _get_modules()
+        self.ids = ids
+        self.folders = folders
+        self.tf = tf.tocsc()
+        self.lengths = lengths
+        self.live = np.ones(len(ids), dtype=bool)
+
+
+class SearchIndex:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.vocabulary = {}
+        self.segments = []
+        self.locations = {}
+        self.epoch = None
+        self.version = None
+        self.refreshed_at = 0.0
+
+    # --- Building ---
+    def refresh(self, store):
+        """Indexes the nodes stamped since the last refresh; a new epoch rebuilds everything."""
+        epoch, version, documents = store.search_documents(self.version)
+        if epoch != self.epoch:
+            self.reset()
+            epoch, version, documents = store.search_documents(None)
+        self.update(epoch, version, documents)
+
+    def update(self, epoch, version, documents):
+        """Indexes the result of store.search_documents for the current epoch."""
+        self.epoch, self.version, self.refreshed_at = epoch, version, time.monotonic()
+        if documents:
+            self.add(documents)
+
+    def add(self, documents):
+        """Adds documents ({id, name, content, is_folder}) as a new segment, retiring their older rows."""
+        np, sparse = _get_modules()
+        rows, cols, counts, lengths = [], [], [], []
+        for row, document in enumerate(documents):
+            terms = Counter(tokenize(document['name']) + tokenize(document['content']))
+            for term, count in terms.items():
+                rows.append(row)
+                cols.append(self.vocabulary.setdefault(term, len(self.vocabulary)))
+                counts.append(count)
+            lengths.append(sum(terms.values()))
+        tf = sparse.coo_matrix((np.array(counts, dtype=np.float32), (rows, cols)),
+                               shape=(len(documents), len(self.vocabulary)))
+        segment = Segment([d['id'] for d in documents], np.array([bool(d['is_folder']) for d in documents]),
+                          tf, np.array(lengths, dtype=np.float32))
+        self.discard(segment.ids)
+        self.segments.append(segment)
+        for row, node_id in enumerate(segment.ids):
+            self.locations[node_id] = (segment, row)
+        if len(self.segments) > SEARCH_MAX_SEGMENTS:
+            self.merge()
+
+    def discard(self, node_ids):
+        for node_id in node_ids:
+            location = self.locations.pop(node_id, None)
+            if location:
+                location[0].live[location[1]] = False
+
+    def merge(self):
+        """Rewrites the live rows of every segment as one segment."""
+        np, sparse = _get_modules()
+        width = len(self.vocabulary)
+        parts = []
+        for segment in self.segments:
+            tf = segment.tf.tocsr()[segment.live]
+            tf.resize((tf.shape[0], width))
+            parts.append(tf)
+        merged = Segment([node_id for s in self.segments for node_id, live in zip(s.ids, s.live) if live],
+                         np.concatenate([s.folders[s.live] for s in self.segments]),
+                         sparse.vstack(parts), np.concatenate([s.lengths[s.live] for s in self.segments]))
+        self.segments = [merged]
+        self.locations = {node_id: (merged, row) for row, node_id in enumerate(merged.ids)}
+
+    # --- Scoring ---
+    def score(self, query, limit, scope_ids=None):
+        """[(id, is_folder), ...] of the best `limit` BM25 matches, optionally only among scope_ids."""
+        np, _ = _get_modules()
+        columns = np.array(sorted({self.vocabulary[t] for t in tokenize(query) if t in self.vocabulary}), dtype=np.int64)
+        if not columns.size:
+            return []
+        documents = sum(int(s.live.sum()) for s in self.segments)
+        if not documents:
+            return []
+        average_length = sum(float(s.lengths[s.live].sum()) for s in self.segments) / documents
+
+        # Document frequencies over live rows, then BM25 idf per query term.
+        slices = []
+        frequencies = np.zeros(columns.size)
+        for segment in self.segments:
+            present = columns < segment.tf.shape[1]
+            matrix = segment.tf[:, columns[present]].tocoo()
+            slices.append((segment, present, matrix))
+            live = segment.live[matrix.row]
+            frequencies[present] += np.bincount(matrix.col[live], minlength=int(present.sum()))
+        idf = np.log(1 + (documents - frequencies + 0.5) / (frequencies + 0.5))
+
+        scope_rows = {}
+        for node_id in scope_ids or ():
+            location = self.locations.get(node_id)
+            if location:
+                scope_rows.setdefault(id(location[0]), []).append(location[1])
+
+        candidates = []
+        for segment, present, matrix in slices:
+            if not matrix.nnz:
+                continue
+            tf = matrix.data
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * segment.lengths[matrix.row] / average_length)
+            weights = idf[present][matrix.col] * tf * (BM25_K1 + 1) / (tf + norm)
+            scores = np.bincount(matrix.row, weights=weights, minlength=len(segment.ids))
+            mask = segment.live.copy()
+            if scope_ids is not None:
+                in_scope = np.zeros(len(segment.ids), dtype=bool)
+                in_scope[scope_rows.get(id(segment), [])] = True
+                mask &= in_scope
+            scores[~mask] = 0
+            top = np.flatnonzero(scores)
+            if top.size > limit:
+                top = top[np.argpartition(-scores[top], limit)[:limit]]
+            candidates.extend((float(scores[row]), segment.ids[row], bool(segment.folders[row])) for row in top)
+        candidates.sort(key=lambda c: -c[0])
+        return [(node_id, is_folder) for _, node_id, is_folder in candidates[:limit]]
+
+
+# --- Per-process index ---
+def _ensure_index(store):
+    """
+    The worker's index, refreshed if due, or None while it is first built in
+    the background. Forked workers build their own.
+    """
+    global _index, _refreshing
+    with _lock:
+        if _index_pid != os.getpid():
+            _start_build()
+            return None
+        index = _index
+        if (index is None or _refreshing
+                or time.monotonic() - index.refreshed_at < SEARCH_REFRESH_INTERVAL):
+            return index
+        _refreshing = True
+    try:
+        epoch, version, documents = store.search_documents(index.version)
+        # A new epoch is built into a new index, so searches keep the old one meanwhile.
+        rebuilt = build(store) if epoch != index.epoch else None
+        with _lock:
+            if _index is not index:
+                return _index
+            if rebuilt is not None:
+                _index = index = rebuilt
+            else:
+                index.update(epoch, version, documents)
+            return index
+    finally:
+        with _lock:
+            _refreshing = False
+
+def _start_build():
+    """Starts building this process's index in the background; called with _lock held."""
+    global _index, _index_pid, _refreshing
+    _index, _index_pid, _refreshing = None, os.getpid(), False
+    threading.Thread(target=_build, name="search-index-builder", daemon=True).start()
+
+def _build():
+    global _index, _index_pid
+    from storage import get_store
+
+    try:
+        index = build(get_store())
+    except Exception as e:
+        _logger.warning("Search index build failed, retrying on the next search: %s", e)
+        with _lock:
+            if _index is None:
+                _index_pid = None
+        return
+    with _lock:
+        _index = index
+
+def start():
+    """Starts building this process's index in the background, unless it is built or building."""
+    if not available():
+        return
+    with _lock:
+        if _index_pid != os.getpid():
+            _start_build()
+
+def build(store):
+    """Builds a complete index from the store."""
+    index = SearchIndex()
+    index.refresh(store)
+    return index
+
+def warm(store):
+    """Builds this worker's index in the foreground, as the benchmarks do before timing searches."""
+    global _index, _index_pid
+    index = build(store)
+    with _lock:
+        _index, _index_pid = index, os.getpid()
+
+def search(store, query, start_node_id=ROOT_ID, limit=15):
+    """BM25-ranked TreeStore.search results; substring search when the index is unavailable."""
+    index = _ensure_index(store) if available() else None
+    if index is None:
+        return store.search(query, start_node_id, limit)
+    scope_ids = None if start_node_id == ROOT_ID else hierarchy.descendant_ids(store, start_node_id)
+    # Over-fetched, since some matches may turn out to be gone.
+    fetch = limit * 2
+    while True:
+        with _lock:
+            matches = index.score(query, fetch, scope_ids)
+        results, gone = [], []
+        for node_id, is_folder in matches:
+            if len(results) == limit:
+                break
+            # From the hierarchy mirror when it is loaded; context_paths' block versions are not needed here.
+            path = hierarchy.path_nodes(store, node_id)
+            if path is None:
+                gone.append(node_id)
+                continue
+            results.append({'id': node_id, 'name': path[-1]['name'], 'is_folder': is_folder,
+                            'path_names': [node['name'] for node in path]})
+        if gone:
+            # Deleted or unreachable: retired until a write stamps them again.
+            with _lock:
+                index.discard(gone)
+        # Scoring again after retiring the gone matches reaches the ones below them.
+        if not gone or len(results) == limit or len(matches) < fetch:
+            return results
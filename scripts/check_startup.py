@@ -0,0 +1,59 @@
+# scripts/check_startup.py
+"""
+Startup budget check. Imports the web app in a fresh interpreter, builds it
+the way a production worker does, and fails if that takes longer than the
+budget or drags in modules that should only load on the code paths that use them.
+
+Usage: python -m scripts.check_startup [budget_ms]
+"""
+import os
+import sys
+import json
+import subprocess
+
+DEFAULT_BUDGET_MS = int(os.getenv("STARTUP_BUDGET_MS", 500))
+RUNS = 3
+
+# Modules the worker must not import before it serves a request.
+LAZY_MODULES = ["neo4j", "markdown", "markdownify", "bs4", "requests", "schedule", "zstandard"]
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import app
+app.create_app(init_db=False)
+elapsed_ms = (time.perf_counter() - start) * 1000
+print(json.dumps({"elapsed_ms": elapsed_ms, "modules": sorted(sys.modules)}))
+"""
+
+def measure_startup():
+    """Returns the fastest of a few cold starts, plus the modules that start imported."""
+    project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    best = None
+    for _ in range(RUNS):
+        output = subprocess.run([sys.executable, "-c", PROBE], cwd=project_root,
+                                capture_output=True, text=True, check=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        if best is None or result["elapsed_ms"] < best["elapsed_ms"]:
+            best = result
+    return best
+
+def check_startup(budget_ms=DEFAULT_BUDGET_MS):
+    result = measure_startup()
+    loaded = set(result["modules"])
+    failures = []
+
+    if result["elapsed_ms"] > budget_ms:
+        failures.append(f"startup took {result['elapsed_ms']:.0f} ms, budget is {budget_ms} ms")
+    for name in LAZY_MODULES:
+        if name in loaded:
+            failures.append(f"'{name}' is imported at startup but should be loaded lazily")
+
+    print(f"Startup: {result['elapsed_ms']:.0f} ms (budget {budget_ms} ms)")
+    for failure in failures:
+        print(f"  - FAIL: {failure}", file=sys.stderr)
+    return not failures
+
+if __name__ == "__main__":
+    budget = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_BUDGET_MS
+    sys.exit(0 if check_startup(budget) else 1)
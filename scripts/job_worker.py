@@ -0,0 +1,67 @@
+# scripts/job_worker.py
+"""
+Runs the jobs the web app queues (see jobs.py) in a process of its own, so
+syncs neither compete with request handling nor die with the web server.
+SIGTERM or Ctrl-C stops claiming new jobs and waits for the running ones,
+which a second signal cuts short; an interrupted sync resumes from its
+checkpoint when its job is retried.
+
+Usage: python -m scripts.job_worker [--workers N] [--drain]
+       python -m scripts.job_worker --enqueue freshtickets --args '{"overwrite": true}'
+"""
+import sys
+import json
+import signal
+import argparse
+import threading
+from dotenv import load_dotenv
+
+load_dotenv()
+
+import jobs
+from storage import close_store
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run queued KnowledgeTree jobs.")
+    parser.add_argument("--workers", type=int, default=jobs.JOB_WORKERS,
+                        help="jobs run at once (default JOB_WORKERS)")
+    parser.add_argument("--drain", action="store_true",
+                        help="exit once no queued job is ready to run instead of waiting for more")
+    parser.add_argument("--enqueue", choices=sorted(jobs.JOBS), help="queue this job and exit")
+    parser.add_argument("--args", default="{}", help="JSON arguments of the job to --enqueue")
+    parser.add_argument("--priority", type=int, help="priority of the job to --enqueue")
+    args = parser.parse_args(argv)
+
+    if args.enqueue:
+        job_id, created = jobs.enqueue(args.enqueue, json.loads(args.args), args.priority)
+        print(f"Job {job_id} {'queued' if created else 'was already queued'}.")
+        return 0
+
+    stop = threading.Event()
+
+    def on_signal(signum, frame):
+        if stop.is_set():
+            sys.exit(1)
+        print("Stopping: waiting for running jobs to finish.")
+        stop.set()
+
+    signal.signal(signal.SIGTERM, on_signal)
+    signal.signal(signal.SIGINT, on_signal)
+
+    threads = [threading.Thread(target=jobs.work_loop, args=(stop, args.drain), name=f"job-worker-{i}",
+                                daemon=True)
+               for i in range(max(args.workers, 1))]
+    print(f"Job worker running {len(threads)} jobs at a time from {jobs.JOB_QUEUE_PATH}.")
+    for thread in threads:
+        thread.start()
+    # Daemon threads joined with a timeout, so the main thread keeps receiving
+    # signals and a second one ends the process even while jobs run.
+    while any(thread.is_alive() for thread in threads):
+        for thread in threads:
+            thread.join(0.5)
+    close_store()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,141 +3,114 @@ import os
 import sys
 import requests
 import base64
-import time
 from dotenv import load_dotenv
-from neo4j import GraphDatabase
+import api_cache
+import paginate
+import sync_runs
+from storage import get_store, close_store
 
 load_dotenv()
 
-# --- Neo4j Connection ---
-uri = os.getenv("NEO4J_URI")
-user = os.getenv("NEO4J_USER")
-password = os.getenv("NEO4J_PASSWORD")
-driver = GraphDatabase.driver(uri, auth=(user, password))
-
 # --- Freshservice Configuration ---
 FRESHSERVICE_DOMAIN = os.getenv("FRESHSERVICE_DOMAIN")
 API_KEY = os.getenv("FRESHSERVICE_API_KEY")
+FRESHSERVICE_URL = os.getenv("FRESHSERVICE_URL", f"https://{FRESHSERVICE_DOMAIN}")
 ACCOUNT_NUMBER_FIELD = "account_number"
+REQUEST_DELAY = api_cache.delay(float(os.getenv("SYNC_REQUEST_DELAY", 0.5)))
 
-def get_freshservice_companies():
-    """Fetches all companies from the Freshservice API."""
-    all_companies = []
-    page = 1
-    endpoint = f"https://{FRESHSERVICE_DOMAIN}/api/v2/departments"
-    auth_str = f"{API_KEY}:X"
-    encoded_auth = base64.b64encode(auth_str.encode()).decode()
-    headers = {"Content-Type": "application/json", "Authorization": f"Basic {encoded_auth}"}
-
-    print("Fetching companies from Freshservice...")
-    while True:
-        try:
-            params = {'page': page, 'per_page': 100}
-            response = requests.get(endpoint, headers=headers, params=params, timeout=30)
-            response.raise_for_status()
-            data = response.json()
-            companies_on_page = data.get('departments', [])
-            if not companies_on_page:
-                break
-            all_companies.extend(companies_on_page)
-            page += 1
-            time.sleep(0.5)
-        except requests.exceptions.RequestException as e:
-            print(f"Error fetching Freshservice companies: {e}", file=sys.stderr)
-            return None
-    print(f"Found {len(all_companies)} companies.")
-    return all_companies
-
-def get_freshservice_users():
-    """Fetches all users (requesters) from the Freshservice API."""
-    all_users = []
-    page = 1
-    endpoint = f"https://{FRESHSERVICE_DOMAIN}/api/v2/requesters"
+def get_freshservice_page(resource, page, limiter):
+    """One page (100 records) of a Freshservice list endpoint, e.g. 'departments'."""
+    endpoint = f"{FRESHSERVICE_URL}/api/v2/{resource}"
     auth_str = f"{API_KEY}:X"
     encoded_auth = base64.b64encode(auth_str.encode()).decode()
     headers = {"Content-Type": "application/json", "Authorization": f"Basic {encoded_auth}"}
+    params = {'page': page, 'per_page': 100}
 
-    print("Fetching users from Freshservice...")
-    while True:
-        try:
-            params = {'page': page, 'per_page': 100}
+    def fetch():
+        while True:
             response = requests.get(endpoint, headers=headers, params=params, timeout=30)
             if response.status_code == 429:
-                retry_after = int(response.headers.get('Retry-After', 5))
-                time.sleep(retry_after)
+                # Every stream sharing the limiter backs off, not just this page.
+                limiter.pause(int(response.headers.get('Retry-After', 5)))
+                limiter.wait()
                 continue
             response.raise_for_status()
-            data = response.json()
-            users_on_page = data.get('requesters', [])
-            if not users_on_page:
-                break
-            all_users.extend(users_on_page)
-            page += 1
-            time.sleep(0.5)
-        except requests.exceptions.RequestException as e:
-            print(f"Error fetching Freshservice users: {e}", file=sys.stderr)
-            return None
-    print(f"Found {len(all_users)} users.")
-    return all_users
+            return response.json()
+
+    return api_cache.get_json('freshservice', endpoint, fetch, params).get(resource, [])
 
+def stream_freshservice(resource, limiter):
+    """A PageStream of every record of a Freshservice list endpoint."""
+    return paginate.PageStream(lambda page: get_freshservice_page(resource, page, limiter), limiter)
 
 def sync_companies_and_users():
-    companies = get_freshservice_companies()
-    users = get_freshservice_users()
+    # Companies and users download at the same time, several pages each, and
+    # are written as they arrive: users only need every company placed first.
+    limiter = paginate.RateLimiter(REQUEST_DELAY)
+    print("Fetching companies and users from Freshservice...")
+    companies = stream_freshservice('departments', limiter)
+    users = stream_freshservice('requesters', limiter)
+
+    store = get_store()
+    run_id = sync_runs.new_run_id()
+    try:
+        company_count, user_count = sync_streams(store, companies, users, run_id)
+    except requests.exceptions.RequestException as e:
+        print(f"Error fetching from Freshservice: {e}", file=sys.stderr)
+        print("Could not fetch data from Freshservice. Aborting.")
+        return
+    finally:
+        companies.close()
+        users.close()
+    print(f"Found {company_count} companies and {user_count} users.")
 
-    if not companies or not users:
+    if not company_count or not user_count:
         print("Could not fetch data from Freshservice. Aborting.")
         return
 
+    # Contacts of users that are no longer active were not seen by this run.
+    sync_runs.sweep(store, 'freshservice', run_id)
+
+def sync_streams(store, companies, users, run_id):
+    """Writes the streamed companies, then users. Returns how many of each were fetched."""
+    # Create a 'Companies' root folder if it doesn't exist
+    store.ensure_companies_root()
+
     # Create a mapping of Freshservice department ID to our account number
     fs_id_to_account_map = {}
+    company_count = 0
     for company in companies:
+        company_count += 1
+        company_name = company.get('name')
         account_number = (company.get('custom_fields') or {}).get(ACCOUNT_NUMBER_FIELD)
         if account_number:
             fs_id_to_account_map[company['id']] = str(account_number)
 
-    with driver.session() as session:
-        # Create a 'Companies' root folder if it doesn't exist
-        session.run("""
-            MERGE (root:ContextItem {id: 'root'})
-            MERGE (companies:ContextItem {id: 'companies_root', name: 'Companies', is_folder: true})
-            MERGE (root)-[:PARENT_OF]->(companies)
-        """)
-
-        for company in companies:
-            company_name = company.get('name')
-            account_number = (company.get('custom_fields') or {}).get(ACCOUNT_NUMBER_FIELD)
+        if not company_name or not account_number:
+            continue
 
-            if not company_name or not account_number:
-                continue
+        # Create or update company folder and its own "Users" subfolder
+        store.upsert_company(str(account_number), company_name, company.get('id'))
 
-            # Create or update company folder and its own "Users" subfolder
-            session.run("""
-                MATCH (companies_root:ContextItem {id: 'companies_root'})
-                MERGE (c:ContextItem {id: $account_number, name: $name, is_folder: true})
-                SET c.freshservice_id = $fs_id
-                MERGE (companies_root)-[:PARENT_OF]->(c)
-                MERGE (u_root:ContextItem {id: 'users_for_' + $account_number, name: 'Users', is_folder: true})
-                MERGE (c)-[:PARENT_OF]->(u_root)
-            """, account_number=str(account_number), name=company_name, fs_id=company.get('id'))
-
-        for user in users:
-            if not user.get('active'):
-                continue
+    user_count = 0
+    for user in users:
+        user_count += 1
+        if not user.get('active'):
+            continue
 
-            user_name = f"{user.get('first_name', '')} {user.get('last_name', '')}".strip()
-            user_email = user.get('primary_email')
-            department_ids = user.get('department_ids')
-            fs_requester_id = user.get('id')
+        user_name = f"{user.get('first_name', '')} {user.get('last_name', '')}".strip()
+        user_email = user.get('primary_email')
+        department_ids = user.get('department_ids')
+        fs_requester_id = user.get('id')
 
 
-            if not user_name or not user_email or not department_ids:
-                continue
+        if not user_name or not user_email or not department_ids:
+            continue
 
-            for dept_id in department_ids:
-                account_number = fs_id_to_account_map.get(dept_id)
-                if account_number:
-                    contact_md_content = f"""
+        for dept_id in department_ids:
+            account_number = fs_id_to_account_map.get(dept_id)
+            if account_number:
+                contact_md_content = f"""
 # Contact Information for {user_name}
 
 - **Email:** {user_email}
@@ -146,23 +119,13 @@ def sync_companies_and_users():
 - **Mobile Phone:** {user.get('mobile_phone_number', 'N/A')}
 - **Time Zone:** {user.get('time_zone', 'N/A')}
 """
-                    # Correctly match the company's "Users" folder and create the user inside it
-                    session.run("""
-                        MATCH (users_root:ContextItem {id: 'users_for_' + $account_number})
-                        MERGE (user_folder:ContextItem {id: $user_email, name: $user_name, is_folder: true, user_email: $user_email})
-                        SET user_folder.freshservice_requester_id = $fs_requester_id
-                        MERGE (users_root)-[:PARENT_OF]->(user_folder)
-
-                        MERGE (contact_md:ContextItem {id: 'contact_for_' + $user_email, name: 'Contact.md', is_folder: false, user_email: $user_email})
-                        ON CREATE SET contact_md.content = $content, contact_md.read_only = true
-                        ON MATCH SET contact_md.content = $content, contact_md.read_only = true
-                        MERGE (user_folder)-[:PARENT_OF]->(contact_md)
-
-                        MERGE (tickets_folder:ContextItem {id: 'tickets_for_' + $user_email, name: 'Tickets', is_folder: true, is_attached: true})
-                        MERGE (user_folder)-[:PARENT_OF]->(tickets_folder)
-                    """, account_number=account_number, user_name=user_name, user_email=user_email, content=contact_md_content, fs_requester_id=fs_requester_id)
-                    break
+                # Create the user inside the company's "Users" folder
+                store.upsert_user(account_number, user_name, user_email, contact_md_content, fs_requester_id,
+                                  run_id=run_id)
+                break
+
+    return company_count, user_count
 
 if __name__ == "__main__":
     sync_companies_and_users()
-    driver.close()
+    close_store()
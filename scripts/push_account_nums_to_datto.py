@@ -1,16 +1,18 @@
 # scripts/push_account_nums_to_datto.py
 import os
 import sys
+import argparse
 import requests
 import base64
-import time
 from dotenv import load_dotenv
+import reconcile
 
 load_dotenv()
 
 # --- Configuration ---
 FRESHSERVICE_DOMAIN = os.getenv("FRESHSERVICE_DOMAIN")
 FRESHSERVICE_API_KEY = os.getenv("FRESHSERVICE_API_KEY")
+FRESHSERVICE_URL = os.getenv("FRESHSERVICE_URL", f"https://{FRESHSERVICE_DOMAIN}")
 DATTO_API_ENDPOINT = os.getenv("DATTO_API_ENDPOINT")
 DATTO_API_KEY = os.getenv("DATTO_API_KEY")
 DATTO_API_SECRET = os.getenv("DATTO_API_SECRET")
@@ -23,7 +25,7 @@ def get_freshservice_companies(headers):
     """Fetches all companies from the Freshservice API."""
     all_companies = []
     page = 1
-    endpoint = f"https://{FRESHSERVICE_DOMAIN}/api/v2/departments"
+    endpoint = f"{FRESHSERVICE_URL}/api/v2/departments"
     print("Fetching companies from Freshservice...")
     while True:
         try:
@@ -67,23 +69,16 @@ def get_datto_sites(access_token):
         print(f"Error fetching Datto sites: {e}", file=sys.stderr)
         return None
 
-def check_datto_variable_exists(access_token, site_uid, variable_name):
-    """Checks if a specific variable already exists for a site."""
+def get_datto_site_variables(access_token, site_uid):
+    """A site's variables as {name: value}; raises when they cannot be read."""
     request_url = f"{DATTO_API_ENDPOINT}/api/v2/site/{site_uid}/variables"
     headers = {'Authorization': f'Bearer {access_token}'}
-    try:
-        response = requests.get(request_url, headers=headers, timeout=30)
-        if response.status_code == 404:
-            return False
-        response.raise_for_status()
-        variables = response.json().get("variables", [])
-        for var in variables:
-            if var.get("name") == variable_name:
-                return True # The variable exists
-        return False # The variable does not exist
-    except requests.exceptions.RequestException as e:
-        print(f"   -> ⚠️  Warning: Could not check for existing variables on site {site_uid}: {e}", file=sys.stderr)
-        return True
+    response = requests.get(request_url, headers=headers, timeout=30)
+    reconcile.check_rate_limit(response)
+    if response.status_code == 404:
+        return {}
+    response.raise_for_status()
+    return {var.get("name"): var.get("value") for var in response.json().get("variables", [])}
 
 def update_datto_site_variable(access_token, site_uid, variable_name, variable_value):
     """Pushes a variable value to a specific Datto RMM site."""
@@ -92,19 +87,78 @@ def update_datto_site_variable(access_token, site_uid, variable_name, variable_v
     payload = {"name": variable_name, "value": str(variable_value)}
     try:
         response = requests.put(request_url, headers=headers, json=payload, timeout=30)
+        reconcile.check_rate_limit(response)
         response.raise_for_status()
         return True
     except requests.exceptions.RequestException as e:
         print(f"   -> ❌ FAILED to update Datto site {site_uid}: {e}", file=sys.stderr)
-        if hasattr(e, 'response'):
+        if getattr(e, 'response', None) is not None:
              print(f"   -> Response: {e.response.text}", file=sys.stderr)
         return False
 
-if __name__ == "__main__":
+def match_sites(fs_companies, datto_sites):
+    """One action per Datto site: 'unmapped', 'missing_account_number', or 'check' for the sites to read."""
+    fs_company_map = {c.get('name').strip(): c for c in fs_companies if c.get('name')}
+    matcher = reconcile.NameMatcher(fs_company_map)
+
+    actions = []
+    for site in datto_sites:
+        datto_name = (site.get('name') or '').strip()
+        if REDBARN_KEYWORD in datto_name:
+            fs_name_match = REDBARN_FRESHSERVICE_TARGET
+        else:
+            fs_name_match = matcher.longest(datto_name)
+
+        action = {"datto_site_name": datto_name, "datto_site_uid": site.get('uid'), "company": fs_name_match}
+        company_data = fs_company_map.get(fs_name_match)
+        if not company_data:
+            action.update(company=None, action="unmapped")
+        else:
+            action["account_number"] = (company_data.get('custom_fields') or {}).get(ACCOUNT_NUMBER_FIELD)
+            action["action"] = "check" if action["account_number"] else "missing_account_number"
+        actions.append(action)
+    return actions
+
+def plan_pushes(datto_token, actions):
+    """
+    Reads the variables of every site to check, all at once, and turns each
+    check into 'push', 'already_set', 'conflict' (set to another number,
+    which is left alone) or 'check_failed'.
+    """
+    checks = [a for a in actions if a["action"] == "check"]
+    for action, variables in reconcile.run_parallel(
+            checks, lambda a: get_datto_site_variables(datto_token, a["datto_site_uid"])):
+        if isinstance(variables, Exception):
+            action.update(action="check_failed", error=str(variables))
+        elif DATTO_VARIABLE_NAME not in variables:
+            action["action"] = "push"
+        else:
+            action["current_value"] = variables[DATTO_VARIABLE_NAME]
+            same = str(variables[DATTO_VARIABLE_NAME]) == str(action["account_number"])
+            action["action"] = "already_set" if same else "conflict"
+    return actions
+
+def apply_pushes(datto_token, actions):
+    """Writes the variable of every 'push' action in parallel, recording each outcome."""
+    pushes = sorted((a for a in actions if a["action"] == "push"), key=lambda a: a["datto_site_name"])
+    for action, success in reconcile.run_parallel(pushes, lambda a: update_datto_site_variable(
+            datto_token, a["datto_site_uid"], DATTO_VARIABLE_NAME, a["account_number"])):
+        action["outcome"] = "updated" if success is True else "failed"
+        print(f"-> {'Pushed' if success is True else 'FAILED to push'} Account Number '{action['account_number']}' "
+              f"to '{action['datto_site_name']}'.")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Push Freshservice account numbers to Datto RMM site variables")
+    parser.add_argument("--dry-run", action="store_true", help="plan the writes without making them")
+    parser.add_argument("--report", help="write the plan and outcomes to this JSON file")
+    args = parser.parse_args(argv)
+
     print(" Datto RMM & Freshservice Account Number Pusher")
     print("===================================================")
 
-    if not all([FRESHSERVICE_API_KEY, FRESHSERVICE_DOMAIN, DATTO_API_ENDPOINT, DATTO_API_KEY, DATTO_API_SECRET]):
+    # FRESHSERVICE_URL has a default built from the domain, so check what it comes from.
+    freshservice_host = FRESHSERVICE_DOMAIN or os.getenv("FRESHSERVICE_URL")
+    if not all([FRESHSERVICE_API_KEY, freshservice_host, DATTO_API_ENDPOINT, DATTO_API_KEY, DATTO_API_SECRET]):
         sys.exit("Error: All Freshservice and Datto environment variables must be set.")
 
     auth_str = f"{FRESHSERVICE_API_KEY}:X"
@@ -124,72 +178,42 @@ if __name__ == "__main__":
     if not datto_sites:
         sys.exit("Could not fetch sites from Datto RMM. Aborting.")
 
-    fs_company_map = {c.get('name').strip(): c for c in fs_companies if c.get('name')}
-
-    actions_to_take = []
-    unmapped_datto_sites = []
-
-    for site in datto_sites:
-        datto_name = (site.get('name') or '').strip()
-        datto_uid = site.get('uid')
-        fs_name_match = None
-
-        if REDBARN_KEYWORD in datto_name:
-            fs_name_match = REDBARN_FRESHSERVICE_TARGET
-        else:
-            best_match = ''
-            for fs_name in fs_company_map.keys():
-                if fs_name in datto_name and len(fs_name) > len(best_match):
-                    best_match = fs_name
-            if best_match:
-                fs_name_match = best_match
-
-        if fs_name_match:
-            company_data = fs_company_map.get(fs_name_match)
-            if company_data:
-                account_number = company_data.get('custom_fields', {}).get(ACCOUNT_NUMBER_FIELD)
-                actions_to_take.append({"datto_site_name": datto_name, "datto_site_uid": datto_uid, "account_number": account_number})
-            else:
-                unmapped_datto_sites.append(datto_name)
-        else:
-            unmapped_datto_sites.append(datto_name)
-
-    print("\n---  Pushing Account Numbers to Datto RMM Sites ---")
-    success_count, fail_count, already_set_count = 0, 0, 0
-    for action in sorted(actions_to_take, key=lambda x: x['datto_site_name']):
-        datto_name, datto_uid, acc_num = action['datto_site_name'], action['datto_site_uid'], action['account_number']
-
-        if not acc_num:
-            print(f"-> Skipping '{datto_name}': Account Number is MISSING in Freshservice.")
-            continue
-
-        print(f"-> Processing site '{datto_name}'...")
-
-        if check_datto_variable_exists(datto_token, datto_uid, DATTO_VARIABLE_NAME):
-            print("   ->   Skipping: 'AccountNumber' variable already exists.")
-            already_set_count += 1
-            continue
-
-        print(f"   -> Pushing Account Number '{acc_num}'...")
-        success = update_datto_site_variable(datto_token, datto_uid, DATTO_VARIABLE_NAME, acc_num)
-        if success:
-            success_count += 1
-            print("   ->  Success.")
-        else:
-            fail_count +=1
-        time.sleep(0.5)
-
-    print("\n--- Summary ---")
-    print(f"Successfully created/updated variables for {success_count} sites.")
-    print(f"Skipped {already_set_count} sites that already had the variable set.")
-    if fail_count > 0:
-        print(f"Failed to update {fail_count} sites. Please check the logs above.")
+    actions = plan_pushes(datto_token, match_sites(fs_companies, datto_sites))
+    counts = {kind: [a for a in actions if a["action"] == kind]
+              for kind in ("push", "already_set", "conflict", "check_failed", "missing_account_number", "unmapped")}
+
+    print("\n--- Plan ---")
+    print(f"{len(counts['push'])} sites need the Account Number pushed.")
+    print(f"{len(counts['already_set'])} sites already have it set.")
+    for action in counts['conflict']:
+        print(f"-> '{action['datto_site_name']}' has Account Number '{action['current_value']}', "
+              f"Freshservice says '{action['account_number']}'; left alone.")
+    for action in counts['check_failed']:
+        print(f"-> Could not check the variables of '{action['datto_site_name']}': {action['error']}", file=sys.stderr)
+    for action in counts['missing_account_number']:
+        print(f"-> Skipping '{action['datto_site_name']}': Account Number is MISSING in Freshservice.")
+
+    if not args.dry_run:
+        print("\n---  Pushing Account Numbers to Datto RMM Sites ---")
+        apply_pushes(datto_token, actions)
+        success_count = sum(1 for a in counts['push'] if a.get("outcome") == "updated")
+        fail_count = len(counts['push']) - success_count
+        print("\n--- Summary ---")
+        print(f"Successfully created/updated variables for {success_count} sites.")
+        print(f"Skipped {len(counts['already_set']) + len(counts['conflict'])} sites that already had the variable set.")
+        if fail_count > 0:
+            print(f"Failed to update {fail_count} sites. Please check the logs above.")
 
     print("\n--- Unmapped Datto Sites (Ignored) ---")
-    if unmapped_datto_sites:
-        for name in sorted(unmapped_datto_sites):
+    if counts['unmapped']:
+        for name in sorted(a['datto_site_name'] for a in counts['unmapped']):
             print(name)
     else:
         print("All mappable Datto sites were processed!")
 
+    if args.report:
+        reconcile.write_report(args.report, "push_account_nums_to_datto", actions, dry_run=args.dry_run)
     print("\nScript finished.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,31 @@
+# scripts/rebuild_from_cache.py
+"""
+Rebuilds the synced nodes from the API responses recorded with
+API_CACHE=record (see api_cache.py), without calling Freshservice or Datto:
+companies and users, then Datto devices, then an overwrite of every ticket.
+Use it after changing how contacts, devices or tickets are rendered.
+
+Usage: API_CACHE_DIR=api_cache python -m scripts.rebuild_from_cache
+"""
+from dotenv import load_dotenv
+
+import api_cache
+from storage import close_store
+
+load_dotenv()
+
+
+def rebuild():
+    api_cache.API_CACHE = 'replay'
+    # Imported only now so the sync modules read their delays as a replay's.
+    from scripts.pull_freshservice import sync_companies_and_users
+    from scripts.pull_datto import sync_datto_devices
+    from scripts.pull_fresh_tickets import sync_fresh_tickets
+
+    sync_companies_and_users()
+    sync_datto_devices()
+    sync_fresh_tickets(overwrite=True)
+
+if __name__ == "__main__":
+    rebuild()
+    close_store()
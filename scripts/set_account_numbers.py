@@ -1,18 +1,20 @@
 # scripts/set_account_numbers.py
 import os
 import sys
+import argparse
 import requests
 import base64
 import time
 import random
 from dotenv import load_dotenv
+import reconcile
 
 load_dotenv()
 
 # --- Configuration ---
 FRESHSERVICE_DOMAIN = os.getenv("FRESHSERVICE_DOMAIN")
 API_KEY = os.getenv("FRESHSERVICE_API_KEY")
-BASE_URL = f"https://{FRESHSERVICE_DOMAIN}"
+BASE_URL = os.getenv("FRESHSERVICE_URL", f"https://{FRESHSERVICE_DOMAIN}")
 ACCOUNT_NUMBER_FIELD = "account_number"
 COMPANIES_PER_PAGE = 100
 MAX_RETRIES = 3
@@ -60,19 +62,52 @@ def update_company_account_number(headers, company_id, account_number):
 
     try:
         response = requests.put(endpoint, headers=headers, json=payload, timeout=30)
+        reconcile.check_rate_limit(response)
         response.raise_for_status()
         return True
     except requests.exceptions.RequestException as e:
         print(f"Failed to update company ID {company_id}: {e}", file=sys.stderr)
-        if hasattr(e, 'response'):
+        if getattr(e, 'response', None) is not None:
             print(f"Response: {e.response.text}", file=sys.stderr)
         return False
 
-if __name__ == "__main__":
+def plan_account_numbers(companies):
+    """
+    One action per company: 'already_set', or 'assign' with a new account
+    number unique among all of them.
+    """
+    existing_numbers = set()
+    for company in companies:
+        acc_num = (company.get('custom_fields') or {}).get(ACCOUNT_NUMBER_FIELD)
+        if acc_num:
+            existing_numbers.add(int(acc_num))
+
+    actions = []
+    for company in companies:
+        action = {"company_id": company['id'], "company_name": company['name']}
+        acc_num = (company.get('custom_fields') or {}).get(ACCOUNT_NUMBER_FIELD)
+        if acc_num:
+            action.update(action="already_set", account_number=acc_num)
+        else:
+            new_number = None
+            while new_number is None or new_number in existing_numbers:
+                new_number = random.randint(100000, 999999)
+            existing_numbers.add(new_number)
+            action.update(action="assign", account_number=new_number)
+        actions.append(action)
+    return actions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Give every Freshservice company without one an account number")
+    parser.add_argument("--dry-run", action="store_true", help="plan the numbers without setting them")
+    parser.add_argument("--report", help="write the plan and outcomes to this JSON file")
+    args = parser.parse_args(argv)
+
     print(" Freshservice Account Number Setter")
     print("==========================================")
 
-    if not API_KEY or not FRESHSERVICE_DOMAIN:
+    # BASE_URL has a default built from the domain, so check what it comes from.
+    if not API_KEY or not (FRESHSERVICE_DOMAIN or os.getenv("FRESHSERVICE_URL")):
         sys.exit("Error: FRESHSERVICE_DOMAIN and FRESHSERVICE_API_KEY must be set in the .env file.")
 
     auth_str = f"{API_KEY}:X"
@@ -89,45 +124,30 @@ if __name__ == "__main__":
 
     print(f"\nFound {len(companies)} total companies in Freshservice.")
 
-    existing_numbers = set()
-    companies_to_update = []
+    actions = plan_account_numbers(companies)
+    assignments = [a for a in actions if a["action"] == "assign"]
+    print(f"Found {len(actions) - len(assignments)} companies with existing account numbers.")
+    print(f"Found {len(assignments)} companies that need a new account number.")
 
-    for company in companies:
-        custom_fields = company.get('custom_fields', {})
-        acc_num = custom_fields.get(ACCOUNT_NUMBER_FIELD)
-        if acc_num:
-            existing_numbers.add(int(acc_num))
-        else:
-            companies_to_update.append(company)
-
-    print(f"Found {len(existing_numbers)} companies with existing account numbers.")
-    print(f"Found {len(companies_to_update)} companies that need a new account number.")
-
-    if not companies_to_update:
+    if not assignments:
         print("\nAll companies already have an account number. Nothing to do.")
-        sys.exit(0)
-
-    print("\n--- Assigning New Account Numbers ---")
-    updated_count = 0
-    for company in companies_to_update:
-        new_number = None
-        while new_number is None or new_number in existing_numbers:
-            new_number = random.randint(100000, 999999)
-
-        company_id = company['id']
-        company_name = company['name']
-
-        print(f"Updating '{company_name}' (ID: {company_id}) with new account number: {new_number}")
-
-        success = update_company_account_number(headers, company_id, new_number)
-
-        if success:
-            existing_numbers.add(new_number)
-            updated_count += 1
-            time.sleep(0.5)
-        else:
-            print(f"Skipping '{company_name}' due to update failure.")
-
-    print("\n-----------------------------------------")
-    print(f" Successfully updated {updated_count} companies.")
+    elif not args.dry_run:
+        print("\n--- Assigning New Account Numbers ---")
+        for action, success in reconcile.run_parallel(assignments, lambda a: update_company_account_number(
+                headers, a["company_id"], a["account_number"])):
+            action["outcome"] = "updated" if success is True else "failed"
+            if success is True:
+                print(f"Updated '{action['company_name']}' (ID: {action['company_id']}) "
+                      f"with new account number: {action['account_number']}")
+            else:
+                print(f"Skipping '{action['company_name']}' due to update failure.")
+
+        print("\n-----------------------------------------")
+        print(f" Successfully updated {sum(1 for a in assignments if a['outcome'] == 'updated')} companies.")
+
+    if args.report:
+        reconcile.write_report(args.report, "set_account_numbers", actions, dry_run=args.dry_run)
     print("\nScript finished.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+# scripts/train_content_dictionary.py
+"""
+Trains a zstd dictionary on the stored ticket bodies and makes it the one new
+ticket bodies are compressed with (see compression.py). Bodies already stored
+keep the dictionary they were compressed with; re-syncing with `overwrite`
+recompresses changed tickets only.
+
+Usage: python -m scripts.train_content_dictionary [sample_size]
+"""
+import sys
+import random
+from dotenv import load_dotenv
+
+import compression
+from storage import get_store, close_store
+
+load_dotenv()
+
+DEFAULT_SAMPLE_SIZE = 2000
+
+
+def train(store, sample_size=DEFAULT_SAMPLE_SIZE):
+    _, _, documents = store.search_documents()
+    bodies = [d['content'] for d in documents if d['id'].startswith('ticket_') and d['content']]
+    if len(bodies) < 10:
+        sys.exit(f"Only {len(bodies)} ticket bodies stored; sync tickets before training a dictionary.")
+    samples = random.sample(bodies, min(sample_size, len(bodies)))
+    dictionary_hash, data = compression.train_dictionary(samples)
+    store.save_content_dictionary(dictionary_hash, data)
+    print(f"Trained a {len(data)} byte dictionary on {len(samples)} tickets: {dictionary_hash}")
+
+
+if __name__ == "__main__":
+    train(get_store(), int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_SAMPLE_SIZE)
+    close_store()
@@ -0,0 +1,161 @@
+# slow_queries.py
+"""
+Slow-query log. Any store query slower than SLOW_QUERY_MS is handed to a
+background thread that re-runs it out of band to capture its plan, then
+appended as one JSON line to a rotating log that the admin panel reads.
+
+Read-only queries are re-run under PROFILE, which executes them and returns
+the plan with database hits. Queries that write are only EXPLAINed: running
+them again would apply the write twice.
+"""
+import os
+import re
+import json
+import time
+import queue
+import logging
+import threading
+from collections import deque
+from logging.handlers import RotatingFileHandler
+
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", 500))
+SLOW_QUERY_LOG = os.getenv("SLOW_QUERY_LOG", os.path.join("logs", "slow_queries.log"))
+SLOW_QUERY_LOG_MAX_BYTES = int(os.getenv("SLOW_QUERY_LOG_MAX_BYTES", 5 * 1024 * 1024))
+SLOW_QUERY_LOG_BACKUPS = int(os.getenv("SLOW_QUERY_LOG_BACKUPS", 3))
+# A query shape is profiled at most once per cooldown, so a hot slow query
+# does not turn into a stream of PROFILE runs against the database.
+PROFILE_COOLDOWN_SECONDS = float(os.getenv("SLOW_QUERY_PROFILE_COOLDOWN", 60))
+
+MAX_PARAM_CHARS = 200
+MAX_PARAM_ITEMS = 20
+WRITE_CLAUSES = re.compile(r"\b(CREATE|MERGE|SET|DELETE|REMOVE|DROP|LOAD\s+CSV)\b", re.IGNORECASE)
+
+_logger = logging.getLogger("knowledgetree.slow_queries")
+_logger.propagate = False
+_lock = threading.Lock()
+_queue = queue.Queue(maxsize=100)
+_worker_pid = None
+_last_profiled = {}
+
+
+def enabled():
+    return SLOW_QUERY_MS > 0
+
+def is_write(query):
+    return bool(WRITE_CLAUSES.search(query))
+
+def _trim(value):
+    """Keeps logged parameters readable: ticket bodies and bulk rows are cut short."""
+    if isinstance(value, str):
+        return value if len(value) <= MAX_PARAM_CHARS else value[:MAX_PARAM_CHARS] + f"... ({len(value)} chars)"
+    if isinstance(value, dict):
+        return {k: _trim(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        items = [_trim(v) for v in value[:MAX_PARAM_ITEMS]]
+        if len(value) > MAX_PARAM_ITEMS:
+            items.append(f"... ({len(value)} items)")
+        return items
+    return value
+
+def summarize_plan(plan):
+    """Reduces a driver plan/profile dict to the fields worth reading."""
+    if not plan:
+        return None
+    args = plan.get('args', {})
+    node = {'operator': plan.get('operatorType')}
+    if 'dbHits' in plan:
+        node['db_hits'] = plan['dbHits']
+        node['rows'] = plan.get('rows')
+    elif 'EstimatedRows' in args:
+        node['estimated_rows'] = args['EstimatedRows']
+    if args.get('Details'):
+        node['details'] = args['Details']
+    children = [summarize_plan(child) for child in plan.get('children', [])]
+    if children:
+        node['children'] = children
+    return node
+
+
+# --- Capture ---
+def report(name, seconds, query=None, parameters=None, rows=None, capture_plan=None):
+    """
+    Queues a slow query for logging. `capture_plan(query, parameters, profile)`
+    re-runs the query and returns the driver's plan dict; the store supplies it.
+    Never blocks the caller: when the queue is full the entry is dropped.
+    """
+    entry = {
+        'timestamp': time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        'name': name,
+        'duration_ms': round(seconds * 1000, 1),
+        'rows': rows,
+        'query': query,
+        'parameters': _trim(parameters or {}),
+        'pid': os.getpid(),
+    }
+    _ensure_worker()
+    try:
+        _queue.put_nowait((entry, query, parameters, capture_plan))
+    except queue.Full:
+        pass
+
+def _ensure_worker():
+    global _worker_pid
+    with _lock:
+        if _worker_pid != os.getpid():
+            threading.Thread(target=_work, name="slow-query-profiler", daemon=True).start()
+            _worker_pid = os.getpid()
+
+def _work():
+    while True:
+        entry, query, parameters, capture_plan = _queue.get()
+        try:
+            if capture_plan is not None and query:
+                _attach_plan(entry, query, parameters, capture_plan)
+            _write(entry)
+        except Exception as e:
+            _logger.debug("Could not record slow query %s: %s", entry['name'], e)
+
+def _attach_plan(entry, query, parameters, capture_plan):
+    now = time.monotonic()
+    if now - _last_profiled.get(query, float('-inf')) < PROFILE_COOLDOWN_SECONDS:
+        entry['plan_mode'] = 'skipped (profiled recently)'
+        return
+    _last_profiled[query] = now
+    profile = not is_write(query)
+    entry['plan_mode'] = 'PROFILE' if profile else 'EXPLAIN'
+    try:
+        plan = capture_plan(query, parameters or {}, profile)
+    except Exception as e:
+        entry['plan_error'] = str(e)
+        return
+    entry['plan'] = summarize_plan(plan)
+    if profile and plan:
+        import metrics  # metrics imports this module
+        entry['db_hits'] = metrics.plan_db_hits(plan)
+
+def _write(entry):
+    if not _logger.handlers:
+        os.makedirs(os.path.dirname(SLOW_QUERY_LOG) or '.', exist_ok=True)
+        handler = RotatingFileHandler(SLOW_QUERY_LOG, maxBytes=SLOW_QUERY_LOG_MAX_BYTES,
+                                      backupCount=SLOW_QUERY_LOG_BACKUPS, encoding='utf-8')
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        _logger.addHandler(handler)
+        _logger.setLevel(logging.INFO)
+    _logger.info(json.dumps(entry, default=str))
+
+
+# --- Reading ---
+def recent(limit=50):
+    """Returns the newest `limit` entries from the current log file, newest first."""
+    try:
+        with open(SLOW_QUERY_LOG, encoding='utf-8') as f:
+            lines = deque(f, maxlen=limit)
+    except FileNotFoundError:
+        return []
+    entries = []
+    for line in reversed(lines):
+        try:
+            entries.append(json.loads(line))
+        except ValueError:
+            continue
+    return entries
@@ -9,6 +9,9 @@ document.addEventListener('DOMContentLoaded', () => {
     const exportBtn = document.getElementById('export-data-btn');
     const importBtn = document.getElementById('import-data-btn');
     const importFileInput = document.getElementById('import-file-input');
+    const refreshSlowQueriesBtn = document.getElementById('refresh-slow-queries-btn');
+    const slowQueriesTable = document.getElementById('slow-queries-table');
+    const slowQueriesStatus = document.getElementById('slow-queries-status');
 
     if (reinitDbBtn) {
         reinitDbBtn.addEventListener('click', async () => {
@@ -142,4 +145,49 @@ document.addEventListener('DOMContentLoaded', () => {
             importBtn.textContent = 'Import User Data';
         });
     }
+
+    const loadSlowQueries = async () => {
+        const response = await fetch('/api/admin/slow_queries?limit=100');
+        const result = await response.json();
+        const tbody = slowQueriesTable.querySelector('tbody');
+        tbody.innerHTML = '';
+        slowQueriesStatus.textContent = result.threshold_ms > 0
+            ? `Threshold: ${result.threshold_ms} ms. ${result.entries.length} recent entries.`
+            : 'The slow-query log is disabled (SLOW_QUERY_MS is 0).';
+
+        result.entries.forEach(entry => {
+            const row = document.createElement('tr');
+            row.className = 'slow-query-row';
+            [entry.timestamp, entry.name, entry.duration_ms, entry.rows ?? '', entry.db_hits ?? '', entry.plan_mode || '']
+                .forEach(value => {
+                    const cell = document.createElement('td');
+                    cell.textContent = value;
+                    row.appendChild(cell);
+                });
+
+            const detailRow = document.createElement('tr');
+            detailRow.style.display = 'none';
+            const detailCell = document.createElement('td');
+            detailCell.colSpan = 6;
+            const pre = document.createElement('pre');
+            pre.textContent = [
+                entry.query || '',
+                'Parameters: ' + JSON.stringify(entry.parameters, null, 2),
+                entry.plan_error ? 'Plan error: ' + entry.plan_error : 'Plan: ' + JSON.stringify(entry.plan, null, 2)
+            ].join('\n\n');
+            detailCell.appendChild(pre);
+            detailRow.appendChild(detailCell);
+
+            row.addEventListener('click', () => {
+                detailRow.style.display = detailRow.style.display === 'none' ? '' : 'none';
+            });
+            tbody.appendChild(row);
+            tbody.appendChild(detailRow);
+        });
+    };
+
+    if (refreshSlowQueriesBtn) {
+        refreshSlowQueriesBtn.addEventListener('click', loadSlowQueries);
+        loadSlowQueries();
+    }
 });
@@ -0,0 +1,68 @@
+# storage/__init__.py
+"""
+Repository layer. Routes and sync scripts call get_store() and never talk to
+a database directly. STORAGE_BACKEND selects the backend:
+
+    neo4j  (default) the Neo4j server configured by NEO4J_URI
+    sqlite           an embedded database file at SQLITE_PATH
+
+The ASGI app (asgi.py) reads through get_async_store(): the async Neo4j
+driver for neo4j, the sync store in worker threads for sqlite.
+"""
+import os
+import threading
+
+_store = None
+_store_lock = threading.Lock()
+_async_store = None
+
+
+def get_store():
+    """Returns the process-wide store, creating it on first use."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                backend = os.getenv("STORAGE_BACKEND", "neo4j").lower()
+                if backend == "neo4j":
+                    from storage.neo4j_store import Neo4jStore
+                    _store = Neo4jStore()
+                elif backend == "sqlite":
+                    from storage.sqlite_store import SQLiteStore
+                    _store = SQLiteStore(os.getenv("SQLITE_PATH", "knowledgetree.db"))
+                else:
+                    raise ValueError(f"Unknown STORAGE_BACKEND '{backend}'. Use 'neo4j' or 'sqlite'.")
+    return _store
+
+
+def close_store():
+    global _store
+    with _store_lock:
+        if _store is not None:
+            _store.close()
+        _store = None
+
+
+def async_store_for(store):
+    """The async counterpart of a sync store, reading the same database."""
+    from storage.neo4j_store import Neo4jStore
+    if isinstance(store, Neo4jStore):
+        from storage.neo4j_async import AsyncNeo4jStore
+        return AsyncNeo4jStore()
+    from storage.threaded import ThreadedStore
+    return ThreadedStore(store)
+
+
+def get_async_store():
+    """Returns the process-wide async store, creating it on first use. Call it on the event loop."""
+    global _async_store
+    if _async_store is None:
+        _async_store = async_store_for(get_store())
+    return _async_store
+
+
+async def close_async_store():
+    global _async_store
+    store, _async_store = _async_store, None
+    if store is not None:
+        await store.close()
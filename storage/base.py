@@ -0,0 +1,461 @@
+# storage/base.py
+"""
+The repository interface the routes and sync scripts are written against.
+Each backend implements every abstract method, or cannot be instantiated;
+tests/test_contract.py checks that they behave the same way.
+
+Nodes are returned as plain dicts. Flags that were never set on a node come
+back as None, as they do from Neo4j.
+
+Every write takes the next value of a global version counter and stamps it
+on each node whose own properties, files or child list changed (`version`)
+and on every ancestor of those nodes (`subtree_version`). Writes that change
+nothing leave the stamps alone, so re-syncing unchanged data keeps caches
+warm. The counter restarts when the store is reinitialized, so stamps also
+carry a random epoch chosen at that point.
+"""
+import os
+import hashlib
+from abc import ABC, abstractmethod
+
+ROOT_ID = 'root'
+ROOT_NAME = 'KnowledgeTree Root'
+ROOT_CONTENT = '# Welcome to KnowledgeTree'
+
+# Bounds on the walk below a folder's attached folders (see context_articles).
+CONTEXT_MAX_DEPTH = int(os.getenv("CONTEXT_MAX_DEPTH", 16))
+CONTEXT_MAX_ARTICLES = int(os.getenv("CONTEXT_MAX_ARTICLES", 10000))
+
+# Syncs whose read-only nodes sweep_unseen can reconcile: Contact.md files,
+# Datto assets and tickets.
+SYNC_SOURCES = ('freshservice', 'datto', 'tickets')
+
+
+def stamp_digest(epoch, parts):
+    """Folds an epoch and a list of version tuples into one short stamp string."""
+    digest = hashlib.sha1(repr(sorted(parts)).encode('utf-8')).hexdigest()[:16]
+    return f"{epoch}-{digest}"
+
+def _article(row, source):
+    return {'id': row['id'], 'name': row['name'], 'content': row['content'], 'version': row['version'],
+            'source_id': source['id'] if source else '', 'source_folder': source['name'] if source else ''}
+
+def path_stamp(path):
+    """The context stamp of a context_path result."""
+    return stamp_digest(path['epoch'], [(node['id'], node['block_version']) for node in path['nodes']])
+
+
+def context_walk(folder_id, excluded_ids, max_depth, max_articles):
+    """
+    TreeStore.context_articles as a generator that does no I/O: it yields
+    the node ids whose children_of rows it needs next, is sent those rows,
+    and returns the articles. Sync and async stores drive the same walk.
+    """
+    excluded = set(excluded_ids)
+    articles, seen, frontier = [], {folder_id}, {}
+    for child in sorted((yield [folder_id]), key=lambda c: (c['name'] or '', c['id'])):
+        if child['is_attached'] and child['id'] not in excluded:
+            frontier[child['id']] = child
+        elif child['is_attached'] or child['is_folder'] is not False:
+            continue
+        else:
+            articles.append(_article(child, None))
+        seen.add(child['id'])
+
+    for _ in range(max_depth):
+        if not frontier or len(articles) >= max_articles:
+            break
+        sources, frontier = frontier, {}
+        children = sorted((yield list(sources)), key=lambda c: (
+            sources[c['parent_id']]['name'] or '', sources[c['parent_id']]['id'], c['name'] or '', c['id']))
+        for child in children:
+            if child['id'] in seen:
+                continue
+            seen.add(child['id'])
+            source = sources[child['parent_id']]
+            frontier[child['id']] = source
+            if child['is_folder'] is False and len(articles) < max_articles:
+                articles.append(_article(child, source))
+    return articles
+
+
+class TreeStore(ABC):
+    context_max_depth = CONTEXT_MAX_DEPTH
+    context_max_articles = CONTEXT_MAX_ARTICLES
+
+    # --- Lifecycle ---
+    @abstractmethod
+    def init_schema(self):
+        """Creates whatever the backend needs and ensures the root node exists."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def reinitialize(self):
+        """Deletes everything and recreates the root node."""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    # --- Tree reads ---
+    @abstractmethod
+    def resolve_path(self, names):
+        """Returns the id of the node reached by following `names` from the root, or None."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def list_children(self, node_id):
+        """Direct children as {id, name, is_folder, is_attached, read_only}, folders first then by name."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def path_nodes(self, node_id):
+        """[{id, name}, ...] along the shortest path from the root to the node, or None if unreachable."""
+        raise NotImplementedError
+
+    def path_names(self, node_id):
+        nodes = self.path_nodes(node_id)
+        return [n['name'] for n in nodes] if nodes else None
+
+    @abstractmethod
+    def get_node(self, node_id):
+        """{id, name, content, is_folder, is_attached, read_only, files: [{id, filename}]} or None."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def search(self, query, start_node_id=ROOT_ID, limit=15):
+        """
+        Case-insensitive substring search over names and content below (and
+        including) the start node. Returns {id, name, is_folder, path_names}.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def descendant_ids(self, node_id):
+        """Ids of the node and everything below it; empty if it does not exist."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def search_documents(self, since_version=None):
+        """
+        Returns (epoch, version, documents): the store's epoch, the current
+        value of the version counter, and {id, name, content, is_folder} for
+        every node except the root stamped after since_version (every node
+        when None). Used to build and refresh the relevance index.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def structure_changes(self, since_version=None):
+        """
+        Returns (epoch, version, nodes) like search_documents, with {id, name,
+        is_folder, is_attached, read_only, children: [id, ...]} for every node,
+        the root included, stamped after since_version (every node when None).
+        Adding, moving or removing a child stamps the parent, so these rows are
+        all a copy of the hierarchy needs to stay current (see hierarchy.py).
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def file_names(self, node_id):
+        raise NotImplementedError
+
+    @abstractmethod
+    def file_names_by_node(self, node_ids):
+        """{node_id: [filename, ...]} for the given nodes; nodes without files are left out."""
+        raise NotImplementedError
+
+    # --- Version stamps ---
+    @abstractmethod
+    def node_stamp(self, node_id):
+        """
+        {stamp, read_only} for the node, or None. The stamp changes whenever
+        get_node's result for the node would.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def context_paths(self, node_ids):
+        """
+        {node_id: {epoch, nodes: [{id, name, block_version}]}} with each
+        node's root path, root first; unreachable nodes are left out. A path
+        node's block version is the newest stamp among itself, its direct
+        children and the subtrees of its attached folders: it rises whenever
+        the node's context block could change.
+        """
+        raise NotImplementedError
+
+    def context_path(self, node_id):
+        """context_paths for one node, or None if it is unreachable."""
+        return self.context_paths([node_id]).get(node_id)
+
+    def context_stamp(self, node_id):
+        """
+        A stamp that changes whenever the node's context export or attached
+        folder list would: any node on the root path, their direct children,
+        anything below their attached folders and the node's files. None if
+        the node is unreachable.
+        """
+        path = self.context_path(node_id)
+        return path_stamp(path) if path else None
+
+    # --- Context ---
+    @abstractmethod
+    def attached_folders_on_path(self, node_id):
+        """Attached folders hanging directly off any node on the root path, as {id, name}."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def children_of(self, node_ids):
+        """
+        Direct children of the given nodes as {parent_id, id, name, content,
+        version, is_folder, is_attached}; content is None for folders.
+        """
+        raise NotImplementedError
+
+    def context_articles(self, folder_id, excluded_ids=()):
+        """
+        The folder's own articles (source_id and source_folder '') plus every
+        article below its attached folders (source_id and source_folder are
+        the attached folder's id and name), as
+        {id, name, content, version, source_id, source_folder}.
+
+        Each article is listed once, however many paths lead to it: a direct
+        article is never repeated from an attached folder, and one reachable
+        from several attached folders belongs to the first to reach it,
+        breadth-first in name order. The walk visits every node once, goes at
+        most context_max_depth levels below the attached folders and stops
+        after context_max_articles articles (CONTEXT_MAX_DEPTH and
+        CONTEXT_MAX_ARTICLES by default).
+        """
+        walk = context_walk(folder_id, excluded_ids, self.context_max_depth, self.context_max_articles)
+        try:
+            node_ids = next(walk)
+            while True:
+                node_ids = walk.send(self.children_of(node_ids))
+        except StopIteration as done:
+            return done.value
+
+    # --- Materialized context blocks (see context_blocks.py) ---
+    @abstractmethod
+    def stored_blocks(self, folder_ids):
+        """{folder_id: {version, segments}} for the folders that have a stored block."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def save_blocks(self, blocks):
+        """
+        Stores blocks given as {folder_id, version, segments}, where each
+        segment names its source_id. The attached folders among the sources
+        are recorded as feeding the block. A block never replaces a stored one
+        with a newer version; blocks of missing folders are dropped.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def blocks_to_refresh(self, since_version):
+        """
+        Returns (version, {folder_id: block_version}): the current value of
+        the version counter, and the stored blocks that nodes stamped after
+        since_version feed and that are now out of date. With since_version
+        None only the current version is returned.
+        """
+        raise NotImplementedError
+
+    # --- Context deltas (see context_blocks.context_delta) ---
+    @abstractmethod
+    def current_version(self):
+        """The current value of the version counter."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def tombstones(self, folder_ids, since_version):
+        """
+        {folder_id: [article_id, ...]}: the articles that left the given
+        folders' context blocks, through a move or a delete, in writes stamped
+        after since_version. Writes that add an article to a block stamp the
+        article, so arrivals need no record.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def purge_tombstones(self, before_version):
+        """Forgets removals stamped before before_version."""
+        raise NotImplementedError
+
+    # --- Compressed content (see compression.py) ---
+    @abstractmethod
+    def content_dictionary(self):
+        """(hash, data) of the dictionary new ticket bodies are compressed with, or None."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def save_content_dictionary(self, dictionary_hash, data):
+        """Stores a trained dictionary and makes it the one tickets are compressed with."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def purge_content_blobs(self):
+        """
+        Deletes the compressed bodies no node refers to any more, which updates
+        and deletes leave behind. Returns how many were deleted.
+        """
+        raise NotImplementedError
+
+    # --- Tree writes ---
+    @abstractmethod
+    def create_node(self, node_id, parent_id, name, is_folder=False, is_attached=False):
+        raise NotImplementedError
+
+    @abstractmethod
+    def update_node(self, node_id, name=None, content=None):
+        raise NotImplementedError
+
+    @abstractmethod
+    def move_node(self, node_id, new_parent_id, old_parent_id=None):
+        """
+        Relinks the node, and with it its whole subtree, under new_parent_id.
+        It is unlinked from old_parent_id, or from every current parent when
+        that is None. Raises ValueError if the node is the root, a node is
+        missing, old_parent_id is not a parent, or the move would put the node
+        below itself.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def copy_node(self, node_id, new_parent_id, name=None):
+        """
+        Copies the node and its whole subtree, with their files, under
+        new_parent_id and returns the new id of the copied node. Each node is
+        copied once, even if it has several parents inside the subtree. The
+        copies are ordinary editable nodes: read_only is cleared and the sync
+        identity properties (user_email, freshservice_id,
+        freshservice_requester_id, datto_uid) are dropped, so a later sync
+        never mistakes a copy for its original. Raises ValueError if a node is
+        missing or new_parent_id is inside the subtree.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def apply_batch(self, ops):
+        """
+        Applies operations prepared by storage.batch.prepare_batch in one
+        transaction. On failure nothing is applied and ValueError names the
+        failing operation.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete_node(self, node_id):
+        """Deletes the node and everything below it."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def add_file(self, node_id, file_id, filename):
+        raise NotImplementedError
+
+    # --- Export / import ---
+    @abstractmethod
+    def export_user_items(self):
+        """
+        Every node reachable from the root through user-created (not read-only)
+        nodes only, as {path, content, is_folder, is_attached}.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def import_items(self, items):
+        """
+        Merges exported items in one transaction. Items must be sorted so
+        parents come first; raises ValueError when a parent folder is missing.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def bulk_load(self, nodes, rels):
+        """Creates nodes (property dicts with an 'id') and {parent, child} links. Used by the benchmarks."""
+        raise NotImplementedError
+
+    # --- Sync runs (see sync_runs.py) ---
+    # upsert_user, upsert_asset and upsert_ticket record their run_id on the
+    # read-only node they write, without stamping it.
+    @abstractmethod
+    def sweep_unseen(self, source, run_id, dry_run=False, batch_size=500):
+        """
+        Deletes, batch_size at a time, the read-only nodes of a SYNC_SOURCES
+        source that the run did not see. An unseen Freshservice contact takes
+        its user folder with it; devices linked there are unlinked, not
+        deleted. Returns {seen, unseen, deleted}. Nothing is deleted in a dry run, or when the run saw none of the
+        source's nodes.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def sync_batch(self):
+        """
+        Context manager under which every store write on this thread joins one
+        transaction, committed when the block exits and rolled back, whole,
+        when it raises. Nodes changed in the block are stamped once.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def sync_checkpoint(self, source):
+        """The checkpoint dict last saved for a SYNC_SOURCES source, or None."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def save_sync_checkpoint(self, source, checkpoint):
+        """
+        Saves a JSON-serializable checkpoint for the source, or clears it when
+        checkpoint is None. Inside sync_batch it commits with the batch.
+        """
+        raise NotImplementedError
+
+    # --- Freshservice sync ---
+    @abstractmethod
+    def ensure_companies_root(self):
+        raise NotImplementedError
+
+    @abstractmethod
+    def upsert_company(self, account_number, name, freshservice_id):
+        """Company folder under Companies, with its Users subfolder."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def upsert_user(self, account_number, user_name, user_email, content, freshservice_requester_id, run_id=None):
+        """User folder under the company's Users folder, with Contact.md and an attached Tickets folder."""
+        raise NotImplementedError
+
+    # --- Datto sync ---
+    @abstractmethod
+    def ensure_assets_folder(self, account_number):
+        raise NotImplementedError
+
+    @abstractmethod
+    def upsert_asset(self, account_number, datto_uid, name, content, run_id=None):
+        raise NotImplementedError
+
+    @abstractmethod
+    def company_users(self, company_id):
+        """User folders of a company as {name, email}."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def link_asset_to_user(self, user_email, datto_uid):
+        raise NotImplementedError
+
+    # --- Ticket sync ---
+    @abstractmethod
+    def latest_ticket_number(self):
+        """Highest synced ticket number, or None when no tickets are stored."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def user_email_for_requester(self, requester_id):
+        raise NotImplementedError
+
+    @abstractmethod
+    def upsert_ticket(self, user_email, node_id, filename, content, run_id=None):
+        """Ticket article in the user's attached Tickets folder."""
+        raise NotImplementedError
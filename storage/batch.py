@@ -0,0 +1,118 @@
+# storage/batch.py
+"""
+Validation and temporary-id resolution for /api/batch.
+
+A batch is an ordered list of operations:
+
+    {"op": "create", "parent_id": "...", "name": "...", "is_folder": false,
+     "is_attached": false, "content": "", "temp_id": "t1"}
+    {"op": "update", "id": "...", "name": "...", "content": "..."}
+    {"op": "move",   "id": "...", "parent_id": "...", "from_parent_id": "..."}
+    {"op": "delete", "id": "..."}
+
+A create may declare a `temp_id`; any later operation can refer to the new
+node as "$<temp_id>" wherever it takes an id. Ids are assigned here, before
+the store runs anything, so the whole batch can execute in one transaction
+and the response can map every temporary id to its real one.
+"""
+import os
+import uuid
+
+from storage.base import ROOT_ID
+
+MAX_BATCH_OPERATIONS = int(os.getenv("MAX_BATCH_OPERATIONS", 10000))
+
+
+def prepare_batch(operations):
+    """
+    Returns (ops, temp_ids): normalized operations with real ids, and the
+    mapping from temporary to real ids. Raises ValueError naming the first
+    invalid operation; nothing has been written at that point.
+    """
+    if not isinstance(operations, list) or not operations:
+        raise ValueError("'operations' must be a non-empty list.")
+    if len(operations) > MAX_BATCH_OPERATIONS:
+        raise ValueError(f"A batch may hold at most {MAX_BATCH_OPERATIONS} operations.")
+
+    temp_ids, ops = {}, []
+    for index, raw in enumerate(operations):
+        if not isinstance(raw, dict):
+            raise ValueError(f"Operation {index}: expected an object.")
+        kind = raw.get('op')
+
+        def ref(field, required=True):
+            value = raw.get(field)
+            if value is None:
+                if required:
+                    raise ValueError(f"Operation {index} ({kind}): '{field}' is required.")
+                return None
+            if isinstance(value, str) and value.startswith('$'):
+                if value[1:] not in temp_ids:
+                    raise ValueError(f"Operation {index} ({kind}): unknown temporary id '{value}'.")
+                return temp_ids[value[1:]]
+            return value
+
+        if kind == 'create':
+            if not raw.get('name'):
+                raise ValueError(f"Operation {index} (create): 'name' is required.")
+            op = {'op': 'create', 'id': str(uuid.uuid4()), 'parent_id': ref('parent_id'), 'name': raw['name'],
+                  'is_folder': bool(raw.get('is_folder', False)), 'content': raw.get('content') or ''}
+            # As with import, only folders can be attached.
+            op['is_attached'] = bool(raw.get('is_attached', False)) and op['is_folder']
+            temp_id = raw.get('temp_id')
+            if temp_id is not None:
+                if temp_id in temp_ids:
+                    raise ValueError(f"Operation {index} (create): temporary id '{temp_id}' is used twice.")
+                temp_ids[temp_id] = op['id']
+                op['temp_id'] = temp_id
+        elif kind == 'update':
+            op = {'op': 'update', 'id': ref('id'), 'name': raw.get('name'), 'content': raw.get('content')}
+            if op['name'] is None and op['content'] is None:
+                raise ValueError(f"Operation {index} (update): nothing to update.")
+        elif kind == 'move':
+            op = {'op': 'move', 'id': ref('id'), 'parent_id': ref('parent_id'),
+                  'from_parent_id': ref('from_parent_id', required=False)}
+        elif kind == 'delete':
+            op = {'op': 'delete', 'id': ref('id')}
+        else:
+            raise ValueError(f"Operation {index}: unknown op '{kind}'.")
+
+        if op['id'] == ROOT_ID and kind in ('move', 'delete'):
+            raise ValueError(f"Operation {index} ({kind}): the root cannot be {kind}d.")
+        op['index'] = index
+        ops.append(op)
+    return ops, temp_ids
+
+def chunk_operations(ops):
+    """
+    Splits prepared operations into runs of the same kind that a backend can
+    apply set-wise in order. A create whose parent is created in the current
+    run, or a second update of the same node, starts a new run, so no run
+    depends on the order of its own rows. Moves and deletes run one at a
+    time: each can change what the next sees.
+    """
+    chunks, current, seen = [], [], set()
+    for op in ops:
+        kind = op['op']
+        depends = op['parent_id'] if kind == 'create' else op['id']
+        breaks = (not current or current[0]['op'] != kind or kind in ('move', 'delete')
+                  or depends in seen)
+        if breaks:
+            if current:
+                chunks.append((current[0]['op'], current))
+            current, seen = [], set()
+        current.append(op)
+        seen.add(op['id'])
+    if current:
+        chunks.append((current[0]['op'], current))
+    return chunks
+
+def batch_results(ops):
+    """The per-operation results returned to the client, in request order."""
+    results = []
+    for op in ops:
+        result = {'op': op['op'], 'id': op['id']}
+        if 'temp_id' in op:
+            result['temp_id'] = op['temp_id']
+        results.append(result)
+    return results
@@ -0,0 +1,124 @@
+# storage/neo4j_async.py
+"""
+Read side of the Neo4j store on the async driver, for the ASGI app
+(asgi.py). It implements the TreeStore methods the async routes call, with
+the same queries and results as Neo4jStore, as coroutines: a request waiting
+on the database no longer holds a thread, and one request can run several
+queries at once. Everything else stays on the sync store.
+"""
+import time
+import metrics
+import compression
+import slow_queries
+import db
+from storage.base import ROOT_ID, context_walk, CONTEXT_MAX_DEPTH, CONTEXT_MAX_ARTICLES
+from storage.neo4j_store import (
+    READ_ACCESS, WRITE_ACCESS, single, capture_plan,
+    NODE_STAMP, GET_NODE, SEARCH, FILE_NAMES, CHILDREN_OF, CONTEXT_PATHS, STORED_BLOCKS, SAVE_BLOCKS,
+    CONTENT_DICTIONARY_DATA, search_params, node_stamp_result, node_result, context_path_results,
+    stored_block_results, block_rows,
+)
+
+
+async def run_query(runner, name, query, parameters=None, profile=True, **kwargs):
+    """neo4j_store.run_query on an async session or transaction."""
+    sampled = profile and metrics.should_profile()
+    start = time.perf_counter()
+    result = await runner.run("PROFILE " + query if sampled else query, parameters, **kwargs)
+    records = [record async for record in result]
+    summary = await result.consume()
+    elapsed = time.perf_counter() - start
+    metrics.record_query(name, elapsed, rows=len(records),
+                         db_hits=metrics.plan_db_hits(summary.profile) if sampled else None)
+    if slow_queries.enabled() and elapsed * 1000 >= slow_queries.SLOW_QUERY_MS:
+        # The plan is captured later on the profiler thread, with the sync driver.
+        slow_queries.report(name, elapsed, query, dict(parameters or {}, **kwargs), len(records), capture_plan)
+    return records
+
+
+class AsyncNeo4jStore:
+    context_max_depth = CONTEXT_MAX_DEPTH
+    context_max_articles = CONTEXT_MAX_ARTICLES
+
+    def __init__(self):
+        # Content dictionaries fetched by this store, by hash (see compression.py).
+        self._dictionaries = {}
+
+    def _session(self, access_mode=WRITE_ACCESS):
+        from neo4j import Bookmarks
+
+        driver = db.get_async_driver()
+        # Besides its own driver's bookmarks, wait for the writes this process
+        # committed through the sync driver, so a read after a Flask write sees it.
+        committed = db.committed_bookmarks()
+        return driver.session(default_access_mode=access_mode,
+                              bookmark_manager=driver.execute_query_bookmark_manager,
+                              bookmarks=Bookmarks.from_raw_values(committed) if committed else None)
+
+    async def _read_query(self, name, query, parameters=None, **params):
+        """Runs one query as a managed read transaction, retried on transient errors; returns its records."""
+        async with self._session(READ_ACCESS) as session:
+            return await session.execute_read(lambda tx: run_query(tx, name, query, parameters, **params))
+
+    async def _write_records(self, name, query, **params):
+        """A single write query that stamps nothing, as a managed write transaction; returns its records."""
+        async with self._session() as session:
+            return await session.execute_write(lambda tx: run_query(tx, name, query, **params))
+
+    async def _inflate(self, record):
+        """Neo4jStore._inflate, fetching the content dictionary without blocking the loop."""
+        data = dict(record)
+        codec, blob = data.pop('codec'), data.pop('data')
+        if data['content'] is None and codec is not None:
+            dictionary_hash = codec.partition(':')[2]
+            if dictionary_hash and dictionary_hash not in self._dictionaries:
+                found = single(await self._read_query("content_dictionary_data", CONTENT_DICTIONARY_DATA,
+                                                      hash=dictionary_hash))
+                self._dictionaries[dictionary_hash] = found['data'] if found else None
+            data['content'] = compression.decompress(codec, blob, self._dictionaries.get)
+        return data
+
+    async def close(self):
+        await db.close_async_driver()
+
+    # --- Reads ---
+    async def node_stamp(self, node_id):
+        return node_stamp_result(single(await self._read_query("node_stamp", NODE_STAMP, node_id=node_id)))
+
+    async def get_node(self, node_id):
+        result = single(await self._read_query("get_node", GET_NODE, node_id=node_id))
+        return node_result(await self._inflate(result)) if result else None
+
+    async def search(self, query, start_node_id=ROOT_ID, limit=15):
+        result = await self._read_query("search", SEARCH, search_params(query, start_node_id, limit))
+        return [dict(record) for record in result]
+
+    async def file_names(self, node_id):
+        result = await self._read_query("file_names", FILE_NAMES, node_id=node_id)
+        return [record['filename'] for record in result if record['filename'] is not None]
+
+    async def children_of(self, node_ids):
+        result = await self._read_query("children_of", CHILDREN_OF, ids=list(node_ids))
+        return [await self._inflate(record) for record in result]
+
+    async def context_articles(self, folder_id, excluded_ids=()):
+        walk = context_walk(folder_id, excluded_ids, self.context_max_depth, self.context_max_articles)
+        try:
+            node_ids = next(walk)
+            while True:
+                node_ids = walk.send(await self.children_of(node_ids))
+        except StopIteration as done:
+            return done.value
+
+    async def context_paths(self, node_ids):
+        return context_path_results(await self._read_query("context_paths", CONTEXT_PATHS,
+                                                           ids=list(dict.fromkeys(node_ids))))
+
+    async def context_path(self, node_id):
+        return (await self.context_paths([node_id])).get(node_id)
+
+    async def stored_blocks(self, folder_ids):
+        return stored_block_results(await self._read_query("stored_blocks", STORED_BLOCKS, ids=list(folder_ids)))
+
+    async def save_blocks(self, blocks):
+        await self._write_records("save_blocks", SAVE_BLOCKS, rows=block_rows(blocks))
@@ -0,0 +1,1179 @@
+# storage/neo4j_store.py
+import json
+import time
+import uuid
+import threading
+from contextlib import contextmanager
+import metrics
+import compression
+import slow_queries
+from db import get_driver, close_driver
+from storage.base import TreeStore, ROOT_ID, SYNC_SOURCES
+from storage.batch import chunk_operations
+
+# neo4j.READ_ACCESS and neo4j.WRITE_ACCESS, without importing the driver at startup.
+READ_ACCESS = "READ"
+WRITE_ACCESS = "WRITE"
+
+# The read-only nodes each sync owns, for sweep_unseen.
+SYNC_SOURCE_FILTERS = {
+    'freshservice': "n.id STARTS WITH 'contact_for_'",
+    'datto': "n.datto_uid IS NOT NULL",
+    'tickets': "n.id STARTS WITH 'ticket_'",
+}
+
+
+def run_query(runner, name, query, parameters=None, profile=True, **kwargs):
+    """
+    Runs one Cypher query on a session or transaction and returns its records
+    as a list, recording the query's name, duration, rows and (for sampled
+    PROFILE executions) database hits.
+    """
+    sampled = profile and metrics.should_profile()
+    start = time.perf_counter()
+    result = runner.run("PROFILE " + query if sampled else query, parameters, **kwargs)
+    records = list(result)
+    summary = result.consume()
+    elapsed = time.perf_counter() - start
+    metrics.record_query(name, elapsed, rows=len(records),
+                         db_hits=metrics.plan_db_hits(summary.profile) if sampled else None)
+    if slow_queries.enabled() and elapsed * 1000 >= slow_queries.SLOW_QUERY_MS:
+        slow_queries.report(name, elapsed, query, dict(parameters or {}, **kwargs), len(records), capture_plan)
+    return records
+
+def capture_plan(query, parameters, profile):
+    """Re-runs a query on its own session under PROFILE (or EXPLAIN) and returns the plan."""
+    with get_driver().session() as session:
+        summary = session.run(("PROFILE " if profile else "EXPLAIN ") + query, parameters).consume()
+    return summary.profile if profile else summary.plan
+
+def single(records):
+    return records[0] if records else None
+
+
+def next_version(tx):
+    """Takes the next value of the global version counter inside the transaction."""
+    return single(run_query(tx, "next_version", """
+        MERGE (c:VersionCounter {id: 'global'})
+        ON CREATE SET c.value = 0, c.epoch = left(replace(randomUUID(), '-', ''), 12)
+        SET c.value = c.value + 1
+        RETURN c.value AS version
+    """))['version']
+
+def touch(tx, node_ids, version):
+    """Stamps the nodes with `version`, and them and their ancestors' subtree_version."""
+    run_query(tx, "touch", """
+        UNWIND $ids AS node_id
+        MATCH (n:ContextItem {id: node_id})
+        SET n.version = $version
+        WITH DISTINCT n
+        MATCH (a:ContextItem)-[:PARENT_OF*0..]->(n)
+        WITH DISTINCT a
+        SET a.subtree_version = $version
+    """, ids=list(node_ids), version=version)
+
+
+def block_version_clause(carry=()):
+    """
+    Cypher that continues a query which has bound folders as `f`, yielding
+    `f, block_version` plus the `carry` variables: the newest stamp among the
+    folder, its children and its attached folders' subtrees.
+    """
+    keep = "".join(f", {name}" for name in carry)
+    return f"""
+        OPTIONAL MATCH (f)-[:PARENT_OF]->(c:ContextItem)
+        WITH f{keep}, max(c.version) AS child_version,
+             max(CASE WHEN c.is_attached THEN c.subtree_version END) AS attached_version
+        WITH f{keep}, reduce(m = 0, v IN [f.version, child_version, attached_version] |
+                             CASE WHEN coalesce(v, 0) > m THEN v ELSE m END) AS block_version
+    """
+
+
+# --- Read queries shared with the async store (storage/neo4j_async.py) ---
+NODE_STAMP = """
+    MATCH (n:ContextItem {id: $node_id})
+    OPTIONAL MATCH (c:VersionCounter {id: 'global'})
+    RETURN coalesce(n.version, 0) AS version, n.read_only AS read_only, c.epoch AS epoch
+"""
+
+GET_NODE = """
+    MATCH (n:ContextItem {id: $node_id})
+    OPTIONAL MATCH (b:ContentBlob {hash: n.content_ref})
+    OPTIONAL MATCH (n)-[:HAS_FILE]->(f:File)
+    RETURN n.id AS id, n.name AS name, n.content AS content, n.is_folder AS is_folder,
+           n.is_attached as is_attached, n.read_only as read_only,
+           b.codec AS codec, b.data AS data,
+           collect({id: f.id, filename: f.filename}) AS files
+"""
+
+SEARCH = """
+    MATCH (startNode:ContextItem {id: $start_node_id})-[:PARENT_OF*0..]->(node)
+    WHERE toLower(node.name) CONTAINS toLower($query) OR toLower(node.content) CONTAINS toLower($query)
+       OR (node.search_terms IS NOT NULL AND size($words) > 0
+           AND all(word IN $words WHERE any(term IN node.search_terms WHERE term CONTAINS word)))
+    WITH DISTINCT node
+    MATCH p = (:ContextItem {id: 'root'})-[:PARENT_OF*..]->(node)
+    RETURN node.id as id,
+           node.name as name,
+           node.is_folder as is_folder,
+           [n IN nodes(p) | n.name] AS path_names
+    LIMIT $limit
+"""
+
+def search_params(query, start_node_id, limit):
+    """SEARCH parameters. A compressed body matches when each query word is part of one of its search_terms."""
+    return {'start_node_id': start_node_id, 'query': query, 'words': compression.search_terms(query), 'limit': limit}
+
+FILE_NAMES = """
+    OPTIONAL MATCH (:ContextItem {id: $node_id})-[:HAS_FILE]->(f:File)
+    RETURN f.filename as filename
+"""
+
+CHILDREN_OF = """
+    UNWIND $ids AS parent_id
+    MATCH (:ContextItem {id: parent_id})-[:PARENT_OF]->(c:ContextItem)
+    OPTIONAL MATCH (b:ContentBlob {hash: c.content_ref})
+    WHERE NOT c.is_folder
+    RETURN parent_id, c.id AS id, c.name AS name,
+           CASE WHEN c.is_folder THEN null ELSE c.content END AS content,
+           coalesce(c.version, 0) AS version, c.is_folder AS is_folder, c.is_attached AS is_attached,
+           b.codec AS codec, b.data AS data
+"""
+
+CONTEXT_PATHS = """
+    UNWIND $ids AS node_id
+    CALL {
+        WITH node_id
+        MATCH (r:ContextItem {id: 'root'})
+        WHERE node_id = 'root'
+        RETURN [r] AS path
+        UNION
+        WITH node_id
+        MATCH (target:ContextItem {id: node_id})
+        WHERE node_id <> 'root'
+        MATCH p = shortestPath((:ContextItem {id: 'root'})-[:PARENT_OF*..]->(target))
+        RETURN nodes(p) AS path
+    }
+    UNWIND range(0, size(path) - 1) AS depth
+    WITH node_id, path[depth] AS f, depth
+""" + block_version_clause(carry=['node_id', 'depth']) + """
+    OPTIONAL MATCH (vc:VersionCounter {id: 'global'})
+    RETURN node_id, vc.epoch AS epoch,
+           collect({depth: depth, id: f.id, name: f.name, block_version: block_version}) AS nodes
+"""
+
+STORED_BLOCKS = """
+    UNWIND $ids AS folder_id
+    MATCH (f:ContextItem {id: folder_id})
+    WHERE f.context_block IS NOT NULL
+    RETURN f.id AS id, f.context_block_version AS version, f.context_block AS segments
+"""
+
+SAVE_BLOCKS = """
+    UNWIND $rows AS row
+    MATCH (f:ContextItem {id: row.folder_id})
+    WHERE coalesce(f.context_block_version, -1) <= row.version
+    SET f.context_block_version = row.version, f.context_block = row.segments
+    WITH f, row
+    OPTIONAL MATCH (:ContextItem)-[old:FEEDS_CONTEXT]->(f)
+    DELETE old
+    WITH DISTINCT f, row
+    UNWIND row.sources AS source_id
+    MATCH (source:ContextItem {id: source_id})
+    MERGE (source)-[:FEEDS_CONTEXT]->(f)
+"""
+
+CONTENT_DICTIONARY_DATA = "MATCH (b:ContentBlob {hash: $hash}) RETURN b.data AS data"
+
+def node_stamp_result(record):
+    if record is None:
+        return None
+    return {'stamp': f"{record['epoch']}-{record['version']}", 'read_only': bool(record['read_only'])}
+
+def node_result(data):
+    """A GET_NODE row, already inflated, without the null file OPTIONAL MATCH yields."""
+    data['files'] = [f for f in data.get('files', []) if f['id'] is not None]
+    return data
+
+def context_path_results(records):
+    paths = {}
+    for record in records:
+        nodes = sorted(record['nodes'], key=lambda node: node['depth'])
+        paths[record['node_id']] = {'epoch': record['epoch'], 'nodes': [
+            {'id': n['id'], 'name': n['name'], 'block_version': n['block_version']} for n in nodes]}
+    return paths
+
+def stored_block_results(records):
+    return {r['id']: {'version': r['version'], 'segments': json.loads(r['segments'])} for r in records}
+
+def block_rows(blocks):
+    """SAVE_BLOCKS rows for blocks given as save_blocks takes them."""
+    return [{'folder_id': block['folder_id'], 'version': block['version'],
+             'segments': json.dumps(block['segments']),
+             'sources': [segment['source_id'] for segment in block['segments'] if segment['source_id']]}
+            for block in blocks]
+
+
+# --- Node writes shared by the single-node methods and apply_batch ---
+def create_nodes(tx, ops):
+    """Creates nodes set-wise. Returns (ids created, ids touched); ops whose parent is missing are skipped."""
+    records = run_query(tx, "create_nodes", """
+        UNWIND $ops AS op
+        MATCH (parent:ContextItem {id: op.parent_id})
+        CREATE (child:ContextItem {
+            id: op.id,
+            name: op.name,
+            is_folder: op.is_folder,
+            content: op.content,
+            is_attached: op.is_attached,
+            read_only: false
+        })
+        CREATE (parent)-[:PARENT_OF]->(child)
+        RETURN child.id AS id, [parent.id, child.id] AS touched
+    """, ops=[{k: op[k] for k in ('id', 'parent_id', 'name', 'is_folder', 'is_attached', 'content')} for op in ops])
+    return {r['id'] for r in records}, [node_id for r in records for node_id in r['touched']]
+
+def update_nodes(tx, ops):
+    """Sets name and/or content set-wise. Returns (ids found, ids changed)."""
+    records = run_query(tx, "update_nodes", """
+        UNWIND $ops AS op
+        MATCH (n:ContextItem {id: op.id})
+        WITH n, op, (op.content IS NOT NULL AND coalesce(n.content <> op.content, true))
+                    OR (op.name IS NOT NULL AND coalesce(n.name <> op.name, true)) AS changed
+        SET n.content = coalesce(op.content, n.content), n.name = coalesce(op.name, n.name),
+            n.content_ref = CASE WHEN op.content IS NULL THEN n.content_ref END,
+            n.content_size = CASE WHEN op.content IS NULL THEN n.content_size END,
+            n.search_terms = CASE WHEN op.content IS NULL THEN n.search_terms END
+        RETURN n.id AS id, changed
+    """, ops=[{k: op.get(k) for k in ('id', 'name', 'content')} for op in ops])
+    return {r['id'] for r in records}, [r['id'] for r in records if r['changed']]
+
+def content_params(content, dictionary=None):
+    """
+    content, content_ref and content_size for a synced body, plus the blobs
+    store_blobs has to write first when it is large enough to compress.
+    A compressed body also keeps its search_terms, which substring search
+    matches since Cypher cannot read the blob.
+    """
+    if not compression.should_compress(content):
+        return {'content': content, 'content_ref': None, 'content_size': None, 'search_terms': None, 'blobs': []}
+    digest = compression.content_hash(content)
+    codec, data = compression.compress(content, dictionary)
+    blobs = [{'hash': digest, 'codec': codec, 'data': data}]
+    if dictionary:
+        blobs.append({'hash': dictionary[0], 'codec': compression.DICTIONARY_CODEC, 'data': dictionary[1]})
+    return {'content': None, 'content_ref': digest, 'content_size': len(content.encode('utf-8')),
+            'search_terms': compression.search_terms(content, compression.CONTENT_SEARCH_TERMS), 'blobs': blobs}
+
+def store_blobs(tx, blobs):
+    if blobs:
+        run_query(tx, "store_content_blobs", """
+            UNWIND $blobs AS blob
+            MERGE (b:ContentBlob {hash: blob.hash})
+            ON CREATE SET b.codec = blob.codec, b.data = blob.data
+        """, blobs=blobs)
+
+def block_memberships(tx, node_id):
+    """{(article_id, folder_id)} for every context block an article in the node's subtree appears in."""
+    records = run_query(tx, "block_memberships", """
+        MATCH (:ContextItem {id: $id})-[:PARENT_OF*0..]->(a:ContextItem)
+        WHERE NOT a.is_folder
+        WITH DISTINCT a
+        CALL {
+            WITH a
+            MATCH (f:ContextItem)-[:PARENT_OF]->(a)
+            WHERE a.is_attached IS NULL OR a.is_attached = false
+            RETURN f
+            UNION
+            WITH a
+            MATCH (f:ContextItem)-[:PARENT_OF]->(:ContextItem {is_attached: true})-[:PARENT_OF*..]->(a)
+            RETURN f
+        }
+        RETURN a.id AS id, collect(DISTINCT f.id) AS folders
+    """, id=node_id)
+    return {(r['id'], folder_id) for r in records for folder_id in r['folders']}
+
+def record_tombstones(tx, removed, version):
+    """Records articles leaving context blocks, as (article_id, folder_id) pairs, for context deltas."""
+    if removed:
+        run_query(tx, "record_tombstones", """
+            UNWIND $rows AS row
+            CREATE (:Tombstone {node_id: row.node_id, folder_id: row.folder_id, version: $version})
+        """, rows=[{'node_id': node_id, 'folder_id': folder_id} for node_id, folder_id in removed], version=version)
+
+def move_subtree(tx, node_id, new_parent_id, old_parent_id=None):
+    """
+    Relinks one node under a new parent and stamps what changed itself, with
+    tombstones for the articles that left context blocks. Returns no ids for
+    _write to touch; raises ValueError if it cannot move.
+    """
+    if node_id == ROOT_ID:
+        raise ValueError("The root cannot be moved.")
+    before = block_memberships(tx, node_id)
+    # Everything below the node may now appear in new context blocks, so it is touched too.
+    record = single(run_query(tx, "move_node", """
+        MATCH (n:ContextItem {id: $id})
+        MATCH (target:ContextItem {id: $parent_id})
+        WHERE NOT EXISTS { (n)-[:PARENT_OF*0..]->(target) }
+        OPTIONAL MATCH (old:ContextItem)-[r:PARENT_OF]->(n)
+        WHERE old <> target AND ($from_parent_id IS NULL OR old.id = $from_parent_id)
+        WITH n, target, collect(old.id) AS old_parents, collect(r) AS rels
+        WHERE $from_parent_id IS NULL OR $from_parent_id = $parent_id OR size(rels) > 0
+        FOREACH (r IN rels | DELETE r)
+        MERGE (target)-[:PARENT_OF]->(n)
+        RETURN old_parents + [target.id] + [(n)-[:PARENT_OF*0..]->(d:ContextItem) | d.id] AS touched
+    """, id=node_id, parent_id=new_parent_id, from_parent_id=old_parent_id))
+    if record is None:
+        raise ValueError(f"Cannot move '{node_id}' under '{new_parent_id}': a node is missing, "
+                         f"'{old_parent_id}' is not its parent, or the move would put it below itself.")
+    version = next_version(tx)
+    record_tombstones(tx, before - block_memberships(tx, node_id), version)
+    touch(tx, set(record['touched']), version)
+    return []
+
+def copy_subtree(tx, node_id, new_parent_id, name=None, batch_size=1000):
+    """
+    Clones the node's subtree, with its PARENT_OF and HAS_FILE relationships,
+    under new_parent_id. The subtree is read once and written back in UNWIND
+    batches. Returns the new id of the copied node; raises ValueError if it
+    cannot copy.
+    """
+    nodes = run_query(tx, "copy_read_subtree", """
+        MATCH (src:ContextItem {id: $id})
+        MATCH (target:ContextItem {id: $parent_id})
+        WHERE NOT EXISTS { (src)-[:PARENT_OF*0..]->(target) }
+        MATCH (src)-[:PARENT_OF*0..]->(n:ContextItem)
+        WITH DISTINCT n
+        RETURN n.id AS id, [(n)-[:PARENT_OF]->(c:ContextItem) | c.id] AS children,
+               [(n)-[:HAS_FILE]->(f:File) | f.filename] AS files
+    """, id=node_id, parent_id=new_parent_id)
+    if not nodes:
+        raise ValueError(f"Cannot copy '{node_id}' under '{new_parent_id}': a node is missing, "
+                         f"or the target is inside the subtree being copied.")
+
+    new_ids = {record['id']: str(uuid.uuid4()) for record in nodes}
+    version = next_version(tx)
+    node_rows = [{'old_id': old_id, 'new_id': new_id, 'name': name if old_id == node_id else None}
+                 for old_id, new_id in new_ids.items()]
+    edge_rows = [{'parent': new_ids[r['id']], 'child': new_ids[child]} for r in nodes for child in r['children']]
+    file_rows = [{'node_id': new_ids[r['id']], 'id': str(uuid.uuid4()), 'filename': filename}
+                 for r in nodes for filename in r['files']]
+    for query_name, query, rows in (
+        ("copy_nodes", """
+            UNWIND $rows AS row
+            MATCH (n:ContextItem {id: row.old_id})
+            CREATE (:ContextItem {
+                id: row.new_id,
+                name: coalesce(row.name, n.name),
+                content: n.content,
+                content_ref: n.content_ref,
+                content_size: n.content_size,
+                search_terms: n.search_terms,
+                is_folder: n.is_folder,
+                is_attached: n.is_attached,
+                read_only: false,
+                version: $version,
+                subtree_version: $version
+            })
+        """, node_rows),
+        ("copy_edges", """
+            UNWIND $rows AS row
+            MATCH (p:ContextItem {id: row.parent})
+            MATCH (c:ContextItem {id: row.child})
+            CREATE (p)-[:PARENT_OF]->(c)
+        """, edge_rows),
+        ("copy_files", """
+            UNWIND $rows AS row
+            MATCH (n:ContextItem {id: row.node_id})
+            CREATE (f:File {id: row.id, filename: row.filename})
+            CREATE (n)-[:HAS_FILE]->(f)
+        """, file_rows),
+    ):
+        for start in range(0, len(rows), batch_size):
+            run_query(tx, query_name, query, rows=rows[start:start + batch_size], version=version)
+
+    run_query(tx, "copy_link", """
+        MATCH (target:ContextItem {id: $parent_id})
+        MATCH (copy:ContextItem {id: $copy_id})
+        CREATE (target)-[:PARENT_OF]->(copy)
+    """, parent_id=new_parent_id, copy_id=new_ids[node_id])
+    # The copies already carry the version; only the target and its ancestors change.
+    touch(tx, [new_parent_id, new_ids[node_id]], version)
+    return new_ids[node_id]
+
+def delete_subtree(tx, node_id):
+    """
+    Deletes the node and everything below it, stamping the surviving parents
+    and recording tombstones itself. Returns no ids for _write to touch, or
+    None if the node did not exist.
+    """
+    before = block_memberships(tx, node_id)
+    # Surviving parents (including other parents of multi-parent nodes) lose a child.
+    record = single(run_query(tx, "delete_node", """
+        MATCH (n:ContextItem {id: $id})
+        OPTIONAL MATCH (n)-[:PARENT_OF*0..]->(child)
+        WITH collect(DISTINCT child) AS doomed
+        UNWIND doomed AS d
+        OPTIONAL MATCH (p:ContextItem)-[:PARENT_OF]->(d)
+        WHERE NOT p IN doomed
+        WITH doomed, collect(DISTINCT p.id) AS touched
+        WITH doomed, touched, [d IN doomed | d.id] AS doomed_ids
+        FOREACH (d IN doomed | DETACH DELETE d)
+        RETURN touched, doomed_ids
+    """, id=node_id))
+    if record is None:
+        return None
+    version = next_version(tx)
+    # Articles leave the blocks of surviving folders; doomed folders' blocks go with them.
+    doomed = set(record['doomed_ids'])
+    record_tombstones(tx, {(a, f) for a, f in before if f not in doomed}, version)
+    touch(tx, record['touched'], version)
+    return []
+
+def sweep_target(tx, source, node_id):
+    """
+    The node sweep_unseen deletes for an unseen one. A contact takes its user
+    folder along; devices linked into that folder are unlinked first, so they
+    stay in their Assets folder.
+    """
+    if source != 'freshservice':
+        return node_id
+    record = single(run_query(tx, "sweep_user_folder", """
+        MATCH (u:ContextItem)-[:PARENT_OF]->(c:ContextItem {id: $id})
+        WHERE u.id = c.user_email AND u.is_folder = true
+        OPTIONAL MATCH (u)-[r:PARENT_OF]->(shared:ContextItem)<-[:PARENT_OF]-(other:ContextItem)
+        WHERE other <> u
+        WITH u, collect(DISTINCT r) AS links, collect(DISTINCT shared.id) AS unlinked
+        FOREACH (r IN links | DELETE r)
+        RETURN u.id AS id, unlinked
+    """, id=node_id))
+    if record is None:
+        return node_id
+    if record['unlinked']:
+        touch(tx, record['unlinked'], next_version(tx))
+    return record['id']
+
+
+def ensure_root_exists(tx):
+    run_query(tx, "ensure_root", """
+        MERGE (r:ContextItem {id: 'root', name: 'KnowledgeTree Root'})
+        ON CREATE SET r.content = '# Welcome to KnowledgeTree', r.is_folder = true, r.is_attached = false,
+                      r.version = 0, r.subtree_version = 0
+        MERGE (c:VersionCounter {id: 'global'})
+        ON CREATE SET c.value = 0, c.epoch = left(replace(randomUUID(), '-', ''), 12)
+    """)
+
+def prime_database_schema(tx):
+    """
+    Creates and immediately deletes a dummy file node and relationship.
+    This "primes" the database with the necessary labels and relationship types,
+    preventing "UnknownLabelWarning" and "UnknownRelationshipTypeWarning"
+    on a fresh database.
+    """
+    run_query(tx, "prime_schema", """
+        MERGE (dummy_parent:ContextItem {id: 'schema_primer_parent'})
+        CREATE (dummy_file:File {id: 'schema_primer_file', filename: 'dummy.txt'})
+        CREATE (dummy_parent)-[:HAS_FILE]->(dummy_file)
+        DETACH DELETE dummy_parent, dummy_file
+    """)
+
+
+class Neo4jStore(TreeStore):
+    def __init__(self):
+        self._local = threading.local()
+
+    def _session(self, access_mode=WRITE_ACCESS):
+        # Every session shares the driver's bookmarks, so a read always sees
+        # the writes this process committed before it, on any cluster member.
+        driver = get_driver()
+        return driver.session(default_access_mode=access_mode,
+                              bookmark_manager=driver.execute_query_bookmark_manager)
+
+    def _read(self, work):
+        """
+        Runs work(tx) as a managed read transaction and returns its result.
+        A routing driver may send it to a read replica; transient errors are
+        retried, so work must not have effects outside tx.
+        """
+        with self._session(READ_ACCESS) as session:
+            return session.execute_read(work)
+
+    def _read_query(self, name, query, parameters=None, **params):
+        """_read for a single query; returns its records."""
+        return self._read(lambda tx: run_query(tx, name, query, parameters, **params))
+
+    def _write(self, work):
+        """
+        Runs work(tx) as one managed write transaction, retried as a whole on
+        transient errors. work returns the ids of the nodes it changed; when
+        there are any they are stamped with a new version before the
+        transaction commits, so writes that change nothing never take the
+        version counter's lock. Inside sync_batch, work runs in the batch's
+        transaction and its ids are stamped when the batch commits.
+        """
+        batch = getattr(self._local, 'batch', None)
+        if batch is not None:
+            tx, touched = batch
+            touched.update(work(tx) or ())
+            return
+
+        def transaction(tx):
+            touched = set(work(tx) or ())
+            touched.discard(None)
+            if touched:
+                touch(tx, touched, next_version(tx))
+
+        with self._session() as session:
+            session.execute_write(transaction)
+
+    def _write_query(self, name, query, blobs=(), **params):
+        """
+        _write for a single query that returns a `touched` list per row. The
+        compressed bodies in `blobs` are stored first (see content_params).
+        """
+        def work(tx):
+            store_blobs(tx, list(blobs))
+            return [node_id for record in run_query(tx, name, query, **params) for node_id in record['touched']]
+
+        self._write(work)
+
+    def _write_records(self, name, query, **params):
+        """_write for a single query that stamps nothing; returns its records."""
+        records = []
+
+        def work(tx):
+            # Replaced, not extended, when the transaction is retried.
+            records[:] = run_query(tx, name, query, **params)
+
+        self._write(work)
+        return records
+
+    def _inflate(self, record):
+        """The record as a dict, its content read from the blob in `codec` and `data` when it has one."""
+        data = dict(record)
+        codec, blob = data.pop('codec'), data.pop('data')
+        if data['content'] is None and codec is not None:
+            data['content'] = compression.decompress(codec, blob, self._dictionary_data)
+        return data
+
+    def _dictionary_data(self, dictionary_hash):
+        record = single(self._read_query("content_dictionary_data", CONTENT_DICTIONARY_DATA, hash=dictionary_hash))
+        return record['data'] if record else None
+
+    # --- Lifecycle ---
+    def init_schema(self):
+        with self._session() as session:
+            # Every lookup is by id; without an index each one is a label scan.
+            run_query(session, "create_index", "CREATE INDEX context_item_id IF NOT EXISTS FOR (n:ContextItem) ON (n.id)",
+                      profile=False)
+            # The context block refresher looks up nodes stamped since its last pass.
+            run_query(session, "create_index", "CREATE INDEX context_item_version IF NOT EXISTS FOR (n:ContextItem) ON (n.version)",
+                      profile=False)
+            # Context deltas look tombstones up by folder; the refresher purges them by version.
+            run_query(session, "create_index", "CREATE INDEX tombstone_folder IF NOT EXISTS FOR (t:Tombstone) ON (t.folder_id)",
+                      profile=False)
+            run_query(session, "create_index", "CREATE INDEX tombstone_version IF NOT EXISTS FOR (t:Tombstone) ON (t.version)",
+                      profile=False)
+            # Reads fetch compressed bodies by hash; purges look for nodes still referring to one.
+            run_query(session, "create_index", "CREATE INDEX content_blob_hash IF NOT EXISTS FOR (b:ContentBlob) ON (b.hash)",
+                      profile=False)
+            run_query(session, "create_index",
+                      "CREATE INDEX context_item_content_ref IF NOT EXISTS FOR (n:ContextItem) ON (n.content_ref)",
+                      profile=False)
+            session.execute_write(ensure_root_exists)
+            session.execute_write(prime_database_schema)
+
+    def reinitialize(self):
+        def work(tx):
+            # Also deletes the version counter, so the next one starts a new epoch.
+            run_query(tx, "reinitialize", "MATCH (n) DETACH DELETE n")
+            ensure_root_exists(tx)
+
+        self._write(work)
+
+    def close(self):
+        close_driver()
+
+    # --- Tree reads ---
+    def resolve_path(self, names):
+        query = "MATCH (n0:ContextItem {id: 'root'})"
+        match_clauses, where_clauses, params = [], [], {}
+        for i, name in enumerate(names):
+            prev_node, curr_node = f"n{i}", f"n{i+1}"
+            param_name = f"part_{i}"
+            match_clauses.append(f"MATCH ({prev_node})-[:PARENT_OF]->({curr_node})")
+            where_clauses.append(f"{curr_node}.name = ${param_name}")
+            params[param_name] = name
+
+        full_query = "\n".join([query] + match_clauses) + ("\nWHERE " + " AND ".join(where_clauses) if where_clauses else "") + f"\nRETURN n{len(names)}.id as id"
+
+        result = single(self._read_query("resolve_path", full_query, params))
+        return result['id'] if result else None
+
+    def list_children(self, node_id):
+        result = self._read_query("list_children", """
+            MATCH (:ContextItem {id: $parent_id})-[:PARENT_OF]->(child)
+            RETURN DISTINCT child.id AS id, child.name AS name, child.is_folder AS is_folder,
+                   child.is_attached as is_attached, child.read_only as read_only
+            ORDER BY child.is_folder DESC, child.name
+        """, parent_id=node_id)
+        return [dict(record) for record in result]
+
+    def path_nodes(self, node_id):
+        if node_id == ROOT_ID:
+            result = single(self._read_query("path_nodes_root",
+                                             "MATCH (r:ContextItem {id: 'root'}) RETURN [{id: r.id, name: r.name}] AS path_nodes"))
+        else:
+            result = single(self._read_query("path_nodes", """
+                MATCH p = shortestPath((:ContextItem {id: 'root'})-[:PARENT_OF*..]->(:ContextItem {id: $node_id}))
+                RETURN [n IN nodes(p) | {id: n.id, name: n.name}] AS path_nodes
+            """, node_id=node_id))
+        return result['path_nodes'] if result else None
+
+    def get_node(self, node_id):
+        result = single(self._read_query("get_node", GET_NODE, node_id=node_id))
+        return node_result(self._inflate(result)) if result else None
+
+    def search(self, query, start_node_id=ROOT_ID, limit=15):
+        result = self._read_query("search", SEARCH, search_params(query, start_node_id, limit))
+        return [dict(record) for record in result]
+
+    def file_names(self, node_id):
+        result = self._read_query("file_names", FILE_NAMES, node_id=node_id)
+        return [record['filename'] for record in result if record['filename'] is not None]
+
+    def descendant_ids(self, node_id):
+        result = self._read_query("descendant_ids", """
+            MATCH (:ContextItem {id: $node_id})-[:PARENT_OF*0..]->(d:ContextItem)
+            RETURN DISTINCT d.id AS id
+        """, node_id=node_id)
+        return [r['id'] for r in result]
+
+    def search_documents(self, since_version=None):
+        def work(tx):
+            # One read transaction, so the counter matches the documents.
+            counter = single(run_query(tx, "search_counter", """
+                OPTIONAL MATCH (c:VersionCounter {id: 'global'})
+                RETURN c.epoch AS epoch, coalesce(c.value, 0) AS version
+            """))
+            result = run_query(tx, "search_documents", """
+                MATCH (n:ContextItem)
+                WHERE n.id <> 'root' AND ($since IS NULL OR n.version > $since)
+                OPTIONAL MATCH (b:ContentBlob {hash: n.content_ref})
+                RETURN n.id AS id, n.name AS name, n.content AS content, n.is_folder AS is_folder,
+                       b.codec AS codec, b.data AS data
+            """, since=since_version)
+            return counter['epoch'], counter['version'], result
+
+        epoch, version, result = self._read(work)
+        return epoch, version, [self._inflate(r) for r in result]
+
+    def structure_changes(self, since_version=None):
+        def work(tx):
+            counter = single(run_query(tx, "structure_counter", """
+                OPTIONAL MATCH (c:VersionCounter {id: 'global'})
+                RETURN c.epoch AS epoch, coalesce(c.value, 0) AS version
+            """))
+            result = run_query(tx, "structure_changes", """
+                MATCH (n:ContextItem)
+                WHERE $since IS NULL OR n.version > $since
+                OPTIONAL MATCH (n)-[:PARENT_OF]->(c:ContextItem)
+                RETURN n.id AS id, n.name AS name, n.is_folder AS is_folder, n.is_attached AS is_attached,
+                       n.read_only AS read_only, collect(c.id) AS children
+            """, since=since_version)
+            return counter['epoch'], counter['version'], [dict(record) for record in result]
+
+        return self._read(work)
+
+    def file_names_by_node(self, node_ids):
+        result = self._read_query("file_names_by_node", """
+            UNWIND $ids AS node_id
+            MATCH (:ContextItem {id: node_id})-[:HAS_FILE]->(f:File)
+            WHERE f.filename IS NOT NULL
+            RETURN node_id, collect(f.filename) AS filenames
+        """, ids=list(node_ids))
+        return {record['node_id']: record['filenames'] for record in result}
+
+    # --- Context ---
+    def attached_folders_on_path(self, node_id):
+        # This query finds the direct path and then, for each node on that path,
+        # finds any folders that are directly attached.
+        result = self._read_query("attached_folders_on_path", """
+            MATCH p = (:ContextItem {id: 'root'})-[:PARENT_OF*0..]->(:ContextItem {id: $node_id})
+            WITH nodes(p) AS path_nodes
+            UNWIND path_nodes as ancestor
+            MATCH (ancestor)-[:PARENT_OF]->(attached:ContextItem {is_attached: true})
+            RETURN DISTINCT attached.id as id, attached.name as name
+        """, node_id=node_id)
+        return [dict(record) for record in result]
+
+    def children_of(self, node_ids):
+        result = self._read_query("children_of", CHILDREN_OF, ids=list(node_ids))
+        return [self._inflate(record) for record in result]
+
+    # --- Version stamps ---
+    def node_stamp(self, node_id):
+        return node_stamp_result(single(self._read_query("node_stamp", NODE_STAMP, node_id=node_id)))
+
+    def context_paths(self, node_ids):
+        return context_path_results(self._read_query("context_paths", CONTEXT_PATHS,
+                                                     ids=list(dict.fromkeys(node_ids))))
+
+    # --- Materialized context blocks ---
+    def stored_blocks(self, folder_ids):
+        return stored_block_results(self._read_query("stored_blocks", STORED_BLOCKS, ids=list(folder_ids)))
+
+    def save_blocks(self, blocks):
+        # Blocks live on the folder node and are deleted with it. Saving one
+        # changes no node's content, so nothing is stamped.
+        self._write_records("save_blocks", SAVE_BLOCKS, rows=block_rows(blocks))
+
+    def current_version(self):
+        return single(self._read_query("current_version", """
+            OPTIONAL MATCH (c:VersionCounter {id: 'global'})
+            RETURN coalesce(c.value, 0) AS version
+        """))['version']
+
+    def blocks_to_refresh(self, since_version):
+        version = self.current_version()
+        if since_version is None:
+            return version, {}
+        # A block reads the folder's child list, its children, and everything
+        # below the attached folders recorded as its sources.
+        result = self._read_query("blocks_to_refresh", """
+            MATCH (changed:ContextItem)
+            WHERE changed.version > $since AND changed.version <= $version
+            CALL {
+                WITH changed RETURN changed AS f
+                UNION
+                WITH changed MATCH (f:ContextItem)-[:PARENT_OF]->(changed) RETURN f
+                UNION
+                WITH changed MATCH (f:ContextItem)<-[:FEEDS_CONTEXT]-(:ContextItem)-[:PARENT_OF*0..]->(changed) RETURN f
+            }
+            WITH DISTINCT f
+            WHERE f.context_block IS NOT NULL
+        """ + block_version_clause() + """
+            WHERE block_version <> f.context_block_version
+            RETURN f.id AS id, block_version
+        """, since=since_version, version=version)
+        return version, {r['id']: r['block_version'] for r in result}
+
+    # --- Context deltas ---
+    def tombstones(self, folder_ids, since_version):
+        result = self._read_query("tombstones", """
+            UNWIND $ids AS folder_id
+            MATCH (t:Tombstone {folder_id: folder_id})
+            WHERE t.version > $since
+            RETURN folder_id, collect(DISTINCT t.node_id) AS ids
+        """, ids=list(folder_ids), since=since_version)
+        return {r['folder_id']: r['ids'] for r in result}
+
+    def purge_tombstones(self, before_version):
+        self._write_records("purge_tombstones", "MATCH (t:Tombstone) WHERE t.version < $before DELETE t",
+                            before=before_version)
+
+    # --- Compressed content ---
+    def content_dictionary(self):
+        record = single(self._read_query("content_dictionary", """
+            MATCH (c:VersionCounter {id: 'global'})
+            MATCH (b:ContentBlob {hash: c.content_dictionary})
+            RETURN b.hash AS hash, b.data AS data
+        """))
+        return (record['hash'], record['data']) if record else None
+
+    def save_content_dictionary(self, dictionary_hash, data):
+        # A dictionary changes no node, so nothing is stamped.
+        self._write_records("save_content_dictionary", """
+            MERGE (b:ContentBlob {hash: $hash})
+            ON CREATE SET b.codec = $codec, b.data = $data
+            WITH b
+            MATCH (c:VersionCounter {id: 'global'})
+            SET c.content_dictionary = b.hash
+        """, hash=dictionary_hash, codec=compression.DICTIONARY_CODEC, data=data)
+
+    def purge_content_blobs(self):
+        record = single(self._write_records("purge_content_blobs", """
+            MATCH (b:ContentBlob)
+            WHERE b.codec <> $codec AND NOT EXISTS { MATCH (:ContextItem {content_ref: b.hash}) }
+            DELETE b
+            RETURN count(b) AS purged
+        """, codec=compression.DICTIONARY_CODEC))
+        return record['purged']
+
+    # --- Tree writes ---
+    def create_node(self, node_id, parent_id, name, is_folder=False, is_attached=False):
+        op = {'id': node_id, 'parent_id': parent_id, 'name': name, 'is_folder': is_folder,
+              'is_attached': is_attached, 'content': ''}
+        self._write(lambda tx: create_nodes(tx, [op])[1])
+
+    def update_node(self, node_id, name=None, content=None):
+        self._write(lambda tx: update_nodes(tx, [{'id': node_id, 'name': name, 'content': content}])[1])
+
+    def move_node(self, node_id, new_parent_id, old_parent_id=None):
+        self._write(lambda tx: move_subtree(tx, node_id, new_parent_id, old_parent_id))
+
+    def copy_node(self, node_id, new_parent_id, name=None):
+        copied = []
+
+        def work(tx):
+            # copy_subtree stamps the copies itself, so nothing is left for _write to touch.
+            copied.append(copy_subtree(tx, node_id, new_parent_id, name))
+
+        self._write(work)
+        # The last attempt's, should the transaction have been retried.
+        return copied[-1]
+
+    def apply_batch(self, ops):
+        def fail(op, message):
+            raise ValueError(f"Operation {op['index']} ({op['op']}): {message}")
+
+        def work(tx):
+            touched = []
+            for kind, chunk in chunk_operations(ops):
+                if kind == 'create':
+                    created, chunk_touched = create_nodes(tx, chunk)
+                    for op in chunk:
+                        if op['id'] not in created:
+                            fail(op, f"Parent '{op['parent_id']}' not found.")
+                elif kind == 'update':
+                    found, chunk_touched = update_nodes(tx, chunk)
+                    for op in chunk:
+                        if op['id'] not in found:
+                            fail(op, f"Node '{op['id']}' not found.")
+                elif kind == 'move':
+                    op = chunk[0]
+                    try:
+                        chunk_touched = move_subtree(tx, op['id'], op['parent_id'], op['from_parent_id'])
+                    except ValueError as e:
+                        fail(op, str(e))
+                else:
+                    op = chunk[0]
+                    chunk_touched = delete_subtree(tx, op['id'])
+                    if chunk_touched is None:
+                        fail(op, f"Node '{op['id']}' not found.")
+                touched.extend(chunk_touched)
+            return touched
+
+        self._write(work)
+
+    def delete_node(self, node_id):
+        self._write(lambda tx: delete_subtree(tx, node_id))
+
+    def add_file(self, node_id, file_id, filename):
+        self._write_query("add_file", """
+            MATCH (n:ContextItem {id: $node_id})
+            CREATE (f:File {id: $file_id, filename: $filename})
+            CREATE (n)-[:HAS_FILE]->(f)
+            RETURN [n.id] AS touched
+        """, node_id=node_id, file_id=file_id, filename=filename)
+
+    # --- Export / import ---
+    def export_user_items(self):
+        result = self._read_query("export_user_items", """
+            MATCH p = (:ContextItem {id:'root'})-[:PARENT_OF*..]->(n:ContextItem)
+            // This ensures that every node in the path from the root's direct children
+            // to the target node `n` is user-created (not read-only).
+            WHERE ALL(node IN nodes(p)[1..] WHERE node.read_only IS NULL OR node.read_only = false)
+            OPTIONAL MATCH (b:ContentBlob {hash: n.content_ref})
+            RETURN [node IN nodes(p) | node.name] AS path_parts,
+                   n.content AS content,
+                   n.is_folder AS is_folder,
+                   n.is_attached AS is_attached,
+                   b.codec AS codec, b.data AS data
+        """)
+        # The path includes 'KnowledgeTree Root', which we skip for the export path
+        return [{
+            "path": "/".join(record['path_parts'][1:]),
+            "content": record['content'],
+            "is_folder": record['is_folder'],
+            "is_attached": record['is_attached']
+        } for record in map(self._inflate, result)]
+
+    def import_items(self, items):
+        def work(tx):
+            touched = []
+            for item in items:
+                path_parts = item['path'].split('/')
+                item_name = path_parts[-1]
+                parent_path_parts = path_parts[:-1]
+
+                # Find the parent node by traversing from the root
+                current_parent_id = 'root'
+                for folder_name in parent_path_parts:
+                    result = single(run_query(tx, "import_find_parent",
+                        "MATCH (parent:ContextItem {id: $parent_id})-[:PARENT_OF]->(child:ContextItem {name: $name}) RETURN child.id as id",
+                        parent_id=current_parent_id, name=folder_name))
+
+                    if result:
+                        current_parent_id = result['id']
+                    else:
+                        # This error means the import file is missing a parent folder definition, or is not sorted correctly.
+                        raise ValueError(f"Inconsistent data: parent folder '{folder_name}' not found for item '{item_name}'.")
+
+                # Create or update the item itself
+                is_folder = item.get('is_folder', False)
+                # The 'is_attached' flag should only apply to folders
+                is_attached = item.get('is_attached', False) and is_folder
+                # Files have content, folders do not
+                content = item.get('content', '') if not is_folder else ''
+
+                # MERGE on the relationship pattern to correctly find or create the node.
+                # This is the idiomatic way to handle nodes that are unique per parent.
+                record = single(run_query(tx, "import_merge_item", """
+                    MATCH (parent:ContextItem {id: $parent_id})
+                    MERGE (parent)-[r:PARENT_OF]->(item:ContextItem {name: $name})
+                    ON CREATE SET item.id = $id,
+                                  item.is_folder = $is_folder,
+                                  item.is_attached = $is_attached,
+                                  item.content = $content,
+                                  item.read_only = false
+                    ON MATCH SET  item.is_folder = $is_folder,
+                                  item.is_attached = $is_attached,
+                                  item.content = $content,
+                                  item.content_ref = null,
+                                  item.content_size = null,
+                                  item.search_terms = null
+                    RETURN [parent.id, item.id] AS touched
+                """, parent_id=current_parent_id, name=item_name, id=str(uuid.uuid4()),
+                     is_folder=is_folder, is_attached=is_attached, content=content))
+                touched.extend(record['touched'])
+            return touched
+
+        self._write(work)
+
+    def bulk_load(self, nodes, rels, batch_size=1000):
+        with self._session() as session:
+            with session.begin_transaction() as tx:
+                version = next_version(tx)
+            for start in range(0, len(nodes), batch_size):
+                run_query(session, "bulk_load_nodes", """
+                    UNWIND $rows AS row
+                    CREATE (n:ContextItem) SET n = row, n.version = $version, n.subtree_version = $version
+                """, rows=nodes[start:start + batch_size], version=version)
+            for start in range(0, len(rels), batch_size):
+                run_query(session, "bulk_load_rels", """
+                    UNWIND $rels AS rel
+                    MATCH (parent:ContextItem {id: rel.parent})
+                    MATCH (child:ContextItem {id: rel.child})
+                    CREATE (parent)-[:PARENT_OF]->(child)
+                """, rels=rels[start:start + batch_size])
+
+    # --- Freshservice sync ---
+    # The upserts below report a node as touched only when they create it,
+    # link it or change one of its properties, so re-syncing unchanged data
+    # keeps every version stamp (and every cached response) as it was.
+    def ensure_companies_root(self):
+        self._write_query("ensure_companies_root", """
+            MERGE (root:ContextItem {id: 'root'})
+            MERGE (companies:ContextItem {id: 'companies_root', name: 'Companies', is_folder: true})
+            WITH root, companies, EXISTS { (root)-[:PARENT_OF]->(companies) } AS linked
+            MERGE (root)-[:PARENT_OF]->(companies)
+            RETURN CASE WHEN linked THEN [] ELSE [root.id, companies.id] END AS touched
+        """)
+
+    def upsert_company(self, account_number, name, freshservice_id):
+        self._write_query("upsert_company", """
+            MATCH (companies_root:ContextItem {id: 'companies_root'})
+            MERGE (c:ContextItem {id: $account_number, name: $name, is_folder: true})
+            WITH companies_root, c, EXISTS { (companies_root)-[:PARENT_OF]->(c) } AS company_linked,
+                 coalesce(c.freshservice_id <> $fs_id, true) AS company_changed
+            SET c.freshservice_id = $fs_id
+            MERGE (companies_root)-[:PARENT_OF]->(c)
+            MERGE (u_root:ContextItem {id: 'users_for_' + $account_number, name: 'Users', is_folder: true})
+            WITH companies_root, c, company_linked, company_changed, u_root,
+                 EXISTS { (c)-[:PARENT_OF]->(u_root) } AS users_linked
+            MERGE (c)-[:PARENT_OF]->(u_root)
+            RETURN [x IN [
+                CASE WHEN NOT company_linked THEN companies_root.id END,
+                CASE WHEN company_changed OR NOT company_linked OR NOT users_linked THEN c.id END,
+                CASE WHEN NOT users_linked THEN u_root.id END
+            ] WHERE x IS NOT NULL] AS touched
+        """, account_number=account_number, name=name, fs_id=freshservice_id)
+
+    def upsert_user(self, account_number, user_name, user_email, content, freshservice_requester_id, run_id=None):
+        # Correctly match the company's "Users" folder and create the user inside it
+        self._write_query("upsert_user", """
+            MATCH (users_root:ContextItem {id: 'users_for_' + $account_number})
+            MERGE (user_folder:ContextItem {id: $user_email, name: $user_name, is_folder: true, user_email: $user_email})
+            WITH users_root, user_folder, EXISTS { (users_root)-[:PARENT_OF]->(user_folder) } AS user_linked,
+                 coalesce(user_folder.freshservice_requester_id <> $fs_requester_id, true) AS user_changed
+            SET user_folder.freshservice_requester_id = $fs_requester_id
+            MERGE (users_root)-[:PARENT_OF]->(user_folder)
+
+            MERGE (contact_md:ContextItem {id: 'contact_for_' + $user_email, name: 'Contact.md', is_folder: false, user_email: $user_email})
+            WITH users_root, user_folder, user_linked, user_changed, contact_md,
+                 EXISTS { (user_folder)-[:PARENT_OF]->(contact_md) } AS contact_linked,
+                 coalesce(contact_md.content <> $content, true) AS contact_changed
+            SET contact_md.content = $content, contact_md.read_only = true,
+                contact_md.sync_run = coalesce($run_id, contact_md.sync_run)
+            MERGE (user_folder)-[:PARENT_OF]->(contact_md)
+
+            MERGE (tickets_folder:ContextItem {id: 'tickets_for_' + $user_email, name: 'Tickets', is_folder: true, is_attached: true})
+            WITH users_root, user_folder, user_linked, user_changed, contact_md, contact_linked, contact_changed,
+                 tickets_folder, EXISTS { (user_folder)-[:PARENT_OF]->(tickets_folder) } AS tickets_linked
+            MERGE (user_folder)-[:PARENT_OF]->(tickets_folder)
+            RETURN [x IN [
+                CASE WHEN NOT user_linked THEN users_root.id END,
+                CASE WHEN user_changed OR NOT user_linked OR NOT contact_linked OR NOT tickets_linked THEN user_folder.id END,
+                CASE WHEN contact_changed OR NOT contact_linked THEN contact_md.id END,
+                CASE WHEN NOT tickets_linked THEN tickets_folder.id END
+            ] WHERE x IS NOT NULL] AS touched
+        """, account_number=account_number, user_name=user_name, user_email=user_email, content=content,
+             fs_requester_id=freshservice_requester_id, run_id=run_id)
+
+    # --- Datto sync ---
+    def ensure_assets_folder(self, account_number):
+        self._write_query("ensure_assets_folder", """
+            MATCH (company:ContextItem {id: $account_number})
+            MERGE (assets_folder:ContextItem {id: 'assets_for_' + $account_number, name: 'Assets', is_folder: true})
+            WITH company, assets_folder, EXISTS { (company)-[:PARENT_OF]->(assets_folder) } AS linked
+            MERGE (company)-[:PARENT_OF]->(assets_folder)
+            RETURN CASE WHEN linked THEN [] ELSE [company.id, assets_folder.id] END AS touched
+        """, account_number=account_number)
+
+    def upsert_asset(self, account_number, datto_uid, name, content, run_id=None):
+        self._write_query("upsert_asset", """
+            MATCH (assets_folder:ContextItem {id: 'assets_for_' + $account_number})
+            MERGE (computer_md:ContextItem {id: $datto_uid, name: $hostname, is_folder: false, datto_uid: $datto_uid})
+            WITH assets_folder, computer_md, EXISTS { (assets_folder)-[:PARENT_OF]->(computer_md) } AS linked,
+                 coalesce(NOT (computer_md.content = $content OR computer_md.content_ref = $content_ref), true) AS changed
+            SET computer_md.content = $content, computer_md.content_ref = $content_ref,
+                computer_md.content_size = $content_size, computer_md.search_terms = $search_terms,
+                computer_md.read_only = true,
+                computer_md.sync_run = coalesce($run_id, computer_md.sync_run)
+            MERGE (assets_folder)-[:PARENT_OF]->(computer_md)
+            RETURN [x IN [
+                CASE WHEN NOT linked THEN assets_folder.id END,
+                CASE WHEN changed OR NOT linked THEN computer_md.id END
+            ] WHERE x IS NOT NULL] AS touched
+        """, account_number=account_number, datto_uid=datto_uid, hostname=name, run_id=run_id,
+             **content_params(content))
+
+    def company_users(self, company_id):
+        result = self._read_query("company_users", """
+            MATCH (:ContextItem {id: $company_id})-[:PARENT_OF]->(:ContextItem {name: 'Users'})-[:PARENT_OF]->(u:ContextItem)
+            WHERE u.is_folder = true
+            RETURN u.name as name, u.user_email as email
+        """, company_id=company_id)
+        return [dict(record) for record in result]
+
+    def link_asset_to_user(self, user_email, datto_uid):
+        # Match the existing asset and user folder, then merge only the relationship.
+        # Contact.md carries user_email too, so restrict the match to the folder.
+        self._write_query("link_asset_to_user", """
+            MATCH (user_folder:ContextItem {user_email: $user_email, is_folder: true})
+            MATCH (computer_md:ContextItem {id: $datto_uid})
+            WITH user_folder, computer_md, EXISTS { (user_folder)-[:PARENT_OF]->(computer_md) } AS linked
+            MERGE (user_folder)-[:PARENT_OF]->(computer_md)
+            RETURN CASE WHEN linked THEN [] ELSE [user_folder.id, computer_md.id] END AS touched
+        """, user_email=user_email, datto_uid=datto_uid)
+
+    # --- Ticket sync ---
+    def latest_ticket_number(self):
+        result = single(self._read_query("latest_ticket_number", """
+            MATCH (t:ContextItem)
+            WHERE t.id STARTS WITH 'ticket_'
+            RETURN toInteger(substring(t.id, 7)) AS ticket_num
+            ORDER BY ticket_num DESC
+            LIMIT 1
+        """))
+        return result['ticket_num'] if result else None
+
+    def user_email_for_requester(self, requester_id):
+        result = single(self._read_query("user_email_for_requester",
+                                         "MATCH (u:ContextItem) WHERE u.freshservice_requester_id = $id RETURN u.user_email as email",
+                                         id=requester_id))
+        return result['email'] if result else None
+
+    def upsert_ticket(self, user_email, node_id, filename, content, run_id=None):
+        self._write_query("upsert_ticket", """
+            MATCH (user_folder:ContextItem {user_email: $user_email, is_folder: true})
+            MERGE (tickets_folder:ContextItem {id: 'tickets_for_' + $user_email, name: 'Tickets', is_folder: true, is_attached: true})
+            WITH user_folder, tickets_folder, EXISTS { (user_folder)-[:PARENT_OF]->(tickets_folder) } AS folder_linked
+            MERGE (user_folder)-[:PARENT_OF]->(tickets_folder)
+
+            MERGE (ticket_md:ContextItem {id: $node_id})
+            ON CREATE SET ticket_md.is_folder = false, ticket_md.read_only = true
+            WITH user_folder, tickets_folder, folder_linked, ticket_md,
+                 EXISTS { (tickets_folder)-[:PARENT_OF]->(ticket_md) } AS ticket_linked,
+                 coalesce(NOT (ticket_md.content = $content OR ticket_md.content_ref = $content_ref)
+                          OR ticket_md.name <> $filename, true) AS changed
+            SET ticket_md.name = $filename, ticket_md.content = $content, ticket_md.content_ref = $content_ref,
+                ticket_md.content_size = $content_size, ticket_md.search_terms = $search_terms,
+                ticket_md.sync_run = coalesce($run_id, ticket_md.sync_run)
+            MERGE (tickets_folder)-[:PARENT_OF]->(ticket_md)
+            RETURN [x IN [
+                CASE WHEN NOT folder_linked THEN user_folder.id END,
+                CASE WHEN NOT folder_linked OR NOT ticket_linked THEN tickets_folder.id END,
+                CASE WHEN changed OR NOT ticket_linked THEN ticket_md.id END
+            ] WHERE x IS NOT NULL] AS touched
+        """, user_email=user_email, node_id=node_id, filename=filename, run_id=run_id,
+             **content_params(content, compression.ticket_dictionary(self.content_dictionary)))
+
+    # --- Sync runs ---
+    def sweep_unseen(self, source, run_id, dry_run=False, batch_size=500):
+        if source not in SYNC_SOURCES:
+            raise ValueError(f"Unknown sync source '{source}'.")
+        owned = f"n.read_only = true AND {SYNC_SOURCE_FILTERS[source]}"
+        record = single(self._read_query("sweep_count", f"""
+            MATCH (n:ContextItem) WHERE {owned}
+            RETURN count(CASE WHEN n.sync_run = $run_id THEN 1 END) AS seen,
+                   count(CASE WHEN coalesce(n.sync_run <> $run_id, true) THEN 1 END) AS unseen
+        """, run_id=run_id))
+        counts = {'seen': record['seen'], 'unseen': record['unseen'], 'deleted': 0}
+        if dry_run or not counts['seen']:
+            return counts
+        while counts['deleted'] < counts['unseen']:
+            ids = [r['id'] for r in self._read_query("sweep_batch", f"""
+                MATCH (n:ContextItem) WHERE {owned} AND coalesce(n.sync_run <> $run_id, true)
+                RETURN n.id AS id LIMIT $limit
+            """, run_id=run_id, limit=batch_size)]
+            if not ids:
+                break
+
+            def work(tx):
+                # delete_subtree stamps and records tombstones itself.
+                for node_id in ids:
+                    delete_subtree(tx, sweep_target(tx, source, node_id))
+                return []
+
+            # One transaction per batch keeps each write short.
+            self._write(work)
+            counts['deleted'] += len(ids)
+        return counts
+
+    @contextmanager
+    def sync_batch(self):
+        # An explicit transaction, not a managed one: the block's writes
+        # cannot be replayed, so a transient error fails the batch instead.
+        with self._session() as session:
+            with session.begin_transaction() as tx:
+                touched = set()
+                self._local.batch = (tx, touched)
+                try:
+                    yield
+                finally:
+                    self._local.batch = None
+                touched.discard(None)
+                if touched:
+                    touch(tx, touched, next_version(tx))
+
+    def sync_checkpoint(self, source):
+        record = single(self._read_query("sync_checkpoint",
+                                         "MATCH (s:SyncState {source: $source}) RETURN s.checkpoint AS checkpoint",
+                                         source=source))
+        return json.loads(record['checkpoint']) if record else None
+
+    def save_sync_checkpoint(self, source, checkpoint):
+        if source not in SYNC_SOURCES:
+            raise ValueError(f"Unknown sync source '{source}'.")
+
+        def work(tx):
+            # A SyncState node is not part of the tree, so nothing is stamped.
+            if checkpoint is None:
+                run_query(tx, "clear_sync_checkpoint", "MATCH (s:SyncState {source: $source}) DELETE s", source=source)
+            else:
+                run_query(tx, "save_sync_checkpoint", "MERGE (s:SyncState {source: $source}) SET s.checkpoint = $checkpoint",
+                          source=source, checkpoint=json.dumps(checkpoint))
+
+        self._write(work)
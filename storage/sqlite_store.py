@@ -0,0 +1,1136 @@
+# storage/sqlite_store.py
+"""
+Embedded SQLite backend for single-node deployments and fast local runs.
+
+The tree is a DAG (pull_datto links one asset under both Assets and a user
+folder), so hierarchy queries use a closure table that counts paths: linking
+parent -> child adds paths(a, parent) * paths(child, d) for every ancestor a
+and descendant d, and unlinking subtracts the same amount. A pair whose count
+drops to zero is no longer related. Search uses an FTS5 trigram index, which
+answers case-insensitive substring queries like the Neo4j CONTAINS search.
+"""
+import os
+import json
+import uuid
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+import metrics
+import compression
+from storage.base import TreeStore, ROOT_ID, ROOT_NAME, ROOT_CONTENT, SYNC_SOURCES
+
+NODE_COLUMNS = ('name', 'content', 'is_folder', 'is_attached', 'read_only', 'user_email',
+                'freshservice_id', 'freshservice_requester_id', 'datto_uid', 'content_ref', 'content_size')
+FLAG_COLUMNS = ('is_folder', 'is_attached', 'read_only')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS nodes (
+    pk INTEGER PRIMARY KEY,
+    id TEXT NOT NULL UNIQUE,
+    name TEXT,
+    content TEXT,
+    is_folder INTEGER,
+    is_attached INTEGER,
+    read_only INTEGER,
+    user_email TEXT,
+    freshservice_id INTEGER,
+    freshservice_requester_id INTEGER,
+    datto_uid TEXT,
+    version INTEGER NOT NULL DEFAULT 0,
+    subtree_version INTEGER NOT NULL DEFAULT 0,
+    content_ref TEXT,
+    content_size INTEGER,
+    sync_run TEXT
+);
+CREATE INDEX IF NOT EXISTS nodes_user_email ON nodes(user_email);
+CREATE INDEX IF NOT EXISTS nodes_requester ON nodes(freshservice_requester_id);
+
+CREATE TABLE IF NOT EXISTS edges (
+    parent_id TEXT NOT NULL,
+    child_id TEXT NOT NULL,
+    PRIMARY KEY (parent_id, child_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS edges_child ON edges(child_id);
+
+CREATE TABLE IF NOT EXISTS closure (
+    ancestor TEXT NOT NULL,
+    descendant TEXT NOT NULL,
+    paths INTEGER NOT NULL,
+    PRIMARY KEY (ancestor, descendant)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS closure_descendant ON closure(descendant);
+
+CREATE TABLE IF NOT EXISTS files (
+    id TEXT PRIMARY KEY,
+    node_id TEXT NOT NULL,
+    filename TEXT
+);
+CREATE INDEX IF NOT EXISTS files_node ON files(node_id);
+
+CREATE TABLE IF NOT EXISTS context_blocks (
+    folder_id TEXT PRIMARY KEY,
+    version INTEGER NOT NULL,
+    segments TEXT NOT NULL
+) WITHOUT ROWID;
+
+-- Which attached folders feed which stored context blocks.
+CREATE TABLE IF NOT EXISTS context_block_sources (
+    source_id TEXT NOT NULL,
+    folder_id TEXT NOT NULL,
+    PRIMARY KEY (source_id, folder_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS context_block_sources_folder ON context_block_sources(folder_id);
+
+-- Articles that left a folder's context block, for context deltas.
+CREATE TABLE IF NOT EXISTS tombstones (
+    version INTEGER NOT NULL,
+    folder_id TEXT NOT NULL,
+    node_id TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tombstones_folder ON tombstones(folder_id, version);
+CREATE INDEX IF NOT EXISTS tombstones_version ON tombstones(version);
+
+-- Compressed bodies of large synced content, keyed by the SHA-256 of the text (see compression.py).
+CREATE TABLE IF NOT EXISTS content_blobs (
+    hash TEXT PRIMARY KEY,
+    codec TEXT NOT NULL,
+    data BLOB NOT NULL
+);
+
+-- Resume points of interrupted sync runs (see sync_runs.py), one per source.
+CREATE TABLE IF NOT EXISTS sync_state (
+    source TEXT PRIMARY KEY,
+    checkpoint TEXT NOT NULL
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value
+) WITHOUT ROWID;
+
+CREATE VIRTUAL TABLE IF NOT EXISTS node_fts USING fts5(
+    name, content, content='nodes', content_rowid='pk', tokenize='trigram'
+);
+"""
+
+
+def _content(alias):
+    """SQL for a node's content, inflated from content_blobs when it was stored compressed."""
+    return (f"coalesce({alias}.content, (SELECT inflate(b.codec, b.data) FROM content_blobs b "
+            f"WHERE b.hash = {alias}.content_ref))")
+
+# Recreated by _migrate, so databases from before compressed content index
+# the inflated bodies too. A blob outlives its last reference until
+# purge_content_blobs, so the delete triggers can still read it.
+FTS_TRIGGERS = {
+    'nodes_fts_insert': f"""
+        CREATE TRIGGER nodes_fts_insert AFTER INSERT ON nodes BEGIN
+            INSERT INTO node_fts(rowid, name, content) VALUES (new.pk, new.name, {_content('new')});
+        END""",
+    'nodes_fts_delete': f"""
+        CREATE TRIGGER nodes_fts_delete AFTER DELETE ON nodes BEGIN
+            INSERT INTO node_fts(node_fts, rowid, name, content) VALUES ('delete', old.pk, old.name, {_content('old')});
+        END""",
+    'nodes_fts_update': f"""
+        CREATE TRIGGER nodes_fts_update AFTER UPDATE OF name, content, content_ref ON nodes BEGIN
+            INSERT INTO node_fts(node_fts, rowid, name, content) VALUES ('delete', old.pk, old.name, {_content('old')});
+            INSERT INTO node_fts(rowid, name, content) VALUES (new.pk, new.name, {_content('new')});
+        END""",
+}
+
+# Columns added after the first release, with the definition ALTER TABLE
+# gives them on databases created before they existed.
+NODE_MIGRATIONS = {
+    'version': 'INTEGER NOT NULL DEFAULT 0',
+    'subtree_version': 'INTEGER NOT NULL DEFAULT 0',
+    'content_ref': 'TEXT',
+    'content_size': 'INTEGER',
+    'sync_run': 'TEXT',
+}
+
+# The read-only nodes each sync owns, for sweep_unseen.
+SYNC_SOURCE_FILTERS = {
+    'freshservice': "substr(id, 1, 12) = 'contact_for_'",
+    'datto': "datto_uid IS NOT NULL",
+    'tickets': "substr(id, 1, 7) = 'ticket_'",
+}
+
+# Trigram queries need at least three characters; shorter ones fall back to a scan.
+FTS_MIN_QUERY_LENGTH = 3
+
+
+def _flag(value):
+    return None if value is None else bool(value)
+
+def _node_dict(row, columns=('id', 'name', 'is_folder', 'is_attached', 'read_only')):
+    data = {}
+    for column in columns:
+        data[column] = _flag(row[column]) if column in FLAG_COLUMNS else row[column]
+    return data
+
+
+class SQLiteStore(TreeStore):
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def _conn(self):
+        # One connection per thread, and never one inherited across a fork.
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.create_function('uuid4', 0, lambda: str(uuid.uuid4()))
+            conn.create_function('inflate', 2, lambda codec, data: compression.decompress(
+                codec, data, self._dictionary_data), deterministic=True)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @contextmanager
+    def _write(self):
+        """
+        Runs the block as one IMMEDIATE transaction. Nodes the block touched,
+        and the tombstones of articles it took out of context blocks, are
+        stamped with a single new version just before it commits. Inside
+        sync_batch the block joins the batch's transaction instead.
+        """
+        conn = self._conn()
+        if getattr(self._local, 'touched', None) is not None:
+            yield conn
+            return
+        conn.execute("BEGIN IMMEDIATE")
+        self._local.touched = set()
+        self._local.removed = set()
+        try:
+            yield conn
+            if self._local.touched or self._local.removed:
+                self._stamp(conn, self._local.touched, self._local.removed)
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            self._local.touched = self._local.removed = None
+        conn.execute("COMMIT")
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            conn.close()
+        self._local = threading.local()
+
+    # --- Hierarchy primitives (callers hold the write transaction) ---
+    def _exists(self, conn, node_id):
+        return conn.execute("SELECT 1 FROM nodes WHERE id = ?", (node_id,)).fetchone() is not None
+
+    def _touch(self, *node_ids):
+        self._local.touched.update(node_ids)
+
+    def _stamp(self, conn, node_ids, removed=()):
+        version = conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'version' RETURNING value").fetchone()[0]
+        conn.executemany("INSERT INTO tombstones (version, folder_id, node_id) VALUES (?, ?, ?)",
+                         [(version, folder_id, node_id) for node_id, folder_id in removed])
+        ids = json.dumps(list(node_ids))
+        conn.execute("UPDATE nodes SET version = ? WHERE id IN (SELECT value FROM json_each(?))", (version, ids))
+        conn.execute("""
+            UPDATE nodes SET subtree_version = ?
+            WHERE id IN (SELECT ancestor FROM closure WHERE descendant IN (SELECT value FROM json_each(?)))
+        """, (version, ids))
+
+    def _upsert(self, conn, node_id, **props):
+        if 'content' in props:
+            # Plain content replaces a compressed body.
+            props.setdefault('content_ref', None)
+            props.setdefault('content_size', None)
+        row = conn.execute(f"SELECT {', '.join(props) or 'id'} FROM nodes WHERE id = ?", (node_id,)).fetchone()
+        if row is None:
+            columns = ['id'] + list(props)
+            conn.execute(f"INSERT INTO nodes ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                         [node_id] + list(props.values()))
+            conn.execute("INSERT INTO closure (ancestor, descendant, paths) VALUES (?, ?, 1)", (node_id, node_id))
+            self._touch(node_id)
+            return
+        changed = {c: v for c, v in props.items() if row[c] != v}
+        if changed:
+            conn.execute(f"UPDATE nodes SET {', '.join(f'{c} = ?' for c in changed)} WHERE id = ?",
+                         list(changed.values()) + [node_id])
+            self._touch(node_id)
+
+    def _packed(self, conn, content, dictionary=None):
+        """The content columns for a synced body, storing it in content_blobs when it is large."""
+        if not compression.should_compress(content):
+            return {'content': content}
+        digest = compression.content_hash(content)
+        if not conn.execute("SELECT 1 FROM content_blobs WHERE hash = ?", (digest,)).fetchone():
+            codec, data = compression.compress(content, dictionary)
+            if dictionary:
+                conn.execute("INSERT OR IGNORE INTO content_blobs (hash, codec, data) VALUES (?, ?, ?)",
+                             (dictionary[0], compression.DICTIONARY_CODEC, dictionary[1]))
+            conn.execute("INSERT INTO content_blobs (hash, codec, data) VALUES (?, ?, ?)", (digest, codec, data))
+        return {'content': None, 'content_ref': digest, 'content_size': len(content.encode('utf-8'))}
+
+    def _dictionary_data(self, dictionary_hash):
+        # Its own connection: inflate() calls this in the middle of a statement.
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            row = conn.execute("SELECT data FROM content_blobs WHERE hash = ?", (dictionary_hash,)).fetchone()
+        finally:
+            conn.close()
+        return row[0] if row else None
+
+    def _seen(self, conn, node_id, run_id):
+        # Not a change to the node: recording the run stamps nothing.
+        if run_id is not None:
+            conn.execute("UPDATE nodes SET sync_run = ? WHERE id = ? AND sync_run IS NOT ?", (run_id, node_id, run_id))
+
+    def _link(self, conn, parent_id, child_id):
+        if conn.execute("SELECT 1 FROM edges WHERE parent_id = ? AND child_id = ?", (parent_id, child_id)).fetchone():
+            return
+        if conn.execute("SELECT 1 FROM closure WHERE ancestor = ? AND descendant = ?", (child_id, parent_id)).fetchone():
+            raise ValueError(f"Linking '{child_id}' under '{parent_id}' would create a cycle.")
+        # Everything below the child may now appear in new context blocks.
+        self._touch(parent_id, *(row[0] for row in conn.execute(
+            "SELECT descendant FROM closure WHERE ancestor = ?", (child_id,))))
+        conn.execute("INSERT INTO edges (parent_id, child_id) VALUES (?, ?)", (parent_id, child_id))
+        conn.execute("""
+            INSERT INTO closure (ancestor, descendant, paths)
+            SELECT a.ancestor, d.descendant, a.paths * d.paths
+            FROM closure a JOIN closure d ON d.ancestor = ?
+            WHERE a.descendant = ?
+            ON CONFLICT(ancestor, descendant) DO UPDATE SET paths = paths + excluded.paths
+        """, (child_id, parent_id))
+
+    def _block_memberships(self, conn, node_ids):
+        """(article_id, folder_id) for each context block the given articles appear in."""
+        rows = conn.execute("""
+            SELECT n.id AS node_id, e.parent_id AS folder_id
+            FROM nodes n JOIN edges e ON e.child_id = n.id
+            WHERE n.id IN (SELECT value FROM json_each(:ids))
+              AND NOT n.is_folder AND (n.is_attached IS NULL OR n.is_attached = 0)
+            UNION
+            SELECT n.id, e.parent_id
+            FROM nodes n
+            JOIN closure cl ON cl.descendant = n.id AND cl.ancestor != n.id
+            JOIN nodes att ON att.id = cl.ancestor AND att.is_attached = 1
+            JOIN edges e ON e.child_id = att.id
+            WHERE n.id IN (SELECT value FROM json_each(:ids)) AND NOT n.is_folder
+        """, {'ids': json.dumps(list(node_ids))}).fetchall()
+        return {(row['node_id'], row['folder_id']) for row in rows}
+
+    def _unlink(self, conn, parent_id, child_id):
+        subtree = [row[0] for row in conn.execute("SELECT descendant FROM closure WHERE ancestor = ?", (child_id,))]
+        before = self._block_memberships(conn, subtree)
+        if not conn.execute("DELETE FROM edges WHERE parent_id = ? AND child_id = ?", (parent_id, child_id)).rowcount:
+            return
+        self._touch(parent_id, child_id)
+        conn.execute("""
+            UPDATE closure SET paths = paths - (
+                SELECT a.paths * d.paths FROM closure a, closure d
+                WHERE a.ancestor = closure.ancestor AND a.descendant = ?
+                  AND d.ancestor = ? AND d.descendant = closure.descendant)
+            WHERE ancestor IN (SELECT ancestor FROM closure WHERE descendant = ?)
+              AND descendant IN (SELECT descendant FROM closure WHERE ancestor = ?)
+        """, (parent_id, child_id, parent_id, child_id))
+        conn.execute("DELETE FROM closure WHERE paths <= 0")
+        self._local.removed.update(before - self._block_memberships(conn, subtree))
+
+    def _rebuild_closure(self, conn):
+        conn.execute("DELETE FROM closure")
+        conn.execute("""
+            INSERT INTO closure (ancestor, descendant, paths)
+            WITH RECURSIVE walk(ancestor, descendant) AS (
+                SELECT id, id FROM nodes
+                UNION ALL
+                SELECT walk.ancestor, edges.child_id FROM walk JOIN edges ON edges.parent_id = walk.descendant
+            )
+            SELECT ancestor, descendant, COUNT(*) FROM walk GROUP BY ancestor, descendant
+        """)
+
+    def _ensure_root(self, conn):
+        if not self._exists(conn, ROOT_ID):
+            self._upsert(conn, ROOT_ID, name=ROOT_NAME, content=ROOT_CONTENT, is_folder=1, is_attached=0)
+
+    def _ensure_meta(self, conn):
+        conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('version', 0)")
+        conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('epoch', ?)", (uuid.uuid4().hex[:12],))
+
+    def _migrate(self, conn):
+        existing = {row['name'] for row in conn.execute("PRAGMA table_info(nodes)")}
+        for column, definition in NODE_MIGRATIONS.items():
+            if column not in existing:
+                conn.execute(f"ALTER TABLE nodes ADD COLUMN {column} {definition}")
+        # Not in SCHEMA: on older databases the column only exists from here on.
+        conn.execute("CREATE INDEX IF NOT EXISTS nodes_version ON nodes(version)")
+        conn.execute("CREATE INDEX IF NOT EXISTS nodes_content_ref ON nodes(content_ref)")
+        for name, trigger in FTS_TRIGGERS.items():
+            conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+            conn.execute(trigger)
+
+    # --- Lifecycle ---
+    @metrics.instrumented
+    def init_schema(self):
+        conn = self._conn()
+        conn.executescript(SCHEMA)
+        with self._write() as conn:
+            self._migrate(conn)
+            self._ensure_meta(conn)
+            self._ensure_root(conn)
+
+    @metrics.instrumented
+    def reinitialize(self):
+        with self._write() as conn:
+            for table in ('nodes', 'edges', 'closure', 'files', 'meta', 'context_blocks', 'context_block_sources',
+                          'tombstones', 'content_blobs', 'sync_state'):
+                conn.execute(f"DELETE FROM {table}")
+            conn.execute("INSERT INTO node_fts(node_fts) VALUES ('delete-all')")
+            self._ensure_meta(conn)
+            self._ensure_root(conn)
+
+    # --- Tree reads ---
+    @metrics.instrumented
+    def resolve_path(self, names):
+        conn = self._conn()
+        node_id = ROOT_ID
+        for name in names:
+            row = conn.execute("""
+                SELECT c.id FROM edges e JOIN nodes c ON c.id = e.child_id
+                WHERE e.parent_id = ? AND c.name = ? LIMIT 1
+            """, (node_id, name)).fetchone()
+            if row is None:
+                return None
+            node_id = row['id']
+        return node_id
+
+    @metrics.instrumented
+    def list_children(self, node_id):
+        rows = self._conn().execute("""
+            SELECT c.id, c.name, c.is_folder, c.is_attached, c.read_only
+            FROM edges e JOIN nodes c ON c.id = e.child_id
+            WHERE e.parent_id = ?
+            ORDER BY c.is_folder IS NULL DESC, c.is_folder DESC, c.name
+        """, (node_id,)).fetchall()
+        return [_node_dict(row) for row in rows]
+
+    def _path_ids(self, conn, node_id):
+        if not self._exists(conn, node_id):
+            return None
+        # Breadth-first walk up the parent links; the first time the root is
+        # reached we have a shortest path.
+        came_from = {node_id: None}
+        frontier = [node_id]
+        while frontier and ROOT_ID not in came_from:
+            placeholders = ", ".join("?" * len(frontier))
+            rows = conn.execute(f"SELECT parent_id, child_id FROM edges WHERE child_id IN ({placeholders})",
+                                frontier).fetchall()
+            frontier = []
+            for row in rows:
+                if row['parent_id'] not in came_from:
+                    came_from[row['parent_id']] = row['child_id']
+                    frontier.append(row['parent_id'])
+        if ROOT_ID not in came_from:
+            return None
+        path_ids = [ROOT_ID]
+        while came_from[path_ids[-1]] is not None:
+            path_ids.append(came_from[path_ids[-1]])
+        return path_ids
+
+    @metrics.instrumented
+    def path_nodes(self, node_id):
+        conn = self._conn()
+        path_ids = self._path_ids(conn, node_id)
+        if path_ids is None:
+            return None
+        placeholders = ", ".join("?" * len(path_ids))
+        names = dict(conn.execute(f"SELECT id, name FROM nodes WHERE id IN ({placeholders})", path_ids).fetchall())
+        return [{'id': i, 'name': names.get(i)} for i in path_ids]
+
+    @metrics.instrumented
+    def get_node(self, node_id):
+        conn = self._conn()
+        row = conn.execute(f"""
+            SELECT n.id, n.name, {_content('n')} AS content, n.is_folder, n.is_attached, n.read_only
+            FROM nodes n WHERE n.id = ?
+        """, (node_id,)).fetchone()
+        if row is None:
+            return None
+        data = _node_dict(row, ('id', 'name', 'content', 'is_folder', 'is_attached', 'read_only'))
+        data['files'] = [dict(f) for f in conn.execute("SELECT id, filename FROM files WHERE node_id = ?", (node_id,))]
+        return data
+
+    @metrics.instrumented
+    def search(self, query, start_node_id=ROOT_ID, limit=15):
+        conn = self._conn()
+        if len(query) >= FTS_MIN_QUERY_LENGTH:
+            phrase = '"' + query.replace('"', '""') + '"'
+            rows = conn.execute("""
+                SELECT n.id, n.name, n.is_folder
+                FROM node_fts
+                JOIN nodes n ON n.pk = node_fts.rowid
+                JOIN closure cl ON cl.descendant = n.id AND cl.ancestor = ?
+                WHERE node_fts MATCH ? AND n.id != ?
+                ORDER BY node_fts.rank
+                LIMIT ?
+            """, (start_node_id, phrase, ROOT_ID, limit * 2)).fetchall()
+        else:
+            needle = query.lower()
+            rows = conn.execute(f"""
+                SELECT n.id, n.name, n.is_folder
+                FROM closure cl JOIN nodes n ON n.id = cl.descendant
+                WHERE cl.ancestor = ? AND n.id != ?
+                  AND (instr(lower(n.name), ?) > 0 OR instr(lower({_content('n')}), ?) > 0)
+                LIMIT ?
+            """, (start_node_id, ROOT_ID, needle, needle, limit * 2)).fetchall()
+
+        results = []
+        for row in rows:
+            path_names = self.path_names(row['id'])
+            if path_names is None:
+                continue
+            results.append({'id': row['id'], 'name': row['name'], 'is_folder': _flag(row['is_folder']),
+                            'path_names': path_names})
+            if len(results) == limit:
+                break
+        return results
+
+    @metrics.instrumented
+    def descendant_ids(self, node_id):
+        rows = self._conn().execute("SELECT descendant FROM closure WHERE ancestor = ?", (node_id,))
+        return [row[0] for row in rows]
+
+    @metrics.instrumented
+    def search_documents(self, since_version=None):
+        conn = self._conn()
+        meta = dict(conn.execute("SELECT key, value FROM meta WHERE key IN ('epoch', 'version')").fetchall())
+        rows = conn.execute(f"""
+            SELECT n.id, n.name, {_content('n')} AS content, n.is_folder FROM nodes n
+            WHERE n.id != ? AND (? IS NULL OR n.version > ?)
+        """, (ROOT_ID, since_version, since_version)).fetchall()
+        return meta['epoch'], meta['version'], [{**dict(row), 'is_folder': _flag(row['is_folder'])} for row in rows]
+
+    @metrics.instrumented
+    def structure_changes(self, since_version=None):
+        conn = self._conn()
+        meta = dict(conn.execute("SELECT key, value FROM meta WHERE key IN ('epoch', 'version')").fetchall())
+        rows = conn.execute("""
+            SELECT n.id, n.name, n.is_folder, n.is_attached, n.read_only,
+                   (SELECT json_group_array(e.child_id) FROM edges e WHERE e.parent_id = n.id) AS children
+            FROM nodes n WHERE ? IS NULL OR n.version > ?
+        """, (since_version, since_version)).fetchall()
+        return meta['epoch'], meta['version'], [dict(_node_dict(row), children=json.loads(row['children']))
+                                                for row in rows]
+
+    @metrics.instrumented
+    def file_names(self, node_id):
+        rows = self._conn().execute("SELECT filename FROM files WHERE node_id = ?", (node_id,))
+        return [row['filename'] for row in rows if row['filename'] is not None]
+
+    @metrics.instrumented
+    def file_names_by_node(self, node_ids):
+        files = {}
+        for row in self._conn().execute("""
+            SELECT node_id, filename FROM files
+            WHERE node_id IN (SELECT value FROM json_each(?)) AND filename IS NOT NULL
+        """, (json.dumps(list(node_ids)),)):
+            files.setdefault(row['node_id'], []).append(row['filename'])
+        return files
+
+    # --- Version stamps ---
+    @metrics.instrumented
+    def node_stamp(self, node_id):
+        row = self._conn().execute("""
+            SELECT n.version, n.read_only, m.value AS epoch
+            FROM nodes n JOIN meta m ON m.key = 'epoch'
+            WHERE n.id = ?
+        """, (node_id,)).fetchone()
+        if row is None:
+            return None
+        return {'stamp': f"{row['epoch']}-{row['version']}", 'read_only': bool(row['read_only'])}
+
+    def _block_versions(self, conn, folder_ids):
+        rows = conn.execute("""
+            SELECT p.id, p.name, max(p.version, coalesce(MAX(c.version), 0),
+                                     coalesce(MAX(CASE WHEN c.is_attached = 1 THEN c.subtree_version END), 0)) AS block_version
+            FROM nodes p
+            LEFT JOIN edges e ON e.parent_id = p.id
+            LEFT JOIN nodes c ON c.id = e.child_id
+            WHERE p.id IN (SELECT value FROM json_each(?))
+            GROUP BY p.id
+        """, (json.dumps(list(folder_ids)),)).fetchall()
+        return {row['id']: row for row in rows}
+
+    @metrics.instrumented
+    def context_paths(self, node_ids):
+        conn = self._conn()
+        paths = {node_id: self._path_ids(conn, node_id) for node_id in dict.fromkeys(node_ids)}
+        paths = {node_id: path_ids for node_id, path_ids in paths.items() if path_ids is not None}
+        rows = self._block_versions(conn, {i for path_ids in paths.values() for i in path_ids})
+        epoch = conn.execute("SELECT value FROM meta WHERE key = 'epoch'").fetchone()[0]
+        return {node_id: {'epoch': epoch, 'nodes': [{'id': i, 'name': rows[i]['name'],
+                                                     'block_version': rows[i]['block_version']} for i in path_ids]}
+                for node_id, path_ids in paths.items()}
+
+    # --- Context ---
+    @metrics.instrumented
+    def attached_folders_on_path(self, node_id):
+        rows = self._conn().execute("""
+            SELECT DISTINCT att.id, att.name
+            FROM closure cl
+            JOIN closure reach ON reach.ancestor = ? AND reach.descendant = cl.ancestor
+            JOIN edges e ON e.parent_id = cl.ancestor
+            JOIN nodes att ON att.id = e.child_id
+            WHERE cl.descendant = ? AND att.is_attached = 1
+        """, (ROOT_ID, node_id)).fetchall()
+        return [dict(row) for row in rows]
+
+    @metrics.instrumented
+    def children_of(self, node_ids):
+        rows = self._conn().execute(f"""
+            SELECT e.parent_id, c.id, c.name, CASE WHEN c.is_folder THEN NULL ELSE {_content('c')} END AS content,
+                   c.version, c.is_folder, c.is_attached
+            FROM edges e JOIN nodes c ON c.id = e.child_id
+            WHERE e.parent_id IN (SELECT value FROM json_each(?))
+        """, (json.dumps(list(node_ids)),)).fetchall()
+        return [_node_dict(row, ('parent_id', 'id', 'name', 'content', 'version', 'is_folder', 'is_attached'))
+                for row in rows]
+
+    @metrics.instrumented
+    def context_articles(self, folder_id, excluded_ids=()):
+        # The walk TreeStore.context_articles does level by level, as one set:
+        # UNION keeps each (source, node, depth) once, so shared subtrees are
+        # not re-walked per path, and the first source at the least depth wins.
+        conn = self._conn()
+        direct = conn.execute(f"""
+            SELECT c.id, c.name, {_content('c')} AS content, c.version, '' AS source_id, '' AS source_folder
+            FROM edges e JOIN nodes c ON c.id = e.child_id
+            WHERE e.parent_id = ? AND c.is_folder = 0 AND (c.is_attached IS NULL OR c.is_attached = 0)
+            ORDER BY c.name, c.id
+        """, (folder_id,)).fetchall()
+        attached = conn.execute(f"""
+            WITH RECURSIVE
+            sources AS (
+                SELECT att.id, att.name, ROW_NUMBER() OVER (ORDER BY att.name, att.id) AS ord
+                FROM edges e JOIN nodes att ON att.id = e.child_id
+                WHERE e.parent_id = :folder AND att.is_attached = 1
+                  AND att.id NOT IN (SELECT value FROM json_each(:excluded))
+            ),
+            walk(ord, id, depth) AS (
+                SELECT ord, id, 0 FROM sources
+                UNION
+                SELECT walk.ord, e.child_id, walk.depth + 1
+                FROM walk JOIN edges e ON e.parent_id = walk.id
+                WHERE walk.depth < :max_depth AND e.child_id != :folder
+                  AND e.child_id NOT IN (SELECT value FROM json_each(:direct))
+            ),
+            -- min() makes SQLite take the bare columns from the winning row.
+            reached AS (SELECT id, depth, ord, MIN(depth * 1000000 + ord) FROM walk GROUP BY id)
+            SELECT a.id, a.name, {_content('a')} AS content, a.version, s.id AS source_id, s.name AS source_folder
+            FROM reached r JOIN sources s ON s.ord = r.ord JOIN nodes a ON a.id = r.id
+            WHERE r.depth > 0 AND a.is_folder = 0
+            ORDER BY r.depth, s.ord, a.name, a.id
+            LIMIT :limit
+        """, {'folder': folder_id, 'excluded': json.dumps(list(excluded_ids)), 'max_depth': self.context_max_depth,
+              'direct': json.dumps([row['id'] for row in direct]),
+              'limit': max(self.context_max_articles - len(direct), 0)}).fetchall()
+        return [dict(row) for row in direct + attached]
+
+    # --- Materialized context blocks ---
+    @metrics.instrumented
+    def stored_blocks(self, folder_ids):
+        rows = self._conn().execute("""
+            SELECT folder_id, version, segments FROM context_blocks
+            WHERE folder_id IN (SELECT value FROM json_each(?))
+        """, (json.dumps(list(folder_ids)),)).fetchall()
+        return {row['folder_id']: {'version': row['version'], 'segments': json.loads(row['segments'])} for row in rows}
+
+    @metrics.instrumented
+    def save_blocks(self, blocks):
+        # Not _write: storing a block changes no node, so nothing is stamped.
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for block in blocks:
+                saved = conn.execute("""
+                    INSERT INTO context_blocks (folder_id, version, segments)
+                    SELECT id, :version, :segments FROM nodes WHERE id = :folder_id
+                    ON CONFLICT(folder_id) DO UPDATE SET version = excluded.version, segments = excluded.segments
+                    WHERE excluded.version >= context_blocks.version
+                """, {'folder_id': block['folder_id'], 'version': block['version'],
+                      'segments': json.dumps(block['segments'])}).rowcount
+                if not saved:
+                    continue
+                conn.execute("DELETE FROM context_block_sources WHERE folder_id = ?", (block['folder_id'],))
+                conn.executemany("INSERT OR IGNORE INTO context_block_sources (source_id, folder_id) VALUES (?, ?)",
+                                 [(segment['source_id'], block['folder_id'])
+                                  for segment in block['segments'] if segment['source_id']])
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    @metrics.instrumented
+    def current_version(self):
+        return self._conn().execute("SELECT value FROM meta WHERE key = 'version'").fetchone()[0]
+
+    @metrics.instrumented
+    def blocks_to_refresh(self, since_version):
+        conn = self._conn()
+        version = self.current_version()
+        if since_version is None:
+            return version, {}
+        # A block reads the folder's child list, its children, and everything
+        # below the attached folders recorded as its sources.
+        rows = conn.execute("""
+            WITH changed AS (SELECT id FROM nodes WHERE version > :since AND version <= :version)
+            SELECT id AS folder_id FROM changed
+            UNION SELECT e.parent_id FROM edges e JOIN changed ON changed.id = e.child_id
+            UNION SELECT s.folder_id FROM context_block_sources s
+                  JOIN closure cl ON cl.ancestor = s.source_id
+                  JOIN changed ON changed.id = cl.descendant
+        """, {'since': since_version, 'version': version}).fetchall()
+        candidates = [row['folder_id'] for row in rows]
+        stored = {row['folder_id']: row['version'] for row in conn.execute("""
+            SELECT folder_id, version FROM context_blocks WHERE folder_id IN (SELECT value FROM json_each(?))
+        """, (json.dumps(candidates),))}
+        current = self._block_versions(conn, stored)
+        return version, {folder_id: row['block_version'] for folder_id, row in current.items()
+                         if row['block_version'] != stored[folder_id]}
+
+    # --- Context deltas ---
+    @metrics.instrumented
+    def tombstones(self, folder_ids, since_version):
+        rows = self._conn().execute("""
+            SELECT DISTINCT folder_id, node_id FROM tombstones
+            WHERE folder_id IN (SELECT value FROM json_each(?)) AND version > ?
+        """, (json.dumps(list(folder_ids)), since_version)).fetchall()
+        removed = {}
+        for row in rows:
+            removed.setdefault(row['folder_id'], []).append(row['node_id'])
+        return removed
+
+    @metrics.instrumented
+    def purge_tombstones(self, before_version):
+        # Not _write: dropping history changes no node, so nothing is stamped.
+        self._conn().execute("DELETE FROM tombstones WHERE version < ?", (before_version,))
+
+    # --- Compressed content ---
+    @metrics.instrumented
+    def content_dictionary(self):
+        row = self._conn().execute("""
+            SELECT b.hash, b.data FROM meta m JOIN content_blobs b ON b.hash = m.value
+            WHERE m.key = 'content_dictionary'
+        """).fetchone()
+        return (row['hash'], row['data']) if row else None
+
+    @metrics.instrumented
+    def save_content_dictionary(self, dictionary_hash, data):
+        # Not _write: a dictionary changes no node, so nothing is stamped.
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("INSERT OR IGNORE INTO content_blobs (hash, codec, data) VALUES (?, ?, ?)",
+                         (dictionary_hash, compression.DICTIONARY_CODEC, data))
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('content_dictionary', ?)", (dictionary_hash,))
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    @metrics.instrumented
+    def purge_content_blobs(self):
+        return self._conn().execute("""
+            DELETE FROM content_blobs
+            WHERE codec != ? AND NOT EXISTS (SELECT 1 FROM nodes WHERE content_ref = content_blobs.hash)
+        """, (compression.DICTIONARY_CODEC,)).rowcount
+
+    # --- Tree writes ---
+    def _create(self, conn, node_id, parent_id, name, is_folder=False, is_attached=False, content=''):
+        if not self._exists(conn, parent_id):
+            return False
+        self._upsert(conn, node_id, name=name, is_folder=int(is_folder), content=content,
+                     is_attached=int(is_attached), read_only=0)
+        self._link(conn, parent_id, node_id)
+        return True
+
+    def _move(self, conn, node_id, new_parent_id, old_parent_id=None):
+        if node_id == ROOT_ID:
+            raise ValueError("The root cannot be moved.")
+        for missing in (node_id, new_parent_id):
+            if not self._exists(conn, missing):
+                raise ValueError(f"Node '{missing}' not found.")
+        if old_parent_id is None:
+            parents = [row['parent_id'] for row in
+                       conn.execute("SELECT parent_id FROM edges WHERE child_id = ?", (node_id,)).fetchall()]
+        elif conn.execute("SELECT 1 FROM edges WHERE parent_id = ? AND child_id = ?",
+                          (old_parent_id, node_id)).fetchone():
+            parents = [old_parent_id]
+        else:
+            raise ValueError(f"'{old_parent_id}' is not a parent of '{node_id}'.")
+        for parent_id in parents:
+            if parent_id != new_parent_id:
+                self._unlink(conn, parent_id, node_id)
+        self._link(conn, new_parent_id, node_id)
+
+    def _apply(self, conn, op):
+        kind = op['op']
+        if kind == 'create':
+            if not self._create(conn, op['id'], op['parent_id'], op['name'], op['is_folder'],
+                                op['is_attached'], op['content']):
+                raise ValueError(f"Parent '{op['parent_id']}' not found.")
+        elif kind == 'move':
+            self._move(conn, op['id'], op['parent_id'], op['from_parent_id'])
+        elif not self._exists(conn, op['id']):
+            raise ValueError(f"Node '{op['id']}' not found.")
+        elif kind == 'update':
+            props = {k: op[k] for k in ('name', 'content') if op[k] is not None}
+            self._upsert(conn, op['id'], **props)
+        elif kind == 'delete':
+            self._delete_subtree(conn, op['id'])
+
+    @metrics.instrumented
+    def create_node(self, node_id, parent_id, name, is_folder=False, is_attached=False):
+        with self._write() as conn:
+            self._create(conn, node_id, parent_id, name, is_folder, is_attached)
+
+    @metrics.instrumented
+    def update_node(self, node_id, name=None, content=None):
+        with self._write() as conn:
+            if not self._exists(conn, node_id):
+                return
+            props = {}
+            if content is not None:
+                props['content'] = content
+            if name is not None:
+                props['name'] = name
+            self._upsert(conn, node_id, **props)
+
+    def _delete_subtree(self, conn, node_id):
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS doomed (id TEXT PRIMARY KEY)")
+        conn.execute("DELETE FROM doomed")
+        conn.execute("INSERT INTO doomed SELECT descendant FROM closure WHERE ancestor = ?", (node_id,))
+        # Surviving parents (including other parents of multi-parent nodes) lose a child.
+        survivors = conn.execute("""
+            SELECT DISTINCT parent_id FROM edges WHERE child_id IN doomed AND parent_id NOT IN doomed
+        """).fetchall()
+        self._touch(*(row['parent_id'] for row in survivors))
+        # Articles leave the blocks of surviving folders; doomed folders' blocks go with them.
+        doomed = {row['id'] for row in conn.execute("SELECT id FROM doomed")}
+        self._local.removed.update((node_id, folder_id) for node_id, folder_id in self._block_memberships(conn, doomed)
+                                   if folder_id not in doomed)
+        conn.execute("DELETE FROM edges WHERE parent_id IN doomed OR child_id IN doomed")
+        conn.execute("DELETE FROM closure WHERE ancestor IN doomed OR descendant IN doomed")
+        conn.execute("DELETE FROM files WHERE node_id IN doomed")
+        conn.execute("DELETE FROM context_blocks WHERE folder_id IN doomed")
+        conn.execute("DELETE FROM context_block_sources WHERE folder_id IN doomed OR source_id IN doomed")
+        conn.execute("DELETE FROM nodes WHERE id IN doomed")
+
+    @metrics.instrumented
+    def move_node(self, node_id, new_parent_id, old_parent_id=None):
+        with self._write() as conn:
+            self._move(conn, node_id, new_parent_id, old_parent_id)
+
+    def _copy(self, conn, node_id, new_parent_id, name=None):
+        for missing in (node_id, new_parent_id):
+            if not self._exists(conn, missing):
+                raise ValueError(f"Node '{missing}' not found.")
+        if conn.execute("SELECT 1 FROM closure WHERE ancestor = ? AND descendant = ?",
+                        (node_id, new_parent_id)).fetchone():
+            raise ValueError(f"Cannot copy '{node_id}' into its own subtree.")
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS copies (old_id TEXT PRIMARY KEY, new_id TEXT NOT NULL)")
+        conn.execute("DELETE FROM copies")
+        conn.execute("INSERT INTO copies SELECT descendant, uuid4() FROM closure WHERE ancestor = ?", (node_id,))
+        conn.execute("""
+            INSERT INTO nodes (id, name, content, content_ref, content_size, is_folder, is_attached, read_only)
+            SELECT c.new_id, CASE WHEN n.id = :root THEN coalesce(:name, n.name) ELSE n.name END,
+                   n.content, n.content_ref, n.content_size, n.is_folder, n.is_attached, 0
+            FROM copies c JOIN nodes n ON n.id = c.old_id
+        """, {'root': node_id, 'name': name})
+        conn.execute("""
+            INSERT INTO edges (parent_id, child_id)
+            SELECT p.new_id, c.new_id FROM edges e
+            JOIN copies p ON p.old_id = e.parent_id JOIN copies c ON c.old_id = e.child_id
+        """)
+        # Every path between two nodes of the subtree stays inside it, so the
+        # copied closure rows keep their counts.
+        conn.execute("""
+            INSERT INTO closure (ancestor, descendant, paths)
+            SELECT a.new_id, d.new_id, cl.paths FROM closure cl
+            JOIN copies a ON a.old_id = cl.ancestor JOIN copies d ON d.old_id = cl.descendant
+        """)
+        conn.execute("""
+            INSERT INTO files (id, node_id, filename)
+            SELECT uuid4(), c.new_id, f.filename FROM files f JOIN copies c ON c.old_id = f.node_id
+        """)
+        self._touch(*(row['new_id'] for row in conn.execute("SELECT new_id FROM copies")))
+        new_id = conn.execute("SELECT new_id FROM copies WHERE old_id = ?", (node_id,)).fetchone()['new_id']
+        self._link(conn, new_parent_id, new_id)
+        return new_id
+
+    @metrics.instrumented
+    def copy_node(self, node_id, new_parent_id, name=None):
+        with self._write() as conn:
+            return self._copy(conn, node_id, new_parent_id, name)
+
+    @metrics.instrumented
+    def apply_batch(self, ops):
+        with self._write() as conn:
+            for op in ops:
+                try:
+                    self._apply(conn, op)
+                except ValueError as e:
+                    raise ValueError(f"Operation {op['index']} ({op['op']}): {e}") from None
+
+    @metrics.instrumented
+    def delete_node(self, node_id):
+        with self._write() as conn:
+            self._delete_subtree(conn, node_id)
+
+    @metrics.instrumented
+    def add_file(self, node_id, file_id, filename):
+        with self._write() as conn:
+            if self._exists(conn, node_id):
+                conn.execute("INSERT INTO files (id, node_id, filename) VALUES (?, ?, ?)", (file_id, node_id, filename))
+                self._touch(node_id)
+
+    # --- Export / import ---
+    @metrics.instrumented
+    def export_user_items(self):
+        rows = self._conn().execute(f"""
+            WITH RECURSIVE walk(id, path) AS (
+                SELECT c.id, c.name FROM edges e JOIN nodes c ON c.id = e.child_id
+                WHERE e.parent_id = ? AND (c.read_only IS NULL OR c.read_only = 0)
+                UNION ALL
+                SELECT c.id, walk.path || '/' || c.name
+                FROM walk JOIN edges e ON e.parent_id = walk.id JOIN nodes c ON c.id = e.child_id
+                WHERE c.read_only IS NULL OR c.read_only = 0
+            )
+            SELECT walk.path, {_content('n')} AS content, n.is_folder, n.is_attached FROM walk JOIN nodes n ON n.id = walk.id
+        """, (ROOT_ID,)).fetchall()
+        return [{"path": row['path'], "content": row['content'], "is_folder": _flag(row['is_folder']),
+                 "is_attached": _flag(row['is_attached'])} for row in rows]
+
+    @metrics.instrumented
+    def import_items(self, items):
+        with self._write() as conn:
+            for item in items:
+                path_parts = item['path'].split('/')
+                item_name = path_parts[-1]
+
+                current_parent_id = ROOT_ID
+                for folder_name in path_parts[:-1]:
+                    row = conn.execute("""
+                        SELECT c.id FROM edges e JOIN nodes c ON c.id = e.child_id
+                        WHERE e.parent_id = ? AND c.name = ? LIMIT 1
+                    """, (current_parent_id, folder_name)).fetchone()
+                    if row is None:
+                        raise ValueError(f"Inconsistent data: parent folder '{folder_name}' not found for item '{item_name}'.")
+                    current_parent_id = row['id']
+
+                is_folder = item.get('is_folder', False)
+                is_attached = item.get('is_attached', False) and is_folder
+                content = item.get('content', '') if not is_folder else ''
+
+                row = conn.execute("""
+                    SELECT c.id FROM edges e JOIN nodes c ON c.id = e.child_id
+                    WHERE e.parent_id = ? AND c.name = ? LIMIT 1
+                """, (current_parent_id, item_name)).fetchone()
+                if row:
+                    self._upsert(conn, row['id'], is_folder=int(bool(is_folder)),
+                                 is_attached=int(bool(is_attached)), content=content)
+                else:
+                    new_id = str(uuid.uuid4())
+                    self._upsert(conn, new_id, name=item_name, is_folder=int(bool(is_folder)),
+                                 is_attached=int(bool(is_attached)), content=content, read_only=0)
+                    self._link(conn, current_parent_id, new_id)
+
+    @metrics.instrumented
+    def bulk_load(self, nodes, rels):
+        with self._write() as conn:
+            for node in nodes:
+                props = {c: node[c] for c in NODE_COLUMNS if c in node}
+                for flag in FLAG_COLUMNS:
+                    if props.get(flag) is not None:
+                        props[flag] = int(props[flag])
+                columns = ['id'] + list(props)
+                conn.execute(f"INSERT INTO nodes ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                             [node['id']] + list(props.values()))
+            conn.executemany("INSERT OR IGNORE INTO edges (parent_id, child_id) VALUES (?, ?)",
+                             [(r['parent'], r['child']) for r in rels])
+            self._rebuild_closure(conn)
+            version = conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'version' RETURNING value").fetchone()[0]
+            conn.execute("UPDATE nodes SET version = ?, subtree_version = ?", (version, version))
+
+    # --- Freshservice sync ---
+    @metrics.instrumented
+    def ensure_companies_root(self):
+        with self._write() as conn:
+            self._ensure_root(conn)
+            self._upsert(conn, 'companies_root', name='Companies', is_folder=1)
+            self._link(conn, ROOT_ID, 'companies_root')
+
+    @metrics.instrumented
+    def upsert_company(self, account_number, name, freshservice_id):
+        with self._write() as conn:
+            if not self._exists(conn, 'companies_root'):
+                return
+            self._upsert(conn, account_number, name=name, is_folder=1, freshservice_id=freshservice_id)
+            self._link(conn, 'companies_root', account_number)
+            self._upsert(conn, f'users_for_{account_number}', name='Users', is_folder=1)
+            self._link(conn, account_number, f'users_for_{account_number}')
+
+    @metrics.instrumented
+    def upsert_user(self, account_number, user_name, user_email, content, freshservice_requester_id, run_id=None):
+        with self._write() as conn:
+            users_root = f'users_for_{account_number}'
+            if not self._exists(conn, users_root):
+                return
+            self._upsert(conn, user_email, name=user_name, is_folder=1, user_email=user_email,
+                         freshservice_requester_id=freshservice_requester_id)
+            self._link(conn, users_root, user_email)
+            self._upsert(conn, f'contact_for_{user_email}', name='Contact.md', is_folder=0,
+                         user_email=user_email, content=content, read_only=1)
+            self._seen(conn, f'contact_for_{user_email}', run_id)
+            self._link(conn, user_email, f'contact_for_{user_email}')
+            self._upsert(conn, f'tickets_for_{user_email}', name='Tickets', is_folder=1, is_attached=1)
+            self._link(conn, user_email, f'tickets_for_{user_email}')
+
+    # --- Datto sync ---
+    @metrics.instrumented
+    def ensure_assets_folder(self, account_number):
+        with self._write() as conn:
+            if not self._exists(conn, account_number):
+                return
+            self._upsert(conn, f'assets_for_{account_number}', name='Assets', is_folder=1)
+            self._link(conn, account_number, f'assets_for_{account_number}')
+
+    @metrics.instrumented
+    def upsert_asset(self, account_number, datto_uid, name, content, run_id=None):
+        with self._write() as conn:
+            assets_folder = f'assets_for_{account_number}'
+            if not self._exists(conn, assets_folder):
+                return
+            self._upsert(conn, datto_uid, name=name, is_folder=0, datto_uid=datto_uid, read_only=1,
+                         **self._packed(conn, content))
+            self._seen(conn, datto_uid, run_id)
+            self._link(conn, assets_folder, datto_uid)
+
+    @metrics.instrumented
+    def company_users(self, company_id):
+        rows = self._conn().execute("""
+            SELECT u.name, u.user_email AS email
+            FROM edges e1
+            JOIN nodes users ON users.id = e1.child_id AND users.name = 'Users'
+            JOIN edges e2 ON e2.parent_id = users.id
+            JOIN nodes u ON u.id = e2.child_id
+            WHERE e1.parent_id = ? AND u.is_folder = 1
+        """, (company_id,)).fetchall()
+        return [dict(row) for row in rows]
+
+    @metrics.instrumented
+    def link_asset_to_user(self, user_email, datto_uid):
+        with self._write() as conn:
+            if not self._exists(conn, datto_uid):
+                return
+            for row in conn.execute("SELECT id FROM nodes WHERE user_email = ? AND is_folder = 1", (user_email,)).fetchall():
+                self._link(conn, row['id'], datto_uid)
+
+    # --- Ticket sync ---
+    @metrics.instrumented
+    def latest_ticket_number(self):
+        row = self._conn().execute("""
+            SELECT MAX(CAST(substr(id, 8) AS INTEGER)) AS ticket_num FROM nodes WHERE substr(id, 1, 7) = 'ticket_'
+        """).fetchone()
+        return row['ticket_num']
+
+    @metrics.instrumented
+    def user_email_for_requester(self, requester_id):
+        row = self._conn().execute("SELECT user_email FROM nodes WHERE freshservice_requester_id = ? LIMIT 1",
+                                   (requester_id,)).fetchone()
+        return row['user_email'] if row else None
+
+    @metrics.instrumented
+    def upsert_ticket(self, user_email, node_id, filename, content, run_id=None):
+        with self._write() as conn:
+            user_folders = conn.execute("SELECT id FROM nodes WHERE user_email = ? AND is_folder = 1",
+                                        (user_email,)).fetchall()
+            if not user_folders:
+                return
+            tickets_folder = f'tickets_for_{user_email}'
+            self._upsert(conn, tickets_folder, name='Tickets', is_folder=1, is_attached=1)
+            for row in user_folders:
+                self._link(conn, row['id'], tickets_folder)
+            self._upsert(conn, node_id, name=filename, is_folder=0, read_only=1,
+                         **self._packed(conn, content, compression.ticket_dictionary(self.content_dictionary)))
+            self._seen(conn, node_id, run_id)
+            self._link(conn, tickets_folder, node_id)
+
+    # --- Sync runs ---
+    @metrics.instrumented
+    def sweep_unseen(self, source, run_id, dry_run=False, batch_size=500):
+        if source not in SYNC_SOURCES:
+            raise ValueError(f"Unknown sync source '{source}'.")
+        owned = f"read_only = 1 AND {SYNC_SOURCE_FILTERS[source]}"
+        row = self._conn().execute(f"""
+            SELECT coalesce(SUM(sync_run IS ?), 0) AS seen, coalesce(SUM(sync_run IS NOT ?), 0) AS unseen
+            FROM nodes WHERE {owned}
+        """, (run_id, run_id)).fetchone()
+        counts = {'seen': row['seen'], 'unseen': row['unseen'], 'deleted': 0}
+        if dry_run or not counts['seen']:
+            return counts
+        while counts['deleted'] < counts['unseen']:
+            # One transaction per batch keeps the write lock short.
+            with self._write() as conn:
+                ids = [r['id'] for r in conn.execute(f"SELECT id FROM nodes WHERE {owned} AND sync_run IS NOT ? LIMIT ?",
+                                                     (run_id, batch_size)).fetchall()]
+                for node_id in ids:
+                    self._delete_subtree(conn, self._sweep_target(conn, source, node_id))
+            if not ids:
+                break
+            counts['deleted'] += len(ids)
+        return counts
+
+    def _sweep_target(self, conn, source, node_id):
+        """
+        The node sweep_unseen deletes for an unseen one. A contact takes its
+        user folder along; devices linked into that folder are unlinked first,
+        so they stay in their Assets folder.
+        """
+        if source != 'freshservice':
+            return node_id
+        folder = conn.execute("""
+            SELECT u.id FROM edges e JOIN nodes c ON c.id = e.child_id JOIN nodes u ON u.id = e.parent_id
+            WHERE e.child_id = ? AND u.id = c.user_email AND u.is_folder = 1
+        """, (node_id,)).fetchone()
+        if folder is None:
+            return node_id
+        shared = conn.execute("""
+            SELECT DISTINCT e.child_id FROM edges e JOIN edges other ON other.child_id = e.child_id
+            WHERE e.parent_id = ? AND other.parent_id <> e.parent_id
+        """, (folder['id'],)).fetchall()
+        for row in shared:
+            self._unlink(conn, folder['id'], row['child_id'])
+        return folder['id']
+
+    @contextmanager
+    def sync_batch(self):
+        with self._write():
+            yield
+
+    @metrics.instrumented
+    def sync_checkpoint(self, source):
+        row = self._conn().execute("SELECT checkpoint FROM sync_state WHERE source = ?", (source,)).fetchone()
+        return json.loads(row['checkpoint']) if row else None
+
+    @metrics.instrumented
+    def save_sync_checkpoint(self, source, checkpoint):
+        if source not in SYNC_SOURCES:
+            raise ValueError(f"Unknown sync source '{source}'.")
+        # _write so that it commits with a sync_batch; it changes no node, so nothing is stamped.
+        with self._write() as conn:
+            if checkpoint is None:
+                conn.execute("DELETE FROM sync_state WHERE source = ?", (source,))
+            else:
+                conn.execute("INSERT OR REPLACE INTO sync_state (source, checkpoint) VALUES (?, ?)",
+                             (source, json.dumps(checkpoint)))
@@ -0,0 +1,30 @@
+# storage/threaded.py
+"""
+Async face of a store without an async driver, for the ASGI app (asgi.py):
+every method runs the sync store's method in a worker thread. The event
+loop stays free while a call waits, but each waiting call still holds a
+thread, as it would under the WSGI app.
+"""
+import asyncio
+import functools
+
+
+class ThreadedStore:
+    def __init__(self, store):
+        self._store = store
+
+    def __getattr__(self, name):
+        method = getattr(self._store, name)
+        if not callable(method):
+            return method
+
+        @functools.wraps(method)
+        async def call(*args, **kwargs):
+            # to_thread copies the context, so metrics still counts the query for the request.
+            return await asyncio.to_thread(method, *args, **kwargs)
+
+        return call
+
+    async def close(self):
+        # The sync store is closed with the app (see storage.close_store).
+        pass
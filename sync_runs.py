@@ -0,0 +1,57 @@
+# sync_runs.py
+"""
+Sync run ids and the sweep of synced nodes a run no longer saw.
+
+Each sync run passes a new run id to the upserts of the read-only nodes it
+owns (contacts, assets, tickets), which record it on the nodes without
+stamping them. After a complete run, nodes of that source still carrying an
+older run id were not returned by the remote system any more: deactivated
+users, decommissioned devices, tickets of removed requesters. The sweep
+counts them and, when SYNC_SWEEP is 'delete', deletes them in batches of
+SYNC_SWEEP_BATCH. The default 'dry-run' only reports the counts; 'off' skips
+the sweep. A run that saw nothing of its source sweeps nothing, so an empty
+API response cannot empty the tree.
+
+Long runs (ticket overwrites, Datto devices) also save a checkpoint after
+each batch, in the same transaction as the batch's writes. A run that finds
+a checkpoint resumes from it, under the interrupted run's id, so what that
+run already wrote still counts as seen. Checkpoints older than
+SYNC_CHECKPOINT_MAX_AGE seconds are ignored and the run starts over. A run
+that gets to the end clears its checkpoint.
+"""
+import os
+import time
+import uuid
+
+SYNC_SWEEP = os.getenv("SYNC_SWEEP", "dry-run")
+SYNC_SWEEP_BATCH = int(os.getenv("SYNC_SWEEP_BATCH", 500))
+SYNC_CHECKPOINT_MAX_AGE = float(os.getenv("SYNC_CHECKPOINT_MAX_AGE", 86400))
+
+
+def new_run_id():
+    return f"{time.strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:6]}"
+
+def sweep(store, source, run_id, mode=None):
+    """Sweeps the source's nodes the run did not see; returns the counts, or None when sweeping is off."""
+    mode = mode or SYNC_SWEEP
+    if mode == 'off':
+        return None
+    counts = store.sweep_unseen(source, run_id, dry_run=mode != 'delete', batch_size=SYNC_SWEEP_BATCH)
+    print(f"Sweep of {source} run {run_id}: {counts['seen']} seen, {counts['unseen']} not seen, "
+          f"{counts['deleted']} deleted{' (dry run)' if mode != 'delete' else ''}.")
+    return counts
+
+def resume(store, source):
+    """The state of the source's interrupted run to carry on from, or a new run's: at least {'run_id': ...}."""
+    state = store.sync_checkpoint(source)
+    if state and time.time() - state.get('saved', 0) <= SYNC_CHECKPOINT_MAX_AGE:
+        print(f"Resuming {source} run {state['run_id']} from its checkpoint.")
+        return state
+    return {'run_id': new_run_id()}
+
+def save_checkpoint(store, source, state):
+    """Saves the run's state; call it inside the store.sync_batch() of the writes it covers."""
+    store.save_sync_checkpoint(source, dict(state, saved=time.time()))
+
+def finish(store, source):
+    store.save_sync_checkpoint(source, None)
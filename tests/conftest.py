@@ -0,0 +1,48 @@
+# tests/conftest.py
+import os
+
+import pytest
+
+import context_blocks
+import hierarchy
+import relevance
+from storage import close_store
+
+
+@pytest.fixture(scope='session', params=['sqlite', 'neo4j'])
+def backend_store(request, tmp_path_factory):
+    """One store per backend for the whole run; Neo4j only when asked for, as it wipes the database."""
+    if request.param == 'sqlite':
+        from storage.sqlite_store import SQLiteStore
+        store = SQLiteStore(str(tmp_path_factory.mktemp('contract') / 'contract.db'))
+    else:
+        if os.getenv("CONTRACT_NEO4J") != 'wipe':
+            pytest.skip("Set CONTRACT_NEO4J=wipe to run against, and wipe, the configured Neo4j database.")
+        from storage.neo4j_store import Neo4jStore
+        store = Neo4jStore()
+    store.init_schema()
+    yield store
+    store.close()
+
+@pytest.fixture
+def store(backend_store):
+    backend_store.reinitialize()
+    return backend_store
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    """The Flask app on a throwaway SQLite store, reading the store directly."""
+    monkeypatch.setenv("STORAGE_BACKEND", "sqlite")
+    monkeypatch.setenv("SQLITE_PATH", str(tmp_path / 'app.db'))
+    monkeypatch.setenv("UPLOAD_FOLDER", str(tmp_path / 'uploads'))
+    monkeypatch.setattr(context_blocks, 'CONTEXT_REFRESH_INTERVAL', 0)
+    monkeypatch.setattr(hierarchy, 'HIERARCHY_MIRROR', 'off')
+    monkeypatch.setattr(relevance, 'SEARCH_MODE', 'substring')
+    close_store()
+    from app import create_app
+    yield create_app()
+    close_store()
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
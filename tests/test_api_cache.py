@@ -0,0 +1,46 @@
+# tests/test_api_cache.py
+import pytest
+import requests
+
+import api_cache
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(api_cache, 'API_CACHE_DIR', str(tmp_path))
+    return tmp_path
+
+
+def test_keys_ignore_host_and_parameter_order():
+    assert (api_cache.cache_key("https://a.example/api/v2/tickets?b=2", {'a': 1})
+            == api_cache.cache_key("http://b.example/api/v2/tickets?a=1", {'b': 2})
+            == "/api/v2/tickets?a=1&b=2")
+    assert api_cache.cache_key("None/api/v2/departments") == "/api/v2/departments"
+
+def test_recorded_responses_replay_without_fetching(cache_dir, monkeypatch):
+    monkeypatch.setattr(api_cache, 'API_CACHE', 'record')
+    payload = {'tickets': [{'id': 7, 'description': 'Paper jam ' * 500}]}
+    assert api_cache.get_json('freshservice', "https://fs.example/api/v2/tickets", lambda: payload, {'page': 1}) == payload
+
+    monkeypatch.setattr(api_cache, 'API_CACHE', 'replay')
+    assert api_cache.delay(5) == 0
+    fetched = api_cache.get_json('freshservice', "https://other.example/api/v2/tickets",
+                                 lambda: pytest.fail("replay fetched"), {'page': 1})
+    assert fetched == payload
+
+def test_replay_miss_fails_like_a_request(cache_dir, monkeypatch):
+    monkeypatch.setattr(api_cache, 'API_CACHE', 'replay')
+    with pytest.raises(requests.exceptions.RequestException) as raised:
+        api_cache.get_json('datto', "https://datto.example/api/v2/account/sites", lambda: pytest.fail("replay fetched"))
+    assert isinstance(raised.value, api_cache.CacheMiss)
+    assert "/api/v2/account/sites" in str(raised.value)
+
+def test_failed_fetches_are_not_recorded(cache_dir, monkeypatch):
+    monkeypatch.setattr(api_cache, 'API_CACHE', 'record')
+
+    def fetch():
+        raise requests.exceptions.ConnectionError("down")
+
+    with pytest.raises(requests.exceptions.ConnectionError):
+        api_cache.get_json('datto', "https://datto.example/api/v2/account/sites", fetch)
+    assert list(cache_dir.iterdir()) == []
@@ -0,0 +1,81 @@
+# tests/test_asgi.py
+import json
+import asyncio
+
+import pytest
+
+import storage
+from storage import get_store
+from storage.base import ROOT_ID
+
+
+@pytest.fixture
+def asgi(app, monkeypatch):
+    monkeypatch.setattr(storage, '_async_store', None)
+    import asgi
+    store = get_store()
+    store.create_node('docs', ROOT_ID, 'Docs', is_folder=True)
+    store.create_node('refs', 'docs', 'Refs', is_folder=True, is_attached=True)
+    store.create_node('guide', 'docs', 'Guide.md')
+    store.update_node('guide', content='# Printer\n\nReset the printer.')
+    store.create_node('ref', 'refs', 'Ref.md')
+    return asgi
+
+
+def call(asgi, method, path, query='', headers=(), body=b''):
+    """(status, headers, body) of one request served by asgi.app."""
+    scope = {'type': 'http', 'method': method, 'path': path, 'query_string': query.encode(), 'root_path': '',
+             'headers': [(name.lower().encode(), value.encode()) for name, value in headers]}
+    messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(asgi.app(scope, receive, send))
+    start, response = sent
+    return start['status'], {k.decode(): v.decode() for k, v in start['headers']}, response['body']
+
+
+@pytest.mark.parametrize('method, path, query, body', [
+    ('GET', '/api/node/guide', '', None),
+    ('GET', '/api/node/missing', '', None),
+    ('GET', '/api/node/docs/children', '', None),
+    ('GET', '/api/search', 'query=printer', None),
+    ('GET', '/api/search', 'query=', None),
+    ('GET', '/api/context/guide', '', None),
+    ('POST', '/api/context/guide', '', {'excluded_ids': ['refs']}),
+    ('GET', '/api/context/missing', '', None),
+])
+def test_native_routes_answer_as_flask_does(asgi, client, method, path, query, body):
+    status, headers, data = call(asgi, method, path, query, [('Content-Type', 'application/json')],
+                                 json.dumps(body).encode() if body is not None else b'')
+    expected = client.open(path, method=method, query_string=query, json=body)
+    assert status == expected.status_code
+    assert json.loads(data) == expected.json
+    assert headers.get('etag') == expected.headers.get('ETag')
+
+def test_native_routes_answer_304_to_their_etag(asgi):
+    _, headers, _ = call(asgi, 'GET', '/api/context/guide')
+    status, _, body = call(asgi, 'GET', '/api/context/guide', headers=[('If-None-Match', headers['etag'])])
+    assert status == 304 and body == b''
+
+def test_large_native_responses_are_compressed(asgi):
+    get_store().update_node('guide', content='Printer ' * 2000)
+    _, headers, body = call(asgi, 'GET', '/api/node/guide', headers=[('Accept-Encoding', 'gzip')])
+    assert headers['content-encoding'] == 'gzip' and int(headers['content-length']) == len(body)
+
+def test_other_requests_go_to_flask(asgi, client):
+    json_type = [('Content-Type', 'application/json')]
+    status, _, body = call(asgi, 'POST', '/api/node', headers=json_type,
+                           body=json.dumps({'parent_id': 'docs', 'name': 'FAQ.md'}).encode())
+    assert status == 200 and json.loads(body)['success'] is True
+    assert [c['name'] for c in get_store().list_children('docs')] == ['Refs', 'FAQ.md', 'Guide.md']
+    # /api/context/batch is not taken for a node id.
+    status, _, body = call(asgi, 'POST', '/api/context/batch', headers=json_type,
+                           body=json.dumps({'ids': ['guide']}).encode())
+    assert status == 200
+    assert json.loads(body) == client.post('/api/context/batch', json={'ids': ['guide']}).json
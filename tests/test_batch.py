@@ -0,0 +1,62 @@
+# tests/test_batch.py
+import pytest
+
+from storage import get_store
+from storage.batch import prepare_batch, chunk_operations
+
+
+def test_temporary_ids_resolve_to_real_ones():
+    ops, temp_ids = prepare_batch([
+        {'op': 'create', 'parent_id': 'root', 'name': 'Docs', 'is_folder': True, 'temp_id': 'docs'},
+        {'op': 'create', 'parent_id': '$docs', 'name': 'Guide.md', 'is_attached': True, 'temp_id': 'guide'},
+        {'op': 'update', 'id': '$guide', 'content': 'Body'},
+    ])
+    assert ops[1]['parent_id'] == temp_ids['docs'] and ops[2]['id'] == temp_ids['guide']
+    # Only folders can be attached.
+    assert ops[1]['is_attached'] is False
+
+@pytest.mark.parametrize('operations, error', [
+    ([], "non-empty list"),
+    ([{'op': 'rename', 'id': 'a'}], "unknown op 'rename'"),
+    ([{'op': 'create', 'parent_id': 'root'}], "'name' is required"),
+    ([{'op': 'update', 'id': '$nope', 'name': 'x'}], "unknown temporary id '$nope'"),
+    ([{'op': 'update', 'id': 'a'}], "nothing to update"),
+    ([{'op': 'move', 'id': 'root', 'parent_id': 'a'}], "the root cannot be moved"),
+    ([{'op': 'delete', 'id': 'root'}], "the root cannot be deleted"),
+    ([{'op': 'create', 'parent_id': 'root', 'name': 'A', 'temp_id': 't'},
+      {'op': 'create', 'parent_id': 'root', 'name': 'B', 'temp_id': 't'}], "'t' is used twice"),
+])
+def test_invalid_operations_are_named(operations, error):
+    with pytest.raises(ValueError) as raised:
+        prepare_batch(operations)
+    assert error in str(raised.value)
+
+def test_dependent_operations_start_new_chunks():
+    ops, _ = prepare_batch([
+        {'op': 'create', 'parent_id': 'root', 'name': 'A', 'temp_id': 'a'},
+        {'op': 'create', 'parent_id': 'root', 'name': 'B'},
+        {'op': 'create', 'parent_id': '$a', 'name': 'A1'},
+        {'op': 'update', 'id': '$a', 'name': 'A2'},
+        {'op': 'update', 'id': '$a', 'content': 'x'},
+        {'op': 'delete', 'id': '$a'},
+    ])
+    assert [(kind, len(chunk)) for kind, chunk in chunk_operations(ops)] == [
+        ('create', 2), ('create', 1), ('update', 1), ('update', 1), ('delete', 1)]
+
+def test_batch_endpoint_applies_everything(client):
+    response = client.post('/api/batch', json={'operations': [
+        {'op': 'create', 'parent_id': 'root', 'name': 'Docs', 'is_folder': True, 'temp_id': 'docs'},
+        {'op': 'create', 'parent_id': '$docs', 'name': 'Guide.md', 'content': 'Body', 'temp_id': 'guide'},
+    ]})
+    assert response.status_code == 200 and response.json['success'] is True
+    guide_id = response.json['temp_ids']['guide']
+    assert [r['op'] for r in response.json['results']] == ['create', 'create']
+    assert get_store().get_node(guide_id)['content'] == 'Body'
+
+def test_a_failing_operation_applies_nothing(client):
+    response = client.post('/api/batch', json={'operations': [
+        {'op': 'create', 'parent_id': 'root', 'name': 'Docs', 'is_folder': True},
+        {'op': 'move', 'id': 'missing', 'parent_id': 'root'},
+    ]})
+    assert response.status_code == 400 and 'Operation 1' in response.json['error']
+    assert get_store().list_children('root') == []
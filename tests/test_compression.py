@@ -0,0 +1,71 @@
+# tests/test_compression.py
+import pytest
+
+import compression
+from storage.base import ROOT_ID
+from storage.sqlite_store import SQLiteStore
+
+BODY = "## Ticket #1\n\nThe printer on floor 3 jams on every second page.\n" * 100
+
+
+@pytest.mark.parametrize('codec', ['zlib', 'zstd'])
+def test_bodies_round_trip(monkeypatch, codec):
+    if codec == 'zstd':
+        pytest.importorskip("zstandard")
+    monkeypatch.setattr(compression, 'CONTENT_CODEC', codec)
+    stored_codec, data = compression.compress(BODY)
+    assert stored_codec == codec and len(data) < len(BODY) // 10
+    assert compression.decompress(stored_codec, data) == BODY
+
+def test_without_zstandard_bodies_use_zlib(monkeypatch):
+    monkeypatch.setattr(compression, '_zstd', False)
+    codec, data = compression.compress(BODY)
+    assert codec == 'zlib' and compression.decompress(codec, data) == BODY
+    with pytest.raises(RuntimeError):
+        compression.decompress('zstd', b'')
+
+def test_only_bodies_above_the_threshold_are_compressed(monkeypatch):
+    monkeypatch.setattr(compression, 'CONTENT_COMPRESS_MIN_BYTES', 100)
+    assert compression.should_compress('x' * 100) and not compression.should_compress('x' * 99)
+    assert not compression.should_compress('')
+    monkeypatch.setattr(compression, 'CONTENT_COMPRESS_MIN_BYTES', 0)
+    assert not compression.should_compress('x' * 10000)
+
+def test_dictionary_bodies_name_their_dictionary(monkeypatch):
+    pytest.importorskip("zstandard")
+    monkeypatch.setattr(compression, 'CONTENT_CODEC', 'zstd')
+    monkeypatch.setattr(compression, 'CONTENT_DICTIONARY_SIZE', 4096)
+    monkeypatch.setattr(compression, '_dictionaries', {})
+    samples = [BODY.replace('#1', f'#{n}').replace('floor 3', f'floor {n % 7}') for n in range(200)]
+    dictionary = compression.train_dictionary(samples)
+    codec, data = compression.compress(samples[5], dictionary)
+    assert codec == f"zstd:{dictionary[0]}"
+    monkeypatch.setattr(compression, '_dictionaries', {})
+    assert compression.decompress(codec, data, lambda h: dictionary[1] if h == dictionary[0] else None) == samples[5]
+    monkeypatch.setattr(compression, '_dictionaries', {})
+    with pytest.raises(RuntimeError):
+        compression.decompress(codec, data)
+
+def test_synced_bodies_leave_the_node_table(store):
+    if not isinstance(store, SQLiteStore):
+        pytest.skip("reads the SQLite tables directly")
+    store.ensure_companies_root()
+    store.upsert_company('ACME', 'Acme', 1)
+    store.upsert_user('ACME', 'Ann', 'ann@acme.example', 'Contact', 7)
+    store.upsert_ticket('ann@acme.example', 'ticket_1', 'Ticket 1.md', BODY)
+    store.upsert_ticket('ann@acme.example', 'ticket_2', 'Ticket 2.md', BODY)
+    row = store._conn().execute("SELECT content, content_size FROM nodes WHERE id = 'ticket_1'").fetchone()
+    assert row[0] is None and row[1] == len(BODY.encode('utf-8'))
+    assert store._conn().execute("SELECT count(*) FROM content_blobs").fetchone()[0] == 1
+    assert store.get_node('ticket_1')['content'] == BODY
+    assert [r['id'] for r in store.search('every second page', ROOT_ID)] == ['ticket_1', 'ticket_2']
+    store.delete_node('ticket_1')
+    assert store.purge_content_blobs() == 0
+    store.delete_node('ticket_2')
+    assert store.purge_content_blobs() == 1
+
+def test_search_terms_are_distinct_words_in_order_of_first_use():
+    assert compression.search_terms("The printer, the PRINTER and the drum") == ['the', 'printer', 'and', 'drum']
+    assert compression.search_terms(BODY, limit=4) == ['ticket', '1', 'the', 'printer']
+    assert compression.search_terms('x' * 100) == ['x' * compression.SEARCH_TERM_MAX_LENGTH]
+    assert compression.search_terms(None) == []
@@ -0,0 +1,52 @@
+# tests/test_context_batch.py
+import pytest
+
+from storage import get_store
+from storage.base import ROOT_ID
+
+
+@pytest.fixture
+def tree(client):
+    store = get_store()
+    store.create_node('docs', ROOT_ID, 'Docs', is_folder=True)
+    store.create_node('guide', 'docs', 'Guide.md')
+    store.update_node('guide', content='How to reset the VPN token')
+    store.create_node('faq', 'docs', 'FAQ.md')
+    store.update_node('faq', content='Frequently asked')
+    store.add_file('faq', 'file-1', 'faq.pdf')
+    store.create_node('refs', 'docs', 'Refs', is_folder=True, is_attached=True)
+    store.create_node('ref', 'refs', 'Ref.md')
+    store.update_node('ref', content='Firewall reference')
+    return store
+
+
+def test_each_node_gets_the_context_of_its_own_endpoint(client, tree):
+    response = client.post('/api/context/batch', json={'ids': ['guide', 'faq', 'missing', 'guide']})
+    assert response.status_code == 200
+    assert response.json['missing'] == ['missing']
+    contexts = response.json['contexts']
+    assert set(contexts) == {'guide', 'faq'}
+    for node_id in ('guide', 'faq'):
+        assert contexts[node_id] == client.get(f'/api/context/{node_id}').json['context']
+    assert '- faq.pdf' in contexts['faq'] and 'faq.pdf' not in contexts['guide']
+
+def test_merged_contexts_include_shared_blocks_once(client, tree):
+    response = client.post('/api/context/batch', json={'ids': ['guide', 'faq'], 'merge': True})
+    context = response.json['context']
+    assert context.count('## Context: Docs') == 1 and context.count('Firewall reference') == 1
+    assert context.count('# Context: KnowledgeTree Root') <= 1
+    assert context.endswith('## Attached Files for FAQ.md\n\n- faq.pdf')
+
+def test_exclusions_apply_to_every_node(client, tree):
+    response = client.post('/api/context/batch', json={'ids': ['guide', 'faq'], 'excluded_ids': ['refs']})
+    assert all('Firewall reference' not in context for context in response.json['contexts'].values())
+
+@pytest.mark.parametrize('payload', [{}, {'ids': []}, {'ids': 'guide'}])
+def test_ids_must_be_a_non_empty_list(client, payload):
+    assert client.post('/api/context/batch', json=payload).status_code == 400
+
+def test_batch_size_is_capped(client, monkeypatch):
+    import context_blocks
+
+    monkeypatch.setattr(context_blocks, 'MAX_CONTEXT_BATCH', 2)
+    assert client.post('/api/context/batch', json={'ids': ['a', 'b', 'c']}).status_code == 400
@@ -0,0 +1,77 @@
+# tests/test_context_blocks.py
+import pytest
+
+import context_blocks
+from storage.base import ROOT_ID
+
+
+@pytest.fixture
+def tree(store):
+    store.create_node('docs', ROOT_ID, 'Docs', is_folder=True)
+    store.create_node('guide', 'docs', 'Guide.md')
+    store.update_node('guide', content='How to reset the VPN token')
+    store.create_node('refs', 'docs', 'Refs', is_folder=True, is_attached=True)
+    store.create_node('ref', 'refs', 'Ref.md')
+    store.update_node('ref', content='Firewall reference')
+    store.create_node('sub', 'docs', 'Sub', is_folder=True)
+    store.create_node('deep', 'sub', 'Deep.md')
+    return store
+
+
+def context(store, node_id, excluded_ids=()):
+    path = store.context_path(node_id)
+    return context_blocks.assemble(path, context_blocks.load_blocks(store, [path], excluded_ids), excluded_ids)
+
+
+def test_blocks_render_each_folder_on_the_path(tree):
+    text = context(tree, 'deep')
+    assert text.startswith("## Context: Docs\n\nFile: Guide.md\n\nHow to reset the VPN token")
+    assert "File: Ref.md (from attached folder: Refs)\n\nFirewall reference" in text
+    assert text.endswith("### Context: Sub\n\nFile: Deep.md\n\n> No content.")
+
+def test_excluding_an_attached_folder_drops_its_segment(tree):
+    text = context(tree, 'deep', excluded_ids=['refs'])
+    assert 'Ref.md' not in text and 'Guide.md' in text
+
+def test_excluding_the_attached_folder_that_claimed_an_article_keeps_it(tree):
+    tree.create_node('manuals', 'docs', 'Manuals', is_folder=True, is_attached=True)
+    tree.create_node('vpn', 'manuals', 'Vpn.md')
+    tree.update_node('vpn', content='VPN client setup')
+    tree.bulk_load([], [{'parent': 'refs', 'child': 'vpn'}])
+    # Manuals comes first by name, so the stored block lists the article under it only.
+    assert "File: Vpn.md (from attached folder: Manuals)" in context(tree, 'deep')
+    text = context(tree, 'deep', excluded_ids=['manuals'])
+    assert "File: Vpn.md (from attached folder: Refs)\n\nVPN client setup" in text and 'Manuals' not in text
+    # The exclusion is not stored: the next plain read still has Manuals.
+    assert "(from attached folder: Manuals)" in context(tree, 'deep')
+
+def test_reads_recompute_only_stale_blocks(tree):
+    context(tree, 'deep')
+    stored = tree.stored_blocks(['docs', 'sub'])
+    tree.update_node('ref', content='Firewall reference v2')
+    path = tree.context_path('deep')
+    blocks = context_blocks.load_blocks(tree, [path])
+    assert 'Firewall reference v2' in blocks['docs'][1]['text']
+    # The edit sits below Docs' attached folder; Sub's block is unchanged.
+    assert tree.stored_blocks(['sub']) == {'sub': stored['sub']}
+    assert tree.stored_blocks(['docs'])['docs'] != stored['docs']
+
+def test_refresh_recomputes_the_blocks_an_edit_feeds(tree):
+    context(tree, 'deep')
+    since = context_blocks.refresh(tree, None)
+    tree.update_node('guide', content='Edited')
+    since = context_blocks.refresh(tree, since)
+    assert 'Edited' in tree.stored_blocks(['docs'])['docs']['segments'][0]['text']
+    # Nothing changed since: the next pass has nothing to do.
+    assert context_blocks.refresh(tree, since) == since
+
+def test_context_endpoint_assembles_blocks(client):
+    from storage import get_store
+
+    store = get_store()
+    store.create_node('docs', ROOT_ID, 'Docs', is_folder=True)
+    store.create_node('guide', 'docs', 'Guide.md')
+    store.update_node('guide', content='Body')
+    response = client.get('/api/context/guide')
+    assert response.status_code == 200 and 'File: Guide.md\n\nBody' in response.json['context']
+    assert client.get('/api/context/missing').status_code == 404
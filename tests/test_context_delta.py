@@ -0,0 +1,61 @@
+# tests/test_context_delta.py
+import pytest
+
+from storage import get_store
+from storage.base import ROOT_ID
+
+
+@pytest.fixture
+def tree(client):
+    store = get_store()
+    store.create_node('docs', ROOT_ID, 'Docs', is_folder=True)
+    store.create_node('guide', 'docs', 'Guide.md')
+    store.update_node('guide', content='How to reset the VPN token')
+    store.create_node('faq', 'docs', 'FAQ.md')
+    store.create_node('archive', ROOT_ID, 'Archive', is_folder=True)
+    return store
+
+
+def delta(client, since, node_id='guide'):
+    response = client.get(f'/api/context/{node_id}/delta', query_string={'since': since})
+    assert response.status_code == 200
+    return response.json
+
+def block(result, node_id):
+    return next(b for b in result['blocks'] if b['id'] == node_id)
+
+
+def test_nothing_changed_since_the_cursor(client, tree):
+    cursor = client.get('/api/context/guide').json['cursor']
+    result = delta(client, cursor)
+    assert result['reset'] is False and result['cursor'] == cursor
+    assert not any(b['changed'] for b in result['blocks'])
+
+def test_edits_send_only_the_changed_articles(client, tree):
+    cursor = client.get('/api/context/guide').json['cursor']
+    tree.update_node('faq', content='Frequently asked')
+    result = delta(client, cursor)
+    docs = block(result, 'docs')
+    assert docs['changed'] and [a['id'] for a in docs['articles']] == ['faq']
+    assert docs['articles'][0]['text'] == "File: FAQ.md\n\nFrequently asked"
+    assert result['cursor'] != cursor and not delta(client, result['cursor'])['blocks'][1]['changed']
+
+def test_articles_that_leave_are_listed_as_removed(client, tree):
+    cursor = client.get('/api/context/guide').json['cursor']
+    tree.move_node('faq', 'archive')
+    docs = block(delta(client, cursor), 'docs')
+    assert docs['removed'] == ['faq'] and docs['articles'] == []
+
+@pytest.mark.parametrize('since', [None, '', 'garbage', 'other-epoch-1-abc', 'x-1-y'])
+def test_unusable_cursors_reset_to_the_whole_context(client, tree, since):
+    result = delta(client, since)
+    assert result['reset'] is True
+    assert {a['id'] for a in block(result, 'docs')['articles']} == {'guide', 'faq'}
+
+def test_a_moved_node_gets_its_whole_context_again(client, tree):
+    cursor = client.get('/api/context/guide').json['cursor']
+    tree.move_node('guide', 'archive')
+    assert delta(client, cursor)['reset'] is True
+
+def test_missing_nodes_are_404(client):
+    assert client.get('/api/context/missing/delta').status_code == 404
@@ -0,0 +1,69 @@
+# tests/test_context_walk.py
+import random
+
+import pytest
+
+from storage.base import ROOT_ID, TreeStore
+
+
+def random_dag(store, rng, size=40):
+    """
+    A folder with attached folders whose subtrees share nodes through extra
+    parents. Extra links only point at later nodes, so it stays acyclic.
+    """
+    store.create_node('top', ROOT_ID, 'Top', is_folder=True)
+    folders, nodes, rels = ['top'], [], []
+    for n in range(size):
+        node_id, is_folder = f'n{n}', rng.random() < 0.4
+        parent = rng.choice(folders)
+        attached = is_folder and parent == 'top' and rng.random() < 0.6
+        store.create_node(node_id, parent, f'{rng.choice("abc")}{n}', is_folder=is_folder, is_attached=attached)
+        if is_folder:
+            folders.append(node_id)
+        nodes.append(node_id)
+    for _ in range(size // 2):
+        parent, child = rng.choice(folders[1:] or folders), rng.choice(nodes)
+        if parent == 'top' or int(parent[1:]) < int(child[1:]):
+            rels.append({'parent': parent, 'child': child})
+    store.bulk_load([], rels)
+
+
+def walk(store, folder_id, excluded_ids=()):
+    return [(a['id'], a['source_id']) for a in TreeStore.context_articles(store, folder_id, excluded_ids)]
+
+@pytest.mark.parametrize('seed', range(30))
+def test_the_sqlite_query_matches_the_generic_walk(store, seed):
+    rng = random.Random(seed)
+    random_dag(store, rng)
+    attached = [c['id'] for c in store.list_children('top') if c['is_attached']]
+    excluded = rng.sample(attached, min(len(attached), 1))
+    for excluded_ids in ((), excluded):
+        expected = walk(store, 'top', excluded_ids)
+        actual = [(a['id'], a['source_id']) for a in store.context_articles('top', excluded_ids)]
+        assert actual == expected
+        assert len({node_id for node_id, _ in actual}) == len(actual)
+
+def test_shared_subtrees_are_walked_once(store):
+    store.create_node('top', ROOT_ID, 'Top', is_folder=True)
+    store.create_node('a', 'top', 'A', is_folder=True, is_attached=True)
+    store.create_node('b', 'top', 'B', is_folder=True, is_attached=True)
+    store.create_node('shared', 'a', 'Shared', is_folder=True)
+    store.create_node('doc', 'shared', 'Doc.md')
+    store.bulk_load([], [{'parent': 'b', 'child': 'shared'}, {'parent': 'b', 'child': 'doc'}])
+    assert [(a['id'], a['source_id']) for a in store.context_articles('top')] == [('doc', 'b')]
+    assert walk(store, 'top') == [('doc', 'b')]
+    assert [(a['id'], a['source_id']) for a in store.context_articles('top', ['b'])] == [('doc', 'a')]
+
+def test_bounds_limit_depth_and_article_count(store, monkeypatch):
+    store.create_node('top', ROOT_ID, 'Top', is_folder=True)
+    store.create_node('refs', 'top', 'Refs', is_folder=True, is_attached=True)
+    parent = 'refs'
+    for depth in range(5):
+        store.create_node(f'doc{depth}', parent, f'Doc{depth}.md')
+        store.create_node(f'level{depth}', parent, f'Level{depth}', is_folder=True)
+        parent = f'level{depth}'
+    monkeypatch.setattr(store, 'context_max_depth', 3, raising=False)
+    assert [a['id'] for a in store.context_articles('top')] == ['doc0', 'doc1', 'doc2']
+    monkeypatch.setattr(store, 'context_max_depth', 16)
+    monkeypatch.setattr(store, 'context_max_articles', 2, raising=False)
+    assert [a['id'] for a in store.context_articles('top')] == ['doc0', 'doc1']
@@ -0,0 +1,608 @@
+# tests/test_contract.py
+"""
+Behavioural contract every TreeStore backend must satisfy, run against each
+backend by the parametrised `store` fixture (see conftest.py). Each test
+gets a freshly reinitialized store.
+"""
+import pytest
+
+import compression
+from storage.base import ROOT_ID, ROOT_NAME
+
+
+def build_sample_tree(store):
+    """root/Docs/{Guide.md, Sub/Deep.md, Refs (attached)/{Ref.md, Inner/Nested.md}}"""
+    store.create_node('docs', ROOT_ID, 'Docs', is_folder=True)
+    store.create_node('guide', 'docs', 'Guide.md')
+    store.update_node('guide', content='How to reset the VPN token')
+    store.create_node('sub', 'docs', 'Sub', is_folder=True)
+    store.create_node('deep', 'sub', 'Deep.md')
+    store.update_node('deep', content='Printer queue notes')
+    store.create_node('refs', 'docs', 'Refs', is_folder=True, is_attached=True)
+    store.create_node('ref', 'refs', 'Ref.md')
+    store.update_node('ref', content='Firewall reference')
+    store.create_node('inner', 'refs', 'Inner', is_folder=True)
+    store.create_node('nested', 'inner', 'Nested.md')
+    store.update_node('nested', content='Nested firewall rule')
+
+
+def test_incomplete_backends_cannot_be_instantiated():
+    from storage.base import TreeStore
+
+    class Partial(TreeStore):
+        def init_schema(self):
+            pass
+
+    with pytest.raises(TypeError):
+        Partial()
+
+def test_root_exists(store):
+    assert store.path_names(ROOT_ID) == [ROOT_NAME]
+    assert store.list_children(ROOT_ID) == []
+    root = store.get_node(ROOT_ID)
+    assert root['is_folder'] is True and root['name'] == ROOT_NAME
+
+def test_create_and_browse(store):
+    build_sample_tree(store)
+    children = store.list_children('docs')
+    assert [c['name'] for c in children] == ['Refs', 'Sub', 'Guide.md'], children
+    assert children[0]['is_attached'] is True and children[2]['is_folder'] is False
+    assert children[2]['read_only'] is False
+    assert store.resolve_path(['Docs', 'Sub', 'Deep.md']) == 'deep'
+    assert store.resolve_path(['Docs', 'Missing']) is None
+    assert store.resolve_path([]) == ROOT_ID
+    assert store.path_nodes('deep') == [{'id': ROOT_ID, 'name': ROOT_NAME}, {'id': 'docs', 'name': 'Docs'},
+                                        {'id': 'sub', 'name': 'Sub'}, {'id': 'deep', 'name': 'Deep.md'}]
+    assert store.path_nodes('missing') is None
+
+def test_create_requires_parent(store):
+    store.create_node('orphan', 'no-such-parent', 'Orphan.md')
+    assert store.get_node('orphan') is None
+
+def test_get_update_and_files(store):
+    build_sample_tree(store)
+    node = store.get_node('guide')
+    assert node['content'] == 'How to reset the VPN token' and node['files'] == []
+    store.update_node('guide', name='Guide v2.md')
+    store.add_file('guide', 'file-1', 'diagram.png')
+    node = store.get_node('guide')
+    assert node['name'] == 'Guide v2.md' and node['content'] == 'How to reset the VPN token'
+    assert node['files'] == [{'id': 'file-1', 'filename': 'diagram.png'}]
+    assert store.file_names('guide') == ['diagram.png']
+    assert store.get_node('missing') is None
+
+def test_search(store):
+    build_sample_tree(store)
+    assert {r['id'] for r in store.search('FIREWALL')} == {'ref', 'nested'}
+    assert {r['id'] for r in store.search('guide')} == {'guide'}
+    assert {r['id'] for r in store.search('ne', start_node_id='inner')} == {'inner', 'nested'}
+    assert {r['id'] for r in store.search('firewall', start_node_id='sub')} == set()
+    result = store.search('printer')[0]
+    assert result['path_names'] == [ROOT_NAME, 'Docs', 'Sub', 'Deep.md'] and result['is_folder'] is False
+    assert len(store.search('.md', limit=2)) == 2
+
+def test_search_documents(store):
+    build_sample_tree(store)
+    epoch, version, documents = store.search_documents()
+    assert {d['id'] for d in documents} == {'docs', 'guide', 'sub', 'deep', 'refs', 'ref', 'inner', 'nested'}
+    store.update_node('guide', content='Rewritten')
+    assert store.search_documents(version)[:2] != (epoch, version)
+    changed = store.search_documents(version)[2]
+    assert changed == [{'id': 'guide', 'name': 'Guide.md', 'content': 'Rewritten', 'is_folder': False}], changed
+    assert set(store.descendant_ids('refs')) == {'refs', 'ref', 'inner', 'nested'}
+    assert store.descendant_ids('missing') == []
+
+def test_context(store):
+    build_sample_tree(store)
+    articles = store.context_articles('docs')
+    assert {(a['id'], a['source_folder']) for a in articles} == {('guide', ''), ('ref', 'Refs'), ('nested', 'Refs')}
+    assert {a['id'] for a in store.context_articles('docs', excluded_ids=['refs'])} == {'guide'}
+    assert {a['id'] for a in store.context_articles('sub')} == {'deep'}
+    assert store.attached_folders_on_path('deep') == [{'id': 'refs', 'name': 'Refs'}]
+    assert store.attached_folders_on_path(ROOT_ID) == []
+
+    try:
+        store.context_max_depth = 1
+        assert {a['id'] for a in store.context_articles('docs')} == {'guide', 'ref'}
+        store.context_max_depth, store.context_max_articles = 16, 2
+        assert [a['id'] for a in store.context_articles('docs')] == ['guide', 'ref']
+    finally:
+        del store.context_max_depth, store.context_max_articles
+    # Extra parents inside and around the attached folder: every article is still listed once.
+    store.bulk_load([], [{'parent': 'refs', 'child': 'nested'}, {'parent': 'refs', 'child': 'guide'}])
+    articles = store.context_articles('docs')
+    assert sorted(a['id'] for a in articles) == ['guide', 'nested', 'ref'], articles
+    assert {a['id']: a['source_id'] for a in articles} == {'guide': '', 'ref': 'refs', 'nested': 'refs'}
+
+def test_context_blocks(store):
+    import context_blocks
+    build_sample_tree(store)
+    store.create_node('other', ROOT_ID, 'Other', is_folder=True)
+    store.create_node('elsewhere', 'other', 'Elsewhere.md')
+    path = store.context_path('deep')
+    assert [n['id'] for n in path['nodes']] == [ROOT_ID, 'docs', 'sub', 'deep'] and store.context_path('missing') is None
+    blocks = context_blocks.load_blocks(store, [path])
+    assert [s['source_id'] for s in blocks['docs']] == ['', 'refs'] and blocks['deep'] == []
+    assert set(store.stored_blocks([ROOT_ID, 'docs', 'sub', 'deep', 'other'])) == {ROOT_ID, 'docs', 'sub', 'deep'}
+    paths = store.context_paths(['deep', 'guide', ROOT_ID, 'missing'])
+    assert set(paths) == {'deep', 'guide', ROOT_ID} and paths['deep'] == path
+    assert [n['id'] for n in paths['guide']['nodes']] == [ROOT_ID, 'docs', 'guide']
+    store.add_file('guide', 'file-1', 'diagram.png')
+    assert store.file_names_by_node(['guide', 'deep', 'missing']) == {'guide': ['diagram.png']}
+
+    since, stale = store.blocks_to_refresh(None)
+    assert stale == {}
+    store.update_node('elsewhere', content='No stored block reads this')
+    assert store.blocks_to_refresh(since)[1] == {}
+    store.update_node('nested', content='Changed inside the attached folder')
+    assert set(store.blocks_to_refresh(since)[1]) == {'docs'}, 'attached folders feed their parent block'
+    since = context_blocks.refresh(store, since)
+    assert 'Changed inside' in store.stored_blocks(['docs'])['docs']['segments'][1]['text']
+    assert store.blocks_to_refresh(since)[1] == {}
+
+    store.update_node('deep', content='Edited')
+    assert set(store.blocks_to_refresh(since)[1]) == {'sub', 'deep'}
+    old = store.stored_blocks(['sub'])['sub']
+    store.save_blocks([{'folder_id': 'sub', 'version': old['version'] - 1, 'segments': []}])
+    assert store.stored_blocks(['sub'])['sub'] == old, 'an older block never replaces a newer one'
+    assert 'Edited' in context_blocks.assemble(store.context_path('deep'),
+                                               context_blocks.load_blocks(store, [store.context_path('deep')]))
+    store.delete_node('refs')
+    # sub and deep were recomputed by the read; the root's child docs was stamped.
+    assert set(store.blocks_to_refresh(since)[1]) == {ROOT_ID, 'docs'}
+    assert store.stored_blocks(['refs']) == {}
+
+def test_context_delta(store):
+    import context_blocks
+    build_sample_tree(store)
+    store.create_node('other', ROOT_ID, 'Other', is_folder=True)
+
+    def delta(since, node_id='deep'):
+        result = context_blocks.context_delta(store, store.context_path(node_id), since)
+        return result, {b['id']: b for b in result['blocks'] if b['changed']}
+
+    full, changed = delta(None)
+    assert full['reset'] and set(changed) == {ROOT_ID, 'docs', 'sub', 'deep'} and full['files'] == []
+    assert {a['id'] for a in changed['docs']['articles']} == {'guide', 'ref', 'nested'}
+    unchanged, changed = delta(full['cursor'])
+    assert not unchanged['reset'] and changed == {} and 'files' not in unchanged
+    assert [b['depth'] for b in unchanged['blocks']] == [1, 2, 3, 4]
+
+    store.update_node('nested', content='Changed inside the attached folder')
+    result, changed = delta(full['cursor'])
+    assert set(changed) == {'docs'} and [a['id'] for a in changed['docs']['articles']] == ['nested']
+    assert changed['docs']['removed'] == [] and 'Changed inside' in changed['docs']['articles'][0]['text']
+
+    store.move_node('refs', 'other')
+    store.move_node('guide', 'sub')
+    result, changed = delta(result['cursor'])
+    assert sorted(changed['docs']['removed']) == ['guide', 'nested', 'ref'] and changed['docs']['articles'] == []
+    assert [a['id'] for a in changed['sub']['articles']] == ['guide'], 'a moved-in article arrives'
+    store.delete_node('guide')
+    result, changed = delta(result['cursor'])
+    assert changed['sub']['removed'] == ['guide']
+    # docs is listed because its child sub was stamped, but nothing in its block changed.
+    assert changed['docs']['articles'] == changed['docs']['removed'] == []
+    assert delta(result['cursor'])[1] == {}
+
+    # The node moving, or a new epoch, makes the cursor unusable.
+    cursor = result['cursor']
+    store.move_node('sub', 'other')
+    assert delta(cursor)[0]['reset']
+    assert delta('garbage')[0]['reset']
+    cursor = delta(None)[0]['cursor']
+    store.reinitialize()
+    build_sample_tree(store)
+    assert delta(cursor)[0]['reset']
+
+def test_version_stamps(store):
+    build_sample_tree(store)
+    store.create_node('other', ROOT_ID, 'Other', is_folder=True)
+    store.create_node('elsewhere', 'other', 'Elsewhere.md')
+    node, context = store.node_stamp('guide'), store.context_stamp('guide')
+    assert node['read_only'] is False and store.node_stamp('missing') is None
+    assert store.context_stamp('missing') is None
+
+    store.update_node('guide', content='How to reset the VPN token')
+    assert store.node_stamp('guide') == node, 'a write that changes nothing keeps the stamp'
+    store.update_node('elsewhere', content='Unrelated')
+    assert store.context_stamp('guide') == context, 'writes outside the context keep the stamp'
+
+    store.update_node('nested', content='Changed deep inside an attached folder')
+    assert store.node_stamp('guide') == node
+    assert store.context_stamp('guide') != context
+    context = store.context_stamp('guide')
+    store.add_file('guide', 'file-1', 'diagram.png')
+    assert store.node_stamp('guide') != node and store.context_stamp('guide') != context
+    context = store.context_stamp('deep')
+    store.delete_node('ref')
+    assert store.context_stamp('deep') != context
+
+    stamp = store.node_stamp(ROOT_ID)
+    store.reinitialize()
+    assert store.node_stamp(ROOT_ID) != stamp, 'reinitializing starts a new epoch'
+
+def test_move_subtree(store):
+    build_sample_tree(store)
+    store.create_node('other', ROOT_ID, 'Other', is_folder=True)
+    store.move_node('refs', 'other')
+    assert [c['id'] for c in store.list_children('docs')] == ['sub', 'guide']
+    assert store.path_names('nested') == [ROOT_NAME, 'Other', 'Refs', 'Inner', 'Nested.md']
+    assert {r['id'] for r in store.search('firewall', start_node_id='other')} == {'ref', 'nested'}
+    assert {r['id'] for r in store.search('firewall', start_node_id='docs')} == set()
+    assert {a['id'] for a in store.context_articles('other')} == {'ref', 'nested'}
+    for args in (('other', 'inner'), ('refs', 'refs'), ('missing', 'docs'), ('refs', 'missing'), ('refs', 'docs', 'sub'),
+                 (ROOT_ID, 'other')):
+        try:
+            store.move_node(*args)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError(f'move_node{args} must raise ValueError')
+    assert store.path_names('nested')[1] == 'Other'
+
+def test_copy_subtree(store):
+    build_sample_tree(store)
+    store.add_file('ref', 'file-1', 'diagram.png')
+    store.move_node('deep', 'inner', old_parent_id='sub')
+    store.create_node('other', ROOT_ID, 'Other', is_folder=True)
+    context = store.context_stamp('other')
+    copy_id = store.copy_node('refs', 'other', name='Refs copy')
+    assert copy_id != 'refs' and store.context_stamp('other') != context
+    copy = store.get_node(copy_id)
+    assert copy['name'] == 'Refs copy' and copy['is_attached'] is True and copy['read_only'] is False
+    assert [c['name'] for c in store.list_children(copy_id)] == ['Inner', 'Ref.md']
+    assert store.path_names(store.resolve_path(['Other', 'Refs copy', 'Inner', 'Deep.md']))[1] == 'Other'
+    copied_ref = store.resolve_path(['Other', 'Refs copy', 'Ref.md'])
+    assert copied_ref not in (None, 'ref') and store.file_names(copied_ref) == ['diagram.png']
+    assert {r['id'] for r in store.search('firewall')} == {'ref', 'nested', copied_ref,
+                                                            store.resolve_path(['Other', 'Refs copy', 'Inner', 'Nested.md'])}
+    assert {a['name'] for a in store.context_articles('other')} == {'Ref.md', 'Nested.md', 'Deep.md'}
+    # The original is untouched, and its files stay its own.
+    assert [c['id'] for c in store.list_children('refs')] == ['inner', 'ref']
+    assert store.file_names('ref') == ['diagram.png']
+    for args in (('docs', 'inner'), ('refs', 'refs'), ('missing', 'docs'), ('refs', 'missing')):
+        try:
+            store.copy_node(*args)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError(f'copy_node{args} must raise ValueError')
+
+    # Synced nodes are copied as plain editable nodes the sync will not match,
+    # and a node linked twice inside the subtree is copied once.
+    store.ensure_companies_root()
+    store.upsert_company('1001', 'Acme', 77)
+    store.upsert_user('1001', 'Ann Lee', 'ann@acme.example', '# Contact', 501)
+    store.ensure_assets_folder('1001')
+    store.upsert_asset('1001', 'dev-1', 'WS-1.md', '# Computer')
+    store.link_asset_to_user('ann@acme.example', 'dev-1')
+    company_copy = store.copy_node('1001', 'other', name='Acme copy')
+    assert store.get_node(company_copy)['read_only'] is False
+    asset_copy = store.resolve_path(['Other', 'Acme copy', 'Assets', 'WS-1.md'])
+    assert asset_copy != 'dev-1'
+    assert asset_copy in [c['id'] for c in store.list_children(store.resolve_path(['Other', 'Acme copy', 'Users', 'Ann Lee']))]
+    store.upsert_user('1001', 'Ann Lee', 'ann@acme.example', '# Changed', 501)
+    store.upsert_asset('1001', 'dev-1', 'WS-1.md', '# Changed')
+    assert store.get_node(store.resolve_path(['Other', 'Acme copy', 'Users', 'Ann Lee', 'Contact.md']))['content'] == '# Contact'
+    assert store.get_node(asset_copy)['content'] == '# Computer'
+    assert store.user_email_for_requester(501) == 'ann@acme.example'
+    assert store.company_users('1001') == [{'name': 'Ann Lee', 'email': 'ann@acme.example'}]
+
+def test_batch_operations(store):
+    from storage.batch import prepare_batch
+    build_sample_tree(store)
+    ops, temp_ids = prepare_batch([
+        {'op': 'create', 'parent_id': 'docs', 'name': 'New', 'is_folder': True, 'temp_id': 'f'},
+        {'op': 'create', 'parent_id': '$f', 'name': 'A.md', 'content': 'alpha', 'temp_id': 'a'},
+        {'op': 'create', 'parent_id': '$f', 'name': 'B.md', 'temp_id': 'b'},
+        {'op': 'update', 'id': '$b', 'name': 'B2.md', 'content': 'beta'},
+        {'op': 'move', 'id': 'deep', 'parent_id': '$f'},
+        {'op': 'delete', 'id': 'sub'},
+    ])
+    store.apply_batch(ops)
+    assert [c['name'] for c in store.list_children(temp_ids['f'])] == ['A.md', 'B2.md', 'Deep.md']
+    assert store.get_node(temp_ids['b'])['content'] == 'beta'
+    assert store.get_node('sub') is None and store.get_node('deep') is not None
+
+    ops, _ = prepare_batch([
+        {'op': 'update', 'id': 'guide', 'content': 'rolled back'},
+        {'op': 'create', 'parent_id': 'missing', 'name': 'X.md'},
+    ])
+    try:
+        store.apply_batch(ops)
+    except ValueError as e:
+        assert 'Operation 1' in str(e), e
+    else:
+        raise AssertionError('a batch with a failing operation must raise ValueError')
+    assert store.get_node('guide')['content'] == 'How to reset the VPN token'
+
+def test_delete_subtree(store):
+    build_sample_tree(store)
+    store.delete_node('refs')
+    for node_id in ('refs', 'ref', 'inner', 'nested'):
+        assert store.get_node(node_id) is None, node_id
+    assert store.search('firewall') == []
+    assert [c['id'] for c in store.list_children('docs')] == ['sub', 'guide']
+
+def test_export_import_roundtrip(store):
+    build_sample_tree(store)
+    store.ensure_companies_root()
+    items = sorted(store.export_user_items(), key=lambda x: x['path'])
+    paths = [item['path'] for item in items]
+    assert 'Docs/Refs/Inner/Nested.md' in paths and 'Docs/Guide.md' in paths
+    assert 'Companies' in paths
+    store.reinitialize()
+    store.import_items(items)
+    assert store.get_node(store.resolve_path(['Docs', 'Refs', 'Inner', 'Nested.md']))['content'] == 'Nested firewall rule'
+    assert store.list_children(store.resolve_path(['Docs']))[0]['is_attached'] is True
+    # Importing again merges instead of duplicating.
+    store.import_items(items)
+    assert len(store.list_children(store.resolve_path(['Docs']))) == 3
+    try:
+        store.import_items([{'path': 'Nowhere/File.md', 'content': 'x', 'is_folder': False}])
+    except ValueError:
+        pass
+    else:
+        raise AssertionError('import with a missing parent folder must raise ValueError')
+
+def test_freshservice_sync(store):
+    store.ensure_companies_root()
+    for _ in range(2):
+        store.upsert_company('1001', 'Acme', 77)
+        store.upsert_user('1001', 'Ann Lee', 'ann@acme.example', '# Contact', 501)
+    assert store.resolve_path(['Companies', 'Acme', 'Users', 'Ann Lee', 'Contact.md']) == 'contact_for_ann@acme.example'
+    assert [c['name'] for c in store.list_children('ann@acme.example')] == ['Tickets', 'Contact.md']
+    assert store.get_node('contact_for_ann@acme.example')['read_only'] is True
+    assert store.company_users('1001') == [{'name': 'Ann Lee', 'email': 'ann@acme.example'}]
+    assert store.user_email_for_requester(501) == 'ann@acme.example'
+    assert store.user_email_for_requester(999) is None
+    # Users for companies that were never synced are skipped.
+    store.upsert_user('9999', 'Nobody', 'nobody@example', '# Contact', 502)
+    assert store.get_node('nobody@example') is None
+
+def test_datto_sync(store):
+    store.ensure_companies_root()
+    store.upsert_company('1001', 'Acme', 77)
+    store.upsert_user('1001', 'Ann Lee', 'ann@acme.example', '# Contact', 501)
+    store.ensure_assets_folder('1001')
+    store.ensure_assets_folder('9999')
+    assert store.get_node('assets_for_9999') is None
+    for _ in range(2):
+        store.upsert_asset('1001', 'dev-1', 'WS-1.md', '# Computer')
+        store.link_asset_to_user('ann@acme.example', 'dev-1')
+    assert [c['id'] for c in store.list_children('assets_for_1001')] == ['dev-1']
+    assert 'dev-1' in [c['id'] for c in store.list_children('ann@acme.example')]
+    assert store.list_children('contact_for_ann@acme.example') == []
+    assert len(store.path_nodes('dev-1')) == 5
+    # The asset is linked under two folders but is one article in the user's context.
+    assert [a['id'] for a in store.context_articles('ann@acme.example')].count('dev-1') == 1
+
+def test_ticket_sync(store):
+    assert store.latest_ticket_number() is None
+    store.ensure_companies_root()
+    store.upsert_company('1001', 'Acme', 77)
+    store.upsert_user('1001', 'Ann Lee', 'ann@acme.example', '# Contact', 501)
+    store.upsert_ticket('ann@acme.example', 'ticket_600', '600_Printer.md', 'old')
+    store.upsert_ticket('ann@acme.example', 'ticket_600', '600_Printer jam.md', 'new')
+    store.upsert_ticket('ann@acme.example', 'ticket_1200', '1200_VPN.md', 'vpn')
+    store.upsert_ticket('ghost@acme.example', 'ticket_1300', '1300_Ghost.md', 'ghost')
+    assert store.latest_ticket_number() == 1200
+    tickets = store.list_children('tickets_for_ann@acme.example')
+    assert [t['name'] for t in tickets] == ['1200_VPN.md', '600_Printer jam.md']
+    assert store.get_node('ticket_600')['content'] == 'new'
+    assert {a['source_folder'] for a in store.context_articles('ann@acme.example')} == {'', 'Tickets'}
+    assert store.get_node('ticket_1300') is None
+
+def test_compressed_content(store):
+    threshold = compression.CONTENT_COMPRESS_MIN_BYTES
+    compression.CONTENT_COMPRESS_MIN_BYTES = 1024
+    try:
+        store.ensure_companies_root()
+        store.upsert_company('1001', 'Acme', 77)
+        store.upsert_user('1001', 'Ann Lee', 'ann@acme.example', '# Contact', 501)
+        store.create_node('docs', ROOT_ID, 'Docs', is_folder=True)
+        body = "# Ticket #700: Printer\n\n" + "Paper jams in tray two on the second floor. " * 60
+        store.upsert_ticket('ann@acme.example', 'ticket_700', '700_Printer.md', body)
+        stamp = store.node_stamp('ticket_700')
+        store.upsert_ticket('ann@acme.example', 'ticket_700', '700_Printer.md', body)
+        assert store.node_stamp('ticket_700') == stamp
+        assert store.get_node('ticket_700')['content'] == body
+        articles = {a['id']: a for a in store.context_articles('ann@acme.example')}
+        assert articles['ticket_700']['content'] == body
+        assert {d['id']: d['content'] for d in store.search_documents()[2]}['ticket_700'] == body
+        # Copies share the body until they are edited; exports read it back.
+        copy_id = store.copy_node('ticket_700', 'docs')
+        assert store.get_node(copy_id)['content'] == body
+        assert {i['path']: i['content'] for i in store.export_user_items()}['Docs/700_Printer.md'] == body
+        store.update_node(copy_id, content='Edited copy')
+        assert store.get_node(copy_id)['content'] == 'Edited copy'
+        # Superseded and deleted bodies are purged once nothing refers to them.
+        store.upsert_ticket('ann@acme.example', 'ticket_700', '700_Printer.md', body + "Resolved.")
+        assert store.node_stamp('ticket_700') != stamp
+        assert store.get_node('ticket_700')['content'] == body + "Resolved."
+        assert store.purge_content_blobs() == 1
+        store.delete_node('ticket_700')
+        assert store.purge_content_blobs() == 1
+        assert store.purge_content_blobs() == 0
+    finally:
+        compression.CONTENT_COMPRESS_MIN_BYTES = threshold
+
+def test_compressed_search(store):
+    store.ensure_companies_root()
+    store.upsert_company('1001', 'Acme', 77)
+    store.upsert_user('1001', 'Ann Lee', 'ann@acme.example', '# Contact', 501)
+    store.create_node('docs', ROOT_ID, 'Docs', is_folder=True)
+    body = "# Ticket #710: Scanner\n\n" + "The scanner drops pages mid batch. " * 80 + "Fixed by Zanzibar firmware."
+    assert compression.should_compress(body) and len(body.encode('utf-8')) > 2048
+    store.upsert_ticket('ann@acme.example', 'ticket_710', '710_Scanner.md', body)
+    # The term only appears at the end of a body stored compressed.
+    assert [r['id'] for r in store.search('zanzibar FIRMWARE')] == ['ticket_710']
+    copy_id = store.copy_node('ticket_710', 'docs')
+    assert {r['id'] for r in store.search('zanzibar')} == {'ticket_710', copy_id}
+    store.update_node(copy_id, content='Edited copy')
+    assert [r['id'] for r in store.search('zanzibar')] == ['ticket_710']
+    store.upsert_ticket('ann@acme.example', 'ticket_710', '710_Scanner.md', 'Short again')
+    assert store.search('zanzibar') == []
+
+def test_sync_sweep(store):
+    store.ensure_companies_root()
+    store.upsert_company('1001', 'Acme', 77)
+    store.upsert_user('1001', 'Old Timer', 'old@acme.example', '# Contact', 500)
+    for email, requester in (('ann@acme.example', 501), ('bob@acme.example', 502)):
+        store.upsert_user('1001', email, email, '# Contact', requester, run_id='fs-1')
+    store.ensure_assets_folder('1001')
+    for uid in ('dev-1', 'dev-2', 'dev-3'):
+        store.upsert_asset('1001', uid, f'{uid}.md', '# Computer', run_id='datto-1')
+    store.link_asset_to_user('ann@acme.example', 'dev-1')
+    store.link_asset_to_user('bob@acme.example', 'dev-2')
+    store.upsert_ticket('bob@acme.example', 'ticket_9', '9_Printer.md', '# Printer', run_id='tickets-1')
+    store.create_node('docs', ROOT_ID, 'Docs', is_folder=True)
+
+    # A later run sees only Ann. Recording the run is not a change.
+    stamp = store.node_stamp('contact_for_ann@acme.example')
+    store.upsert_user('1001', 'ann@acme.example', 'ann@acme.example', '# Contact', 501, run_id='fs-2')
+    assert store.node_stamp('contact_for_ann@acme.example') == stamp
+    # Contacts synced before run ids existed were not seen either.
+    assert store.sweep_unseen('freshservice', 'fs-2', dry_run=True) == {'seen': 1, 'unseen': 2, 'deleted': 0}
+    assert store.get_node('contact_for_bob@acme.example') is not None
+    assert store.sweep_unseen('freshservice', 'fs-2') == {'seen': 1, 'unseen': 2, 'deleted': 2}
+    assert store.get_node('contact_for_bob@acme.example') is None
+    assert store.get_node('contact_for_old@acme.example') is None
+    assert store.get_node('contact_for_ann@acme.example') is not None
+    # An unseen contact's user folder goes with it, Tickets and all, but its devices stay.
+    for node_id in ('bob@acme.example', 'tickets_for_bob@acme.example', 'ticket_9', 'old@acme.example'):
+        assert store.get_node(node_id) is None, node_id
+    assert [c['id'] for c in store.list_children('users_for_1001')] == ['ann@acme.example']
+    assert store.path_names('dev-2') == ['KnowledgeTree Root', 'Companies', 'Acme', 'Assets', 'dev-2.md']
+
+    # Deletion runs in batches, and copies of synced nodes are not the sync's.
+    copy_id = store.copy_node('dev-1', 'docs')
+    store.upsert_asset('1001', 'dev-3', 'dev-3.md', '# Computer', run_id='datto-2')
+    assert store.sweep_unseen('datto', 'datto-2', batch_size=1) == {'seen': 1, 'unseen': 2, 'deleted': 2}
+    assert [c['id'] for c in store.list_children('assets_for_1001')] == ['dev-3']
+    assert 'dev-1' not in [c['id'] for c in store.list_children('ann@acme.example')]
+    assert store.get_node(copy_id) is not None
+    # A run that saw nothing deletes nothing.
+    assert store.sweep_unseen('datto', 'datto-3') == {'seen': 0, 'unseen': 1, 'deleted': 0}
+    assert store.get_node('dev-3') is not None
+
+def test_sync_checkpoints(store):
+    store.ensure_companies_root()
+    store.upsert_company('1001', 'Acme', 77)
+    assert store.sync_checkpoint('datto') is None
+    version = store.current_version()
+    with store.sync_batch():
+        store.ensure_assets_folder('1001')
+        store.upsert_asset('1001', 'dev-1', 'dev-1.md', '# Computer', run_id='datto-1')
+        store.save_sync_checkpoint('datto', {'run_id': 'datto-1', 'last_site_uid': 'site-a'})
+    assert [c['id'] for c in store.list_children('assets_for_1001')] == ['dev-1']
+    assert store.current_version() == version + 1, 'a batch is stamped once'
+
+    # A batch that fails leaves neither its writes nor its checkpoint.
+    try:
+        with store.sync_batch():
+            store.upsert_asset('1001', 'dev-2', 'dev-2.md', '# Computer', run_id='datto-1')
+            store.save_sync_checkpoint('datto', {'run_id': 'datto-1', 'last_site_uid': 'site-b'})
+            raise RuntimeError('interrupted')
+    except RuntimeError:
+        pass
+    assert store.get_node('dev-2') is None
+    assert store.sync_checkpoint('datto') == {'run_id': 'datto-1', 'last_site_uid': 'site-a'}
+    assert store.sync_checkpoint('tickets') is None
+    store.save_sync_checkpoint('datto', None)
+    assert store.sync_checkpoint('datto') is None
+
+def test_hierarchy_mirror(store):
+    from hierarchy import Hierarchy
+
+    def assert_mirrors(mirror):
+        mirror.refresh(store)
+        node_ids = store.descendant_ids(ROOT_ID)
+        assert sorted(mirror.descendant_ids(ROOT_ID)) == sorted(node_ids)
+        for node_id in node_ids:
+            assert mirror.list_children(node_id) == store.list_children(node_id), node_id
+            path = store.path_nodes(node_id)
+            assert mirror.path_nodes(node_id) == path, node_id
+            assert mirror.resolve_path([n['name'] for n in path[1:]]) == store.resolve_path([n['name'] for n in path[1:]])
+            assert sorted(mirror.descendant_ids(node_id)) == sorted(store.descendant_ids(node_id)), node_id
+            assert (sorted(mirror.attached_folders_on_path(node_id), key=lambda f: f['id'])
+                    == sorted(store.attached_folders_on_path(node_id), key=lambda f: f['id'])), node_id
+        assert mirror.path_nodes('missing') is None and mirror.list_children('missing') == []
+
+    build_sample_tree(store)
+    mirror = Hierarchy()
+    assert_mirrors(mirror)
+    assert len(mirror) == 9
+
+    # A rename stamps only the renamed node; structural changes stamp the parents.
+    version = store.current_version()
+    store.update_node('guide', name='Guide v2.md')
+    assert [n['id'] for n in store.structure_changes(version)[2]] == ['guide']
+    store.move_node('sub', 'refs')
+    store.copy_node('inner', ROOT_ID, name='Inner copy')
+    assert_mirrors(mirror)
+    store.delete_node('refs')
+    assert_mirrors(mirror)
+    assert mirror.list_children('refs') == [] and mirror.path_nodes('deep') is None
+
+    # Synced nodes, a second parent, and a sweep that removes a linked asset.
+    store.ensure_companies_root()
+    store.upsert_company('1001', 'Acme', 77)
+    store.upsert_user('1001', 'Ann Lee', 'ann@acme.example', '# Contact', 501)
+    store.ensure_assets_folder('1001')
+    store.upsert_asset('1001', 'dev-1', 'WS-1.md', '# Computer', run_id='datto-1')
+    store.link_asset_to_user('ann@acme.example', 'dev-1')
+    store.upsert_ticket('ann@acme.example', 'ticket_600', '600_Printer.md', 'jam')
+    assert_mirrors(mirror)
+    store.upsert_asset('1001', 'dev-2', 'WS-2.md', '# Computer', run_id='datto-2')
+    store.sweep_unseen('datto', 'datto-2')
+    assert_mirrors(mirror)
+    assert mirror.path_nodes('dev-1') is None
+
+    store.reinitialize()
+    assert_mirrors(mirror)
+    assert len(mirror) == 1
+
+
+def test_async_reads(store):
+    """The async counterpart (see storage.async_store_for) reads what the store does."""
+    import asyncio
+    import context_blocks as blocks_module
+    from storage import async_store_for
+    from storage.base import TreeStore
+
+    build_sample_tree(store)
+    store.add_file('guide', 'f1', 'guide.pdf')
+    # The walk context_articles shares with the async store, run on this backend's children_of.
+    for folder_id in ('docs', 'refs', 'sub'):
+        assert TreeStore.context_articles(store, folder_id) == store.context_articles(folder_id)
+
+    async def reads(async_store):
+        try:
+            path = await async_store.context_path('nested')
+            return {
+                'stamp': await async_store.node_stamp('guide'),
+                'node': await async_store.get_node('guide'),
+                'missing': await async_store.get_node('missing'),
+                'search': await async_store.search('firewall', 'docs'),
+                'files': await async_store.file_names('guide'),
+                'path': path,
+                'articles': await async_store.context_articles('docs', excluded_ids=['refs']),
+                'blocks': await blocks_module.load_blocks_async(async_store, [path]),
+                'stored': await async_store.stored_blocks(['docs']),
+            }
+        finally:
+            await async_store.close()
+
+    result = asyncio.run(reads(async_store_for(store)))
+    assert result['stamp'] == store.node_stamp('guide')
+    assert result['node'] == store.get_node('guide') and result['missing'] is None
+    assert sorted(r['id'] for r in result['search']) == sorted(r['id'] for r in store.search('firewall', 'docs'))
+    assert result['files'] == ['guide.pdf']
+    path = store.context_path('nested')
+    assert result['path'] == path
+    assert result['articles'] == store.context_articles('docs', excluded_ids=['refs'])
+    # The async load computed and saved the blocks the sync one now reads.
+    assert result['stored'] == store.stored_blocks(['docs']) and result['stored']
+    assert result['blocks'] == blocks_module.load_blocks(store, [path])
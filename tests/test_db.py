@@ -0,0 +1,32 @@
+# tests/test_db.py
+import pytest
+
+import db
+
+neo4j = pytest.importorskip("neo4j")
+
+
+@pytest.fixture
+def driver_kwargs(monkeypatch):
+    created = []
+    monkeypatch.setattr(neo4j.GraphDatabase, 'driver', lambda uri, **kwargs: created.append((uri, kwargs)) or object())
+    monkeypatch.setattr(db, '_driver', None)
+    monkeypatch.setattr(db, '_driver_pid', None)
+    monkeypatch.setenv("NEO4J_URI", "neo4j://graph.example:7687")
+    yield created
+    monkeypatch.setattr(db, '_driver', None)
+
+
+def test_the_driver_retries_managed_transactions(driver_kwargs, monkeypatch):
+    monkeypatch.setenv("NEO4J_MAX_RETRY_TIME", "12.5")
+    monkeypatch.setenv("NEO4J_MAX_POOL_SIZE", "8")
+    driver = db.get_driver()
+    assert db.get_driver() is driver
+    [(uri, kwargs)] = driver_kwargs
+    assert uri == "neo4j://graph.example:7687"
+    assert kwargs['max_transaction_retry_time'] == 12.5 and kwargs['max_connection_pool_size'] == 8
+
+def test_retries_default_to_thirty_seconds(driver_kwargs, monkeypatch):
+    monkeypatch.delenv("NEO4J_MAX_RETRY_TIME", raising=False)
+    db.get_driver()
+    assert driver_kwargs[0][1]['max_transaction_retry_time'] == 30
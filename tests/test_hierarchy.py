@@ -0,0 +1,119 @@
+# tests/test_hierarchy.py
+import time
+import threading
+
+import pytest
+
+import storage
+import hierarchy
+from storage import get_store
+from storage.base import ROOT_ID
+
+
+@pytest.fixture
+def mirror(store, monkeypatch):
+    monkeypatch.setattr(hierarchy, 'HIERARCHY_MIRROR', 'on')
+    monkeypatch.setattr(hierarchy, 'HIERARCHY_REFRESH_INTERVAL', 3600)
+    monkeypatch.setattr(hierarchy, '_mirror', None)
+    monkeypatch.setattr(hierarchy, '_mirror_pid', None)
+    store.create_node('docs', ROOT_ID, 'Docs', is_folder=True)
+    store.create_node('refs', 'docs', 'Refs', is_folder=True, is_attached=True)
+    store.create_node('guide', 'docs', 'Guide.md')
+    hierarchy.warm(store)
+    return store
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+def same_as_store(store, node_ids):
+    for node_id in node_ids:
+        assert hierarchy.path_nodes(store, node_id) == store.path_nodes(node_id)
+        assert hierarchy.list_children(store, node_id) == store.list_children(node_id)
+        assert sorted(hierarchy.descendant_ids(store, node_id)) == sorted(store.descendant_ids(node_id))
+        assert hierarchy.attached_folders_on_path(store, node_id) == store.attached_folders_on_path(node_id)
+
+def test_reads_match_the_store(mirror):
+    same_as_store(mirror, [ROOT_ID, 'docs', 'refs', 'guide'])
+    assert hierarchy.resolve_path(mirror, ['Docs', 'Guide.md']) == 'guide'
+    assert hierarchy.path_names(mirror, 'guide') == ['KnowledgeTree Root', 'Docs', 'Guide.md']
+    assert hierarchy.path_nodes(mirror, 'missing') is None and hierarchy.path_names(mirror, 'missing') is None
+
+def test_writes_show_up_after_invalidate(mirror):
+    mirror.create_node('faq', 'docs', 'FAQ.md')
+    mirror.update_node('guide', name='Handbook.md')
+    mirror.move_node('refs', ROOT_ID)
+    assert hierarchy.resolve_path(mirror, ['Docs', 'FAQ.md']) is None, 'the mirror refreshes on its interval'
+    hierarchy.invalidate()
+    same_as_store(mirror, [ROOT_ID, 'docs', 'refs', 'guide', 'faq'])
+    mirror.delete_node('docs')
+    hierarchy.invalidate()
+    assert hierarchy.path_nodes(mirror, 'faq') is None and sorted(hierarchy.descendant_ids(mirror, ROOT_ID)) == ['refs', ROOT_ID]
+
+def test_the_mirror_holds_no_content(mirror):
+    mirror.update_node('guide', content='x' * 100000)
+    hierarchy.invalidate()
+    with hierarchy._lock:
+        structure, strings = hierarchy._mirror.memory_bytes()
+    assert structure + strings < 10000
+
+def test_writes_through_the_app_are_read_back(client, monkeypatch):
+    monkeypatch.setattr(hierarchy, 'HIERARCHY_MIRROR', 'on')
+    monkeypatch.setattr(hierarchy, 'HIERARCHY_REFRESH_INTERVAL', 3600)
+    hierarchy.warm(get_store())
+    assert client.post('/api/node', json={'parent_id': ROOT_ID, 'name': 'Docs', 'is_folder': True}).json['success']
+    assert client.post('/api/node', json={'parent_id': ROOT_ID, 'name': 'Handbook.md'}).json['success']
+    page = client.get('/browse/')
+    assert b'Docs' in page.data and b'Handbook.md' in page.data
+
+def test_off_reads_the_store(mirror, monkeypatch):
+    monkeypatch.setattr(hierarchy, 'HIERARCHY_MIRROR', 'off')
+    mirror.create_node('faq', 'docs', 'FAQ.md')
+    assert hierarchy.resolve_path(mirror, ['Docs', 'FAQ.md']) == 'faq'
+
+def test_reads_during_a_slow_refresh_go_to_the_store(mirror, monkeypatch):
+    release, entered = threading.Event(), threading.Event()
+    changes = mirror.structure_changes
+
+    def slow_changes(since_version):
+        entered.set()
+        release.wait(5)
+        return changes(since_version)
+
+    monkeypatch.setattr(mirror, 'structure_changes', slow_changes)
+    mirror.create_node('faq', 'docs', 'FAQ.md')
+    hierarchy.invalidate()
+    refresh = threading.Thread(target=hierarchy.list_children, args=(mirror, 'docs'))
+    refresh.start()
+    try:
+        assert entered.wait(5)
+        # The refresh holds no lock while it queries, and a read that is due goes to the store.
+        started = time.monotonic()
+        assert hierarchy.resolve_path(mirror, ['Docs', 'FAQ.md']) == 'faq'
+        assert time.monotonic() - started < 1
+    finally:
+        release.set()
+        refresh.join()
+    assert hierarchy.resolve_path(mirror, ['Docs', 'FAQ.md']) == 'faq'
+
+def test_a_failed_load_is_retried_on_the_next_read(store, monkeypatch):
+    monkeypatch.setattr(hierarchy, 'HIERARCHY_MIRROR', 'on')
+    monkeypatch.setattr(hierarchy, '_mirror', None)
+    monkeypatch.setattr(hierarchy, '_mirror_pid', None)
+    attempts = []
+
+    def flaky_store():
+        attempts.append(None)
+        if len(attempts) == 1:
+            raise ConnectionError("database unavailable")
+        return store
+
+    monkeypatch.setattr(storage, 'get_store', flaky_store)
+    hierarchy.start()
+    wait_for(lambda: attempts and hierarchy._mirror_pid is None)
+    assert hierarchy.path_names(store, ROOT_ID) == ['KnowledgeTree Root'], 'reads fall back to the store'
+    wait_for(lambda: hierarchy._mirror is not None)
+    assert len(attempts) == 2
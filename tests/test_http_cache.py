@@ -0,0 +1,71 @@
+# tests/test_http_cache.py
+import gzip
+import json
+
+import http_cache
+from storage import get_store
+from storage.base import ROOT_ID
+
+
+def test_node_revalidates_with_its_etag(client):
+    response = client.get('/api/node/root')
+    etag = response.headers['ETag']
+    assert response.status_code == 200 and etag.startswith('W/"node-')
+    assert response.headers['Cache-Control'] == 'no-cache'
+
+    cached = client.get('/api/node/root', headers={'If-None-Match': etag})
+    assert cached.status_code == 304 and cached.data == b'' and cached.headers['ETag'] == etag
+
+    get_store().update_node('root', content='# Changed')
+    changed = client.get('/api/node/root', headers={'If-None-Match': etag})
+    assert changed.status_code == 200 and changed.headers['ETag'] != etag
+
+def test_stale_or_unrelated_etags_get_the_body(client):
+    response = client.get('/api/node/root', headers={'If-None-Match': 'W/"node-stale", "other"'})
+    assert response.status_code == 200 and response.json['id'] == 'root'
+
+def test_context_etag_follows_the_articles_below(client):
+    store = get_store()
+    store.create_node('docs', ROOT_ID, 'Docs', is_folder=True)
+    store.create_node('guide', 'docs', 'Guide.md')
+    etag = client.get('/api/context/guide').headers['ETag']
+    assert client.get('/api/context/guide', headers={'If-None-Match': etag}).status_code == 304
+
+    store.create_node('faq', 'docs', 'FAQ.md')
+    response = client.get('/api/context/guide', headers={'If-None-Match': etag})
+    assert response.status_code == 200 and 'File: FAQ.md' in response.json['context']
+    # POSTs carry exclusions, so they are never answered from a validator.
+    posted = client.post('/api/context/guide', json={'excluded_ids': []}, headers={'If-None-Match': etag})
+    assert posted.status_code == 200 and 'ETag' not in posted.headers
+
+def test_large_json_is_gzipped_when_accepted(client):
+    get_store().update_node('root', content='# Welcome\n\n' + 'Printer queue notes. ' * 200)
+    plain = client.get('/api/node/root')
+    assert 'Content-Encoding' not in plain.headers
+
+    response = client.get('/api/node/root', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert json.loads(gzip.decompress(response.data)) == plain.json
+
+def test_small_bodies_and_unacceptable_encodings_are_left_alone(client):
+    small = client.get('/api/node/root', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in small.headers
+    get_store().update_node('root', content='x' * 5000)
+    response = client.get('/api/node/root', headers={'Accept-Encoding': 'identity'})
+    assert 'Content-Encoding' not in response.headers and response.json['content'] == 'x' * 5000
+
+def test_raw_header_helpers():
+    etag = 'context-abc'
+    assert http_cache.etag_matches('W/"context-abc"', etag)
+    assert http_cache.etag_matches('"other", W/"context-abc"', etag)
+    assert not http_cache.etag_matches('', etag)
+    assert http_cache.validator_headers(etag, 300) == [('etag', 'W/"context-abc"'),
+                                                       ('cache-control', 'private, max-age=300')]
+
+    small = b'{"ok":true}'
+    assert http_cache.encode_headers(small, 'gzip') == (small, [])
+    large = json.dumps({'content': 'y' * 4000}).encode()
+    body, headers = http_cache.encode_headers(large, 'gzip;q=1.0, br;q=0')
+    assert gzip.decompress(body) == large and ('content-encoding', 'gzip') in headers
+    assert http_cache.encode_headers(large, 'identity') == (large, [('vary', 'Accept-Encoding')])
@@ -0,0 +1,52 @@
+# tests/test_ingest.py
+import pytest
+
+import jobs
+import ingest
+
+SECRET = 's3cret'
+
+
+@pytest.fixture
+def webhook(client, tmp_path, monkeypatch):
+    monkeypatch.setattr(ingest, 'FRESHSERVICE_WEBHOOK_SECRET', SECRET)
+    monkeypatch.setattr(jobs, 'JOB_QUEUE_PATH', str(tmp_path / 'jobs.db'))
+    monkeypatch.setattr(jobs, '_local', type(jobs._local)())
+
+    def post(payload, secret=SECRET):
+        headers = {'X-Webhook-Secret': secret} if secret is not None else {}
+        return client.post('/api/ingest/freshservice', json=payload, headers=headers)
+    return post
+
+
+def test_events_queue_one_fetch_per_ticket(webhook):
+    first = webhook({'event': 'ticket_updated', 'ticket_id': '#SR-1234'})
+    assert first.status_code == 202
+    assert first.json['ticket_id'] == 1234 and first.json['queued'] is True
+    again = webhook({'event': 'replied', 'ticket_id': 1234})
+    assert again.status_code == 202 and again.json['job_id'] == first.json['job_id'] and again.json['queued'] is False
+    [job] = jobs.recent()
+    assert (job['name'], job['args']) == ('freshticket', {'ticket_id': 1234})
+
+@pytest.mark.parametrize('secret', ['wrong', '', 's3cret ', None])
+def test_bad_secrets_are_refused(webhook, secret):
+    response = webhook({'event': 'ticket_updated', 'ticket_id': 1}, secret=secret)
+    assert response.status_code == 403
+    assert jobs.pending_count() == 0
+
+def test_ingest_is_off_without_a_secret(client, monkeypatch):
+    monkeypatch.setattr(ingest, 'FRESHSERVICE_WEBHOOK_SECRET', '')
+    assert not ingest.authorized('')
+    assert client.post('/api/ingest/freshservice', json={'ticket_id': 1},
+                       headers={'X-Webhook-Secret': ''}).status_code == 503
+
+@pytest.mark.parametrize('payload', [['not', 'an', 'object'], {'event': 'ticket_deleted', 'ticket_id': 1},
+                                     {'event': 'ticket_updated'}, {'ticket_id': 'SR-'}])
+def test_malformed_events_are_rejected(webhook, payload):
+    response = webhook(payload)
+    assert response.status_code == 400 and response.json['success'] is False
+    assert jobs.pending_count() == 0
+
+def test_parse_ticket_event():
+    assert ingest.parse_ticket_event({'ticket_id': 'INC-77'}) == ('ticket_updated', 77)
+    assert ingest.parse_ticket_event({'event': 'Created', 'ticket_id': 5}) == ('ticket_created', 5)
@@ -0,0 +1,89 @@
+# tests/test_jobs.py
+import threading
+
+import pytest
+
+import jobs
+
+
+@pytest.fixture(autouse=True)
+def queue(tmp_path, monkeypatch):
+    monkeypatch.setattr(jobs, 'JOB_QUEUE_PATH', str(tmp_path / 'jobs.db'))
+    monkeypatch.setattr(jobs, '_local', type(jobs._local)())
+    monkeypatch.setattr(jobs, 'JOB_RETRY_DELAY', 0)
+    monkeypatch.setattr(jobs, 'JOB_MAX_ATTEMPTS', 2)
+    monkeypatch.setitem(jobs.JOBS, 'boom', {'target': 'tests.test_jobs:boom', 'priority': 5, 'limit': 1})
+
+
+def boom():
+    raise RuntimeError("sync failed")
+
+def expire_lease(job_id):
+    jobs._conn().execute("UPDATE jobs SET lease_until = 0 WHERE id = ?", (job_id,))
+
+def state(job_id):
+    return next(job for job in jobs.recent() if job['id'] == job_id)
+
+
+def test_identical_pending_jobs_are_folded_together():
+    job_id, created = jobs.enqueue('freshticket', {'ticket_id': 12})
+    assert created
+    assert jobs.enqueue('freshticket', {'ticket_id': 12}, priority=99) == (job_id, False)
+    assert jobs.enqueue('freshticket', {'ticket_id': 13})[1]
+    assert state(job_id)['priority'] == 99 and jobs.pending_count() == 2
+    with pytest.raises(ValueError):
+        jobs.enqueue('no-such-job')
+
+def test_claims_go_by_priority_within_each_jobs_limit():
+    jobs.enqueue('datto')
+    jobs.enqueue('freshservice')
+    jobs.enqueue('freshticket', {'ticket_id': 1})
+    jobs.enqueue('freshticket', {'ticket_id': 2})
+    claimed = [jobs.claim()['name'] for _ in range(3)]
+    assert claimed == ['freshticket', 'freshservice', 'datto']
+    # The second ticket waits for the first: one freshticket job runs at a time.
+    assert jobs.claim() is None
+
+def test_delayed_jobs_wait_for_their_start_time():
+    jobs.enqueue('freshticket', {'ticket_id': 5}, delay=60)
+    assert jobs.claim() is None
+
+def test_an_expired_lease_puts_the_job_back():
+    job_id, _ = jobs.enqueue('datto')
+    assert jobs.claim()['id'] == job_id
+    jobs.renew(job_id)
+    assert jobs.claim() is None
+    expire_lease(job_id)
+    # The claim that finds the lease expired requeues the job; it may only run from the next one.
+    retried = jobs.claim() or jobs.claim()
+    assert retried['id'] == job_id and retried['attempts'] == 2
+    assert "stopped renewing its lease" in retried['error']
+
+    # A lease that runs out on the last attempt fails the job for good.
+    expire_lease(job_id)
+    assert jobs.claim() is None and state(job_id)['state'] == 'failed'
+
+def test_failed_jobs_are_retried_then_failed():
+    job_id, _ = jobs.enqueue('boom')
+    assert jobs.run(jobs.claim()) is False
+    assert state(job_id)['state'] == 'pending' and "sync failed" in state(job_id)['error']
+    assert jobs.run(jobs.claim()) is False
+    failed = state(job_id)
+    assert failed['state'] == 'failed' and failed['attempts'] == 2 and jobs.claim() is None
+
+def test_a_failed_job_is_not_retried_next_to_a_queued_copy():
+    job_id, _ = jobs.enqueue('boom')
+    jobs.claim()
+    copy_id, created = jobs.enqueue('boom')
+    assert created
+    jobs.fail(job_id, "sync failed")
+    assert state(job_id)['state'] == 'failed'
+    assert f"job {copy_id} is already queued" in state(job_id)['error']
+
+def test_work_loop_drains_the_queue(monkeypatch):
+    # Any importable callable taking the job's arguments will do.
+    monkeypatch.setitem(jobs.JOBS, 'noop', {'target': 'builtins:dict', 'priority': 0, 'limit': 1})
+    for n in range(3):
+        jobs.enqueue('noop', {'n': n})
+    jobs.work_loop(threading.Event(), drain=True)
+    assert [job['state'] for job in jobs.recent()] == ['done'] * 3 and jobs.pending_count() == 0
@@ -0,0 +1,66 @@
+# tests/test_metrics.py
+import pytest
+
+import metrics
+
+
+@pytest.fixture(autouse=True)
+def clean_metrics():
+    metrics.reset()
+    yield
+    metrics.reset()
+
+
+def test_histograms_render_cumulative_buckets():
+    metrics.record_query('get_node', 0.003, rows=1)
+    metrics.record_query('get_node', 0.2, rows=4)
+    text = metrics.render_prometheus()
+    assert '# TYPE kt_query_duration_seconds histogram' in text
+    assert 'kt_query_duration_seconds_bucket{query="get_node",le="0.0025"} 0' in text
+    assert 'kt_query_duration_seconds_bucket{query="get_node",le="0.005"} 1' in text
+    assert 'kt_query_duration_seconds_bucket{query="get_node",le="0.25"} 2' in text
+    assert 'kt_query_duration_seconds_bucket{query="get_node",le="+Inf"} 2' in text
+    assert 'kt_query_duration_seconds_count{query="get_node"} 2' in text
+    assert 'kt_query_rows_total{query="get_node"} 5' in text
+    # Nothing was profiled, so the db hits series are left out.
+    assert 'kt_query_db_hits_total' not in text
+
+def test_label_values_are_escaped():
+    metrics.record_query('odd "name"\\\n', 0.001)
+    assert 'kt_query_rows_total{query="odd \\"name\\"\\\\\\n"} 0' in metrics.render_prometheus()
+
+def test_request_scope_counts_only_its_queries():
+    metrics.record_query('outside', 0.5)
+    scope = metrics.start_request()
+    metrics.record_query('inside', 0.25)
+    metrics.record_query('inside', 0.25)
+    stats = metrics.finish_request(scope, '/api/node/<node_id>', 'GET', 404)
+    assert (stats.queries, stats.query_seconds) == (2, 0.5)
+    metrics.record_query('after', 0.1)
+    assert stats.queries == 2
+    assert ('kt_requests_total{route="/api/node/<node_id>",method="GET",status="404"} 1'
+            in metrics.render_prometheus())
+
+def test_instrumented_records_failed_calls():
+    @metrics.instrumented
+    def broken_operation(store):
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError):
+        broken_operation(None)
+    assert 'kt_query_duration_seconds_count{query="broken_operation"} 1' in metrics.render_prometheus()
+
+def test_plan_db_hits_sums_the_plan_tree():
+    plan = {'dbHits': 3, 'children': [{'dbHits': 4, 'children': [{'dbHits': 5}]}, {}]}
+    assert metrics.plan_db_hits(plan) == 12
+    assert metrics.plan_db_hits(None) == 0
+
+def test_requests_are_counted_per_route(app, client):
+    app.config['QUERY_COUNT_HEADER'] = True
+    response = client.get('/api/node/missing')
+    assert response.status_code == 404 and int(response.headers['X-Query-Count']) >= 1
+    # Queries outside a request are not attributed to one.
+    metrics.record_query('outside', 0.5)
+    text = client.get('/metrics').data.decode()
+    assert 'kt_requests_total{route="/api/node/<node_id>",method="GET",status="404"} 1' in text
+    assert 'kt_request_queries_count{route="/api/node/<node_id>"} 1' in text
@@ -0,0 +1,59 @@
+# tests/test_move_copy.py
+import pytest
+
+from storage import get_store
+from storage.base import ROOT_ID
+
+
+@pytest.fixture
+def tree(client):
+    store = get_store()
+    store.create_node('docs', ROOT_ID, 'Docs', is_folder=True)
+    store.create_node('sub', 'docs', 'Sub', is_folder=True)
+    store.create_node('deep', 'sub', 'Deep.md')
+    store.update_node('deep', content='Printer queue notes')
+    store.add_file('deep', 'file-1', 'queue.png')
+    store.create_node('archive', ROOT_ID, 'Archive', is_folder=True)
+    return store
+
+
+def test_move_relinks_the_whole_subtree(client, tree):
+    response = client.post('/api/node/sub/move', json={'parent_id': 'archive'})
+    assert response.status_code == 200 and response.json['success'] is True
+    assert [n['id'] for n in tree.path_nodes('deep')] == [ROOT_ID, 'archive', 'sub', 'deep']
+    assert tree.list_children('docs') == []
+
+@pytest.mark.parametrize('node_id, payload', [
+    ('sub', {}),
+    ('missing', {'parent_id': 'archive'}),
+    ('sub', {'parent_id': 'missing'}),
+    ('docs', {'parent_id': 'sub'}),
+    ('sub', {'parent_id': 'archive', 'from_parent_id': 'archive'}),
+])
+def test_invalid_moves_are_refused_and_change_nothing(client, tree, node_id, payload):
+    response = client.post(f'/api/node/{node_id}/move', json=payload)
+    assert response.status_code == 400 and response.json['success'] is False
+    assert [n['id'] for n in tree.path_nodes('deep')] == [ROOT_ID, 'docs', 'sub', 'deep']
+    assert tree.list_children('archive') == []
+
+def test_the_root_cannot_be_moved(client, tree):
+    response = client.post(f'/api/node/{ROOT_ID}/move', json={'parent_id': 'archive'})
+    assert response.status_code == 400 and response.json['error'] == 'The root cannot be moved.'
+    assert [n['id'] for n in tree.path_nodes(ROOT_ID)] == [ROOT_ID]
+    assert tree.list_children('archive') == []
+
+def test_copy_duplicates_content_and_files(client, tree):
+    response = client.post('/api/node/sub/copy', json={'parent_id': 'archive', 'name': 'Sub copy'})
+    assert response.status_code == 200
+    copy_id = response.json['id']
+    [deep_copy] = tree.list_children(copy_id)
+    assert tree.get_node(copy_id)['name'] == 'Sub copy'
+    copied = tree.get_node(deep_copy['id'])
+    assert copied['content'] == 'Printer queue notes' and copied['files'][0]['filename'] == 'queue.png'
+    # The original is untouched.
+    assert [n['id'] for n in tree.path_nodes('deep')] == [ROOT_ID, 'docs', 'sub', 'deep']
+
+def test_copy_into_its_own_subtree_is_refused(client, tree):
+    response = client.post('/api/node/docs/copy', json={'parent_id': 'sub'})
+    assert response.status_code == 400
+    assert client.post('/api/node/docs/copy', json={}).status_code == 400
@@ -0,0 +1,59 @@
+# tests/test_paginate.py
+import time
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+import paginate
+
+
+def test_pages_are_yielded_in_order_until_the_first_empty_one():
+    requested = []
+
+    def fetch_page(page):
+        requested.append(page)
+        # Later pages answer first.
+        time.sleep(0.01 * (5 - page) if page < 5 else 0)
+        return [f"{page}-a", f"{page}-b"] if page <= 3 else []
+
+    records = list(paginate.PageStream(fetch_page, prefetch=3))
+    assert records == ['1-a', '1-b', '2-a', '2-b', '3-a', '3-b']
+    assert 4 in requested
+
+def test_a_failed_page_raises_after_the_pages_before_it():
+    def fetch_page(page):
+        if page == 2:
+            raise ConnectionError("page 2 failed")
+        return [page] if page < 5 else []
+
+    stream = iter(paginate.PageStream(fetch_page, prefetch=2))
+    assert next(stream) == 1
+    with pytest.raises(ConnectionError):
+        next(stream)
+
+def test_pause_holds_back_every_stream_on_the_limiter():
+    limiter = paginate.RateLimiter(0)
+    limiter.pause(0.2)
+    started = time.monotonic()
+    threads = [threading.Thread(target=limiter.wait) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert time.monotonic() - started >= 0.19
+
+def test_freshservice_pages_back_off_on_429(monkeypatch):
+    from scripts import pull_freshservice
+
+    responses = [
+        SimpleNamespace(status_code=429, headers={'Retry-After': '0'}),
+        SimpleNamespace(status_code=200, headers={}, raise_for_status=lambda: None,
+                        json=lambda: {'departments': [{'id': 1}]}),
+    ]
+    monkeypatch.setattr(pull_freshservice.requests, 'get', lambda *args, **kwargs: responses.pop(0))
+    limiter = paginate.RateLimiter(0)
+    paused = []
+    monkeypatch.setattr(limiter, 'pause', paused.append)
+    assert pull_freshservice.get_freshservice_page('departments', 1, limiter) == [{'id': 1}]
+    assert paused == [0] and responses == []
@@ -0,0 +1,50 @@
+# tests/test_pull_datto.py
+import pytest
+import requests
+
+import sync_runs
+from scripts import pull_datto
+
+SITES = [{'uid': 'a', 'name': 'Acme'}, {'uid': 'b', 'name': 'Globex'}, {'uid': 'c', 'name': 'Initech'}]
+
+
+@pytest.fixture
+def datto(store, monkeypatch):
+    """A Datto account of three sites with one device each; site ids listed in `down` fail to fetch."""
+    down = set()
+    store.ensure_companies_root()
+    for account in ('100', '200', '300'):
+        store.upsert_company(account, f'Company {account}', int(account))
+
+    def site_variable(token, site_uid, name):
+        if site_uid in down:
+            raise requests.exceptions.ConnectionError(f"site {site_uid} is down")
+        return {'a': '100', 'b': '200', 'c': '300'}[site_uid]
+
+    def listing(token, path):
+        if path == "/v2/account/sites":
+            return SITES
+        return [{'uid': f"dev-{path.split('/')[3]}", 'hostname': 'PC'}]
+
+    monkeypatch.setattr(pull_datto, 'get_store', lambda: store)
+    monkeypatch.setattr(pull_datto, 'get_datto_access_token', lambda: 'token')
+    monkeypatch.setattr(pull_datto, 'get_site_variable', site_variable)
+    monkeypatch.setattr(pull_datto, 'get_paginated_api_request', listing)
+    monkeypatch.setattr(sync_runs, 'SYNC_SWEEP', 'delete')
+    return down
+
+
+def test_a_failed_site_stops_the_checkpoint_and_the_sweep(store, datto):
+    pull_datto.sync_datto_devices()
+    datto.add('b')
+    store.upsert_asset('300', 'dev-old', 'Old.md', '# Computer', run_id='datto-0')
+    with pytest.raises(SystemExit):
+        pull_datto.sync_datto_devices()
+    # Site c was still written, but the checkpoint stays before b, and nothing was swept.
+    assert store.sync_checkpoint('datto')['last_site_uid'] == 'a'
+    assert store.get_node('dev-b') is not None and store.get_node('dev-old') is not None
+
+    datto.clear()
+    pull_datto.sync_datto_devices()
+    assert store.sync_checkpoint('datto') is None
+    assert store.get_node('dev-b') is not None and store.get_node('dev-old') is None
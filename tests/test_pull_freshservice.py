@@ -0,0 +1,45 @@
+# tests/test_pull_freshservice.py
+import pytest
+
+import sync_runs
+from scripts import pull_freshservice
+
+DEPARTMENTS = [{'id': 77, 'name': 'Acme', 'custom_fields': {'account_number': '1001'}}]
+
+
+def requester(requester_id, first_name):
+    return {'id': requester_id, 'active': True, 'first_name': first_name, 'last_name': 'Lee',
+            'primary_email': f'{first_name.lower()}@acme.example', 'department_ids': [77]}
+
+
+@pytest.fixture
+def freshservice(store, monkeypatch):
+    """The requesters Freshservice lists; tests change it between runs."""
+    requesters = [requester(501, 'Ann'), requester(502, 'Bob')]
+
+    def page(resource, number, limiter):
+        records = {'departments': DEPARTMENTS, 'requesters': requesters}[resource]
+        return list(records) if number == 1 else []
+
+    monkeypatch.setattr(pull_freshservice, 'get_store', lambda: store)
+    monkeypatch.setattr(pull_freshservice, 'get_freshservice_page', page)
+    monkeypatch.setattr(pull_freshservice, 'REQUEST_DELAY', 0)
+    monkeypatch.setattr(sync_runs, 'SYNC_SWEEP', 'delete')
+    return requesters
+
+
+def test_a_requester_who_vanishes_loses_their_user_folder(store, freshservice):
+    pull_freshservice.sync_companies_and_users()
+    store.ensure_assets_folder('1001')
+    store.upsert_asset('1001', 'dev-1', 'PC-BOB.md', '# Computer')
+    store.link_asset_to_user('bob@acme.example', 'dev-1')
+    store.upsert_ticket('bob@acme.example', 'ticket_9', '9_Printer.md', '# Printer')
+    assert [c['id'] for c in store.list_children('users_for_1001')] == ['ann@acme.example', 'bob@acme.example']
+
+    del freshservice[1]
+    pull_freshservice.sync_companies_and_users()
+    assert [c['id'] for c in store.list_children('users_for_1001')] == ['ann@acme.example']
+    assert store.get_node('bob@acme.example') is None and store.get_node('ticket_9') is None
+    assert store.get_node('contact_for_ann@acme.example') is not None
+    # Bob's device is Datto's to sweep; it only leaves his folder.
+    assert [c['id'] for c in store.list_children('assets_for_1001')] == ['dev-1']
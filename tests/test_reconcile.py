@@ -0,0 +1,72 @@
+# tests/test_reconcile.py
+import json
+from types import SimpleNamespace
+
+import pytest
+
+import reconcile
+
+
+def rate_limited(retry_after=None):
+    return SimpleNamespace(status_code=429, headers={} if retry_after is None else {'Retry-After': retry_after})
+
+
+def test_name_matcher_prefers_the_longest_name():
+    matcher = reconcile.NameMatcher(['Acme', 'Acme Labs', 'Labs', '', 'Acme'])
+    assert matcher.names == ['Acme', 'Acme Labs', 'Labs']
+    assert matcher.matches('Acme Labs - Main Site') == ['Acme', 'Acme Labs', 'Labs']
+    assert matcher.longest('Acme Labs - Main Site') == 'Acme Labs'
+    assert matcher.longest('Globex') is None
+
+def test_results_keep_item_order_with_exceptions_in_place():
+    def work(item):
+        if item == 2:
+            raise ValueError("bad item")
+        return item * 10
+
+    results = reconcile.run_parallel(range(4), work, workers=3, interval=0)
+    assert [item for item, _ in results] == [0, 1, 2, 3]
+    assert [r for _, r in results if not isinstance(r, Exception)] == [0, 10, 30]
+    assert isinstance(results[2][1], ValueError)
+
+def test_rate_limited_work_is_retried_after_retry_after(monkeypatch):
+    attempts = []
+    paused = []
+    monkeypatch.setattr(reconcile.paginate.RateLimiter, 'pause', lambda self, seconds: paused.append(seconds))
+
+    def work(item):
+        attempts.append(item)
+        if len(attempts) < 3:
+            reconcile.check_rate_limit(rate_limited('7'))
+        return 'ok'
+
+    assert reconcile.run_parallel(['site'], work, interval=0) == [('site', 'ok')]
+    assert attempts == ['site'] * 3 and paused == [7.0, 7.0]
+
+def test_rate_limited_work_gives_up_after_max_retries(monkeypatch):
+    paused = []
+    monkeypatch.setattr(reconcile.paginate.RateLimiter, 'pause', lambda self, seconds: paused.append(seconds))
+    monkeypatch.setattr(reconcile, 'RECONCILE_RETRY_DELAY', 1)
+
+    def work(item):
+        # An HTTP date is not a usable delay: the back-off doubles instead.
+        reconcile.check_rate_limit(rate_limited('Wed, 21 Oct 2026 07:28:00 GMT'))
+
+    [(_, result)] = reconcile.run_parallel(['site'], work, interval=0, max_retries=3)
+    assert isinstance(result, reconcile.RateLimited) and result.retry_after is None
+    assert paused == [1, 2, 4]
+
+def test_check_rate_limit_passes_other_statuses():
+    reconcile.check_rate_limit(SimpleNamespace(status_code=500, headers={}))
+    with pytest.raises(reconcile.RateLimited) as raised:
+        reconcile.check_rate_limit(rate_limited('2.5'))
+    assert raised.value.retry_after == 2.5
+
+def test_write_report_counts_actions_and_outcomes(tmp_path):
+    actions = [{'action': 'push', 'outcome': 'updated'}, {'action': 'push', 'outcome': 'failed'},
+               {'action': 'conflict'}]
+    path = tmp_path / 'report.json'
+    reconcile.write_report(str(path), 'push', actions, dry_run=True)
+    report = json.loads(path.read_text())
+    assert report['actions'] == {'push': 2, 'conflict': 1}
+    assert report['outcomes'] == {'updated': 1, 'failed': 1} and report['dry_run'] is True
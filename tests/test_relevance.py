@@ -0,0 +1,107 @@
+# tests/test_relevance.py
+import time
+
+import pytest
+
+import storage
+import hierarchy
+import relevance
+from storage.base import ROOT_ID, ROOT_NAME
+
+pytest.importorskip("numpy")
+pytest.importorskip("scipy")
+
+
+@pytest.fixture
+def index(store, monkeypatch):
+    monkeypatch.setattr(relevance, 'SEARCH_REFRESH_INTERVAL', 0)
+    monkeypatch.setattr(relevance, '_index', None)
+    monkeypatch.setattr(relevance, '_index_pid', None)
+    monkeypatch.setattr(hierarchy, 'HIERARCHY_MIRROR', 'off')
+    store.create_node('docs', ROOT_ID, 'Docs', is_folder=True)
+    store.create_node('other', ROOT_ID, 'Other', is_folder=True)
+    for node_id, parent_id, content in [
+        ('printer', 'docs', 'Printer jams. The printer needs a new printer drum.'),
+        ('mention', 'docs', 'The VPN guide mentions the printer once, among many other things to check.'),
+        ('vpn', 'docs', 'Reset the VPN token.'),
+        ('elsewhere', 'other', 'Printer printer printer.'),
+    ]:
+        store.create_node(node_id, parent_id, f'{node_id}.md')
+        store.update_node(node_id, content=content)
+    relevance.warm(store)
+    return store
+
+
+def ids(results):
+    return [r['id'] for r in results]
+
+
+def test_results_are_ranked_by_bm25(index):
+    results = relevance.search(index, 'printer')
+    assert ids(results) == ['elsewhere', 'printer', 'mention']
+    assert results[1]['path_names'][1:] == ['Docs', 'printer.md'] and results[1]['is_folder'] is False
+    assert ids(relevance.search(index, 'vpn token')) == ['vpn', 'mention']
+    assert relevance.search(index, 'nothing matches') == []
+
+def test_searches_are_scoped_to_the_start_node(index):
+    assert ids(relevance.search(index, 'printer', start_node_id='docs')) == ['printer', 'mention']
+    assert relevance.search(index, 'printer', start_node_id='vpn') == []
+
+def test_refresh_indexes_new_and_changed_nodes(index):
+    index.update_node('vpn', content='The printer is fixed.')
+    index.create_node('new', 'other', 'new.md')
+    index.update_node('new', content='Printer printer printer printer.')
+    assert set(ids(relevance.search(index, 'printer'))) == {'elsewhere', 'printer', 'mention', 'vpn', 'new'}
+    assert ids(relevance.search(index, 'token')) == []
+
+def test_deleted_matches_do_not_cut_results_short(index, monkeypatch):
+    for n in range(12):
+        index.create_node(f'gone-{n}', 'other', f'gone-{n}.md')
+        index.update_node(f'gone-{n}', content='Printer ' * 20)
+    relevance.warm(index)
+    for n in range(12):
+        index.delete_node(f'gone-{n}')
+    monkeypatch.setattr(relevance, 'SEARCH_REFRESH_INTERVAL', 3600)
+    # The deleted nodes outscore every live one and fill the first over-fetch.
+    assert ids(relevance.search(index, 'printer', limit=3)) == ['elsewhere', 'printer', 'mention']
+
+def test_result_paths_come_from_the_hierarchy_mirror(index, monkeypatch):
+    monkeypatch.setattr(hierarchy, 'HIERARCHY_MIRROR', 'on')
+    monkeypatch.setattr(hierarchy, '_mirror', None)
+    monkeypatch.setattr(hierarchy, '_mirror_pid', None)
+    hierarchy.warm(index)
+
+    def context_paths(node_ids):
+        raise AssertionError("searches must not build context paths")
+
+    monkeypatch.setattr(index, 'context_paths', context_paths)
+    results = relevance.search(index, 'printer', start_node_id='docs')
+    assert [r['path_names'] for r in results] == [[ROOT_NAME, 'Docs', 'printer.md'], [ROOT_NAME, 'Docs', 'mention.md']]
+
+def test_without_numpy_searches_fall_back_to_substring_search(index, monkeypatch):
+    monkeypatch.setattr(relevance, '_modules', False)
+    assert set(ids(relevance.search(index, 'vpn token'))) == {'vpn'}
+
+def test_a_failed_build_is_retried_on_the_next_search(index, monkeypatch):
+    monkeypatch.setattr(relevance, '_index', None)
+    monkeypatch.setattr(relevance, '_index_pid', None)
+    attempts = []
+
+    def flaky_store():
+        attempts.append(None)
+        if len(attempts) == 1:
+            raise ConnectionError("database unavailable")
+        return index
+
+    monkeypatch.setattr(storage, 'get_store', flaky_store)
+    relevance.start()
+    deadline = time.monotonic() + 5
+    while not (attempts and relevance._index_pid is None):
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    # Substring search answers meanwhile, and starts the next build.
+    assert set(ids(relevance.search(index, 'vpn token'))) == {'vpn'}
+    while relevance._index is None:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    assert ids(relevance.search(index, 'printer')) == ['elsewhere', 'printer', 'mention'] and len(attempts) == 2
@@ -0,0 +1,69 @@
+# tests/test_slow_queries.py
+import json
+
+import pytest
+
+import slow_queries
+
+
+@pytest.fixture(autouse=True)
+def no_cooldowns(monkeypatch):
+    monkeypatch.setattr(slow_queries, '_last_profiled', {})
+
+
+def test_writes_are_explained_and_reads_profiled():
+    calls = []
+
+    def capture_plan(query, parameters, profile):
+        calls.append(profile)
+        return {'operatorType': 'ProduceResults', 'dbHits': 2, 'rows': 1,
+                'children': [{'operatorType': 'NodeIndexSeek', 'dbHits': 3, 'rows': 1}]}
+
+    read, write = {}, {}
+    slow_queries._attach_plan(read, "MATCH (n) RETURN n", {}, capture_plan)
+    slow_queries._attach_plan(write, "MATCH (n) SET n.x = 1", {}, capture_plan)
+    assert calls == [True, False]
+    assert read['plan_mode'] == 'PROFILE' and read['db_hits'] == 5
+    assert read['plan']['children'] == [{'operator': 'NodeIndexSeek', 'db_hits': 3, 'rows': 1}]
+    assert write['plan_mode'] == 'EXPLAIN'
+
+def test_a_query_is_profiled_once_per_cooldown():
+    entry = {}
+    slow_queries._attach_plan({}, "MATCH (n) RETURN n", {}, lambda *args: None)
+    slow_queries._attach_plan(entry, "MATCH (n) RETURN n", {}, lambda *args: pytest.fail("profiled twice"))
+    assert entry == {'plan_mode': 'skipped (profiled recently)'}
+
+def test_plan_capture_failure_is_recorded():
+    def capture_plan(query, parameters, profile):
+        raise RuntimeError("database unavailable")
+
+    entry = {}
+    slow_queries._attach_plan(entry, "MATCH (n) RETURN n", {}, capture_plan)
+    assert entry['plan_error'] == "database unavailable" and 'plan' not in entry
+
+def test_parameters_are_trimmed():
+    trimmed = slow_queries._trim({'content': 'x' * 500, 'rows': list(range(30))})
+    assert trimmed['content'].endswith("... (500 chars)") and len(trimmed['content']) < 250
+    assert trimmed['rows'][-1] == "... (30 items)" and len(trimmed['rows']) == slow_queries.MAX_PARAM_ITEMS + 1
+
+def test_recent_reads_newest_first_and_skips_bad_lines(tmp_path, monkeypatch):
+    log = tmp_path / 'slow.log'
+    monkeypatch.setattr(slow_queries, 'SLOW_QUERY_LOG', str(log))
+    assert slow_queries.recent() == []
+    log.write_text(json.dumps({'name': 'first'}) + "\nnot json\n" + json.dumps({'name': 'second'}) + "\n")
+    assert [e['name'] for e in slow_queries.recent()] == ['second', 'first']
+    assert [e['name'] for e in slow_queries.recent(limit=1)] == ['second']
+
+def test_slow_store_operations_are_reported(monkeypatch):
+    import metrics
+
+    reported = []
+    monkeypatch.setattr(slow_queries, 'SLOW_QUERY_MS', 0.000001)
+    monkeypatch.setattr(slow_queries, 'report', lambda name, seconds, **kwargs: reported.append((name, kwargs)))
+
+    @metrics.instrumented
+    def list_children(store, node_id):
+        return [{'id': 'a'}, {'id': 'b'}]
+
+    list_children(None, 'docs')
+    assert reported == [('list_children', {'parameters': {'args': ['docs']}, 'rows': 2})]
@@ -0,0 +1,60 @@
+# tests/test_sync_runs.py
+import pytest
+
+import sync_runs
+
+
+@pytest.fixture
+def synced(store):
+    store.ensure_companies_root()
+    store.upsert_company('1001', 'Acme', 77)
+    for email, requester in (('ann@acme.example', 501), ('bob@acme.example', 502)):
+        store.upsert_user('1001', email, email, '# Contact', requester, run_id='fs-1')
+    store.upsert_user('1001', 'ann@acme.example', 'ann@acme.example', '# Contact', 501, run_id='fs-2')
+    return store
+
+
+def test_run_ids_are_unique_and_ordered_by_time():
+    first, second = sync_runs.new_run_id(), sync_runs.new_run_id()
+    assert first != second and first[:14].isdigit()
+
+def test_the_default_sweep_only_counts(synced, monkeypatch, capsys):
+    monkeypatch.setattr(sync_runs, 'SYNC_SWEEP', 'dry-run')
+    assert sync_runs.sweep(synced, 'freshservice', 'fs-2') == {'seen': 1, 'unseen': 1, 'deleted': 0}
+    assert synced.get_node('contact_for_bob@acme.example') is not None
+    assert '(dry run)' in capsys.readouterr().out
+
+def test_delete_mode_removes_what_the_run_did_not_see(synced):
+    assert sync_runs.sweep(synced, 'freshservice', 'fs-2', mode='delete') == {'seen': 1, 'unseen': 1, 'deleted': 1}
+    assert synced.get_node('contact_for_bob@acme.example') is None
+    assert synced.get_node('contact_for_ann@acme.example') is not None
+
+def test_sweeping_can_be_turned_off(synced, monkeypatch):
+    monkeypatch.setattr(sync_runs, 'SYNC_SWEEP', 'off')
+    assert sync_runs.sweep(synced, 'freshservice', 'fs-2') is None
+    assert synced.get_node('contact_for_bob@acme.example') is not None
+
+def test_a_run_that_saw_nothing_deletes_nothing(synced):
+    assert sync_runs.sweep(synced, 'freshservice', 'fs-3', mode='delete') == {'seen': 0, 'unseen': 2, 'deleted': 0}
+    assert synced.get_node('contact_for_bob@acme.example') is not None
+
+def test_an_interrupted_run_resumes_under_its_own_id(store):
+    state = sync_runs.resume(store, 'tickets')
+    assert set(state) == {'run_id'}
+    with pytest.raises(RuntimeError):
+        with store.sync_batch():
+            store.ensure_companies_root()
+            sync_runs.save_checkpoint(store, 'tickets', dict(state, page=2))
+            raise RuntimeError("killed mid-batch")
+    assert sync_runs.resume(store, 'tickets') != dict(state, page=2), 'the checkpoint rolls back with its batch'
+    with store.sync_batch():
+        sync_runs.save_checkpoint(store, 'tickets', dict(state, page=2))
+    resumed = sync_runs.resume(store, 'tickets')
+    assert resumed['run_id'] == state['run_id'] and resumed['page'] == 2
+    sync_runs.finish(store, 'tickets')
+    assert sync_runs.resume(store, 'tickets')['run_id'] != state['run_id']
+
+def test_stale_checkpoints_start_a_new_run(store, monkeypatch):
+    sync_runs.save_checkpoint(store, 'datto', {'run_id': 'datto-1', 'site': 'b'})
+    monkeypatch.setattr(sync_runs, 'SYNC_CHECKPOINT_MAX_AGE', -1)
+    assert sync_runs.resume(store, 'datto')['run_id'] != 'datto-1'
@@ -0,0 +1,7 @@
+# wsgi.py
+# Production entry point: gunicorn -c gunicorn.conf.py wsgi:app
+# Schema initialisation is done once by the gunicorn master (see gunicorn.conf.py),
+# so the workers built from this module never write to the database at startup.
+from app import create_app
+
+app = create_app(init_db=False)